@@ -23,7 +23,31 @@ import "../../global/LibStorage.sol";
  *  - Markets
  *
  * Per Account: Balances and Portfolio Type
+ *
+ * setCurrencies and setAccount write all of these settings in a single transaction so that test
+ * fixtures do not need one transaction per setting.
  */
+struct MockCurrencySettings {
+    uint16 currencyId;
+    AssetRateStorage assetRate;
+    ETHRateStorage ethRate;
+    CashGroupSettings cashGroup;
+    address nTokenAddress;
+    uint96 nTokenTotalSupply;
+    int88 nTokenCashBalance;
+    uint8 pvHaircutPercentage;
+    uint8 liquidationHaircutPercentage;
+    uint256 lastInitializedTime;
+    uint256 settlementDate;
+    MarketParameters[] markets;
+}
+
+struct MockBalance {
+    uint16 currencyId;
+    int256 cashBalance;
+    int256 nTokenBalance;
+}
+
 library MockValuationLib {
     using PortfolioHandler for PortfolioState;
     using AccountContextHandler for AccountContext;
@@ -76,12 +100,68 @@ library MockValuationLib {
         market.setMarketStorageForInitialize(currencyId, settlementDate);
     }
 
+    function setCurrencies(MockCurrencySettings[] calldata currencies) external {
+        mapping(uint256 => AssetRateStorage) storage assetStore = LibStorage.getAssetRateStorage();
+        mapping(uint256 => ETHRateStorage) storage ethStore = LibStorage.getExchangeRateStorage();
+
+        for (uint256 i; i < currencies.length; i++) {
+            MockCurrencySettings calldata c = currencies[i];
+            assetStore[c.currencyId] = c.assetRate;
+            ethStore[c.currencyId] = c.ethRate;
+            CashGroup.setCashGroupStorage(c.currencyId, c.cashGroup);
+            setNTokenValue(
+                c.currencyId,
+                c.nTokenAddress,
+                c.nTokenTotalSupply,
+                c.nTokenCashBalance,
+                c.pvHaircutPercentage,
+                c.liquidationHaircutPercentage,
+                c.lastInitializedTime
+            );
+
+            for (uint256 j; j < c.markets.length; j++) {
+                setMarketStorage(c.currencyId, c.settlementDate, c.markets[j]);
+            }
+        }
+    }
+
+    /// @notice Sets balances and then adds assets to the account's portfolio, or to its
+    /// bitmap if bitmap is enabled
+    function setAccount(
+        address account,
+        MockBalance[] calldata balances,
+        PortfolioAsset[] memory assets
+    ) external {
+        for (uint256 i; i < balances.length; i++) {
+            setBalance(
+                account,
+                balances[i].currencyId,
+                balances[i].cashBalance,
+                balances[i].nTokenBalance
+            );
+        }
+
+        if (assets.length == 0) return;
+        if (AccountContextHandler.getAccountContext(account).isBitmapEnabled()) {
+            for (uint256 i; i < assets.length; i++) {
+                setifCashAsset(
+                    account,
+                    assets[i].currencyId,
+                    assets[i].maturity,
+                    assets[i].notional
+                );
+            }
+        } else {
+            setPortfolio(account, assets);
+        }
+    }
+
     function setBalance(
         address account,
         uint256 currencyId,
         int256 cashBalance,
         int256 nTokenBalance
-    ) external {
+    ) public {
         AccountContext memory accountContext = AccountContextHandler.getAccountContext(account);
         if (cashBalance < 0)
             accountContext.hasDebt = accountContext.hasDebt | Constants.HAS_CASH_DEBT;
@@ -102,7 +182,7 @@ library MockValuationLib {
         accountContext.setAccountContext(account);
     }
 
-    function setPortfolio(address account, PortfolioAsset[] memory assets) external {
+    function setPortfolio(address account, PortfolioAsset[] memory assets) public {
         AccountContext memory accountContext = AccountContextHandler.getAccountContext(account);
         PortfolioState memory portfolioState = PortfolioHandler.buildPortfolioState(
             account,
@@ -130,7 +210,7 @@ library MockValuationLib {
         uint256 currencyId,
         uint256 maturity,
         int256 notional
-    ) external {
+    ) public {
         AccountContext memory accountContext = AccountContextHandler.getAccountContext(account);
         int256 finalNotional = BitmapAssetsHandler.addifCashAsset(
             account,
@@ -338,6 +418,18 @@ contract MockValuationBase {
         MockValuationLib.setMarketStorage(currencyId, settlementDate, market);
     }
 
+    function setCurrencies(MockCurrencySettings[] calldata currencies) external {
+        MockValuationLib.setCurrencies(currencies);
+    }
+
+    function setAccount(
+        address account,
+        MockBalance[] calldata balances,
+        PortfolioAsset[] memory assets
+    ) external {
+        MockValuationLib.setAccount(account, balances, assets);
+    }
+
     function setBalance(
         address account,
         uint256 currencyId,
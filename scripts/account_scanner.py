@@ -0,0 +1,249 @@
+"""
+Bulk AccountContext scanner and in memory index for settlement and liquidation triage.
+
+AccountContext is a single packed storage slot per account. Contexts are read for a whole
+account set either straight from AccountStorage with concurrent eth_getStorageAt requests pinned
+to one block, or with getAccountContext where storage reads are not available. Raw slots are
+decoded together as a byte matrix, each field is a column slice:
+
+    bytes 0..4    unused
+    bytes 5..22   activeCurrencies, nine 2 byte entries of currency id and active flags
+    bytes 23..24  bitmapCurrencyId
+    byte  25      assetArrayLength
+    byte  26      hasDebt
+    bytes 27..31  nextSettleTime
+
+Queries over the index are numpy masks, the account set is discovered from AccountContextUpdate
+events and kept current by re-reading only the accounts those events name.
+
+Usage:
+    brownie run scripts/account_scanner.py main [source] --network mainnet
+"""
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from brownie import chain, network
+from brownie.network import web3
+from eth_utils import keccak, to_checksum_address
+from scripts.environment_v2 import EnvironmentV2
+from scripts.event_logs import EventDecoder, stream_events
+from scripts.offchain.constants import (
+    ACTIVE_IN_BALANCES,
+    ACTIVE_IN_PORTFOLIO,
+    DAY,
+    HAS_ASSET_DEBT,
+    HAS_CASH_DEBT,
+    UNMASK_FLAGS,
+)
+
+READ_WORKERS = 16
+# LibStorage.StorageId.AccountStorage + STORAGE_SLOT_BASE
+ACCOUNT_STORAGE_SLOT = 1000001
+MAX_ACTIVE_CURRENCIES = 9
+
+
+def account_context_slot(account):
+    """Storage slot of an account's context in the AccountStorage mapping"""
+    key = bytes.fromhex(str(account)[2:]).rjust(32, b"\x00")
+    return int.from_bytes(keccak(key + ACCOUNT_STORAGE_SLOT.to_bytes(32, "big")), "big")
+
+
+def encode_account_context(context):
+    """Packs an AccountContext tuple into its 32 byte storage word"""
+    (nextSettleTime, hasDebt, assetArrayLength, bitmapCurrencyId, activeCurrencies) = context
+    return (
+        bytes(5)
+        + bytes(activeCurrencies).ljust(18, b"\x00")
+        + int(bitmapCurrencyId).to_bytes(2, "big")
+        + int(assetArrayLength).to_bytes(1, "big")
+        + bytes(hasDebt)[:1].rjust(1, b"\x00")
+        + int(nextSettleTime).to_bytes(5, "big")
+    )
+
+
+def decode_account_contexts(words):
+    """
+    Decodes an (accounts, 32) uint8 matrix of storage words. Returns a dict of columns, the
+    active currencies are an (accounts, 9) uint16 matrix of raw entries including flags.
+    """
+    words = np.asarray(words, dtype=np.uint8).reshape(-1, 32)
+    nextSettleTime = np.zeros(len(words), dtype=np.int64)
+    for i in range(27, 32):
+        nextSettleTime = (nextSettleTime << 8) | words[:, i]
+
+    active = words[:, 5:23].reshape(-1, MAX_ACTIVE_CURRENCIES, 2).astype(np.uint16)
+    return {
+        "nextSettleTime": nextSettleTime,
+        "hasDebt": words[:, 26].copy(),
+        "assetArrayLength": words[:, 25].copy(),
+        "bitmapCurrencyId": (words[:, 23].astype(np.uint16) << 8) | words[:, 24],
+        "activeCurrencies": (active[:, :, 0] << 8) | active[:, :, 1],
+    }
+
+
+class AccountContextIndex:
+    def __init__(self, notional, source="storage"):
+        """
+        `source` is "storage" to read AccountStorage slots directly or "view" to call
+        getAccountContext for every account.
+        """
+        if source not in ("storage", "view"):
+            raise Exception("Unknown source {}".format(source))
+
+        self.notional = notional
+        self.source = source
+        self.blockNumber = None
+        self.accounts = []
+        self.rows = {}
+        self.words = np.zeros((0, 32), dtype=np.uint8)
+        self.columns = decode_account_contexts(self.words)
+        self.stats = {"reads": 0, "refreshes": 0}
+
+    def _read_storage(self, account, blockNumber):
+        slot = hex(account_context_slot(account))
+        response = web3.provider.make_request(
+            "eth_getStorageAt", [self.notional.address, slot, hex(blockNumber)]
+        )
+        if "error" in response:
+            raise Exception(response["error"])
+        return bytes.fromhex(response["result"][2:].rjust(64, "0"))
+
+    def _read_view(self, account, blockNumber):
+        context = self.notional.getAccountContext(account, block_identifier=blockNumber)
+        return encode_account_context(context)
+
+    def _read(self, accounts, blockNumber):
+        read = self._read_storage if self.source == "storage" else self._read_view
+        with ThreadPoolExecutor(max_workers=READ_WORKERS) as pool:
+            words = list(pool.map(lambda a: read(a, blockNumber), accounts))
+
+        self.stats["reads"] += len(accounts)
+        return np.frombuffer(b"".join(words), dtype=np.uint8).reshape(-1, 32)
+
+    def update(self, accounts, blockNumber=None):
+        """Reads the contexts of accounts, replacing any that are already indexed"""
+        blockNumber = chain.height if blockNumber is None else blockNumber
+        accounts = [to_checksum_address(str(a)) for a in dict.fromkeys(accounts)]
+        if len(accounts) == 0:
+            self.blockNumber = blockNumber
+            return
+
+        words = self._read(accounts, blockNumber)
+        newAccounts = [a for a in accounts if a not in self.rows]
+        for account in newAccounts:
+            self.rows[account] = len(self.accounts)
+            self.accounts.append(account)
+
+        self.words = np.concatenate([self.words, np.zeros((len(newAccounts), 32), np.uint8)])
+        self.words[[self.rows[a] for a in accounts]] = words
+        self.columns = decode_account_contexts(self.words)
+        self.blockNumber = blockNumber
+        self.stats["refreshes"] += 1
+
+    def sync(self, toBlock=None, decoder=None):
+        """Re-reads accounts with an AccountContextUpdate since the last indexed block"""
+        toBlock = chain.height if toBlock is None else toBlock
+        fromBlock = 0 if self.blockNumber is None else self.blockNumber + 1
+        decoder = EventDecoder() if decoder is None else decoder
+        updated = [
+            r.args["account"]
+            for r in stream_events(
+                decoder, fromBlock, toBlock, [self.notional.address], ["AccountContextUpdate"]
+            )
+        ]
+        self.update(updated, toBlock)
+        return len(set(updated))
+
+    def context(self, account):
+        """Returns the decoded (nextSettleTime, hasDebt, assetArrayLength, bitmapCurrencyId,
+        activeCurrencies) of an indexed account"""
+        row = self.rows[to_checksum_address(str(account))]
+        return (
+            int(self.columns["nextSettleTime"][row]),
+            int(self.columns["hasDebt"][row]),
+            int(self.columns["assetArrayLength"][row]),
+            int(self.columns["bitmapCurrencyId"][row]),
+            [int(c) for c in self.columns["activeCurrencies"][row] if c != 0],
+        )
+
+    def _select(self, mask):
+        return [self.accounts[i] for i in np.flatnonzero(mask)]
+
+    def _active(self, currencyId, flag):
+        active = self.columns["activeCurrencies"]
+        return (((active & UNMASK_FLAGS) == currencyId) & ((active & flag) != 0)).any(axis=1)
+
+    def must_settle(self, blockTime):
+        """Accounts where AccountContextHandler.mustSettleAssets is true at blockTime"""
+        nextSettleTime = self.columns["nextSettleTime"]
+        isBitmap = self.columns["bitmapCurrencyId"] != 0
+        blockTimeUTC0 = blockTime - blockTime % DAY
+        return self._select(
+            np.where(
+                isBitmap,
+                nextSettleTime < blockTimeUTC0,
+                (0 < nextSettleTime) & (nextSettleTime <= blockTime),
+            )
+        )
+
+    def with_debt(self, assetDebt=True, cashDebt=True):
+        """Accounts with the selected debt flags set"""
+        flags = (HAS_ASSET_DEBT if assetDebt else 0) | (HAS_CASH_DEBT if cashDebt else 0)
+        return self._select((self.columns["hasDebt"] & flags) != 0)
+
+    def with_cash_debt(self, currencyId):
+        """
+        Accounts flagged with cash debt that hold a balance in the currency. The context does not
+        record which currency is in debt so these are candidates to check with getAccountBalance.
+        """
+        hasCashDebt = (self.columns["hasDebt"] & HAS_CASH_DEBT) != 0
+        inBalances = self._active(currencyId, ACTIVE_IN_BALANCES) | (
+            self.columns["bitmapCurrencyId"] == currencyId
+        )
+        return self._select(hasCashDebt & inBalances)
+
+    def with_asset_debt(self, currencyId):
+        """Accounts flagged with asset debt that hold assets in the currency"""
+        hasAssetDebt = (self.columns["hasDebt"] & HAS_ASSET_DEBT) != 0
+        inPortfolio = self._active(currencyId, ACTIVE_IN_PORTFOLIO) | (
+            self.columns["bitmapCurrencyId"] == currencyId
+        )
+        return self._select(hasAssetDebt & inPortfolio)
+
+    def bitmap_accounts(self, currencyId):
+        return self._select(self.columns["bitmapCurrencyId"] == currencyId)
+
+    def active_in(self, currencyId, portfolio=True, balances=True):
+        """Accounts with the currency active in their portfolio or balances"""
+        flag = (ACTIVE_IN_PORTFOLIO if portfolio else 0) | (ACTIVE_IN_BALANCES if balances else 0)
+        return self._select(self._active(currencyId, flag))
+
+
+def main(source="storage"):
+    networkName = network.show_active()
+    if networkName in ("mainnet-fork", "hardhat-fork"):
+        networkName = "mainnet"
+    with open("v2.{}.json".format(networkName), "r") as f:
+        config = json.load(f)
+    env = EnvironmentV2(config)
+
+    index = AccountContextIndex(env.notional, source)
+    index.blockNumber = config["startBlock"] - 1
+    index.sync()
+    blockTime = chain[index.blockNumber].timestamp
+    maxCurrencyId = env.notional.getMaxCurrencyId()
+
+    print("Indexed {} accounts at block {}".format(len(index.accounts), index.blockNumber))
+    print("Must settle: {}".format(len(index.must_settle(blockTime))))
+    print("With debt: {}".format(len(index.with_debt())))
+    for currencyId in range(1, maxCurrencyId + 1):
+        print(
+            "Currency {}: {} active, {} cash debt, {} asset debt, {} bitmap".format(
+                currencyId,
+                len(index.active_in(currencyId)),
+                len(index.with_cash_debt(currencyId)),
+                len(index.with_asset_debt(currencyId)),
+                len(index.bitmap_accounts(currencyId)),
+            )
+        )
@@ -0,0 +1,249 @@
+"""
+Precompiled calldata encoder for Notional batch actions.
+
+All of the structs accepted by batchBalanceAction, batchBalanceAndTradeAction and batchLend have a
+fixed ABI layout, so instead of resolving type strings on every call the layouts are resolved once
+at import time and actions are encoded directly into 32 byte words. Packed bytes32 trade actions
+are built with integer shifts using the bit layouts documented on TradeActionType in Types.sol.
+"""
+from functools import lru_cache
+from typing import List, NamedTuple, Sequence
+
+from eth_utils import function_signature_to_4byte_selector
+from tests.constants import DEPOSIT_ACTION_TYPE, TRADE_ACTION_TYPE
+
+WORD = 32
+UINT256_MAX = 2 ** 256 - 1
+
+BALANCE_ACTION_TYPES = "(uint8,uint16,uint256,uint256,bool,bool)"
+BALANCE_ACTION_WITH_TRADES_TYPES = "(uint8,uint16,uint256,uint256,bool,bool,bytes32[])"
+BATCH_LEND_TYPES = "(uint16,bool,bytes32[])"
+
+SELECTORS = {
+    name: function_signature_to_4byte_selector(signature)
+    for (name, signature) in {
+        "batchBalanceAction": "batchBalanceAction(address,{}[])".format(BALANCE_ACTION_TYPES),
+        "batchBalanceAndTradeAction": "batchBalanceAndTradeAction(address,{}[])".format(
+            BALANCE_ACTION_WITH_TRADES_TYPES
+        ),
+        "batchLend": "batchLend(address,{}[])".format(BATCH_LEND_TYPES),
+    }.items()
+}
+
+# Bit layouts of each packed trade action, listed from the most significant bits. Every layout
+# starts with the uint8 trade action type and is right padded with zeros to 256 bits. Each entry
+# is (kwarg name, bit width, signed)
+TRADE_ACTION_LAYOUT = {
+    "Lend": (("marketIndex", 8, False), ("notional", 88, False), ("minSlippage", 32, False)),
+    "Borrow": (("marketIndex", 8, False), ("notional", 88, False), ("maxSlippage", 32, False)),
+    "AddLiquidity": (
+        ("marketIndex", 8, False),
+        ("notional", 88, False),
+        ("minSlippage", 32, False),
+        ("maxSlippage", 32, False),
+    ),
+    "RemoveLiquidity": (
+        ("marketIndex", 8, False),
+        ("notional", 88, False),
+        ("minSlippage", 32, False),
+        ("maxSlippage", 32, False),
+    ),
+    "PurchaseNTokenResidual": (("maturity", 32, False), ("fCashAmountToPurchase", 88, True)),
+    "SettleCashDebt": (("counterparty", 160, False), ("amountToSettle", 88, False)),
+}
+
+
+def _resolve_layout(tradeActionType, fields):
+    # Converts the field list into (name, shift, mask, signed) tuples so that encoding a trade
+    # only requires a single shift and mask per field
+    offset = 256 - 8
+    resolved = []
+    for (name, bits, signed) in fields:
+        offset -= bits
+        resolved.append((name, offset, (1 << bits) - 1, bits, signed))
+
+    return (TRADE_ACTION_TYPE[tradeActionType] << 248, tuple(resolved))
+
+
+RESOLVED_TRADE_ACTION_LAYOUT = {
+    k: _resolve_layout(k, fields) for (k, fields) in TRADE_ACTION_LAYOUT.items()
+}
+
+
+class BalanceAction(NamedTuple):
+    actionType: int
+    currencyId: int
+    depositActionAmount: int = 0
+    withdrawAmountInternalPrecision: int = 0
+    withdrawEntireCashBalance: bool = False
+    redeemToUnderlying: bool = False
+
+
+class BalanceActionWithTrades(NamedTuple):
+    actionType: int
+    currencyId: int
+    depositActionAmount: int = 0
+    withdrawAmountInternalPrecision: int = 0
+    withdrawEntireCashBalance: bool = False
+    redeemToUnderlying: bool = False
+    trades: Sequence[bytes] = ()
+
+
+class BatchLend(NamedTuple):
+    currencyId: int
+    depositUnderlying: bool
+    trades: Sequence[bytes] = ()
+
+
+def _to_uint(value):
+    if hasattr(value, "address"):
+        # Brownie accounts and contracts
+        value = value.address
+    if isinstance(value, str):
+        return int(value, 16)
+    return int(value)
+
+
+def _pack_field(value, mask, bits, signed, name):
+    value = _to_uint(value)
+    if signed:
+        if not -(1 << (bits - 1)) <= value < (1 << (bits - 1)):
+            raise ValueError("{} overflows int{}".format(name, bits))
+        return value & mask
+
+    if not 0 <= value <= mask:
+        raise ValueError("{} overflows uint{}".format(name, bits))
+    return value
+
+
+@lru_cache(maxsize=4096)
+def _encode_trade_action(tradeActionType, values):
+    (packed, layout) = RESOLVED_TRADE_ACTION_LAYOUT[tradeActionType]
+    for ((name, shift, mask, bits, signed), value) in zip(layout, values):
+        packed |= _pack_field(value, mask, bits, signed, name) << shift
+
+    return packed.to_bytes(WORD, "big")
+
+
+def encode_trade_action(tradeActionType, **kwargs):
+    """
+    Returns the packed bytes32 trade action, takes the same keyword arguments as
+    tests.helpers.get_trade_action. Identical trades are served from a cache.
+    """
+    (_, layout) = RESOLVED_TRADE_ACTION_LAYOUT[tradeActionType]
+    values = tuple(_to_uint(kwargs[name]) for (name, _, _, _, _) in layout)
+    return _encode_trade_action(tradeActionType, values)
+
+
+def _deposit_action_type(actionType):
+    return DEPOSIT_ACTION_TYPE[actionType] if isinstance(actionType, str) else actionType
+
+
+def balance_action(currencyId, depositActionType, **kwargs):
+    return BalanceAction(
+        _deposit_action_type(depositActionType),
+        currencyId,
+        int(kwargs.get("depositActionAmount", 0)),
+        int(kwargs.get("withdrawAmountInternalPrecision", 0)),
+        kwargs.get("withdrawEntireCashBalance", False),
+        kwargs.get("redeemToUnderlying", False),
+    )
+
+
+def balance_action_with_trades(currencyId, depositActionType, tradeActionData, **kwargs):
+    return BalanceActionWithTrades(
+        *balance_action(currencyId, depositActionType, **kwargs),
+        [encode_trade_action(**t) for t in tradeActionData],
+    )
+
+
+def batch_lend(currencyId, tradeActionData, depositUnderlying):
+    return BatchLend(
+        currencyId, depositUnderlying, [encode_trade_action(**t) for t in tradeActionData]
+    )
+
+
+def _word(value):
+    return value.to_bytes(WORD, "big")
+
+
+@lru_cache(maxsize=4096)
+def _balance_action_head(
+    actionType, currencyId, depositAmount, withdrawAmount, withdrawAll, redeem
+):
+    # The static portion of BalanceAction and BalanceActionWithTrades is identical
+    if not (0 <= depositAmount <= UINT256_MAX and 0 <= withdrawAmount <= UINT256_MAX):
+        raise ValueError("Balance action amount overflows uint256")
+
+    return b"".join(
+        (
+            _word(actionType),
+            _word(currencyId),
+            _word(depositAmount),
+            _word(withdrawAmount),
+            _word(1 if withdrawAll else 0),
+            _word(1 if redeem else 0),
+        )
+    )
+
+
+def _encode_bytes32_array(trades):
+    return _word(len(trades)) + b"".join(bytes(t) for t in trades)
+
+
+def _encode_dynamic_array(encodedItems):
+    # Dynamic tuple arrays are encoded as a length, a list of offsets relative to the first
+    # offset and then the concatenated tuples
+    offsets = []
+    offset = len(encodedItems) * WORD
+    for item in encodedItems:
+        offsets.append(_word(offset))
+        offset += len(item)
+
+    return _word(len(encodedItems)) + b"".join(offsets) + b"".join(encodedItems)
+
+
+def _encode_call(selector, account, encodedArray):
+    # Both arguments are (address, T[]) so the array always starts after two head words
+    return selector + _word(_to_uint(account)) + _word(2 * WORD) + encodedArray
+
+
+def encode_batch_balance_action(account, actions: List[BalanceAction]):
+    body = b"".join(_balance_action_head(*(int(v) for v in a)) for a in actions)
+    return _encode_call(SELECTORS["batchBalanceAction"], account, _word(len(actions)) + body)
+
+
+def encode_batch_balance_and_trade_action(account, actions: List[BalanceActionWithTrades]):
+    items = [
+        _balance_action_head(*(int(v) for v in a[0:6]))
+        + _word(7 * WORD)
+        + _encode_bytes32_array(a[6])
+        for a in actions
+    ]
+    return _encode_call(
+        SELECTORS["batchBalanceAndTradeAction"], account, _encode_dynamic_array(items)
+    )
+
+
+def encode_batch_lend(account, actions: List[BatchLend]):
+    items = [
+        _word(int(a[0])) + _word(1 if a[1] else 0) + _word(3 * WORD) + _encode_bytes32_array(a[2])
+        for a in actions
+    ]
+    return _encode_call(SELECTORS["batchLend"], account, _encode_dynamic_array(items))
+
+
+BATCH_ENCODERS = {
+    "batchBalanceAction": encode_batch_balance_action,
+    "batchBalanceAndTradeAction": encode_batch_balance_and_trade_action,
+    "batchLend": encode_batch_lend,
+}
+
+
+def encode_bulk(method, batches):
+    """
+    Encodes calldata for many batches at once, `batches` is an iterable of (account, actions)
+    pairs. Returns a list of calldata bytes in the same order.
+    """
+    encoder = BATCH_ENCODERS[method]
+    return [encoder(account, actions) for (account, actions) in batches]
@@ -0,0 +1,302 @@
+"""
+Bitmap portfolio net present value engine with a per block discount factor table.
+
+BitmapAssetsHandler.getifCashNetPresentValue discounts every ifCash asset of a bitmap portfolio
+with the oracle rate of its maturity, adjusted by the fCash haircut or debt buffer when risk
+adjusted. Within a block the discount factor of a maturity is the same for every account, so
+each cash group's factors are computed once per block with the integer ports in scripts/offchain
+and cached per (nextSettleTime, bit number). Portfolios are held as arrays of (bit number,
+notional) and every account is then valued with one gather and a row wise dot product.
+
+Array valuations do not truncate each asset's present value like mulInRatePrecision does, they
+differ from the contracts by less than one unit of internal precision per asset.
+getNetPresentValueFromBitmap values a single portfolio with exact contract rounding.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+from brownie import chain, interface
+from scripts.offchain.asset_handler import getDiscountFactor
+from scripts.offchain.cash_group import CashGroup, interpolateOracleRate
+from scripts.offchain.constants import RATE_PRECISION
+from scripts.offchain.date_time import (
+    getBitNumFromMaturity,
+    getMarketIndex,
+    getMaturityFromBitNum,
+    getReferenceTime,
+    getTradedMarket,
+)
+from scripts.offchain.market import updateRateOracle
+from scripts.offchain.safe_math import Revert, mulInRatePrecision
+from scripts.rate_provider import RateProvider
+
+READ_WORKERS = 8
+MAX_BITMAP_ASSETS = 20
+MAX_BIT_NUM = 256
+
+
+class DiscountFactorTable:
+    def __init__(self, cashGroup, marketOracleRates, supplyRate, blockTime):
+        """
+        `marketOracleRates` maps market maturities to their oracle rates at `blockTime` as
+        returned by Market.getOracleRate. `supplyRate` is the annualized asset supply rate used
+        to interpolate maturities before the first market.
+        """
+        self.cashGroup = cashGroup
+        self.marketOracleRates = marketOracleRates
+        self.supplyRate = supplyRate
+        self.blockTime = blockTime
+        self.factors = {}
+        self.rows = {}
+
+    @classmethod
+    def fromMarkets(cls, cashGroup, markets, supplyRate, blockTime):
+        """Builds from offchain Markets, updating their oracle rates to the block time"""
+        timeWindow = cashGroup.getRateOracleTimeWindow()
+        return cls(
+            cashGroup,
+            {
+                m.maturity: updateRateOracle(
+                    m.previousTradeTime, m.lastImpliedRate, m.oracleRate, timeWindow, blockTime
+                )
+                for m in markets
+            },
+            supplyRate,
+            blockTime,
+        )
+
+    def calculateOracleRate(self, maturity):
+        """Port of CashGroup.calculateOracleRate"""
+        (marketIndex, idiosyncratic) = getMarketIndex(
+            self.cashGroup.maxMarketIndex, maturity, self.blockTime
+        )
+        if not idiosyncratic:
+            return self.marketOracleRates[maturity]
+
+        referenceTime = getReferenceTime(self.blockTime)
+        longMaturity = referenceTime + getTradedMarket(marketIndex)
+        longRate = self.marketOracleRates[longMaturity]
+        if marketIndex == 1:
+            (shortMaturity, shortRate) = (self.blockTime, self.supplyRate)
+        else:
+            shortMaturity = referenceTime + getTradedMarket(marketIndex - 1)
+            shortRate = self.marketOracleRates[shortMaturity]
+
+        return interpolateOracleRate(shortMaturity, longMaturity, shortRate, longRate, maturity)
+
+    def getDiscountFactors(self, maturity):
+        """
+        Returns (positive, negative, unadjusted) discount factors in RATE_PRECISION, matching
+        AssetHandler.getRiskAdjustedPresentfCashValue and getPresentfCashValue. Matured assets are
+        held at their notional.
+        """
+        if maturity in self.factors:
+            return self.factors[maturity]
+
+        if maturity <= self.blockTime:
+            factors = (RATE_PRECISION, RATE_PRECISION, RATE_PRECISION)
+        else:
+            timeToMaturity = maturity - self.blockTime
+            oracleRate = self.calculateOracleRate(maturity)
+            debtBuffer = self.cashGroup.getDebtBuffer()
+            factors = (
+                getDiscountFactor(timeToMaturity, oracleRate + self.cashGroup.getfCashHaircut()),
+                RATE_PRECISION
+                if debtBuffer >= oracleRate
+                else getDiscountFactor(timeToMaturity, oracleRate - debtBuffer),
+                getDiscountFactor(timeToMaturity, oracleRate),
+            )
+
+        self.factors[maturity] = factors
+        return factors
+
+    def getBitNumFactors(self, nextSettleTime, riskAdjusted=True):
+        """
+        Returns (positive, negative) float discount factors of shape (MAX_BIT_NUM + 1,) indexed
+        by bit number. Bits that do not map to a valuable maturity are zero.
+        """
+        key = (nextSettleTime, riskAdjusted)
+        if key in self.rows:
+            return self.rows[key]
+
+        rows = np.zeros((2, MAX_BIT_NUM + 1))
+        for bitNum in range(1, MAX_BIT_NUM + 1):
+            try:
+                factors = self.getDiscountFactors(getMaturityFromBitNum(nextSettleTime, bitNum))
+            except Revert:
+                continue
+            rows[:, bitNum] = factors[0:2] if riskAdjusted else factors[2]
+
+        self.rows[key] = rows / RATE_PRECISION
+        return self.rows[key]
+
+    def getNetPresentValueFromBitmap(self, nextSettleTime, assets, riskAdjusted=True):
+        """
+        Port of BitmapAssetsHandler.getNetPresentValueFromBitmap over a dict of bit number to
+        notional, returns (totalValueUnderlying, hasDebt)
+        """
+        (totalValueUnderlying, hasDebt) = (0, False)
+        for bitNum in sorted(assets):
+            notional = assets[bitNum]
+            if notional == 0:
+                continue
+
+            factors = self.getDiscountFactors(getMaturityFromBitNum(nextSettleTime, bitNum))
+            if riskAdjusted:
+                factor = factors[0] if notional > 0 else factors[1]
+            else:
+                factor = factors[2]
+            pv = mulInRatePrecision(notional, factor)
+            totalValueUnderlying += pv
+            hasDebt = hasDebt or pv < 0
+
+        return (totalValueUnderlying, hasDebt)
+
+
+class BitmapPortfolios(NamedTuple):
+    accounts: tuple
+    currencyIds: np.ndarray
+    nextSettleTimes: np.ndarray
+    # (accounts, MAX_BITMAP_ASSETS) one indexed bit numbers and notionals, padded with zeros
+    bitNums: np.ndarray
+    notionals: np.ndarray
+
+    @classmethod
+    def build(cls, accounts, currencyIds, nextSettleTimes, assets):
+        """`assets` is a list per account of (maturity, notional) ifCash assets"""
+        bitNums = np.zeros((len(accounts), MAX_BITMAP_ASSETS), dtype=np.int64)
+        notionals = np.zeros((len(accounts), MAX_BITMAP_ASSETS))
+        for (a, accountAssets) in enumerate(assets):
+            for (i, (maturity, notional)) in enumerate(accountAssets):
+                (bitNum, _) = getBitNumFromMaturity(nextSettleTimes[a], maturity)
+                bitNums[a, i] = bitNum
+                notionals[a, i] = notional
+
+        return cls(
+            tuple(accounts),
+            np.array(currencyIds, dtype=np.int64),
+            np.array(nextSettleTimes, dtype=np.int64),
+            bitNums,
+            notionals,
+        )
+
+
+def present_values(portfolios, tables, riskAdjusted=True):
+    """
+    Net present value in underlying internal precision of every portfolio, given a dict of
+    currency id to DiscountFactorTable for the same block
+    """
+    values = np.zeros(len(portfolios.accounts))
+    groups = np.stack([portfolios.currencyIds, portfolios.nextSettleTimes], axis=1)
+    (keys, group) = np.unique(groups, axis=0, return_inverse=True)
+    group = group.reshape(-1)
+
+    # Stack the factor rows of every (currency, nextSettleTime) so that a single gather looks
+    # up the factor of every asset
+    rows = (
+        np.stack([tables[int(c)].getBitNumFactors(int(t), riskAdjusted) for (c, t) in keys])
+        if len(keys)
+        else np.zeros((0, 2, MAX_BIT_NUM + 1))
+    )
+    notionals = portfolios.notionals
+    sign = (notionals < 0).astype(np.int64)
+    factors = rows[group[:, None], sign, portfolios.bitNums]
+    np.einsum("ij,ij->i", notionals, factors, out=values)
+    return values
+
+
+class BitmapValuation:
+    def __init__(self, notional, rates=None):
+        """
+        Loads discount factor tables once per block, pass a shared RateProvider as `rates` to
+        avoid reading asset rates more than once per block.
+        """
+        self.notional = notional
+        self.rates = RateProvider(notional) if rates is None else rates
+        self.blockNumber = None
+        self.blockTime = None
+        self.tables = {}
+        self.stats = {"rpcCalls": 0, "refreshes": 0}
+
+    def refresh(self, blockNumber=None):
+        """Drops all discount factors if the chain has moved past the loaded block"""
+        blockNumber = chain.height if blockNumber is None else blockNumber
+        if blockNumber == self.blockNumber:
+            return False
+
+        self.blockNumber = blockNumber
+        self.blockTime = chain[blockNumber].timestamp
+        self.rates.refresh(blockNumber)
+        self.tables = {}
+        self.stats["refreshes"] += 1
+        return True
+
+    def _call(self, method, *args):
+        self.stats["rpcCalls"] += 1
+        return getattr(self.notional, method)(*args, block_identifier=self.blockNumber)
+
+    def getTable(self, currencyId):
+        if self.blockNumber is None:
+            self.refresh()
+
+        if currencyId not in self.tables:
+            assetRate = self.rates.getAssetRate(currencyId)
+            cashGroup = CashGroup.fromParameters(
+                currencyId, self._call("getCashGroup", currencyId), assetRate
+            )
+            markets = self._call("getActiveMarketsAtBlockTime", currencyId, self.blockTime)
+            supplyRate = 0
+            if int(assetRate.rateOracle, 16) != 0:
+                self.stats["rpcCalls"] += 1
+                supplyRate = interface.AssetRateAdapter(
+                    assetRate.rateOracle
+                ).getAnnualizedSupplyRate(block_identifier=self.blockNumber)
+
+            # The view has already updated each market's oracle rate to the block time
+            self.tables[currencyId] = DiscountFactorTable(
+                cashGroup, {int(m[1]): int(m[6]) for m in markets}, int(supplyRate), self.blockTime
+            )
+
+        return self.tables[currencyId]
+
+    def loadAccounts(self, accounts):
+        """Reads the bitmap portfolios of accounts, accounts without bitmaps are skipped"""
+        if self.blockNumber is None:
+            self.refresh()
+
+        def fetch(account):
+            (context, _, portfolio) = self._call("getAccount", account)
+            (nextSettleTime, _, _, bitmapCurrencyId, _) = context
+            assets = [(int(a[1]), int(a[3])) for a in portfolio]
+            return (account, int(bitmapCurrencyId), int(nextSettleTime), assets)
+
+        with ThreadPoolExecutor(max_workers=READ_WORKERS) as pool:
+            rows = [r for r in pool.map(fetch, accounts) if r[1] != 0]
+
+        return (
+            BitmapPortfolios.build(*zip(*rows)) if rows else BitmapPortfolios.build([], [], [], [])
+        )
+
+    def loadNTokens(self, currencyIds):
+        """Reads the ifCash books of nTokens, which are settled relative to lastInitializedTime"""
+        if self.blockNumber is None:
+            self.refresh()
+
+        def fetch(currencyId):
+            nTokenAddress = self._call("nTokenAddress", currencyId)
+            lastInitializedTime = self._call("getNTokenAccount", nTokenAddress)[3]
+            (_, netfCashAssets) = self._call("getNTokenPortfolio", nTokenAddress)
+            assets = [(int(a[1]), int(a[3])) for a in netfCashAssets]
+            return (nTokenAddress, currencyId, int(lastInitializedTime), assets)
+
+        with ThreadPoolExecutor(max_workers=READ_WORKERS) as pool:
+            rows = list(pool.map(fetch, currencyIds))
+
+        return (
+            BitmapPortfolios.build(*zip(*rows)) if rows else BitmapPortfolios.build([], [], [], [])
+        )
+
+    def presentValues(self, portfolios, riskAdjusted=True):
+        tables = {int(c): self.getTable(int(c)) for c in np.unique(portfolios.currencyIds)}
+        return present_values(portfolios, tables, riskAdjusted)
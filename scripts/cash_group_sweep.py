@@ -0,0 +1,287 @@
+"""
+Parallel cash group parameter sweeps on isolated local chains.
+
+Every worker process loads the project, launches its own development chain on a free port and
+deploys the environment from tests.helpers.initialize_environment once, taking a snapshot. Each
+candidate configuration is then run from that snapshot: the cash group is updated with
+updateCashGroup, markets are rolled into the next quarter and a scripted lend, borrow and
+liquidate scenario is played, collecting one row of metrics per configuration.
+
+Candidates are CurrencyDefaults style dicts, i.e. the keys debtBuffer, fCashHaircut,
+liquidationfCashDiscount, tokenHaircut, rateScalar and so on. Configurations that the
+governance checks reject are reported with their revert reason.
+
+Usage:
+    brownie run scripts/cash_group_sweep.py main [workers] [output]
+"""
+import csv
+import socket
+from concurrent.futures import ProcessPoolExecutor
+from copy import copy
+from itertools import product
+from multiprocessing import get_context
+
+from brownie import accounts, network, project
+from brownie._config import CONFIG
+from brownie.exceptions import VirtualMachineError
+from brownie.network.state import Chain
+from scripts.config import CurrencyDefaults, nTokenDefaults
+from scripts.offchain.constants import DEPOSIT_PERCENT_BASIS, QUARTER
+
+chain = Chain()
+
+CURRENCY_ID = 2
+COLLATERAL_CURRENCY_ID = 1
+# Currencies with markets initialized by initialize_environment
+MARKET_CURRENCY_IDS = (1, 2, 3)
+
+DEFAULT_SCENARIO = {
+    # fCash lent and borrowed in the local currency
+    "lendNotional": 1_000e8,
+    "borrowNotional": 100e8,
+    # ETH deposited by the borrower as collateral
+    "collateral": 2e18,
+    # Relative increase in the local currency ETH rate before liquidation
+    "priceShock": 0.3,
+}
+
+METRICS = [
+    "error",
+    "lendAssetCash",
+    "lendImpliedRate",
+    "borrowAssetCash",
+    "borrowImpliedRate",
+    "freeCollateralAfterBorrow",
+    "freeCollateralAfterShock",
+    "netLocalFromLiquidator",
+    "netCollateralTransfer",
+    "freeCollateralAfterLiquidation",
+    "liquidationGas",
+]
+
+# Per process sweep state, set by _start_worker
+_worker = {}
+
+
+def cash_group_settings(config):
+    """CashGroupSettings tuple for a CurrencyDefaults style config, as in enableCurrency"""
+    maxMarketIndex = config["maxMarketIndex"]
+    return (
+        maxMarketIndex,
+        config["rateOracleTimeWindow"],
+        config["totalFee"],
+        config["reserveFeeShare"],
+        config["debtBuffer"],
+        config["fCashHaircut"],
+        config["settlementPenalty"],
+        config["liquidationfCashDiscount"],
+        config["liquidationDebtBuffer"],
+        tuple(config["tokenHaircut"][0:maxMarketIndex]),
+        tuple(config["rateScalar"][0:maxMarketIndex]),
+    )
+
+
+def ntoken_parameters(maxMarketIndex):
+    """
+    Deposit and initialization parameters for any number of markets, extended from nTokenDefaults
+    with deposit shares split evenly
+    """
+    depositShares = [DEPOSIT_PERCENT_BASIS // maxMarketIndex] * maxMarketIndex
+    depositShares[0] += DEPOSIT_PERCENT_BASIS - sum(depositShares)
+    return (
+        (depositShares, [nTokenDefaults["Deposit"][1][0]] * maxMarketIndex),
+        (
+            [nTokenDefaults["Initialization"][0][0]] * maxMarketIndex,
+            [nTokenDefaults["Initialization"][1][0]] * maxMarketIndex,
+        ),
+    )
+
+
+def config_grid(base=CurrencyDefaults, **candidates):
+    """
+    Returns a config for every combination of the candidate values given per key, i.e.
+    config_grid(debtBuffer=[100, 150], fCashHaircut=[100, 150]). Other keys keep the base value.
+    """
+    keys = sorted(candidates)
+    configs = []
+    for values in product(*(candidates[k] for k in keys)):
+        config = copy(base)
+        config.update(zip(keys, values))
+        configs.append(config)
+    return configs
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _setup(scenario):
+    # Imported here since contract containers only exist once the project is loaded
+    from tests.helpers import initialize_environment
+
+    env = initialize_environment(accounts)
+    chain.snapshot()
+    _worker.update(env=env, scenario=scenario)
+
+
+def _start_worker(projectPath, scenario):
+    active = project.load(projectPath, raise_if_loaded=False)
+    active.load_config()
+    active._add_to_main_namespace()
+
+    # Every worker launches its own chain
+    CONFIG.networks["development"]["cmd_settings"]["port"] = _free_port()
+    network.connect("development")
+    _setup(scenario)
+
+
+def _implied_rate(env, marketIndex):
+    return env.notional.getActiveMarkets(CURRENCY_ID)[marketIndex - 1][5]
+
+
+def _roll_markets(env, config):
+    """Applies the config and initializes the next quarter's markets"""
+    maxMarketIndex = config["maxMarketIndex"]
+    env.notional.updateCashGroup(CURRENCY_ID, cash_group_settings(config))
+    (deposit, initialization) = ntoken_parameters(maxMarketIndex)
+    env.notional.updateDepositParameters(CURRENCY_ID, *deposit)
+    env.notional.updateInitializationParameters(CURRENCY_ID, *initialization)
+
+    blockTime = chain.time()
+    chain.mine(1, timestamp=blockTime - blockTime % QUARTER + QUARTER + 1)
+    for currencyId in MARKET_CURRENCY_IDS:
+        env.notional.initializeMarkets(currencyId, False)
+
+
+def _run_scenario(env, scenario, metrics):
+    from tests.helpers import get_balance_trade_action
+
+    (lender, borrower, liquidator) = (accounts[1], accounts[2], accounts[0])
+    lend = get_balance_trade_action(
+        CURRENCY_ID,
+        "DepositUnderlying",
+        [
+            {
+                "tradeActionType": "Lend",
+                "marketIndex": 1,
+                "notional": scenario["lendNotional"],
+                "minSlippage": 0,
+            }
+        ],
+        # Underlying has 18 decimals, more than enough to lend the notional
+        depositActionAmount=scenario["lendNotional"] * 10 ** 10,
+        withdrawEntireCashBalance=True,
+        redeemToUnderlying=True,
+    )
+    txn = env.notional.batchBalanceAndTradeAction(lender, [lend], {"from": lender})
+    metrics["lendAssetCash"] = txn.events["LendBorrowTrade"]["netAssetCash"]
+    metrics["lendImpliedRate"] = _implied_rate(env, 1)
+
+    collateral = get_balance_trade_action(
+        COLLATERAL_CURRENCY_ID, "DepositUnderlying", [], depositActionAmount=scenario["collateral"]
+    )
+    borrow = get_balance_trade_action(
+        CURRENCY_ID,
+        "None",
+        [
+            {
+                "tradeActionType": "Borrow",
+                "marketIndex": 2,
+                "notional": scenario["borrowNotional"],
+                "maxSlippage": 0,
+            }
+        ],
+        withdrawEntireCashBalance=True,
+        redeemToUnderlying=True,
+    )
+    txn = env.notional.batchBalanceAndTradeAction(
+        borrower, [collateral, borrow], {"from": borrower, "value": scenario["collateral"]}
+    )
+    metrics["borrowAssetCash"] = txn.events["LendBorrowTrade"]["netAssetCash"]
+    metrics["borrowImpliedRate"] = _implied_rate(env, 2)
+    metrics["freeCollateralAfterBorrow"] = env.notional.getFreeCollateral(borrower)[0]
+
+    oracle = env.ethOracle["DAI"]
+    oracle.setAnswer(int(oracle.latestAnswer() * (1 + scenario["priceShock"])))
+    metrics["freeCollateralAfterShock"] = env.notional.getFreeCollateral(borrower)[0]
+    if metrics["freeCollateralAfterShock"] >= 0:
+        return
+
+    txn = env.notional.liquidateCollateralCurrency(
+        borrower, CURRENCY_ID, COLLATERAL_CURRENCY_ID, 0, 0, True, False, {"from": liquidator}
+    )
+    event = txn.events["LiquidateCollateralCurrency"]
+    metrics["netLocalFromLiquidator"] = event["netLocalFromLiquidator"]
+    metrics["netCollateralTransfer"] = event["netCollateralTransfer"]
+    metrics["freeCollateralAfterLiquidation"] = env.notional.getFreeCollateral(borrower)[0]
+    metrics["liquidationGas"] = txn.gas_used
+
+
+def run_config(config):
+    """Runs the scenario for one config from the worker snapshot and returns its metrics"""
+    env = _worker["env"]
+    metrics = dict.fromkeys(METRICS)
+    chain.revert()
+    try:
+        _roll_markets(env, config)
+        _run_scenario(env, _worker["scenario"], metrics)
+    except VirtualMachineError as e:
+        metrics["error"] = e.revert_msg or str(e)
+    return metrics
+
+
+def sweep(configs, workers=None, scenario=None, projectPath="."):
+    """
+    Returns a list of (config, metrics) in config order. With `workers=1` the configs run on the
+    chain that is already connected, otherwise every worker process gets its own chain.
+    """
+    scenario = DEFAULT_SCENARIO if scenario is None else scenario
+    configs = list(configs)
+    if workers == 1:
+        _setup(scenario)
+        return list(zip(configs, map(run_config, configs)))
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=get_context("spawn"),
+        initializer=_start_worker,
+        initargs=(projectPath, scenario),
+    ) as pool:
+        return list(zip(configs, pool.map(run_config, configs)))
+
+
+def write_results(results, keys, path):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(keys + METRICS)
+        for (config, metrics) in results:
+            writer.writerow([config[k] for k in keys] + [metrics[m] for m in METRICS])
+
+
+def main(workers=None, output=None):
+    keys = ["debtBuffer", "fCashHaircut", "liquidationfCashDiscount", "maxMarketIndex"]
+    configs = [
+        c
+        for c in config_grid(
+            debtBuffer=[100, 150, 200],
+            fCashHaircut=[100, 150, 200],
+            liquidationfCashDiscount=[25, 50, 75],
+            maxMarketIndex=[2, 3],
+        )
+        # Rejected by the governance checks
+        if c["liquidationfCashDiscount"] < c["fCashHaircut"]
+    ]
+    results = sweep(configs, workers)
+
+    print(" ".join("{:>12}".format(k[:12]) for k in keys + METRICS[1:]))
+    for (config, metrics) in results:
+        if metrics["error"] is not None:
+            values = [config[k] for k in keys] + ["reverted: {}".format(metrics["error"])]
+        else:
+            values = [config[k] for k in keys] + [metrics[m] for m in METRICS[1:]]
+        print(" ".join("{:>12}".format(str(v)) for v in values))
+
+    if output is not None:
+        write_results(results, keys, output)
@@ -0,0 +1,368 @@
+"""
+Monte Carlo stress engine for cross currency collateral shocks.
+
+Scenarios are correlated joint draws of log shocks to every currency's ETH exchange rate and
+asset rate and of parallel shifts to its oracle rates. Accounts are reduced to, per currency,
+their cash balance, nToken balance and the risk adjusted present value of their fCash grouped
+by maturity. Under a scenario:
+
+  - cash and nTokens are asset cash, converted to underlying at the shocked asset rate. nTokens
+    are valued at the nToken present value per token with the PV haircut, as in
+    FreeCollateral._getNTokenHaircutAssetPV.
+  - fCash present values are discounted continuously at the oracle rate, so a parallel shift of
+    `shift` scales a present value with time to maturity t by exp(-shift * t / IMPLIED_RATE_TIME).
+  - net underlying values are converted to ETH at the shocked exchange rate with the haircut or
+    buffer of the currency, as in FreeCollateral._updateNetETHValue.
+
+Free collateral of every account is computed for a block of scenarios at once, fCash with one
+matrix product per currency, so the cost is linear in scenarios * accounts. Results are the
+shortfall distribution, the number of liquidatable accounts and the bad debt (negative net value
+before haircuts and buffers) that falls to the reserve, per scenario.
+
+Usage:
+    brownie run scripts/collateral_stress.py main [scenarios] [volatility] [rateVolatility] \
+        [correlation] --network mainnet
+"""
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Tuple
+
+import numpy as np
+from brownie import chain, network
+from scripts.environment_v2 import EnvironmentV2
+from scripts.liquidation_backtester import RiskParameters, active_accounts, current_rates
+from scripts.offchain.constants import (
+    ASSET_RATE_DECIMAL_DIFFERENCE,
+    BASIS_POINT,
+    FCASH_ASSET_TYPE,
+    IMPLIED_RATE_TIME,
+    PERCENTAGE_DECIMALS,
+    PV_HAIRCUT_PERCENTAGE,
+    RATE_PRECISION,
+)
+
+READ_WORKERS = 8
+# Upper bound on the (scenarios, accounts) elements evaluated at once
+CHUNK_ELEMENTS = 2 ** 23
+
+
+class StressParameters(NamedTuple):
+    currencyIds: Tuple[int, ...]
+    # (currencies,) ETH per unit of underlying and underlying internal precision per unit of
+    # asset cash internal precision, as read by the contracts
+    ethRates: np.ndarray
+    assetRates: np.ndarray
+    buffer: np.ndarray
+    haircut: np.ndarray
+    liquidationDiscount: np.ndarray
+    # (currencies,) asset cash per nToken and the nToken PV haircut percentage
+    nTokenPV: np.ndarray
+    nTokenPVHaircut: np.ndarray
+
+    @classmethod
+    def fromValuationMock(cls, valuation):
+        """Builds from the per currency settings of tests/internal/liquidation ValuationMock"""
+        currencyIds = tuple(sorted(valuation.ethRates))
+        return cls(
+            currencyIds,
+            np.array([valuation.ethRates[c] / 1e18 for c in currencyIds]),
+            np.array(
+                [
+                    valuation.cTokenRates[c]
+                    / (ASSET_RATE_DECIMAL_DIFFERENCE * 10 ** valuation.underlyingDecimals[c])
+                    for c in currencyIds
+                ]
+            ),
+            *[
+                np.array([float(valuation.bufferHaircutDiscount[c][i]) for c in currencyIds])
+                for i in range(3)
+            ],
+            np.array(
+                [
+                    valuation.nTokenCashBalance[c] / valuation.nTokenTotalSupply[c]
+                    for c in currencyIds
+                ]
+            ),
+            np.array([float(valuation.nTokenParameters[c][0]) for c in currencyIds]),
+        )
+
+    @classmethod
+    def fetch(cls, notional, currencyIds):
+        (ethRates, assetRates) = current_rates(notional, currencyIds)
+        risk = RiskParameters.fetch(notional, currencyIds)
+        (nTokenPV, nTokenPVHaircut) = ([], [])
+        for currencyId in currencyIds:
+            nTokenAccount = notional.getNTokenAccount(notional.nTokenAddress(currencyId))
+            totalSupply = nTokenAccount[1]
+            nTokenPV.append(
+                notional.nTokenPresentValueAssetDenominated(currencyId) / totalSupply
+                if totalSupply > 0
+                else 0
+            )
+            nTokenPVHaircut.append(bytes.fromhex(str(nTokenAccount[4])[2:])[PV_HAIRCUT_PERCENTAGE])
+
+        return cls(
+            tuple(currencyIds),
+            ethRates,
+            assetRates,
+            *risk,
+            np.array(nTokenPV, dtype=np.float64),
+            np.array(nTokenPVHaircut, dtype=np.float64),
+        )
+
+
+class StressPortfolio(NamedTuple):
+    # (accounts, currencies) cash balances in asset cash and nToken balances
+    cash: np.ndarray
+    nTokens: np.ndarray
+    # (currencies, maturities, accounts) risk adjusted fCash present value in underlying
+    fCashPV: np.ndarray
+    # (currencies, maturities) seconds to each maturity, padding maturities are zero
+    timeToMaturity: np.ndarray
+
+    @classmethod
+    def build(cls, currencyIds, balances, fCash, blockTime):
+        """
+        `balances` is a list per account of currencyId => (cashBalance, nTokenBalance) and
+        `fCash` a list per account of (currencyId, maturity, riskAdjustedPresentValue)
+        """
+        column = {c: i for (i, c) in enumerate(currencyIds)}
+        maturities = [
+            sorted({m for assets in fCash for (c, m, _) in assets if c == currencyId})
+            for currencyId in currencyIds
+        ]
+        index = [{m: i for (i, m) in enumerate(ms)} for ms in maturities]
+        width = max([len(ms) for ms in maturities] + [1])
+
+        cash = np.zeros((len(balances), len(currencyIds)))
+        nTokens = np.zeros((len(balances), len(currencyIds)))
+        fCashPV = np.zeros((len(currencyIds), width, len(balances)))
+        for (a, (accountBalances, assets)) in enumerate(zip(balances, fCash)):
+            for (currencyId, (cashBalance, nTokenBalance)) in accountBalances.items():
+                cash[a, column[currencyId]] = cashBalance
+                nTokens[a, column[currencyId]] = nTokenBalance
+            for (currencyId, maturity, pv) in assets:
+                c = column[currencyId]
+                fCashPV[c, index[c][maturity], a] += pv
+
+        timeToMaturity = np.zeros((len(currencyIds), width))
+        for (c, ms) in enumerate(maturities):
+            timeToMaturity[c, : len(ms)] = np.array(ms, dtype=np.float64) - blockTime
+        return cls(cash, nTokens, fCashPV, timeToMaturity)
+
+    @classmethod
+    def fetch(cls, notional, accounts, currencyIds, blockTime, workers=READ_WORKERS):
+        """
+        Reads balances and fCash of each account. Liquidity token cash claims are valued as
+        cash, the residual of the net local value after nTokens and fCash.
+        """
+        params = StressParameters.fetch(notional, currencyIds)
+        column = {c: i for (i, c) in enumerate(currencyIds)}
+
+        def fetch(account):
+            (_, accountBalances, portfolio) = notional.getAccount(account)
+            (_, netLocal) = notional.getFreeCollateral(account)
+            assets = [
+                (
+                    a[0],
+                    a[1],
+                    notional.getPresentfCashValue(a[0], a[1], a[3], blockTime, True),
+                )
+                for a in portfolio
+                if a[2] == FCASH_ASSET_TYPE
+            ]
+
+            balances = {}
+            for (balance, value) in zip(accountBalances, netLocal):
+                if balance[0] == 0:
+                    break
+                c = column[balance[0]]
+                pv = sum(p for (currencyId, _, p) in assets if currencyId == balance[0])
+                nTokenValue = (
+                    balance[2]
+                    * params.nTokenPV[c]
+                    * params.nTokenPVHaircut[c]
+                    / PERCENTAGE_DECIMALS
+                )
+                balances[balance[0]] = (
+                    value - nTokenValue - pv / params.assetRates[c],
+                    balance[2],
+                )
+            return (balances, assets)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            (balances, fCash) = zip(*pool.map(fetch, accounts)) if accounts else ((), ())
+
+        return cls.build(currencyIds, list(balances), list(fCash), blockTime)
+
+
+class Scenarios(NamedTuple):
+    # (scenarios, currencies) in the units of StressParameters
+    ethRates: np.ndarray
+    assetRates: np.ndarray
+    # (scenarios, currencies) parallel oracle rate shifts in RATE_PRECISION
+    oracleRateShifts: np.ndarray
+
+
+def correlated_scenarios(params, scenarios, volatility, correlation, seed=0):
+    """
+    Draws joint normal shocks for the factors [ETH rates, asset rates, oracle rates] of every
+    currency, in that order. `volatility` has 3 * currencies entries: log volatilities of the
+    ETH and asset rates and the oracle rate shift volatility in RATE_PRECISION. `correlation` is
+    the (3 * currencies) square factor correlation matrix.
+    """
+    currencies = len(params.currencyIds)
+    volatility = np.asarray(volatility, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    shocks = rng.standard_normal((scenarios, 3 * currencies)) @ np.linalg.cholesky(correlation).T
+    shocks *= volatility
+
+    (ethShocks, assetShocks, oracleShocks) = np.split(shocks, 3, axis=1)
+    ethVolatility = volatility[:currencies]
+    assetVolatility = volatility[currencies : 2 * currencies]  # noqa: E203
+    return Scenarios(
+        params.ethRates * np.exp(ethShocks - ethVolatility ** 2 / 2),
+        params.assetRates * np.exp(assetShocks - assetVolatility ** 2 / 2),
+        oracleShocks,
+    )
+
+
+def base_scenario(params):
+    """A single scenario with no shocks"""
+    return Scenarios(
+        params.ethRates[None, :],
+        params.assetRates[None, :],
+        np.zeros((1, len(params.currencyIds))),
+    )
+
+
+def _net_values(portfolio, params, scenarios):
+    # Returns (haircut, unhaircut) net ETH values of shape (scenarios, accounts)
+    (count, currencies) = scenarios.ethRates.shape
+    netETHValue = np.zeros((count, len(portfolio.cash)))
+    nTokenAssetPV = portfolio.nTokens * params.nTokenPV
+    nTokenHaircutPV = nTokenAssetPV * params.nTokenPVHaircut / PERCENTAGE_DECIMALS
+    haircutAssetCash = portfolio.cash + nTokenHaircutPV
+
+    # The value of the nToken haircut does not depend on the sign of the net value, so it is
+    # added to the unhaircut value with a single product over all currencies
+    netValue = (scenarios.ethRates * scenarios.assetRates) @ (nTokenAssetPV - nTokenHaircutPV).T
+    for c in range(currencies):
+        # Asset cash and fCash are valued together as one product of the scenario asset rate
+        # and discount factors against the account's asset cash and fCash present values
+        discount = np.exp(
+            -scenarios.oracleRateShifts[:, c, None]
+            / RATE_PRECISION
+            * portfolio.timeToMaturity[c]
+            / IMPLIED_RATE_TIME
+        )
+        factors = np.hstack([scenarios.assetRates[:, c, None], discount])
+        underlying = factors @ np.vstack([haircutAssetCash[None, :, c], portfolio.fCashPV[c]])
+
+        ethRate = scenarios.ethRates[:, c, None]
+        netValue += underlying * ethRate
+        underlying *= np.where(
+            underlying > 0,
+            ethRate * (params.haircut[c] / PERCENTAGE_DECIMALS),
+            ethRate * (params.buffer[c] / PERCENTAGE_DECIMALS),
+        )
+        netETHValue += underlying
+
+    return (netETHValue, netValue)
+
+
+def free_collateral(portfolio, params, scenarios):
+    """Net ETH value in internal precision of every account, shape (scenarios, accounts)"""
+    return _net_values(portfolio, params, scenarios)[0]
+
+
+class StressResult(NamedTuple):
+    # (scenarios,) accounts with negative free collateral, their total negative free collateral
+    # and the total negative net value before haircuts and buffers, in ETH internal precision
+    liquidatable: np.ndarray
+    shortfall: np.ndarray
+    badDebt: np.ndarray
+    # (scenarios,) reserve balances in ETH, zero if no reserves were given
+    reserves: np.ndarray
+    # (accounts,) number of scenarios in which each account is liquidatable
+    accountLiquidations: np.ndarray
+
+    def summary(self, quantiles=(0.5, 0.95, 0.99, 0.999)):
+        def distribution(values):
+            return dict(zip(quantiles, np.quantile(values, quantiles).tolist()))
+
+        return {
+            "scenarios": len(self.liquidatable),
+            "liquidatable": distribution(self.liquidatable),
+            "shortfall": distribution(self.shortfall),
+            "badDebt": distribution(self.badDebt),
+            "badDebtExceedsReserves": float((self.badDebt > self.reserves).mean()),
+            "accountsEverLiquidatable": int((self.accountLiquidations > 0).sum()),
+        }
+
+
+def stress(portfolio, params, scenarios, reserves=None):
+    """
+    Evaluates every scenario against the portfolio in blocks of scenarios. `reserves` are the
+    (currencies,) reserve balances in asset cash internal precision.
+    """
+    count = len(scenarios.ethRates)
+    chunk = max(1, CHUNK_ELEMENTS // max(1, len(portfolio.cash)))
+    (liquidatable, shortfall, badDebt) = (
+        np.zeros(count, dtype=np.int64),
+        np.zeros(count),
+        np.zeros(count),
+    )
+    accountLiquidations = np.zeros(len(portfolio.cash), dtype=np.int64)
+
+    for start in range(0, count, chunk):
+        block = slice(start, start + chunk)
+        (netETHValue, netValue) = _net_values(
+            portfolio, params, Scenarios(*[s[block] for s in scenarios])
+        )
+        negative = netETHValue < 0
+        liquidatable[block] = negative.sum(axis=1)
+        shortfall[block] = np.where(negative, -netETHValue, 0).sum(axis=1)
+        badDebt[block] = np.maximum(-netValue, 0).sum(axis=1)
+        accountLiquidations += negative.sum(axis=0)
+
+    reserveETH = np.zeros(count)
+    if reserves is not None:
+        reserveETH = (np.asarray(reserves) * scenarios.assetRates * scenarios.ethRates).sum(axis=1)
+
+    return StressResult(liquidatable, shortfall, badDebt, reserveETH, accountLiquidations)
+
+
+def main(scenarios=10000, volatility=0.1, rateVolatility=200, correlation=0.5, seed=0):
+    """
+    Stresses current accounts with one day shocks: `volatility` is the log volatility of ETH
+    rates, `rateVolatility` the oracle rate volatility in basis points and `correlation` the
+    correlation between any two non ETH exchange rates. Asset rates are held fixed.
+    """
+    networkName = network.show_active()
+    if networkName in ("mainnet-fork", "hardhat-fork"):
+        networkName = "mainnet"
+    with open("v2.{}.json".format(networkName), "r") as f:
+        config = json.load(f)
+    env = EnvironmentV2(config)
+
+    currencyIds = list(range(1, env.notional.getMaxCurrencyId() + 1))
+    accounts = active_accounts(env.notional, config["startBlock"], chain.height)
+    params = StressParameters.fetch(env.notional, currencyIds)
+    portfolio = StressPortfolio.fetch(env.notional, accounts, currencyIds, chain.time())
+    reserves = [env.notional.getReserveBalance(c) for c in currencyIds]
+
+    # ETH is the numeraire, its rate is always one
+    currencies = len(currencyIds)
+    volatilities = (
+        [0 if c == 1 else float(volatility) for c in currencyIds]
+        + [0] * currencies
+        + [float(rateVolatility) * BASIS_POINT] * currencies
+    )
+    factors = np.identity(3 * currencies)
+    factors[1:currencies, 1:currencies] = float(correlation)
+    np.fill_diagonal(factors, 1)
+    draws = correlated_scenarios(params, int(scenarios), volatilities, factors, seed=int(seed))
+
+    print("Stressing {} accounts over {} scenarios".format(len(accounts), scenarios))
+    print(json.dumps(stress(portfolio, params, draws, reserves).summary(), indent=2))
@@ -26,15 +26,64 @@ CurrencySymbol = {
     4: "WBTC"
 }
 
+# Parsed ABIs are shared by every contract handle in the process, keyed by file path
+_ABI_REGISTRY = {}
+
+
+def loadABI(path):
+    if path not in _ABI_REGISTRY:
+        with open(path, "r") as f:
+            _ABI_REGISTRY[path] = json.load(f)
+    return _ABI_REGISTRY[path]
+
+
+def loadArtifactABI(path):
+    return loadABI(path)["abi"]
+
+
+class LazyContract:
+    """
+    Stands in for a brownie Contract, the underlying handle is only built on first attribute
+    access. The address is available without building the contract so lazy handles can be
+    passed as transaction arguments.
+    """
+    def __init__(self, name, address, abi):
+        self._name = name
+        self.address = address
+        # Either an ABI list or a zero argument callable that returns one
+        self._abi = abi
+        self._contract = None
+
+    def _load(self):
+        if self._contract is None:
+            abi = self._abi() if callable(self._abi) else self._abi
+            self._contract = Contract.from_abi(self._name, self.address, abi)
+        return self._contract
+
+    def __getattr__(self, attr):
+        if attr in ("_name", "_abi", "_contract"):
+            # Not yet initialized, i.e. while being copied
+            raise AttributeError(attr)
+        return getattr(self._load(), attr)
+
+    def __str__(self):
+        return self.address
+
+    def __repr__(self):
+        return "<LazyContract '{}' at {}>".format(self._name, self.address)
+
+    def __eq__(self, other):
+        return str(self) == str(other)
+
+    def __hash__(self):
+        return hash(self.address)
+
+
 def loadContractFromABI(name, address, path):
-    with open(path, "r") as f:
-        abi = json.load(f)
-    return Contract.from_abi(name, address, abi)
+    return LazyContract(name, address, lambda: loadABI(path))
 
 def loadContractFromArtifact(name, address, path):
-    with open(path, "r") as a:
-        artifact = json.load(a)
-    return Contract.from_abi(name, address, artifact["abi"])
+    return LazyContract(name, address, lambda: loadArtifactABI(path))
 
 def getDependencies(bytecode):
     deps = set()
@@ -0,0 +1,162 @@
+"""
+Offline cToken exchange rate projection.
+
+Starting from a cToken's current cash, borrows, reserves and supply, interest is accrued with the
+cToken's whitepaper or jump rate model (CompoundConfig / scripts/artifacts) over arbitrary
+future block ranges. `project` is vectorized with numpy over any number of utilization scenarios
+so thousands of rate paths can be generated for settlement rate forecasting and stress tests.
+`project_exact` runs a single path with the integer port in scripts/offchain/compound.py, which
+matches cTokenV2Aggregator.getExchangeRateView exactly when accrued in one step.
+
+Interest is accrued once per step, which is the same as the cToken being touched every
+`blocksPerStep` blocks. Real cTokens accrue on every interaction so shorter steps compound
+slightly more often.
+"""
+import json
+
+import numpy as np
+from brownie import network
+from scripts.common import loadContractFromArtifact
+from scripts.config import CompoundConfig
+from scripts.environment_v2 import EnvironmentV2
+from scripts.offchain.compound import BLOCKS_PER_YEAR, MANTISSA, CTokenState, InterestRateModel
+
+INTEREST_RATE_MODEL_ARTIFACTS = {
+    "whitepaper": "scripts/artifacts/nWhitePaperInterestRateModel.json",
+    "jump": "scripts/artifacts/nJumpRateModel.json",
+}
+
+
+def borrow_rates(model, utilization):
+    """Per block borrow rates for an array of utilizations, both as fractions of one"""
+    base = model.baseRatePerBlock / MANTISSA
+    multiplier = model.multiplierPerBlock / MANTISSA
+    normalRates = utilization * multiplier + base
+    if model.kink >= MANTISSA:
+        # Whitepaper model or a kink that can never be reached
+        return normalRates
+
+    kink = model.kink / MANTISSA
+    jumpRates = (kink * multiplier + base) + (utilization - kink) * (
+        model.jumpMultiplierPerBlock / MANTISSA
+    )
+    return np.where(utilization <= kink, normalRates, jumpRates)
+
+
+def utilization_paths(
+    start, steps, scenarios, target=None, meanReversion=0.05, volatility=0.02, seed=None
+):
+    """
+    Mean reverting utilization paths with shape (scenarios, steps), clipped to [0, 0.99]. Used
+    as the utilization scenarios passed to `project`.
+    """
+    rng = np.random.default_rng(seed)
+    target = start if target is None else target
+    paths = np.empty((scenarios, steps))
+    current = np.full(scenarios, float(start))
+    for t in range(steps):
+        current = current + meanReversion * (target - current)
+        current = np.clip(current + volatility * rng.standard_normal(scenarios), 0.0, 0.99)
+        paths[:, t] = current
+    return paths
+
+
+def project(state, model, blocksPerStep, steps, utilization=None):
+    """
+    Returns projected exchange rates (in 1e18 mantissa terms) with shape (scenarios, steps + 1),
+    the first column is the current exchange rate.
+
+    `utilization` is an optional (scenarios, steps) array. Before each step, borrows and cash
+    are moved so that the utilization matches the scenario. The net underlying held by the
+    cToken does not change, so only the interest rate is affected. Without it a single
+    scenario is projected with no flows, where utilization drifts only through interest.
+    """
+    scenarios = 1 if utilization is None else utilization.shape[0]
+    if utilization is not None and utilization.shape[1] < steps:
+        raise Exception("Utilization scenarios are shorter than the projection")
+
+    cash = np.full(scenarios, float(state.cash))
+    borrows = np.full(scenarios, float(state.totalBorrows))
+    reserves = np.full(scenarios, float(state.totalReserves))
+    reserveFactor = state.reserveFactorMantissa / MANTISSA
+
+    rates = np.empty((scenarios, steps + 1))
+    rates[:, 0] = state.exchangeRate()
+    if state.totalSupply == 0:
+        # Nothing accrues to a cToken with no supply
+        rates[:, 1:] = state.initialExchangeRateMantissa
+        return rates
+
+    supply = float(state.totalSupply)
+    for t in range(steps):
+        if utilization is not None:
+            total = cash + borrows
+            borrows = np.clip(utilization[:, t], 0.0, 1.0) * (total - reserves)
+            cash = total - borrows
+
+        denominator = cash + borrows - reserves
+        util = np.divide(borrows, denominator, out=np.zeros(scenarios), where=borrows > 0)
+        interest = borrow_rates(model, util) * blocksPerStep * borrows
+        borrows = borrows + interest
+        reserves = reserves + reserveFactor * interest
+        rates[:, t + 1] = (cash + borrows - reserves) * MANTISSA / supply
+
+    return rates
+
+
+def project_exact(state, model, blocksPerStep, steps):
+    """Single path projection with the integer port, no utilization flows"""
+    rates = [state.exchangeRate()]
+    for _ in range(steps):
+        state = state.accrueInterest(model, state.accrualBlockNumber + blocksPerStep)
+        rates.append(state.exchangeRate())
+    return rates
+
+
+def annualized_rates(rates, blocksPerStep, steps=None):
+    """Annualized supply rate implied by each projected path, relative to the first column"""
+    steps = rates.shape[1] - 1 if steps is None else steps
+    growth = rates[:, steps] / rates[:, 0]
+    return (growth - 1) * BLOCKS_PER_YEAR / (blocksPerStep * steps)
+
+
+def load_ctoken(cToken, symbol, blockNumber=None):
+    """Returns the current state and interest rate model of a deployed cToken"""
+    name = CompoundConfig[symbol]["interestRateModel"]["name"]
+    model = loadContractFromArtifact(
+        "{}InterestRateModel".format(symbol),
+        cToken.interestRateModel(),
+        INTEREST_RATE_MODEL_ARTIFACTS[name],
+    )
+    return (CTokenState.fromContract(cToken, blockNumber), InterestRateModel.fromContract(model))
+
+
+def main(blocksPerStep=6570, steps=365, scenarios=1000, volatility=0.02, seed=None):
+    networkName = network.show_active()
+    if networkName in ("mainnet-fork", "hardhat-fork"):
+        networkName = "mainnet"
+    with open("v2.{}.json".format(networkName), "r") as f:
+        env = EnvironmentV2(json.load(f))
+
+    print(
+        "{:<6} {:>28} {:>10} {:>10} {:>10} {:>10}".format(
+            "cToken", "Exchange Rate", "Util", "p5 APY", "p50 APY", "p95 APY"
+        )
+    )
+    for (symbol, cToken) in env.ctokens.items():
+        (state, model) = load_ctoken(cToken, symbol)
+        denominator = state.cash + state.totalBorrows - state.totalReserves
+        startUtilization = state.totalBorrows / denominator if denominator > 0 else 0
+        paths = utilization_paths(
+            startUtilization, steps, scenarios, volatility=volatility, seed=seed
+        )
+        rates = project(state, model, blocksPerStep, steps, paths)
+        apy = annualized_rates(rates, blocksPerStep)
+        print(
+            "{:<6} {:>28} {:>10.4f} {:>10.4%} {:>10.4%} {:>10.4%}".format(
+                symbol,
+                state.exchangeRate(),
+                startUtilization,
+                *np.percentile(apy, [5, 50, 95]),
+            )
+        )
@@ -1,5 +1,5 @@
-from brownie import Contract, cTokenV2Aggregator
-from scripts.common import loadContractFromABI, loadContractFromArtifact
+from brownie import cTokenV2Aggregator
+from scripts.common import LazyContract, loadContractFromABI, loadContractFromArtifact
 
 
 class EnvironmentV2:
@@ -27,12 +27,12 @@ class EnvironmentV2:
         ctokens = self.config["compound"]["ctokens"]
         for k, v in ctokens.items():
             if k == "ETH":
-                path = "scripts/compound_artifacts/nCEther.json"
+                path = "scripts/artifacts/nCEther.json"
             else:
-                path = "scripts/compound_artifacts/nCErc20.json"
+                path = "scripts/artifacts/nCErc20.json"
             self.ctokens[k] = loadContractFromArtifact("c{}".format(k), v["address"], path)
-            self.cTokenOracles[k] = Contract.from_abi(
-                "c{}Oracle".format(k), v["oracle"], cTokenV2Aggregator.abi
+            self.cTokenOracles[k] = LazyContract(
+                "c{}Oracle".format(k), v["oracle"], lambda: cTokenV2Aggregator.abi
             )
 
         if "note" in self.config:
@@ -0,0 +1,294 @@
+"""
+Streaming export of Notional event logs over block ranges.
+
+Event ABIs are resolved once into a table keyed by topic0 and topic count (ERC20 and ERC1155
+events share names across the ABIs, the indexed layout tells them apart). Logs are fetched with
+raw eth_getLogs requests in block chunks that adapt to the number of logs returned and to node
+errors, the next chunk is fetched on a background thread while the current one is decoded.
+
+Events made only of static types are decoded directly from 32 byte words, events with dynamic
+types (strings and arrays) fall back to eth_abi. Indexed dynamic types are returned as the topic
+hash, as they are in brownie.
+
+Usage:
+    brownie run scripts/event_logs.py main <fromBlock> <toBlock> <output.jsonl> [--network mainnet]
+"""
+import json
+import queue
+import re
+import threading
+from functools import lru_cache
+from typing import NamedTuple
+
+from brownie import network
+from brownie.network import web3
+from eth_abi import decode_abi
+from eth_utils import event_abi_to_log_topic, to_checksum_address
+from scripts.common import loadABI
+from scripts.environment_v2 import EnvironmentV2
+
+EVENT_ABI_PATHS = ("abi/Notional.json", "abi/nTokenERC20.json", "abi/IStrategyVault.json")
+
+WORD = 32
+# Requested block range per eth_getLogs call, adjusted as logs are returned
+INITIAL_CHUNK_SIZE = 2_000
+MIN_CHUNK_SIZE = 1
+MAX_CHUNK_SIZE = 500_000
+# Chunks are sized so that each response holds roughly this many logs
+TARGET_LOGS_PER_CHUNK = 2_000
+PREFETCH_CHUNKS = 4
+
+STATIC_TYPE_PATTERN = re.compile(r"^(u?int\d*|address|bool|bytes\d+)$")
+
+
+class EventLog(NamedTuple):
+    event: str
+    address: str
+    blockNumber: int
+    transactionHash: str
+    logIndex: int
+    # Event arguments by name, as in brownie's EventDict
+    args: dict
+
+
+_checksum_address = lru_cache(maxsize=4096)(to_checksum_address)
+
+
+def _to_address(word):
+    return _checksum_address(word[12:])
+
+
+def _word_decoder(abiType):
+    """Returns a function decoding a 32 byte word of a static ABI type"""
+    if abiType.startswith("uint"):
+        return lambda w: int.from_bytes(w, "big")
+    elif abiType.startswith("int"):
+        return lambda w: int.from_bytes(w, "big", signed=True)
+    elif abiType == "address":
+        return _to_address
+    elif abiType == "bool":
+        return lambda w: w[-1] == 1
+    elif abiType.startswith("bytes"):
+        size = int(abiType[5:])
+        return lambda w: w[:size]
+    raise Exception("Unsupported static type {}".format(abiType))
+
+
+class EventSpec:
+    def __init__(self, abi):
+        self.name = abi["name"]
+        self.topic = event_abi_to_log_topic(abi)
+        self.argNames = [i["name"] for i in abi["inputs"]]
+
+        # Indexed dynamic types are hashed into their topic and kept as is
+        self.topicDecoders = [
+            _word_decoder(i["type"]) if STATIC_TYPE_PATTERN.match(i["type"]) else bytes
+            for i in abi["inputs"]
+            if i["indexed"]
+        ]
+        dataTypes = [i["type"] for i in abi["inputs"] if not i["indexed"]]
+        if all(STATIC_TYPE_PATTERN.match(t) for t in dataTypes):
+            self.dataDecoders = [_word_decoder(t) for t in dataTypes]
+            self.dataTypes = None
+        else:
+            self.dataDecoders = None
+            self.dataTypes = dataTypes
+
+        # Position of each input in the indexed and data lists, in argument order
+        self.order = []
+        (indexed, data) = (0, 0)
+        for i in abi["inputs"]:
+            if i["indexed"]:
+                self.order.append((True, indexed))
+                indexed += 1
+            else:
+                self.order.append((False, data))
+                data += 1
+        self.topicCount = indexed + 1
+
+    def decode(self, topics, data):
+        indexed = [decode(t) for (decode, t) in zip(self.topicDecoders, topics[1:])]
+        if self.dataDecoders is not None:
+            values = [
+                decode(data[i * WORD : (i + 1) * WORD])
+                for (i, decode) in enumerate(self.dataDecoders)
+            ]
+        else:
+            values = [
+                _checksum_address(v) if t == "address" else v
+                for (t, v) in zip(self.dataTypes, decode_abi(self.dataTypes, data))
+            ]
+
+        return dict(
+            zip(
+                self.argNames,
+                (indexed[i] if isIndexed else values[i] for (isIndexed, i) in self.order),
+            )
+        )
+
+
+class EventDecoder:
+    def __init__(self, paths=EVENT_ABI_PATHS):
+        # (topic0, topic count) => EventSpec
+        self.events = {}
+        for path in paths:
+            abi = loadABI(path)
+            abi = abi["abi"] if isinstance(abi, dict) else abi
+            for e in abi:
+                if e["type"] != "event" or e.get("anonymous", False):
+                    continue
+                spec = EventSpec(e)
+                self.events.setdefault((spec.topic, spec.topicCount), spec)
+        self.unknown = 0
+
+    def topics(self, names):
+        """topic0 filter for eth_getLogs matching any of the event names"""
+        topics = sorted({s.topic for s in self.events.values() if s.name in names})
+        if len(topics) == 0:
+            raise Exception("No events named {}".format(", ".join(names)))
+        return ["0x" + t.hex() for t in topics]
+
+    def decode(self, log):
+        """Decodes a raw JSON-RPC log into an EventLog, returns None for unknown events"""
+        topics = [bytes.fromhex(t[2:]) for t in log["topics"]]
+        spec = self.events.get((topics[0], len(topics))) if topics else None
+        if spec is None:
+            self.unknown += 1
+            return None
+
+        return EventLog(
+            spec.name,
+            _checksum_address(log["address"]),
+            int(log["blockNumber"], 16),
+            log["transactionHash"],
+            int(log["logIndex"], 16),
+            spec.decode(topics, bytes.fromhex(log["data"][2:])),
+        )
+
+
+def fetch_log_chunks(fromBlock, toBlock, addresses, topics=None, chunkSize=INITIAL_CHUNK_SIZE):
+    """
+    Yields lists of raw logs for consecutive block ranges covering fromBlock to toBlock. The block
+    range is halved when the node rejects a request or returns too many logs and doubled when it
+    returns few.
+    """
+    start = fromBlock
+    while start <= toBlock:
+        end = min(start + chunkSize - 1, toBlock)
+        params = {"fromBlock": hex(start), "toBlock": hex(end), "address": addresses}
+        if topics is not None:
+            params["topics"] = [topics]
+
+        try:
+            response = web3.provider.make_request("eth_getLogs", [params])
+            error = response.get("error")
+        except (OSError, ValueError) as e:
+            # Timeouts and oversized responses
+            error = str(e)
+
+        if error is not None:
+            if chunkSize == MIN_CHUNK_SIZE:
+                raise Exception("eth_getLogs failed for block {}: {}".format(start, error))
+            chunkSize = max(chunkSize // 2, MIN_CHUNK_SIZE)
+            continue
+
+        logs = response["result"]
+        yield logs
+        start = end + 1
+
+        if len(logs) > TARGET_LOGS_PER_CHUNK:
+            chunkSize = max(chunkSize // 2, MIN_CHUNK_SIZE)
+        elif len(logs) < TARGET_LOGS_PER_CHUNK // 2:
+            chunkSize = min(chunkSize * 2, MAX_CHUNK_SIZE)
+
+
+def prefetch(iterable, size=PREFETCH_CHUNKS):
+    """Iterates `iterable` on a background thread, buffering up to `size` items ahead"""
+    buffer = queue.Queue(maxsize=size)
+    done = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                buffer.put((item, None))
+        except Exception as e:
+            buffer.put((None, e))
+        buffer.put((done, None))
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        (item, error) = buffer.get()
+        if error is not None:
+            raise error
+        if item is done:
+            return
+        yield item
+
+
+def stream_events(decoder, fromBlock, toBlock, addresses, names=None, chunkSize=None):
+    """
+    Yields decoded EventLogs emitted by `addresses` between fromBlock and toBlock (inclusive) in
+    block order, optionally only the events in `names`. Removed and unknown logs are skipped.
+    """
+    topics = decoder.topics(names) if names is not None else None
+    chunks = fetch_log_chunks(
+        fromBlock, toBlock, addresses, topics, chunkSize or INITIAL_CHUNK_SIZE
+    )
+    for logs in prefetch(chunks):
+        for log in logs:
+            if log.get("removed", False):
+                continue
+            record = decoder.decode(log)
+            if record is not None:
+                yield record
+
+
+def _json_value(value):
+    if isinstance(value, bytes):
+        return "0x" + value.hex()
+    elif isinstance(value, (list, tuple)):
+        return [_json_value(v) for v in value]
+    return value
+
+
+def export_jsonl(records, path):
+    """Writes records as one JSON object per line, returns the number of records written"""
+    count = 0
+    with open(path, "w") as f:
+        for r in records:
+            row = r._asdict()
+            row["args"] = {k: _json_value(v) for (k, v) in r.args.items()}
+            f.write(json.dumps(row))
+            f.write("\n")
+            count += 1
+    return count
+
+
+def notional_addresses(notional):
+    """The Notional proxy and every nToken, which emit nToken ERC20 events"""
+    addresses = [notional.address]
+    for currencyId in range(1, notional.getMaxCurrencyId() + 1):
+        addresses.append(notional.nTokenAddress(currencyId))
+    return addresses
+
+
+def main(fromBlock=None, toBlock=None, output="events.jsonl", names=None):
+    networkName = network.show_active()
+    if networkName in ("mainnet-fork", "hardhat-fork"):
+        networkName = "mainnet"
+    with open("v2.{}.json".format(networkName), "r") as f:
+        config = json.load(f)
+    env = EnvironmentV2(config)
+
+    fromBlock = int(config["startBlock"] if fromBlock is None else fromBlock)
+    toBlock = int(web3.eth.block_number if toBlock is None else toBlock)
+    names = names.split(",") if isinstance(names, str) else names
+
+    decoder = EventDecoder()
+    records = stream_events(decoder, fromBlock, toBlock, notional_addresses(env.notional), names)
+    count = export_jsonl(records, output)
+    print(
+        "Exported {} events from blocks {} to {} to {}, skipped {} unknown logs".format(
+            count, fromBlock, toBlock, output, decoder.unknown
+        )
+    )
@@ -0,0 +1,457 @@
+"""
+Off chain route and size planner for collateral currency liquidations with
+NotionalV2FlashLiquidator.
+
+A flash liquidation borrows local currency underlying from the lending pool, purchases the
+account's collateral with it, sells the collateral underlying on a DEX and repays the loan plus
+premium. The planner reads the liquidation view (calculateCollateralCurrencyLiquidation with no
+limits) once, then searches the liquidation size and the DEX route locally:
+
+  - The local currency paid by the liquidator is linear in the collateral purchased. Collateral
+    is taken from cash before nTokens and nTokens are purchased at their liquidation haircut, so
+    the proceeds are linear on each side of the point where cash runs out.
+  - Swap venues are exchange models that quote routes with the same integer math as the venue.
+    MockExchangeModel mirrors MockExchange, ConstantProductModel is a constant product pool graph
+    for multi hop routes, encoded as Uniswap V3 SwapRouter exactInput calls.
+
+Profit in local underlying is the swap output less the local currency paid, the flash loan
+premium and gas. It is maximized with a golden section search on each linear segment of the
+liquidation size for every route, so no RPC calls are made per candidate. The best plan is
+encoded into the LiquidationAction params and the lending pool flashLoan calldata.
+
+Usage:
+    brownie run scripts/flash_liquidation_planner.py main <account> <localCurrency> \
+        <collateralCurrency> <liquidator> <mockExchange> [gasPrice] --network <network>
+"""
+import json
+import math
+from typing import NamedTuple, Tuple
+
+from brownie import MockExchange, network
+from eth_abi import encode_abi
+from eth_utils import function_signature_to_4byte_selector
+from scripts.environment_v2 import EnvironmentV2
+from scripts.offchain.asset_rate import AssetRate
+from scripts.offchain.constants import (
+    ETH_CURRENCY_ID,
+    INTERNAL_TOKEN_PRECISION,
+    LIQUIDATION_HAIRCUT_PERCENTAGE,
+    PERCENTAGE_DECIMALS,
+)
+from scripts.offchain.exchange_rate import ETHRate
+
+# Matches LiquidationType in NotionalV2BaseLiquidator.sol
+COLLATERAL_CURRENCY_LIQUIDATION = 1
+COLLATERAL_CURRENCY_LIQUIDATION_TYPES = (
+    "(address,uint16,address,uint16,address,address,uint128,uint96,(address,bytes))"
+)
+LIQUIDATION_ACTION_TYPES = "(uint8,bool,bool,bytes)"
+
+SELECTORS = {
+    name: function_signature_to_4byte_selector(signature)
+    for (name, signature) in {
+        "exchange": "exchange(address,address,uint256)",
+        "exactInput": "exactInput((bytes,address,uint256,uint256,uint256))",
+        "flashLoan": "flashLoan(address,address[],uint256[],uint256[],address,bytes,uint16)",
+    }.items()
+}
+
+BASIS_POINTS = 10000
+# Aave V2 and MockAaveFlashLender charge 9 basis points
+FLASH_LOAN_PREMIUM_BPS = 9
+# Collateral redeemed from cTokens and nTokens is not exact, the swap input is discounted by
+# this much so that the trade never exceeds the balance held by the liquidator
+COLLATERAL_BUFFER_BPS = 5
+SLIPPAGE_BPS = 50
+# Gas used by a flash collateral currency liquidation excluding the swap, and per swap hop
+COLLATERAL_LIQUIDATION_GAS = 1_500_000
+SWAP_HOP_GAS = 110_000
+UNISWAP_FEE_PRECISION = 1_000_000
+# Iterations of the golden section search on each segment, the interval shrinks by 0.618 each
+SEARCH_ITERATIONS = 48
+GOLDEN_RATIO = (math.sqrt(5) - 1) / 2
+
+
+def _to_external(internal, decimals, roundUp=False):
+    if roundUp:
+        return -((-internal * decimals) // INTERNAL_TOKEN_PRECISION)
+    return internal * decimals // INTERNAL_TOKEN_PRECISION
+
+
+class Route(NamedTuple):
+    exchange: object
+    # Tokens traded through, from the collateral underlying to the local underlying
+    tokens: Tuple[str, ...]
+    # Pool fees per hop, empty for venues without fee tiers
+    fees: Tuple[int, ...] = ()
+
+    @property
+    def hops(self):
+        return len(self.tokens) - 1
+
+    def quote(self, amountIn):
+        return self.exchange.quote(self, amountIn)
+
+
+class MockExchangeModel:
+    """Mirrors MockExchange: a single hop between any two tokens at a fixed 1e18 rate"""
+
+    def __init__(self, address, exchangeRate, balances=None):
+        self.address = str(address)
+        self.exchangeRate = int(exchangeRate)
+        # Token => balance held by the exchange, the trade reverts if it cannot pay out
+        self.balances = {str(k): int(v) for (k, v) in (balances or {}).items()}
+
+    @classmethod
+    def fromContract(cls, exchange, tokens):
+        """Reads the exchange rate and the exchange's balance of each of the ERC20 `tokens`"""
+        return cls(
+            exchange.address,
+            exchange.exchangeRate(),
+            {t.address: t.balanceOf(exchange.address) for t in tokens},
+        )
+
+    def routes(self, tokenIn, tokenOut, maxHops):
+        return [Route(self, (str(tokenIn), str(tokenOut)))]
+
+    def quote(self, route, amountIn):
+        amountOut = amountIn * self.exchangeRate // 10 ** 18
+        if route.tokens[-1] in self.balances and amountOut > self.balances[route.tokens[-1]]:
+            return 0
+        return amountOut
+
+    def trade_data(self, route, amountIn, amountOutMin, recipient, deadline):
+        # MockExchange has no minimum output, the flash loan repayment fails instead
+        return (
+            self.address,
+            SELECTORS["exchange"]
+            + encode_abi(
+                ["address", "address", "uint256"], [route.tokens[0], route.tokens[1], amountIn]
+            ),
+        )
+
+
+class ConstantProductModel:
+    """
+    Graph of constant product pools reached through a Uniswap V3 style router. Each pool is
+    (tokenA, tokenB, reserveA, reserveB, fee) with the fee in hundredths of a basis point. Pools
+    are modeled as full range liquidity, which underestimates the output of concentrated pools.
+    """
+
+    def __init__(self, address, pools):
+        self.address = str(address)
+        self.pools = {}
+        for (tokenA, tokenB, reserveA, reserveB, fee) in pools:
+            (tokenA, tokenB) = (str(tokenA), str(tokenB))
+            self.pools.setdefault(tokenA, {})[(tokenB, fee)] = (int(reserveA), int(reserveB))
+            self.pools.setdefault(tokenB, {})[(tokenA, fee)] = (int(reserveB), int(reserveA))
+
+    def routes(self, tokenIn, tokenOut, maxHops):
+        (tokenIn, tokenOut) = (str(tokenIn), str(tokenOut))
+        found = []
+        paths = [((tokenIn,), ())]
+        for _ in range(maxHops):
+            extended = []
+            for (tokens, fees) in paths:
+                for (token, fee) in self.pools.get(tokens[-1], {}):
+                    if token == tokenOut:
+                        found.append(Route(self, tokens + (token,), fees + (fee,)))
+                    elif token not in tokens:
+                        extended.append((tokens + (token,), fees + (fee,)))
+            paths = extended
+        return found
+
+    def quote(self, route, amountIn):
+        amount = amountIn
+        for (i, fee) in enumerate(route.fees):
+            (reserveIn, reserveOut) = self.pools[route.tokens[i]][(route.tokens[i + 1], fee)]
+            amountWithFee = amount * (UNISWAP_FEE_PRECISION - fee)
+            amount = (
+                amountWithFee * reserveOut // (reserveIn * UNISWAP_FEE_PRECISION + amountWithFee)
+            )
+        return amount
+
+    def trade_data(self, route, amountIn, amountOutMin, recipient, deadline):
+        # Uniswap V3 paths are packed token (20 bytes), fee (3 bytes), token...
+        path = bytes.fromhex(route.tokens[0][2:])
+        for (fee, token) in zip(route.fees, route.tokens[1:]):
+            path += fee.to_bytes(3, "big") + bytes.fromhex(token[2:])
+        return (
+            self.address,
+            SELECTORS["exactInput"]
+            + encode_abi(
+                ["(bytes,address,uint256,uint256,uint256)"],
+                [(path, str(recipient), deadline, amountIn, amountOutMin)],
+            ),
+        )
+
+
+class Currency(NamedTuple):
+    currencyId: int
+    assetAddress: str
+    # WETH for ETH, since the liquidator wraps ETH before trading or repaying the flash loan
+    underlyingAddress: str
+    underlyingDecimals: int
+    hasTransferFee: bool
+    assetRate: AssetRate
+    ethRate: ETHRate
+
+    @classmethod
+    def fetch(cls, notional, currencyId, weth):
+        (assetToken, underlyingToken) = notional.getCurrency(currencyId)
+        (_, _, ethRate, assetRate) = notional.getCurrencyAndRates(currencyId)
+        underlying = str(weth) if currencyId == ETH_CURRENCY_ID else str(underlyingToken[0])
+        return cls(
+            currencyId,
+            str(assetToken[0]),
+            underlying,
+            int(underlyingToken[2]),
+            bool(assetToken[1]) or bool(underlyingToken[1]),
+            AssetRate.fromParameters(assetRate),
+            ETHRate.fromParameters(ethRate),
+        )
+
+    def to_underlying(self, assetCash, roundUp=False):
+        """Asset cash in internal precision to underlying in external precision"""
+        return _to_external(
+            self.assetRate.convertToUnderlying(assetCash), self.underlyingDecimals, roundUp
+        )
+
+
+class LiquidationView(NamedTuple):
+    account: str
+    local: Currency
+    collateral: Currency
+    # Results of calculateCollateralCurrencyLiquidation with no limits, all positive
+    localAssetCash: int
+    collateralAssetCash: int
+    collateralNTokens: int
+    # Asset cash claimed by all collateral nTokens and their liquidation haircut
+    nTokenAssetValue: int
+    nTokenLiquidationHaircut: int
+
+    @classmethod
+    def fetch(cls, notional, account, localCurrency, collateralCurrency, weth):
+        (localAssetCash, collateralAssetCash, nTokens) = [
+            int(v)
+            for v in notional.calculateCollateralCurrencyLiquidation.call(
+                account, localCurrency, collateralCurrency, 0, 0
+            )
+        ]
+
+        (nTokenAssetValue, haircut) = (0, PERCENTAGE_DECIMALS)
+        if nTokens > 0:
+            nTokenAccount = notional.getNTokenAccount(notional.nTokenAddress(collateralCurrency))
+            nTokenAssetValue = (
+                nTokens
+                * notional.nTokenPresentValueAssetDenominated(collateralCurrency)
+                // nTokenAccount[1]
+            )
+            haircut = bytes.fromhex(str(nTokenAccount[4])[2:])[LIQUIDATION_HAIRCUT_PERCENTAGE]
+
+        return cls(
+            str(account),
+            Currency.fetch(notional, localCurrency, weth),
+            Currency.fetch(notional, collateralCurrency, weth),
+            localAssetCash,
+            collateralAssetCash,
+            nTokens,
+            nTokenAssetValue,
+            haircut,
+        )
+
+    @property
+    def collateralRaised(self):
+        """Collateral asset cash counted against maxCollateralLiquidation for a full liquidation"""
+        return (
+            self.collateralAssetCash
+            + self.nTokenAssetValue * self.nTokenLiquidationHaircut // PERCENTAGE_DECIMALS
+        )
+
+    def at(self, maxCollateralLiquidation):
+        """
+        Returns (localAssetCash, collateralAssetCashProceeds) when liquidating with the given
+        maxCollateralLiquidation, proceeds include the asset cash redeemed from nTokens
+        """
+        raised = min(maxCollateralLiquidation, self.collateralRaised)
+        localAssetCash = -((-self.localAssetCash * raised) // self.collateralRaised)
+        fromCash = min(raised, self.collateralAssetCash)
+        fromNTokens = (raised - fromCash) * PERCENTAGE_DECIMALS // self.nTokenLiquidationHaircut
+        return (localAssetCash, fromCash + fromNTokens)
+
+
+class Plan(NamedTuple):
+    route: Route
+    maxCollateralLiquidation: int
+    localAssetCash: int
+    # Amounts below are in the external precision of the local or collateral underlying
+    flashLoanAmount: int
+    premium: int
+    amountIn: int
+    amountOut: int
+    amountOutMin: int
+    gasCost: int
+    profit: int
+
+
+def gas_cost(view, route, gasPrice):
+    """Gas cost of liquidating through `route` in local underlying"""
+    gasWei = gasPrice * (COLLATERAL_LIQUIDATION_GAS + SWAP_HOP_GAS * route.hops)
+    ethInternal = gasWei * INTERNAL_TOKEN_PRECISION // 10 ** 18
+    return _to_external(
+        view.local.ethRate.convertETHTo(ethInternal), view.local.underlyingDecimals, True
+    )
+
+
+def evaluate(view, route, maxCollateralLiquidation, gasCost, premiumBps=FLASH_LOAN_PREMIUM_BPS):
+    (localAssetCash, proceeds) = view.at(maxCollateralLiquidation)
+    # Minting cTokens rounds down, one more unit of underlying covers the local asset cash
+    flashLoanAmount = view.local.to_underlying(localAssetCash, True) + 1
+    premium = flashLoanAmount * premiumBps // BASIS_POINTS
+    amountIn = (
+        view.collateral.to_underlying(proceeds)
+        * (BASIS_POINTS - COLLATERAL_BUFFER_BPS)
+        // BASIS_POINTS
+    )
+    amountOut = route.quote(amountIn)
+    # Local underlying not spent on the liquidation is redeemed and repays part of the loan
+    profit = amountOut - view.local.to_underlying(localAssetCash, True) - premium - gasCost
+
+    return Plan(
+        route,
+        maxCollateralLiquidation,
+        localAssetCash,
+        flashLoanAmount,
+        premium,
+        amountIn,
+        amountOut,
+        amountOut * (BASIS_POINTS - SLIPPAGE_BPS) // BASIS_POINTS,
+        gasCost,
+        profit,
+    )
+
+
+def _golden_section(f, lower, upper):
+    """Maximizes a unimodal function of an integer on [lower, upper], returns the best result"""
+    best = max(f(lower), f(upper), key=lambda p: p.profit)
+    (a, b) = (lower, upper)
+    c = int(b - GOLDEN_RATIO * (b - a))
+    d = int(a + GOLDEN_RATIO * (b - a))
+    (fc, fd) = (f(c), f(d))
+    for _ in range(SEARCH_ITERATIONS):
+        if b - a <= 2:
+            break
+        if fc.profit >= fd.profit:
+            (b, d, fd) = (d, c, fc)
+            c = int(b - GOLDEN_RATIO * (b - a))
+            fc = f(c)
+        else:
+            (a, c, fc) = (c, d, fd)
+            d = int(a + GOLDEN_RATIO * (b - a))
+            fd = f(d)
+        best = max(best, fc, fd, key=lambda p: p.profit)
+    return best
+
+
+def plan_collateral_liquidation(view, exchanges, gasPrice, maxHops=2):
+    """
+    Returns the most profitable Plan across the routes of `exchanges` from the collateral
+    underlying to the local underlying, or None if no route is profitable
+    """
+    if view.localAssetCash <= 0 or view.collateralRaised <= 0:
+        return None
+
+    # Proceeds are linear on each side of the point where the collateral cash runs out
+    segments = [(1, view.collateralRaised)]
+    if 0 < view.collateralAssetCash < view.collateralRaised:
+        segments = [
+            (1, view.collateralAssetCash),
+            (view.collateralAssetCash, view.collateralRaised),
+        ]
+
+    best = None
+    for exchange in exchanges:
+        for route in exchange.routes(
+            view.collateral.underlyingAddress, view.local.underlyingAddress, maxHops
+        ):
+            cost = gas_cost(view, route, gasPrice)
+            for (lower, upper) in segments:
+                plan = _golden_section(lambda c: evaluate(view, route, c, cost), lower, upper)
+                if best is None or plan.profit > best.profit:
+                    best = plan
+
+    return best if best is not None and best.profit > 0 else None
+
+
+def encode_params(view, plan, liquidator, deadline, withdrawProfit=True):
+    """Encodes the LiquidationAction decoded by executeOperation"""
+    (dexAddress, tradeParams) = plan.route.exchange.trade_data(
+        plan.route, plan.amountIn, plan.amountOutMin, liquidator, deadline
+    )
+    payload = encode_abi(
+        [COLLATERAL_CURRENCY_LIQUIDATION_TYPES],
+        [
+            (
+                view.account,
+                view.local.currencyId,
+                view.local.underlyingAddress,
+                view.collateral.currencyId,
+                view.collateral.assetAddress,
+                view.collateral.underlyingAddress,
+                plan.maxCollateralLiquidation,
+                0,
+                (dexAddress, tradeParams),
+            )
+        ],
+    )
+    return encode_abi(
+        [LIQUIDATION_ACTION_TYPES],
+        [(COLLATERAL_CURRENCY_LIQUIDATION, withdrawProfit, view.local.hasTransferFee, payload)],
+    )
+
+
+def flash_loan_calldata(view, plan, liquidator, params):
+    """Calldata for flashLoan on the lending pool with the liquidator as the receiver"""
+    return SELECTORS["flashLoan"] + encode_abi(
+        ["address", "address[]", "uint256[]", "uint256[]", "address", "bytes", "uint16"],
+        [
+            str(liquidator),
+            [view.local.underlyingAddress],
+            [plan.flashLoanAmount],
+            [0],
+            str(liquidator),
+            params,
+            0,
+        ],
+    )
+
+
+def main(
+    account, localCurrency, collateralCurrency, liquidator, mockExchange, gasPrice=50 * 10 ** 9
+):
+    networkName = network.show_active()
+    if networkName in ("mainnet-fork", "hardhat-fork"):
+        networkName = "mainnet"
+    with open("v2.{}.json".format(networkName), "r") as f:
+        config = json.load(f)
+    env = EnvironmentV2(config)
+
+    view = LiquidationView.fetch(
+        env.notional,
+        account,
+        int(localCurrency),
+        int(collateralCurrency),
+        config["tokens"]["WETH"]["address"],
+    )
+    exchange = MockExchange.at(mockExchange)
+    model = MockExchangeModel(exchange.address, exchange.exchangeRate())
+    plan = plan_collateral_liquidation(view, [model], int(gasPrice))
+    if plan is None:
+        print("No profitable liquidation for {}".format(account))
+        return
+
+    params = encode_params(view, plan, liquidator, 2 ** 256 - 1)
+    print(json.dumps({k: str(v) for (k, v) in plan._asdict().items() if k != "route"}, indent=2))
+    print(
+        "flashLoan calldata: 0x{}".format(flash_loan_calldata(view, plan, liquidator, params).hex())
+    )
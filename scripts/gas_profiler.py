@@ -0,0 +1,199 @@
+"""
+Per function gas profiler for Notional transactions.
+
+Replays a transaction with debug_traceTransaction (via brownie's TransactionReceipt.trace) and
+attributes the gas of every opcode to the source function it belongs to using the pc maps in the
+brownie build. Internal functions are tracked with the jump depth brownie derives from the source
+maps, external calls with the call depth, so library calls such as Market.calculateTrade or
+FreeCollateral valuation show up as their own frames.
+
+Outputs a per function inclusive / exclusive gas table as JSON and a folded stack file which can
+be rendered with flamegraph.pl or loaded directly into speedscope.
+"""
+import json
+from collections import Counter, defaultdict
+
+from brownie import accounts, chain
+from tests.constants import SECONDS_IN_QUARTER
+from tests.helpers import get_balance_trade_action, get_tref, initialize_environment
+
+
+def _function_name(step):
+    if step.get("fn"):
+        return step["fn"]
+    return "{}.<unknown>".format(step.get("contractName") or step.get("address"))
+
+
+def _step_costs(trace):
+    """
+    Returns the gas consumed by each step. For call opcodes this is only the cost of the call
+    itself, the gas spent inside the callee is attributed to the callee's own steps.
+    """
+    costs = [0] * len(trace)
+    # Stack of [call step index, gas consumed by the callee so far]
+    openCalls = []
+
+    for (i, step) in enumerate(trace):
+        while openCalls and step["depth"] <= trace[openCalls[-1][0]]["depth"]:
+            (callIndex, calleeGas) = openCalls.pop()
+            costs[callIndex] = trace[callIndex]["gas"] - step["gas"] - calleeGas
+            if openCalls:
+                openCalls[-1][1] += costs[callIndex] + calleeGas
+
+        nextStep = trace[i + 1] if i + 1 < len(trace) else None
+        if nextStep is not None and nextStep["depth"] > step["depth"]:
+            # Cost is resolved when execution returns to this depth
+            openCalls.append([i, 0])
+            continue
+        elif nextStep is not None and nextStep["depth"] == step["depth"]:
+            costs[i] = step["gas"] - nextStep["gas"]
+        else:
+            # Final step of a call frame
+            costs[i] = step["gasCost"]
+
+        if openCalls:
+            openCalls[-1][1] += costs[i]
+
+    # Calls that never returned (i.e. the transaction ran out of gas)
+    for (callIndex, _) in openCalls:
+        costs[callIndex] = trace[callIndex]["gasCost"]
+
+    return costs
+
+
+def _call_paths(trace):
+    """Yields the function call path (outermost first) that each step executes in"""
+    # Each frame is ((depth, jumpDepth), function name)
+    frames = []
+    for step in trace:
+        key = (step["depth"], step["jumpDepth"])
+        fn = _function_name(step)
+        while frames and frames[-1][0] > key:
+            frames.pop()
+
+        entered = False
+        if frames and frames[-1][0] == key:
+            if frames[-1][1] != fn:
+                frames[-1] = (key, fn)
+                entered = True
+        else:
+            frames.append((key, fn))
+            entered = True
+
+        yield (tuple(f for (_, f) in frames), entered)
+
+
+def profile_trace(trace, gasUsed):
+    costs = _step_costs(trace)
+    inclusive = Counter()
+    exclusive = Counter()
+    calls = Counter()
+    stacks = Counter()
+
+    for (cost, (path, entered)) in zip(costs, _call_paths(trace)):
+        exclusive[path[-1]] += cost
+        # Recursive frames are only counted once in the inclusive total
+        for fn in set(path):
+            inclusive[fn] += cost
+        if entered:
+            calls[path[-1]] += 1
+        stacks[";".join(path)] += cost
+
+    traced = sum(costs)
+    functions = defaultdict(dict)
+    for fn in inclusive:
+        functions[fn] = {
+            "inclusive": inclusive[fn],
+            "exclusive": exclusive[fn],
+            "calls": calls[fn],
+        }
+
+    return {
+        "gasUsed": gasUsed,
+        # Intrinsic gas (base cost and calldata) and refunds are not part of the trace
+        "untraced": gasUsed - traced,
+        "functions": dict(functions),
+        "stacks": dict(stacks),
+    }
+
+
+def profile_transaction(tx):
+    """Profiles a brownie TransactionReceipt, the trace is fetched from the node on first use"""
+    return profile_trace(tx.trace, tx.gas_used)
+
+
+def write_flamegraph(profile, path):
+    with open(path, "w") as f:
+        for (stack, gas) in sorted(profile["stacks"].items()):
+            if gas > 0:
+                f.write("{} {}\n".format(stack, gas))
+
+
+def write_profile(profile, path):
+    with open(path, "w") as f:
+        json.dump(
+            {k: v for (k, v) in profile.items() if k != "stacks"}, f, sort_keys=True, indent=4
+        )
+
+
+def print_profile(profile, top=30):
+    print(
+        "Gas used: {}, untraced (intrinsic and refunds): {}".format(
+            profile["gasUsed"], profile["untraced"]
+        )
+    )
+    print("{:<60} {:>12} {:>12} {:>8}".format("Function", "Inclusive", "Exclusive", "Calls"))
+    rows = sorted(profile["functions"].items(), key=lambda x: x[1]["inclusive"], reverse=True)
+    for (fn, stats) in rows[:top]:
+        print(
+            "{:<60} {:>12} {:>12} {:>8}".format(
+                fn[:60], stats["inclusive"], stats["exclusive"], stats["calls"]
+            )
+        )
+
+
+def sample_transactions():
+    """Runs a few representative transactions on a fresh local environment"""
+    env = initialize_environment(accounts)
+    txns = {}
+
+    lendAction = [
+        {"tradeActionType": "Lend", "marketIndex": 1, "notional": 100e8, "minSlippage": 0}
+    ]
+    txns["batchBalanceAndTradeAction.lend"] = env.notional.batchBalanceAndTradeAction(
+        accounts[1],
+        [
+            get_balance_trade_action(
+                2,
+                "DepositAsset",
+                lendAction,
+                depositActionAmount=5000e8,
+                withdrawEntireCashBalance=True,
+            )
+        ],
+        {"from": accounts[1]},
+    )
+    txns["nTokenRedeem"] = env.notional.nTokenRedeem(
+        accounts[0], 2, 1000e8, True, False, {"from": accounts[0]}
+    )
+
+    chain.mine(1, timestamp=get_tref(chain.time()) + SECONDS_IN_QUARTER)
+    txns["initializeMarkets"] = env.notional.initializeMarkets(2, False)
+
+    return txns
+
+
+def main(txid=None, output="gas_profile"):
+    if txid is not None:
+        txns = {txid: chain.get_transaction(txid)}
+    else:
+        txns = sample_transactions()
+
+    for (name, tx) in txns.items():
+        profile = profile_transaction(tx)
+        print("\n{}".format(name))
+        print_profile(profile)
+
+        prefix = output if len(txns) == 1 else "{}.{}".format(output, name)
+        write_profile(profile, "{}.json".format(prefix))
+        write_flamegraph(profile, "{}.folded".format(prefix))
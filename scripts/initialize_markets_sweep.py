@@ -0,0 +1,285 @@
+"""
+nToken parameter sweeps over the InitializeMarketsAction port in scripts/offchain.
+
+The nToken portfolio, its markets, the cash group and the current governance parameters are read
+once. Candidate (deposit shares, leverage thresholds, annualized anchor rates, proportions)
+combinations are then rolled through one or more quarterly market initializations in a process
+pool and the resulting market states are reported, so nTokenDefaults can be tuned without
+redeploying for every candidate.
+
+Rolled quarters assume no trading in between, every quarter starts from the markets and residual
+fCash left by the previous initialization.
+"""
+import csv
+import json
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+
+from brownie import chain, network
+from brownie.network import web3
+from eth_utils import keccak
+from scripts.environment_v2 import EnvironmentV2
+from scripts.offchain.cash_group import CashGroup
+from scripts.offchain.constants import (
+    CASH_WITHHOLDING_BUFFER,
+    FCASH_ASSET_TYPE,
+    QUARTER,
+    RATE_PRECISION,
+)
+from scripts.offchain.date_time import getReferenceTime
+from scripts.offchain.initialize_markets import (
+    GovernanceParameters,
+    NTokenState,
+    initializeMarkets,
+)
+from scripts.offchain.market import Market
+from scripts.offchain.safe_math import Revert
+
+SWEEP_CHUNK_SIZE = 64
+# LibStorage.StorageId.Market + STORAGE_SLOT_BASE
+MARKET_STORAGE_SLOT = 1000010
+UINT32_MASK = 2 ** 32 - 1
+UINT80_MASK = 2 ** 80 - 1
+
+
+def _mapping_slot(key, slot):
+    return int.from_bytes(keccak(key.to_bytes(32, "big") + slot.to_bytes(32, "big")), "big")
+
+
+def read_market_storage(notional, currencyId, maturity, settlementDate, blockNumber=None):
+    """
+    Reads MarketStorage directly. The market views update the oracle rate to the current block
+    time, initialize markets reads the stored oracle rate at other times so it is needed as is.
+    """
+    slot = _mapping_slot(
+        settlementDate,
+        _mapping_slot(maturity, _mapping_slot(currencyId, MARKET_STORAGE_SLOT)),
+    )
+    block = "latest" if blockNumber is None else blockNumber
+    data = int.from_bytes(web3.eth.get_storage_at(notional.address, slot, block), "big")
+    liquidity = int.from_bytes(web3.eth.get_storage_at(notional.address, slot + 1, block), "big")
+    return Market(
+        maturity,
+        data & UINT80_MASK,
+        (data >> 80) & UINT80_MASK,
+        liquidity & UINT80_MASK,
+        (data >> 160) & UINT32_MASK,
+        (data >> 192) & UINT32_MASK,
+        (data >> 224) & UINT32_MASK,
+    )
+
+
+def load_ntoken_state(notional, currencyId, blockNumber=None):
+    """
+    Returns (NTokenState, CashGroup, GovernanceParameters) for a currency as of blockNumber. The
+    markets are read at the current settlement date so they become the previous markets of the
+    next initialization.
+    """
+
+    def call(method, *args):
+        return getattr(notional, method)(*args, block_identifier=blockNumber)
+
+    nTokenAddress = call("nTokenAddress", currencyId)
+    (_, _, _, lastInitializedTime, parameters, cashBalance, _, _) = call(
+        "getNTokenAccount", nTokenAddress
+    )
+    (liquidityTokens, netfCashAssets) = call("getNTokenPortfolio", nTokenAddress)
+    (cashGroupSettings, assetRate) = call("getCashGroupAndAssetRate", currencyId)
+
+    blockTime = chain[blockNumber].timestamp if blockNumber is not None else chain.time()
+    settlementDate = getReferenceTime(blockTime) + QUARTER
+    markets = {
+        int(lt[1]): read_market_storage(
+            notional, currencyId, int(lt[1]), settlementDate, blockNumber
+        )
+        for lt in liquidityTokens
+    }
+
+    nToken = NTokenState(
+        int(cashBalance),
+        int(lastInitializedTime),
+        bytes(parameters)[CASH_WITHHOLDING_BUFFER],
+        tuple(sorted((int(lt[1]), int(lt[2]), int(lt[3])) for lt in liquidityTokens)),
+        {int(a[1]): int(a[3]) for a in netfCashAssets if a[2] == FCASH_ASSET_TYPE},
+        markets,
+    )
+    governance = GovernanceParameters.fromParameters(
+        call("getDepositParameters", currencyId), call("getInitializationParameters", currencyId)
+    )
+    return (nToken, CashGroup.fromParameters(currencyId, cashGroupSettings, assetRate), governance)
+
+
+def parameter_grid(
+    base, depositShares=None, leverageThresholds=None, annualizedAnchorRates=None, proportions=None
+):
+    """
+    Yields GovernanceParameters for every combination of the candidate lists given, each candidate
+    being a full per market tuple. Fields without candidates keep their value from `base`.
+    """
+    candidates = [
+        [tuple(c) for c in values] if values is not None else [getattr(base, field)]
+        for (field, values) in zip(
+            GovernanceParameters._fields,
+            (depositShares, leverageThresholds, annualizedAnchorRates, proportions),
+        )
+    ]
+    for combination in product(*candidates):
+        yield GovernanceParameters(*combination)
+
+
+def summarize_markets(nToken, cashGroup):
+    """Returns (maturity, totalfCash, totalAssetCash, oracleRate, proportion) for each market"""
+    summary = []
+    for (maturity, market) in sorted(nToken.markets.items()):
+        totalCashUnderlying = cashGroup.assetRate.convertToUnderlying(market.totalAssetCash)
+        proportion = market.totalfCash * RATE_PRECISION // (market.totalfCash + totalCashUnderlying)
+        summary.append(
+            (maturity, market.totalfCash, market.totalAssetCash, market.oracleRate, proportion)
+        )
+    return summary
+
+
+def simulate(nToken, cashGroup, parameters, blockTime, isFirstInit=False, quarters=1):
+    """
+    Runs `quarters` consecutive market initializations starting at blockTime. Returns a list with
+    one InitializeMarketsResult per quarter, stops early with the revert reason as the last
+    element if an initialization would revert.
+    """
+    results = []
+    for q in range(quarters):
+        try:
+            result = initializeMarkets(
+                nToken, cashGroup, parameters, blockTime + q * QUARTER, isFirstInit and q == 0
+            )
+        except Revert as e:
+            results.append(str(e))
+            break
+        results.append(result)
+        nToken = result.nToken
+    return results
+
+
+def _simulate_chunk(args):
+    (nToken, cashGroup, candidates, blockTime, isFirstInit, quarters) = args
+    return [
+        (parameters, simulate(nToken, cashGroup, parameters, blockTime, isFirstInit, quarters))
+        for parameters in candidates
+    ]
+
+
+def sweep(nToken, cashGroup, candidates, blockTime, isFirstInit=False, quarters=1, workers=None):
+    """
+    Simulates every candidate GovernanceParameters and returns a list of (parameters, results)
+    in candidate order, see `simulate`. Candidates are split across a process pool unless
+    `workers` is 1.
+    """
+    candidates = list(candidates)
+    chunks = [
+        (nToken, cashGroup, candidates[i : i + SWEEP_CHUNK_SIZE], blockTime, isFirstInit, quarters)
+        for i in range(0, len(candidates), SWEEP_CHUNK_SIZE)
+    ]
+    if workers == 1 or len(chunks) <= 1:
+        return [r for chunk in chunks for r in _simulate_chunk(chunk)]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return [r for chunk in pool.map(_simulate_chunk, chunks) for r in chunk]
+
+
+def write_results(results, cashGroup, path):
+    """Writes one row per candidate, quarter and market to a csv file"""
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(
+            [
+                "candidate",
+                "depositShares",
+                "leverageThresholds",
+                "annualizedAnchorRates",
+                "proportions",
+                "quarter",
+                "error",
+                "netAssetCashAvailable",
+                "assetCashWithholding",
+                "maturity",
+                "totalfCash",
+                "totalAssetCash",
+                "oracleRate",
+                "proportion",
+            ]
+        )
+        for (candidate, (parameters, quarters)) in enumerate(results):
+            prefix = [candidate, *("/".join(str(v) for v in p) for p in parameters)]
+            for (q, result) in enumerate(quarters):
+                if isinstance(result, str):
+                    writer.writerow(prefix + [q, result])
+                    continue
+                for market in summarize_markets(result.nToken, cashGroup):
+                    writer.writerow(
+                        prefix
+                        + [q, "", result.netAssetCashAvailable, result.assetCashWithholding]
+                        + list(market)
+                    )
+
+
+def main(currencyId=2, quarters=1, anchorRateSteps=5, proportionSteps=5, workers=None, output=None):
+    """
+    Sweeps annualized anchor rates and proportions around the current governance parameters of
+    a currency for its next market initialization.
+    """
+    networkName = network.show_active()
+    if networkName in ("mainnet-fork", "hardhat-fork"):
+        networkName = "mainnet"
+    with open("v2.{}.json".format(networkName), "r") as f:
+        env = EnvironmentV2(json.load(f))
+
+    (nToken, cashGroup, governance) = load_ntoken_state(env.notional, currencyId)
+    blockTime = getReferenceTime(chain.time()) + QUARTER
+
+    if anchorRateSteps < 1 or proportionSteps < 1:
+        raise Exception("anchorRateSteps and proportionSteps must be at least 1")
+
+    # Anchor rates from 0.5x to 1.5x of the current values, proportions +/- 0.1. A single step
+    # only simulates the current governance value.
+    anchorRates = [tuple(governance.annualizedAnchorRates)]
+    if anchorRateSteps > 1:
+        anchorRates = [
+            tuple(
+                r * (anchorRateSteps - 1 + 2 * s) // (2 * (anchorRateSteps - 1))
+                for r in governance.annualizedAnchorRates
+            )
+            for s in range(anchorRateSteps)
+        ]
+    proportions = [tuple(governance.proportions)]
+    if proportionSteps > 1:
+        proportions = [
+            tuple(
+                min(
+                    max(p + int(0.1e9) * (2 * s - proportionSteps + 1) // (proportionSteps - 1), 1),
+                    int(0.95e9),
+                )
+                for p in governance.proportions
+            )
+            for s in range(proportionSteps)
+        ]
+    candidates = list(
+        parameter_grid(governance, annualizedAnchorRates=anchorRates, proportions=proportions)
+    )
+    results = sweep(nToken, cashGroup, candidates, blockTime, False, quarters, workers)
+
+    for (parameters, quarterResults) in results:
+        last = quarterResults[-1]
+        if isinstance(last, str):
+            rates = "reverted: {}".format(last)
+        else:
+            rates = " ".join(
+                "{:.3%}".format(m[3] / RATE_PRECISION)
+                for m in summarize_markets(last.nToken, cashGroup)
+            )
+        print(
+            "anchors={} proportions={} => {}".format(
+                parameters.annualizedAnchorRates, parameters.proportions, rates
+            )
+        )
+
+    if output is not None:
+        write_results(results, cashGroup, output)
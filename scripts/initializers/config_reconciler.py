@@ -0,0 +1,248 @@
+"""
+Reconciles the on chain Notional configuration with scripts/config.py.
+
+All current parameters are read in a single pass pinned to one block, diffed against the desired
+configuration and only the governance calls that would change something are emitted. Calls are
+ordered so that listing a currency and enabling its cash group happen before any parameter
+updates for that currency. Re-running initialization on a fork or after a partial failure only
+submits what is still missing.
+"""
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from web3.exceptions import ContractLogicError
+
+from brownie.exceptions import VirtualMachineError
+from brownie.network import web3
+from scripts.common import CurrencySymbol, encodeNTokenParams
+
+READ_WORKERS = 8
+
+Change = namedtuple("Change", ["currencyId", "method", "args", "description"])
+
+
+def _normalize(value):
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+class ConfigReconciler:
+    def __init__(self, initializer):
+        self.initializer = initializer
+        self.env = initializer.env
+        self.notional = initializer.env.notional
+
+    def _call(self, method, args, block):
+        try:
+            return getattr(self.notional, method).call(*args, block_identifier=block)
+        except (VirtualMachineError, ContractLogicError):
+            # nTokenAddress reverts for currencies without an nToken. Transport errors are raised,
+            # they must not be mistaken for missing configuration.
+            return None
+
+    def _batch(self, requests, block):
+        with ThreadPoolExecutor(max_workers=READ_WORKERS) as pool:
+            futures = {
+                key: pool.submit(self._call, method, args, block)
+                for (key, (method, args)) in requests.items()
+            }
+        return {key: f.result() for (key, f) in futures.items()}
+
+    def readState(self, currencyIds, block=None):
+        if block is None:
+            block = web3.eth.block_number
+
+        # Currency ids are assigned sequentially, so every id up to the max is listed
+        maxCurrencyId = self.notional.getMaxCurrencyId.call(block_identifier=block)
+        listedIds = [c for c in currencyIds if c <= maxCurrencyId]
+
+        requests = {}
+        for currencyId in listedIds:
+            for method in (
+                "getRateStorage",
+                "getCashGroup",
+                "getDepositParameters",
+                "getInitializationParameters",
+                "nTokenAddress",
+            ):
+                requests[(currencyId, method)] = (method, (currencyId,))
+        results = self._batch(requests, block)
+
+        # nToken accounts can only be read once the nToken addresses are known
+        nTokenRequests = {
+            (currencyId, "getNTokenAccount"): (
+                "getNTokenAccount",
+                (results[(currencyId, "nTokenAddress")],),
+            )
+            for currencyId in listedIds
+            if results[(currencyId, "nTokenAddress")] is not None
+        }
+        results.update(self._batch(nTokenRequests, block))
+
+        state = {}
+        for currencyId in currencyIds:
+            state[currencyId] = {
+                "listed": currencyId in listedIds,
+                "cashGroupEnabled": results.get((currencyId, "nTokenAddress")) is not None,
+                "rateStorage": results.get((currencyId, "getRateStorage")),
+                "cashGroup": results.get((currencyId, "getCashGroup")),
+                "depositParameters": results.get((currencyId, "getDepositParameters")),
+                "initializationParameters": results.get(
+                    (currencyId, "getInitializationParameters")
+                ),
+                "nTokenAccount": results.get((currencyId, "getNTokenAccount")),
+            }
+        return state
+
+    def _diffCurrency(self, currencyId, current, config, nTokenConfig):
+        symbol = CurrencySymbol[currencyId]
+        changes = []
+
+        if not current["listed"]:
+            changes.append(
+                Change(
+                    currencyId,
+                    "listCurrency",
+                    self.initializer._listCurrencyArgs(symbol, config),
+                    "List currency {}".format(symbol),
+                )
+            )
+        else:
+            # Read from storage, getCurrencyAndRates would also call the rate oracle
+            rateStorage = current["rateStorage"][0]
+            desiredOracle = self.env.ethOracles[symbol]
+            if (
+                rateStorage[3] != config["buffer"]
+                or rateStorage[4] != config["haircut"]
+                or rateStorage[5] != config["liquidationDiscount"]
+                or rateStorage[0] != desiredOracle
+            ):
+                changes.append(
+                    Change(
+                        currencyId,
+                        "updateETHRate",
+                        (
+                            currencyId,
+                            desiredOracle,
+                            rateStorage[2],
+                            config["buffer"],
+                            config["haircut"],
+                            config["liquidationDiscount"],
+                        ),
+                        "Update ETH rate for {}".format(symbol),
+                    )
+                )
+
+        if not current["cashGroupEnabled"]:
+            changes.append(
+                Change(
+                    currencyId,
+                    "enableCashGroup",
+                    self.initializer._enableCashGroupArgs(currencyId, symbol, config),
+                    "Enable cash group for {}".format(symbol),
+                )
+            )
+            # Everything below is unset for a new nToken
+            current = {}
+        else:
+            settings = self.initializer._cashGroupSettings(config)
+            if _normalize(current["cashGroup"]) != _normalize(settings):
+                changes.append(
+                    Change(
+                        currencyId,
+                        "updateCashGroup",
+                        (currencyId, settings),
+                        "Update cash group for {}".format(symbol),
+                    )
+                )
+
+        deposit = nTokenConfig["Deposit"]
+        if _normalize(current.get("depositParameters")) != _normalize(deposit):
+            changes.append(
+                Change(
+                    currencyId,
+                    "updateDepositParameters",
+                    (currencyId, *deposit),
+                    "Update deposit parameters for {}".format(symbol),
+                )
+            )
+
+        initialization = nTokenConfig["Initialization"]
+        if _normalize(current.get("initializationParameters")) != _normalize(initialization):
+            changes.append(
+                Change(
+                    currencyId,
+                    "updateInitializationParameters",
+                    (currencyId, *initialization),
+                    "Update initialization parameters for {}".format(symbol),
+                )
+            )
+
+        nTokenAccount = current.get("nTokenAccount")
+        collateral = nTokenConfig["Collateral"]
+        if nTokenAccount is None or nTokenAccount[4] != encodeNTokenParams(collateral):
+            changes.append(
+                Change(
+                    currencyId,
+                    "updateTokenCollateralParameters",
+                    (currencyId, *collateral),
+                    "Update collateral parameters for {}".format(symbol),
+                )
+            )
+
+        if nTokenAccount is None or nTokenAccount[2] != config["incentiveEmissionRate"]:
+            changes.append(
+                Change(
+                    currencyId,
+                    "updateIncentiveEmissionRate",
+                    (currencyId, config["incentiveEmissionRate"]),
+                    "Update incentive emission rate for {}".format(symbol),
+                )
+            )
+
+        return changes
+
+    def diff(self, currencyIds, currencyConfig, nTokenConfig, block=None):
+        return self.diffState(self.readState(currencyIds, block), currencyConfig, nTokenConfig)
+
+    def diffState(self, state, currencyConfig, nTokenConfig):
+        """Returns the changes required to move from `state`, as returned by readState"""
+        changes = []
+        # Currencies are listed with sequential ids so they must be processed in order
+        for currencyId in sorted(state):
+            symbol = CurrencySymbol[currencyId]
+            changes.extend(
+                self._diffCurrency(
+                    currencyId, state[currencyId], currencyConfig[symbol], nTokenConfig[symbol]
+                )
+            )
+        return changes
+
+    def proposal(self, changes):
+        """Returns the targets, values and calldatas of a single governance proposal"""
+        targets = [self.notional.address] * len(changes)
+        values = [0] * len(changes)
+        calldatas = [getattr(self.notional, c.method).encode_input(*c.args) for c in changes]
+        return (targets, values, calldatas)
+
+    def apply(self, changes, governor=None):
+        if len(changes) == 0:
+            print("On chain configuration matches config, nothing to do")
+            return None
+
+        for c in changes:
+            print(c.description)
+
+        if self.initializer.dryRun:
+            return None
+
+        if governor is not None:
+            (targets, values, calldatas) = self.proposal(changes)
+            print("Submitting {} calls in a single proposal".format(len(changes)))
+            return governor.propose(targets, values, calldatas, {"from": self.initializer.deployer})
+
+        return [
+            getattr(self.notional, c.method)(*c.args, {"from": self.initializer.deployer})
+            for c in changes
+        ]
@@ -3,6 +3,7 @@ import json
 from brownie import ZERO_ADDRESS
 from scripts.common import CurrencySymbol, TokenType, encodeNTokenParams, hasTransferFee
 from scripts.environment_v2 import EnvironmentV2
+from scripts.initializers.config_reconciler import ConfigReconciler
 from tests.helpers import get_balance_action
 
 
@@ -32,7 +33,7 @@ class NotionalInitializer:
             with open("v2.{}.json".format(self.network), "w") as f:
                 json.dump(self.config, f, sort_keys=True, indent=4)
 
-    def _listCurrency(self, symbol, config):
+    def _listCurrencyArgs(self, symbol, config):
         if symbol not in self.env.ethOracles:
             raise Exception("{} not found in ethOracles".format(symbol))
 
@@ -61,47 +62,56 @@ class NotionalInitializer:
                 0,
             )
 
+        return (
+            asset,
+            underlying,
+            self.env.ethOracles[symbol],
+            False,
+            config["buffer"],
+            config["haircut"],
+            config["liquidationDiscount"],
+        )
+
+    def _listCurrency(self, symbol, config):
+        args = self._listCurrencyArgs(symbol, config)
         print("Listing currency {}".format(symbol))
         if not self.dryRun:
-            self.env.notional.listCurrency(
-                asset,
-                underlying,
-                self.env.ethOracles[symbol],
-                False,
-                config["buffer"],
-                config["haircut"],
-                config["liquidationDiscount"],
-                {"from": self.deployer},
-            )
+            self.env.notional.listCurrency(*args, {"from": self.deployer})
 
-    def _enableCashGroup(self, currencyId, symbol, config):
+    def _cashGroupSettings(self, config):
+        return (
+            config["maxMarketIndex"],
+            config["rateOracleTimeWindow"],
+            config["totalFee"],
+            config["reserveFeeShare"],
+            config["debtBuffer"],
+            config["fCashHaircut"],
+            config["settlementPenalty"],
+            config["liquidationfCashDiscount"],
+            config["liquidationDebtBuffer"],
+            config["tokenHaircut"][0 : config["maxMarketIndex"]],
+            config["rateScalar"][0 : config["maxMarketIndex"]],
+        )
+
+    def _enableCashGroupArgs(self, currencyId, symbol, config):
         if symbol == "NOMINT":
             assetRateAddress = ZERO_ADDRESS
         else:
             assetRateAddress = self.env.cTokenOracles[symbol].address
 
+        return (
+            currencyId,
+            assetRateAddress,
+            self._cashGroupSettings(config),
+            self.env.tokens[symbol].name() if symbol != "ETH" else "Ether",
+            symbol,
+        )
+
+    def _enableCashGroup(self, currencyId, symbol, config):
+        args = self._enableCashGroupArgs(currencyId, symbol, config)
         print("Enabling CashGroup for {}".format(symbol))
         if not self.dryRun:
-            self.env.notional.enableCashGroup(
-                currencyId,
-                assetRateAddress,
-                (
-                    config["maxMarketIndex"],
-                    config["rateOracleTimeWindow"],
-                    config["totalFee"],
-                    config["reserveFeeShare"],
-                    config["debtBuffer"],
-                    config["fCashHaircut"],
-                    config["settlementPenalty"],
-                    config["liquidationfCashDiscount"],
-                    config["liquidationDebtBuffer"],
-                    config["tokenHaircut"][0 : config["maxMarketIndex"]],
-                    config["rateScalar"][0 : config["maxMarketIndex"]],
-                ),
-                self.env.tokens[symbol].name() if symbol != "ETH" else "Ether",
-                symbol,
-                {"from": self.deployer},
-            )
+            self.env.notional.enableCashGroup(*args, {"from": self.deployer})
 
     def enableCurrency(self, currencyId, config):
         symbol = CurrencySymbol[currencyId]
@@ -202,6 +212,16 @@ class NotionalInitializer:
             currencyId, currencyConfig[symbol]["incentiveEmissionRate"]
         )
 
+    def reconcile(self, currencyIds, currencyConfig, nTokenConfig, governor=None):
+        """
+        Submits only the governance calls required to bring the on chain configuration in line
+        with the given config. If a governor is given the calls are bundled into a single
+        proposal instead of being sent by the deployer.
+        """
+        reconciler = ConfigReconciler(self)
+        changes = reconciler.diff(currencyIds, currencyConfig, nTokenConfig)
+        return reconciler.apply(changes, governor)
+
     def _depositLiquidity(self, currencyId, amount):
         print("Depositing liquidity for currency {}".format(currencyId))
         value = amount if currencyId == 1 else 0
@@ -0,0 +1,334 @@
+"""
+Vectorized liquidation backtester over ETH exchange rate and asset rate paths.
+
+A snapshot of account portfolios is split, per account and currency, into the part of the net
+local value that is denominated in asset cash (cash balances, liquidity token cash claims and
+nTokens) and the risk adjusted present value of fCash, which is denominated in underlying. Along
+a price path the asset cash part moves with the asset rate (AssetRate.convertToUnderlying) and
+both are converted to ETH with the path's exchange rate and the haircut or buffer of the
+currency, as in FreeCollateral._updateNetETHValue. fCash present values are held at the snapshot
+oracle rates, only ETH rates and asset rates vary along a path.
+
+Every path is evaluated at once for every account with numpy, no rates are set on chain. For
+each path the first step where an account's free collateral is negative is recorded along with
+an estimate of what liquidation would clear at that point, following
+LiquidateCurrency._calculateCollateralToRaise for the largest debt and collateral currencies of
+the account. Collateral is purchased from cash and nTokens (LiquidateCurrency) before fCash
+(LiquidatefCash). Risk parameters are inputs so that buffer, haircut and liquidationDiscount
+changes can be compared over the same paths.
+
+Usage:
+    brownie run scripts/liquidation_backtester.py main [paths] [steps] [volatility] \
+        --network mainnet
+"""
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Tuple
+
+import numpy as np
+from brownie import chain, network
+from scripts.environment_v2 import EnvironmentV2
+from scripts.event_logs import EventDecoder, stream_events
+from scripts.offchain.asset_rate import AssetRate
+from scripts.offchain.constants import (
+    ASSET_RATE_DECIMAL_DIFFERENCE,
+    FCASH_ASSET_TYPE,
+    PERCENTAGE_DECIMALS,
+)
+
+# Matches Constants.DEFAULT_LIQUIDATION_PORTION
+DEFAULT_LIQUIDATION_PORTION = 40
+SNAPSHOT_WORKERS = 8
+# Upper bound on the (paths, steps, accounts) elements evaluated at once
+CHUNK_ELEMENTS = 2 ** 24
+
+
+class PortfolioSnapshot(NamedTuple):
+    accounts: Tuple[str, ...]
+    currencyIds: Tuple[int, ...]
+    # (accounts, currencies) net local value held as asset cash, in internal precision
+    assetCash: np.ndarray
+    # (accounts, currencies) risk adjusted fCash present value, underlying internal precision
+    fCashUnderlying: np.ndarray
+    blockTime: int
+
+    @classmethod
+    def fetch(cls, notional, accounts, currencyIds, blockTime=None, workers=SNAPSHOT_WORKERS):
+        blockTime = chain.time() if blockTime is None else blockTime
+        column = {c: i for (i, c) in enumerate(currencyIds)}
+        assetRates = {
+            c: AssetRate.fromParameters(notional.getCurrencyAndRates(c)[3]) for c in currencyIds
+        }
+
+        def fetch(account):
+            (_, balances, portfolio) = notional.getAccount(account)
+            (_, netLocal) = notional.getFreeCollateral(account)
+            fCash = {}
+            for asset in portfolio:
+                if asset[2] == FCASH_ASSET_TYPE:
+                    fCash[asset[0]] = fCash.get(asset[0], 0) + notional.getPresentfCashValue(
+                        asset[0], asset[1], asset[3], blockTime, True
+                    )
+
+            row = np.zeros((2, len(currencyIds)))
+            for (balance, value) in zip(balances, netLocal):
+                currencyId = balance[0]
+                if currencyId == 0:
+                    break
+                pv = fCash.get(currencyId, 0)
+                assetPV = assetRates[currencyId].convertFromUnderlying(pv)
+                row[:, column[currencyId]] = (value - assetPV, pv)
+            return row
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            rows = list(pool.map(fetch, accounts))
+
+        rows = np.array(rows).reshape(len(accounts), 2, len(currencyIds))
+        return cls(
+            tuple(str(a) for a in accounts),
+            tuple(currencyIds),
+            rows[:, 0, :],
+            rows[:, 1, :],
+            blockTime,
+        )
+
+
+class RiskParameters(NamedTuple):
+    # (currencies,) percentages as stored in ETHRateStorage
+    buffer: np.ndarray
+    haircut: np.ndarray
+    liquidationDiscount: np.ndarray
+
+    @classmethod
+    def fetch(cls, notional, currencyIds):
+        ethRates = [notional.getCurrencyAndRates(c)[2] for c in currencyIds]
+        return cls(*[np.array([float(r[i]) for r in ethRates]) for i in (2, 3, 4)])
+
+    def update(self, index, **kwargs):
+        """Returns a copy with the parameters of the currency at `index` replaced"""
+        arrays = {k: v.copy() for (k, v) in self._asdict().items()}
+        for (k, v) in kwargs.items():
+            arrays[k][index] = v
+        return RiskParameters(**arrays)
+
+
+def current_rates(notional, currencyIds):
+    """
+    Returns (ethRates, assetRates) of shape (currencies,) as read by the contracts: ETH per unit
+    of underlying and underlying internal precision per unit of asset cash internal precision
+    """
+    (ethRates, assetRates) = ([], [])
+    for currencyId in currencyIds:
+        (_, _, ethRate, assetRate) = notional.getCurrencyAndRates(currencyId)
+        ethRates.append(ethRate[1] / ethRate[0])
+        assetRates.append(assetRate[1] / (ASSET_RATE_DECIMAL_DIFFERENCE * assetRate[2]))
+    return (np.array(ethRates), np.array(assetRates))
+
+
+def eth_rates_from_answers(answers, rateDecimalPlaces, mustInvert):
+    """Vectorized ExchangeRate.buildExchangeRate over raw aggregator answers"""
+    rates = np.asarray(answers, dtype=np.float64) / 10 ** rateDecimalPlaces
+    return 1 / rates if mustInvert else rates
+
+
+def asset_rates_from_ctoken(exchangeRates, underlyingDecimals):
+    """Asset rates from cTokenV2Aggregator exchange rates, cTokens have 8 decimals"""
+    return np.asarray(exchangeRates, dtype=np.float64) / (
+        ASSET_RATE_DECIMAL_DIFFERENCE * 10 ** underlyingDecimals
+    )
+
+
+def log_normal_paths(initial, volatility, paths, steps, correlation=None, seed=0):
+    """
+    Returns (paths, steps + 1, currencies) geometric Brownian motion paths with zero drift
+    starting at `initial`, volatility is per step and `correlation` is a currency matrix
+    """
+    initial = np.asarray(initial, dtype=np.float64)
+    volatility = np.broadcast_to(np.asarray(volatility, dtype=np.float64), initial.shape)
+    rng = np.random.default_rng(seed)
+    shocks = rng.standard_normal((paths, steps, len(initial)))
+    if correlation is not None:
+        shocks = shocks @ np.linalg.cholesky(correlation).T
+
+    logReturns = shocks * volatility - volatility ** 2 / 2
+    cumulative = np.concatenate(
+        [np.zeros((paths, 1, len(initial))), np.cumsum(logReturns, axis=1)], axis=1
+    )
+    return initial * np.exp(cumulative)
+
+
+def _eth_values(underlying, ethRates, params):
+    """ExchangeRate.convertToETH, applies the haircut to positive and buffer to negative values"""
+    multiplier = np.where(underlying > 0, params.haircut, params.buffer)
+    return underlying * ethRates * multiplier / PERCENTAGE_DECIMALS
+
+
+def liquidation_estimate(cashUnderlying, fCashUnderlying, ethRates, params):
+    """
+    Estimates a collateral currency liquidation for accounts with negative free collateral. All
+    inputs are (accounts, currencies) at the point of liquidation. Returns (currencyCleared,
+    fCashCleared, badDebt) in ETH, where collateral is cleared from cash and nTokens before fCash.
+    """
+    underlying = cashUnderlying + fCashUnderlying
+    ethValues = _eth_values(underlying, ethRates, params)
+    netETHValue = ethValues.sum(axis=1)
+    rows = np.arange(len(underlying))
+    local = np.argmin(ethValues, axis=1)
+    collateral = np.argmax(ethValues, axis=1)
+
+    collateralETHRate = ethRates[rows, collateral]
+    localETHRate = ethRates[rows, local]
+    discount = np.maximum(params.liquidationDiscount[collateral], params.liquidationDiscount[local])
+    # LiquidateCurrency._calculateCollateralToRaise in collateral underlying
+    collateralDenominatedFC = -netETHValue / collateralETHRate
+    denominator = params.buffer[local] * PERCENTAGE_DECIMALS / discount - params.haircut[collateral]
+    required = collateralDenominatedFC * PERCENTAGE_DECIMALS / denominator
+
+    # LiquidationHelpers.calculateLiquidationAmount
+    available = np.maximum(underlying[rows, collateral], 0)
+    amount = np.minimum(required, available)
+    amount = np.where(
+        required < available * DEFAULT_LIQUIDATION_PORTION / PERCENTAGE_DECIMALS,
+        available * DEFAULT_LIQUIDATION_PORTION / PERCENTAGE_DECIMALS,
+        amount,
+    )
+
+    # LiquidationHelpers.calculateLocalToPurchase caps the local currency paid at the debt
+    localPaid = amount * collateralETHRate / localETHRate * PERCENTAGE_DECIMALS / discount
+    maxLocal = np.maximum(-underlying[rows, local], 0)
+    amount = np.where(localPaid > maxLocal, amount * maxLocal / np.maximum(localPaid, 1), amount)
+    amount = np.where(ethValues[rows, collateral] > 0, amount, 0)
+
+    currencyCleared = np.clip(amount, 0, np.maximum(cashUnderlying[rows, collateral], 0))
+    fCashCleared = np.clip(
+        amount - currencyCleared, 0, np.maximum(fCashUnderlying[rows, collateral], 0)
+    )
+    # Debt that remains after all collateral is sold at its unhaircut value
+    unhaircut = (underlying * ethRates).sum(axis=1)
+    return (
+        currencyCleared * collateralETHRate,
+        fCashCleared * collateralETHRate,
+        np.maximum(-unhaircut, 0),
+    )
+
+
+class BacktestResult(NamedTuple):
+    # (paths, accounts) first step with negative free collateral, -1 if never
+    firstLiquidation: np.ndarray
+    # (paths, accounts) negative free collateral in ETH at the first liquidation step
+    shortfall: np.ndarray
+    # (paths, accounts) ETH value cleared by each liquidation type at the first step
+    currencyCleared: np.ndarray
+    fCashCleared: np.ndarray
+    badDebt: np.ndarray
+    # (paths, steps) number of accounts with negative free collateral
+    liquidatable: np.ndarray
+
+    def summary(self, quantiles=(0.5, 0.95, 0.99)):
+        liquidated = self.firstLiquidation >= 0
+        return {
+            "paths": len(self.firstLiquidation),
+            "accountsLiquidated": float(liquidated.sum(axis=1).mean()),
+            "pathsWithLiquidation": float(liquidated.any(axis=1).mean()),
+            "maxLiquidatable": dict(
+                zip(quantiles, np.quantile(self.liquidatable.max(axis=1), quantiles).tolist())
+            ),
+            "shortfall": dict(
+                zip(quantiles, np.quantile(self.shortfall.sum(axis=1), quantiles).tolist())
+            ),
+            "currencyCleared": float(self.currencyCleared.sum(axis=1).mean()),
+            "fCashCleared": float(self.fCashCleared.sum(axis=1).mean()),
+            "badDebt": dict(
+                zip(quantiles, np.quantile(self.badDebt.sum(axis=1), quantiles).tolist())
+            ),
+        }
+
+
+def free_collateral(snapshot, params, ethRates, assetRates):
+    """
+    Net ETH value of every account, shape (paths, steps, accounts), given (paths, steps,
+    currencies) ETH rate and asset rate paths in the units returned by current_rates
+    """
+    (paths, steps, _) = ethRates.shape
+    netETHValue = np.zeros((paths, steps, len(snapshot.accounts)))
+    for c in range(len(snapshot.currencyIds)):
+        underlying = (
+            snapshot.assetCash[:, c] * assetRates[:, :, c, None] + snapshot.fCashUnderlying[:, c]
+        )
+        multiplier = np.where(underlying > 0, params.haircut[c], params.buffer[c])
+        netETHValue += underlying * multiplier * (ethRates[:, :, c, None] / PERCENTAGE_DECIMALS)
+    return netETHValue
+
+
+def _backtest_chunk(snapshot, params, ethRates, assetRates):
+    netETHValue = free_collateral(snapshot, params, ethRates, assetRates)
+    negative = netETHValue < 0
+    crossed = negative.any(axis=1)
+    first = np.where(crossed, negative.argmax(axis=1), -1)
+
+    (pathIndex, accountIndex) = np.nonzero(crossed)
+    stepIndex = first[pathIndex, accountIndex]
+    shortfall = np.zeros(first.shape)
+    shortfall[pathIndex, accountIndex] = -netETHValue[pathIndex, stepIndex, accountIndex]
+
+    cleared = [np.zeros(first.shape) for _ in range(3)]
+    if len(pathIndex) > 0:
+        estimates = liquidation_estimate(
+            snapshot.assetCash[accountIndex] * assetRates[pathIndex, stepIndex],
+            snapshot.fCashUnderlying[accountIndex],
+            ethRates[pathIndex, stepIndex],
+            params,
+        )
+        for (array, values) in zip(cleared, estimates):
+            array[pathIndex, accountIndex] = values
+
+    return (first, shortfall, *cleared, negative.sum(axis=2))
+
+
+def backtest(snapshot, params, ethRates, assetRates):
+    """
+    Replays (paths, steps, currencies) ETH rate and asset rate paths against the snapshot, paths
+    are evaluated in chunks to bound memory
+    """
+    (paths, steps, _) = ethRates.shape
+    chunk = max(1, CHUNK_ELEMENTS // max(1, steps * len(snapshot.accounts)))
+    chunks = [slice(i, i + chunk) for i in range(0, paths, chunk)]
+    results = [_backtest_chunk(snapshot, params, ethRates[s], assetRates[s]) for s in chunks]
+    return BacktestResult(*[np.concatenate(r) for r in zip(*results)])
+
+
+def active_accounts(notional, fromBlock, toBlock, decoder=None):
+    """Accounts with an AccountContextUpdate event between the two blocks"""
+    decoder = EventDecoder() if decoder is None else decoder
+    return sorted(
+        {
+            r.args["account"]
+            for r in stream_events(
+                decoder, fromBlock, toBlock, [notional.address], ["AccountContextUpdate"]
+            )
+        }
+    )
+
+
+def main(paths=1000, steps=30, volatility=0.05, seed=0):
+    """Backtests current accounts over daily log normal ETH rate paths, with independent shocks"""
+    networkName = network.show_active()
+    if networkName in ("mainnet-fork", "hardhat-fork"):
+        networkName = "mainnet"
+    with open("v2.{}.json".format(networkName), "r") as f:
+        config = json.load(f)
+    env = EnvironmentV2(config)
+
+    currencyIds = list(range(1, env.notional.getMaxCurrencyId() + 1))
+    accounts = active_accounts(env.notional, config["startBlock"], chain.height)
+    snapshot = PortfolioSnapshot.fetch(env.notional, accounts, currencyIds)
+    params = RiskParameters.fetch(env.notional, currencyIds)
+    (ethRates, assetRates) = current_rates(env.notional, currencyIds)
+
+    # ETH is the numeraire, its rate is always one
+    volatilities = [0 if c == 1 else float(volatility) for c in currencyIds]
+    ethPaths = log_normal_paths(ethRates, volatilities, int(paths), int(steps), seed=int(seed))
+    assetPaths = np.broadcast_to(assetRates, ethPaths.shape)
+
+    print("Backtesting {} accounts over {} paths".format(len(accounts), paths))
+    print(json.dumps(backtest(snapshot, params, ethPaths, assetPaths).summary(), indent=2))
@@ -0,0 +1,359 @@
+"""
+Synthetic load generator against a local Notional deployment.
+
+Deploys a TestEnvironment via initialize_environment, funds a set of fresh accounts and then has
+each account submit a Poisson stream of batch actions concurrently. Reports throughput, gas per
+block, submission to receipt latency percentiles and revert reasons.
+
+Usage:
+    brownie run scripts/load_test.py main [numAccounts] [durationSeconds] [txPerSecond]
+"""
+import json
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+
+from brownie import accounts
+from brownie.exceptions import VirtualMachineError
+from brownie.network import web3
+from scripts.batch_encoder import encode_batch_balance_and_trade_action
+from tests.helpers import get_balance_trade_action, initialize_environment
+
+# Relative weights of each action type in the generated load, these are scaled so that the sum
+# equals the target transaction rate
+DEFAULT_ACTION_RATES = {
+    "lend": 4,
+    "borrow": 2,
+    "addLiquidity": 1,
+    "removeLiquidity": 1,
+    "mintNToken": 1,
+    "redeemNToken": 1,
+    "transferfCash": 1,
+}
+
+GAS_LIMIT = 6_000_000
+CURRENCY_ID = 2
+ASSET_CASH_FUNDING = 500_000e8
+UNDERLYING_FUNDING = 50_000e18
+ETH_FUNDING = 1_000e18
+
+
+class LoadUser:
+    """
+    Tracks the positions that a single load test account holds so that actions which require an
+    existing position (redeem, remove liquidity, transfer) are only generated when they can succeed.
+    """
+
+    def __init__(self, account) -> None:
+        self.account = account
+        self.fCash = 0
+        self.liquidityTokens = 0
+        self.nTokens = 0
+
+
+class LoadStats:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.submitted = Counter()
+        self.succeeded = Counter()
+        self.reverts = Counter()
+        self.gasUsed = Counter()
+
+    def record(self, actionType, latency, receipt=None, revertReason=None):
+        with self.lock:
+            self.submitted[actionType] += 1
+            self.latencies[actionType].append(latency)
+            if revertReason is None:
+                self.succeeded[actionType] += 1
+                self.gasUsed[actionType] += receipt.gas_used
+            else:
+                self.reverts[(actionType, revertReason)] += 1
+
+
+def percentile(values, p):
+    if len(values) == 0:
+        return 0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def fund_accounts(env, numAccounts):
+    deployer = accounts[0]
+    cToken = env.cToken["DAI"]
+    token = env.token["DAI"]
+    users = []
+
+    for _ in range(numAccounts):
+        account = accounts.add()
+        deployer.transfer(account, ETH_FUNDING, silent=True)
+        token.transfer(account, UNDERLYING_FUNDING, {"from": deployer})
+        cToken.transfer(account, ASSET_CASH_FUNDING, {"from": deployer})
+        token.approve(env.notional.address, 2 ** 255, {"from": account})
+        cToken.approve(env.notional.address, 2 ** 255, {"from": account})
+        users.append(LoadUser(account))
+
+    return users
+
+
+def build_action(env, user, actionType, fCashId, counterparties):
+    """
+    Returns (calldata, value, onSuccess) for the given action type, or None if the user does
+    not hold the position required for the action.
+    """
+
+    def trade(depositActionType, trades, **kwargs):
+        action = get_balance_trade_action(CURRENCY_ID, depositActionType, trades, **kwargs)
+        return encode_batch_balance_and_trade_action(user.account.address, [action])
+
+    if actionType == "lend":
+        calldata = trade(
+            "DepositAsset",
+            [{"tradeActionType": "Lend", "marketIndex": 1, "notional": 100e8, "minSlippage": 0}],
+            depositActionAmount=5500e8,
+            withdrawEntireCashBalance=True,
+        )
+        return (calldata, 0, lambda: setattr(user, "fCash", user.fCash + 100e8))
+
+    elif actionType == "borrow":
+        collateral = get_balance_trade_action(1, "DepositUnderlying", [], depositActionAmount=1e18)
+        borrow = get_balance_trade_action(
+            CURRENCY_ID,
+            "None",
+            [{"tradeActionType": "Borrow", "marketIndex": 1, "notional": 10e8, "maxSlippage": 0}],
+            withdrawEntireCashBalance=True,
+        )
+        calldata = encode_batch_balance_and_trade_action(user.account.address, [collateral, borrow])
+        return (calldata, 1e18, None)
+
+    elif actionType == "addLiquidity":
+        calldata = trade(
+            "DepositAsset",
+            [
+                {
+                    "tradeActionType": "AddLiquidity",
+                    "marketIndex": 1,
+                    "notional": 1000e8,
+                    "minSlippage": 0,
+                    "maxSlippage": 0.40 * 1e9,
+                }
+            ],
+            depositActionAmount=1000e8,
+        )
+        return (calldata, 0, lambda: setattr(user, "liquidityTokens", user.liquidityTokens + 1))
+
+    elif actionType == "removeLiquidity":
+        if user.liquidityTokens == 0:
+            return None
+        calldata = trade(
+            "None",
+            [
+                {
+                    "tradeActionType": "RemoveLiquidity",
+                    "marketIndex": 1,
+                    "notional": 100e8,
+                    "minSlippage": 0,
+                    "maxSlippage": 0.40 * 1e9,
+                }
+            ],
+            withdrawEntireCashBalance=True,
+        )
+        return (calldata, 0, lambda: setattr(user, "liquidityTokens", user.liquidityTokens - 1))
+
+    elif actionType == "mintNToken":
+        calldata = trade("DepositAssetAndMintNToken", [], depositActionAmount=1000e8)
+        return (calldata, 0, lambda: setattr(user, "nTokens", user.nTokens + 1))
+
+    elif actionType == "redeemNToken":
+        if user.nTokens == 0:
+            return None
+        calldata = trade(
+            "RedeemNToken", [], depositActionAmount=100e8, withdrawEntireCashBalance=True
+        )
+        return (calldata, 0, lambda: setattr(user, "nTokens", user.nTokens - 1))
+
+    elif actionType == "transferfCash":
+        if user.fCash < 10e8:
+            return None
+        to = random.choice(counterparties)
+        calldata = env.notional.safeTransferFrom.encode_input(
+            user.account.address, to.address, fCashId, 10e8, bytes()
+        )
+        return (calldata, 0, lambda: setattr(user, "fCash", user.fCash - 10e8))
+
+    raise Exception("Unknown action type {}".format(actionType))
+
+
+def submit(user, calldata, value, to):
+    start = time.perf_counter()
+    try:
+        receipt = user.account.transfer(
+            to,
+            value,
+            data=calldata,
+            gas_limit=GAS_LIMIT,
+            allow_revert=True,
+            silent=True,
+        )
+        latency = time.perf_counter() - start
+        if receipt.status == 0:
+            return (latency, receipt, receipt.revert_msg or "reverted")
+        return (latency, receipt, None)
+    except VirtualMachineError as e:
+        return (time.perf_counter() - start, None, e.revert_msg or str(e))
+
+
+def run_user(env, user, actionRates, ratePerUser, deadline, fCashId, counterparties, stats):
+    actionTypes = list(actionRates.keys())
+    weights = list(actionRates.values())
+
+    nextArrival = time.perf_counter()
+    while True:
+        # Poisson arrivals, if the account falls behind schedule it submits back to back
+        nextArrival += random.expovariate(ratePerUser)
+        if nextArrival > deadline:
+            return
+        delay = nextArrival - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+        actionType = random.choices(actionTypes, weights)[0]
+        action = build_action(env, user, actionType, fCashId, counterparties)
+        if action is None:
+            # Fall back to an action that opens the required position
+            actionType = {"removeLiquidity": "addLiquidity", "redeemNToken": "mintNToken"}.get(
+                actionType, "lend"
+            )
+            action = build_action(env, user, actionType, fCashId, counterparties)
+
+        (calldata, value, onSuccess) = action
+        (latency, receipt, revertReason) = submit(user, calldata, value, env.notional.address)
+        stats.record(actionType, latency, receipt, revertReason)
+        if revertReason is None and onSuccess is not None:
+            onSuccess()
+
+
+def block_stats(startBlock, endBlock):
+    gasPerBlock = []
+    txPerBlock = []
+    for n in range(startBlock + 1, endBlock + 1):
+        block = web3.eth.get_block(n)
+        gasPerBlock.append(block["gasUsed"])
+        txPerBlock.append(len(block["transactions"]))
+
+    return (gasPerBlock, txPerBlock)
+
+
+def run_load(env, users, duration, txPerSecond, actionRates=None):
+    if actionRates is None:
+        actionRates = DEFAULT_ACTION_RATES
+
+    market = env.notional.getActiveMarkets(CURRENCY_ID)[0]
+    fCashId = env.notional.encodeToId(CURRENCY_ID, market[1], 1)
+    stats = LoadStats()
+    ratePerUser = txPerSecond / len(users)
+
+    startBlock = web3.eth.block_number
+    start = time.perf_counter()
+    deadline = start + duration
+    threads = []
+    for user in users:
+        counterparties = [u.account for u in users if u is not user] or [accounts[0]]
+        t = threading.Thread(
+            target=run_user,
+            args=(env, user, actionRates, ratePerUser, deadline, fCashId, counterparties, stats),
+            daemon=True,
+        )
+        t.start()
+        threads.append(t)
+
+    for t in threads:
+        t.join()
+
+    elapsed = time.perf_counter() - start
+    endBlock = web3.eth.block_number
+    (gasPerBlock, txPerBlock) = block_stats(startBlock, endBlock)
+
+    return summarize(stats, elapsed, gasPerBlock, txPerBlock)
+
+
+def summarize(stats, elapsed, gasPerBlock, txPerBlock):
+    allLatencies = [x for v in stats.latencies.values() for x in v]
+    totalSubmitted = sum(stats.submitted.values())
+    totalSucceeded = sum(stats.succeeded.values())
+
+    return {
+        "elapsedSeconds": elapsed,
+        "submitted": totalSubmitted,
+        "succeeded": totalSucceeded,
+        "txPerSecond": totalSucceeded / elapsed if elapsed > 0 else 0,
+        "blocks": len(gasPerBlock),
+        "gasPerBlock": {
+            "mean": sum(gasPerBlock) / len(gasPerBlock) if len(gasPerBlock) > 0 else 0,
+            "max": max(gasPerBlock, default=0),
+        },
+        "txPerBlock": {
+            "mean": sum(txPerBlock) / len(txPerBlock) if len(txPerBlock) > 0 else 0,
+            "max": max(txPerBlock, default=0),
+        },
+        "latency": {
+            "p50": percentile(allLatencies, 50),
+            "p90": percentile(allLatencies, 90),
+            "p99": percentile(allLatencies, 99),
+            "max": max(allLatencies, default=0),
+        },
+        "actions": {
+            k: {
+                "submitted": stats.submitted[k],
+                "succeeded": stats.succeeded[k],
+                "meanGas": stats.gasUsed[k] / stats.succeeded[k] if stats.succeeded[k] else 0,
+                "p50": percentile(stats.latencies[k], 50),
+                "p99": percentile(stats.latencies[k], 99),
+            }
+            for k in stats.submitted.keys()
+        },
+        "reverts": {"{}: {}".format(k, r): n for ((k, r), n) in stats.reverts.most_common()},
+    }
+
+
+def print_report(report):
+    print("Elapsed: {:.1f}s, Blocks: {}".format(report["elapsedSeconds"], report["blocks"]))
+    print(
+        "Submitted: {}, Succeeded: {}, TPS: {:.2f}".format(
+            report["submitted"], report["succeeded"], report["txPerSecond"]
+        )
+    )
+    print(
+        "Gas per block: mean {:.0f}, max {}".format(
+            report["gasPerBlock"]["mean"], report["gasPerBlock"]["max"]
+        )
+    )
+    print(
+        "Latency (s): p50 {p50:.3f}, p90 {p90:.3f}, p99 {p99:.3f}, max {max:.3f}".format(
+            **report["latency"]
+        )
+    )
+    print(
+        "{:<16} {:>9} {:>9} {:>10} {:>8} {:>8}".format("Action", "Sent", "Ok", "Gas", "p50", "p99")
+    )
+    for (k, v) in sorted(report["actions"].items()):
+        print(
+            "{:<16} {:>9} {:>9} {:>10.0f} {:>8.3f} {:>8.3f}".format(
+                k, v["submitted"], v["succeeded"], v["meanGas"], v["p50"], v["p99"]
+            )
+        )
+    for (reason, n) in report["reverts"].items():
+        print("Revert {}: {}".format(reason, n))
+
+
+def main(numAccounts=10, duration=60, txPerSecond=5):
+    env = initialize_environment(accounts)
+    users = fund_accounts(env, int(numAccounts))
+
+    report = run_load(env, users, float(duration), float(txPerSecond))
+    print_report(report)
+
+    with open("load_stats.json", "w") as f:
+        json.dump(report, f, sort_keys=True, indent=4)
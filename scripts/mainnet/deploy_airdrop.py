@@ -3,10 +3,10 @@ import os
 
 from brownie import accounts, network
 from scripts.deployment import deployArtifact
+from scripts.mainnet.merkle_airdrop import read_merkle_root
 
-IncentiveAirdropTree = json.load(
-    open(os.path.join(os.path.dirname(__file__), "IncentiveAirdropTree.json"), "r")
-)
+# Either the JSON tree or a binary proof store built by merkle_airdrop.py
+IncentiveAirdropTree = os.path.join(os.path.dirname(__file__), "IncentiveAirdropTree.json")
 
 
 def main():
@@ -22,7 +22,7 @@ def main():
 
     airdrop = deployArtifact(
         os.path.join(os.path.dirname(__file__), "MerkleDistributor.json"),
-        [addresses["note"], IncentiveAirdropTree["merkleRoot"], 0],  # Can claim immediately
+        [addresses["note"], read_merkle_root(IncentiveAirdropTree), 0],  # Can claim immediately
         deployer,
         "IncentiveAirdrop",
     )
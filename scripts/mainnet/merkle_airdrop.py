@@ -0,0 +1,259 @@
+"""
+Merkle tree builder and proof store for the MerkleDistributor airdrops.
+
+Builds the same tree as the Uniswap merkle-distributor scripts that produced
+AirdropMerkleTree.json and IncentiveAirdropTree.json: claims are indexed by checksummed address
+order, leaves are keccak256(abi.encodePacked(uint256 index, address account, uint256 amount)),
+leaves are sorted and each pair is hashed in sorted order. An odd node at the end of a layer is
+carried up unchanged.
+
+Instead of inlining every proof in a JSON file the tree is written once to a binary store:
+
+    header      magic, version, number of claims, number of layers, merkle root, token total
+    layers      (offset, length) of every tree layer in the file
+    index       one fixed size record per claim sorted by address bytes:
+                address, claim index, leaf position, amount
+    nodes       every layer of the tree, 32 bytes per node, leaves first
+
+Lookups memory map the file, binary search the index for the address and read one sibling node
+per layer, so a proof costs O(log n) reads and nothing is parsed up front.
+"""
+import csv
+import json
+import mmap
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+from eth_utils import keccak, to_checksum_address
+
+MAGIC = b"NMKL"
+VERSION = 1
+HEADER = struct.Struct(">4sHII32s32s")
+LAYER = struct.Struct(">QI")
+RECORD = struct.Struct(">20sII32s")
+NODE_SIZE = 32
+HASH_CHUNK_SIZE = 4096
+
+
+def _hash_leaves(chunk):
+    return [
+        keccak(index.to_bytes(32, "big") + address + amount.to_bytes(32, "big"))
+        for (index, address, amount) in chunk
+    ]
+
+
+def _hex_amount(amount):
+    # Matches the even length hex strings in the existing JSON trees
+    value = "{:x}".format(amount)
+    return "0x" + ("0" if len(value) % 2 else "") + value
+
+
+def _hash_pair(a, b):
+    return keccak(a + b) if a < b else keccak(b + a)
+
+
+def _next_layer(layer):
+    nextLayer = [_hash_pair(layer[i], layer[i + 1]) for i in range(0, len(layer) - 1, 2)]
+    if len(layer) % 2 == 1:
+        nextLayer.append(layer[-1])
+    return nextLayer
+
+
+def read_claims_csv(path):
+    """Streams (address, amount) rows from a csv with an address and an amount column"""
+    with open(path, "r", newline="") as f:
+        for row in csv.reader(f):
+            if len(row) == 0 or row[0].strip().lower() == "address":
+                continue
+            amount = row[1].strip()
+            yield (row[0].strip(), int(amount, 16) if amount.startswith("0x") else int(amount))
+
+
+def read_claims_json_tree(path):
+    """Reads (address, amount) rows from an existing merkle-distributor JSON tree"""
+    with open(path, "r") as f:
+        tree = json.load(f)
+    for (address, claim) in tree["claims"].items():
+        yield (address, int(claim["amount"], 16))
+
+
+def _checksum_addresses(chunk):
+    return [(to_checksum_address(address), amount) for (address, amount) in chunk]
+
+
+def _map_chunks(pool, fn, items):
+    chunks = [items[i : i + HASH_CHUNK_SIZE] for i in range(0, len(items), HASH_CHUNK_SIZE)]
+    if pool is None:
+        return [r for chunk in chunks for r in fn(chunk)]
+    return [r for chunk in pool.map(fn, chunks) for r in chunk]
+
+
+def build_tree(claims, workers=None):
+    """
+    Returns the claims sorted in index order as (index, address bytes, amount), the position of
+    each claim's leaf in the bottom layer and the tree layers, leaves first.
+    """
+    rows = list(claims)
+    if len(rows) == 0:
+        raise Exception("No claims")
+
+    # Checksumming and leaf hashing are both a keccak per claim, spread them over processes
+    pool = None
+    if len(rows) > HASH_CHUNK_SIZE and workers != 1:
+        pool = ProcessPoolExecutor(max_workers=workers)
+
+    try:
+        amounts = {}
+        for (address, amount) in _map_chunks(pool, _checksum_addresses, rows):
+            if address in amounts:
+                raise Exception("Duplicate address {}".format(address))
+            if amount <= 0:
+                raise Exception("Invalid amount for {}".format(address))
+            amounts[address] = amount
+
+        # Indexes follow the order of the checksummed address strings
+        indexed = [
+            (index, bytes.fromhex(address[2:]), amounts[address])
+            for (index, address) in enumerate(sorted(amounts))
+        ]
+        leafHashes = _map_chunks(pool, _hash_leaves, indexed)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    layers = [sorted(leafHashes)]
+    while len(layers[-1]) > 1:
+        layers.append(_next_layer(layers[-1]))
+
+    position = {leaf: i for (i, leaf) in enumerate(layers[0])}
+    leafPositions = [position[leaf] for leaf in leafHashes]
+    return (indexed, leafPositions, layers)
+
+
+def write_proof_store(path, indexed, leafPositions, layers):
+    tokenTotal = sum(amount for (_, _, amount) in indexed)
+    records = sorted(
+        (address, index, leafPositions[index], amount) for (index, address, amount) in indexed
+    )
+
+    offset = HEADER.size + LAYER.size * len(layers) + RECORD.size * len(records)
+    with open(path, "wb") as f:
+        f.write(
+            HEADER.pack(
+                MAGIC,
+                VERSION,
+                len(records),
+                len(layers),
+                layers[-1][0],
+                tokenTotal.to_bytes(32, "big"),
+            )
+        )
+        for layer in layers:
+            f.write(LAYER.pack(offset, len(layer)))
+            offset += NODE_SIZE * len(layer)
+        for (address, index, leafPosition, amount) in records:
+            f.write(RECORD.pack(address, index, leafPosition, amount.to_bytes(32, "big")))
+        for layer in layers:
+            f.write(b"".join(layer))
+
+    return "0x" + layers[-1][0].hex()
+
+
+class ProofStore:
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.numClaims, numLayers, root, tokenTotal) = HEADER.unpack_from(
+            self._map, 0
+        )
+        if magic != MAGIC or version != VERSION:
+            raise Exception("{} is not a merkle proof store".format(path))
+
+        self.merkleRoot = "0x" + root.hex()
+        self.tokenTotal = int.from_bytes(tokenTotal, "big")
+        self._layers = [
+            LAYER.unpack_from(self._map, HEADER.size + LAYER.size * i) for i in range(numLayers)
+        ]
+        self._recordsOffset = HEADER.size + LAYER.size * numLayers
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def _record(self, i):
+        return RECORD.unpack_from(self._map, self._recordsOffset + RECORD.size * i)
+
+    def _find(self, address):
+        lo = 0
+        hi = self.numClaims
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self._recordsOffset + RECORD.size * mid
+            candidate = self._map[start : start + 20]
+            if candidate < address:
+                lo = mid + 1
+            elif candidate > address:
+                hi = mid
+            else:
+                return self._record(mid)
+        return None
+
+    def getProof(self, leafPosition):
+        proof = []
+        position = leafPosition
+        for (offset, length) in self._layers[:-1]:
+            sibling = position ^ 1
+            if sibling < length:
+                start = offset + NODE_SIZE * sibling
+                proof.append("0x" + self._map[start : start + NODE_SIZE].hex())
+            position //= 2
+        return proof
+
+    def getClaim(self, address):
+        """Returns the claim in the same shape as the JSON trees or None if there is no claim"""
+        record = self._find(bytes.fromhex(to_checksum_address(address)[2:]))
+        if record is None:
+            return None
+
+        (_, index, leafPosition, amount) = record
+        return {
+            "index": index,
+            "amount": _hex_amount(int.from_bytes(amount, "big")),
+            "proof": self.getProof(leafPosition),
+        }
+
+
+def verify_proof(root, index, address, amount, proof):
+    node = _hash_leaves([(index, bytes.fromhex(to_checksum_address(address)[2:]), amount)])[0]
+    for sibling in proof:
+        node = _hash_pair(node, bytes.fromhex(sibling[2:]))
+    return "0x" + node.hex() == root
+
+
+def read_merkle_root(path):
+    """Reads the merkle root from either a binary proof store or a JSON tree"""
+    if path.endswith(".json"):
+        with open(path, "r") as f:
+            return json.load(f)["merkleRoot"]
+
+    with open(path, "rb") as f:
+        (magic, _, _, _, root, _) = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC:
+        raise Exception("{} is not a merkle proof store".format(path))
+    return "0x" + root.hex()
+
+
+def main(claimsPath, outputPath=None, workers=None):
+    if claimsPath.endswith(".json"):
+        claims = read_claims_json_tree(claimsPath)
+    else:
+        claims = read_claims_csv(claimsPath)
+
+    if outputPath is None:
+        outputPath = os.path.splitext(claimsPath)[0] + ".bin"
+
+    (indexed, leafPositions, layers) = build_tree(claims, workers)
+    root = write_proof_store(outputPath, indexed, leafPositions, layers)
+    print("Merkle root: {}".format(root))
+    print("Wrote {} claims to {}".format(len(indexed), outputPath))
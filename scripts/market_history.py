@@ -0,0 +1,217 @@
+"""
+Columnar, memory mapped history of Notional market state.
+
+Market state returned by getActiveMarkets is captured per currency at a set of blocks, i.e. every
+block with a trade, liquidity or market initialization event, and appended to one raw little
+endian file per column under `<root>/<currencyId>/`. Each captured block appends one row per
+active market. The number of committed rows is kept in `meta.json` and only updated once every
+column is written, so a capture that is interrupted never exposes partial rows.
+
+Readers memory map the column files and slice block or time ranges with a binary search on the
+block number or timestamp column, the returned arrays are views of the files.
+
+Usage:
+    brownie run scripts/market_history.py main <root> [fromBlock] [toBlock] --network mainnet
+"""
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from brownie import chain, network
+from brownie.network import web3
+from scripts.environment_v2 import EnvironmentV2
+from scripts.event_logs import EventDecoder, stream_events
+
+# Column name => dtype, rows are ordered by blockNumber
+COLUMNS = {
+    "blockNumber": np.dtype("<i8"),
+    "timestamp": np.dtype("<i8"),
+    "marketIndex": np.dtype("<u1"),
+    "maturity": np.dtype("<i8"),
+    # Balances are uint80 in storage, they are checked to fit in an int64 when appended
+    "totalfCash": np.dtype("<i8"),
+    "totalAssetCash": np.dtype("<i8"),
+    "totalLiquidity": np.dtype("<i8"),
+    "lastImpliedRate": np.dtype("<u4"),
+    "oracleRate": np.dtype("<u4"),
+    "previousTradeTime": np.dtype("<u4"),
+}
+MARKET_EVENTS = ("LendBorrowTrade", "AddRemoveLiquidity", "MarketsInitialized")
+CAPTURE_WORKERS = 8
+INT64_MAX = 2 ** 63 - 1
+
+
+class MarketHistory:
+    """Read only view over the history of one currency, every column is a NumPy array"""
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns["blockNumber"])
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def _slice(self, start, end):
+        return MarketHistory({k: v[start:end] for (k, v) in self.columns.items()})
+
+    def blocks(self, fromBlock=None, toBlock=None):
+        """Rows captured between fromBlock and toBlock, inclusive"""
+        return self._range("blockNumber", fromBlock, toBlock)
+
+    def time(self, fromTime=None, toTime=None):
+        """Rows captured between fromTime and toTime, inclusive"""
+        return self._range("timestamp", fromTime, toTime)
+
+    def _range(self, column, start, end):
+        values = self.columns[column]
+        startIndex = 0 if start is None else np.searchsorted(values, start, side="left")
+        endIndex = len(values) if end is None else np.searchsorted(values, end, side="right")
+        return self._slice(startIndex, endIndex)
+
+    def curve(self, blockNumber):
+        """Rows of the last capture at or before blockNumber, i.e. the yield curve at that block"""
+        blocks = self.columns["blockNumber"]
+        end = np.searchsorted(blocks, blockNumber, side="right")
+        if end == 0:
+            return self._slice(0, 0)
+        return self._slice(np.searchsorted(blocks, blocks[end - 1], side="left"), end)
+
+    def market(self, marketIndex):
+        """Rows of a single market index, this copies the selected rows"""
+        mask = self.columns["marketIndex"] == marketIndex
+        return MarketHistory({k: v[mask] for (k, v) in self.columns.items()})
+
+
+class MarketHistoryStore:
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, currencyId, name):
+        return os.path.join(self.root, str(currencyId), name)
+
+    def _meta(self, currencyId):
+        path = self._path(currencyId, "meta.json")
+        if not os.path.exists(path):
+            return {"rows": 0, "lastBlock": -1}
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def _write_meta(self, currencyId, meta):
+        path = self._path(currencyId, "meta.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(path + ".tmp", path)
+
+    def currencies(self):
+        return sorted(int(d) for d in os.listdir(self.root) if d.isdigit())
+
+    def last_block(self, currencyId):
+        return self._meta(currencyId)["lastBlock"]
+
+    def append(self, currencyId, rows):
+        """
+        Appends rows, a dict of column name => sequence of equal length. Block numbers must not
+        decrease and must be after the last block already stored.
+        """
+        columns = {name: np.asarray(rows[name]) for name in COLUMNS}
+        count = len(columns["blockNumber"])
+        if count == 0:
+            return
+        if any(len(c) != count for c in columns.values()):
+            raise Exception("Columns have different lengths")
+
+        blocks = columns["blockNumber"]
+        meta = self._meta(currencyId)
+        if blocks[0] <= meta["lastBlock"] or np.any(np.diff(blocks) < 0):
+            raise Exception("Blocks must be appended in order after {}".format(meta["lastBlock"]))
+        for name in ("totalfCash", "totalAssetCash", "totalLiquidity"):
+            # Python ints beyond the int64 range are converted to object arrays
+            if columns[name].dtype == object and (
+                max(columns[name]) > INT64_MAX or min(columns[name]) < -INT64_MAX
+            ):
+                raise Exception("{} does not fit in an int64".format(name))
+
+        os.makedirs(os.path.join(self.root, str(currencyId)), exist_ok=True)
+        for (name, dtype) in COLUMNS.items():
+            with open(self._path(currencyId, name + ".bin"), "ab") as f:
+                # Drop anything past the committed rows left by an interrupted append
+                f.truncate(meta["rows"] * dtype.itemsize)
+                columns[name].astype(dtype).tofile(f)
+
+        self._write_meta(currencyId, {"rows": meta["rows"] + count, "lastBlock": int(blocks[-1])})
+
+    def read(self, currencyId):
+        """Memory maps the committed rows of a currency"""
+        rows = self._meta(currencyId)["rows"]
+        if rows == 0:
+            return MarketHistory({name: np.empty(0, dtype) for (name, dtype) in COLUMNS.items()})
+
+        return MarketHistory(
+            {
+                name: np.memmap(
+                    self._path(currencyId, name + ".bin"), dtype=dtype, mode="r", shape=(rows,)
+                )
+                for (name, dtype) in COLUMNS.items()
+            }
+        )
+
+
+def _market_rows(blockNumber, timestamp, markets):
+    return [
+        (blockNumber, timestamp, i + 1, m[1], m[2], m[3], m[4], m[5], m[6], m[7])
+        for (i, m) in enumerate(markets)
+    ]
+
+
+def capture(store, notional, currencyId, blocks, workers=CAPTURE_WORKERS):
+    """
+    Appends the active markets of a currency at each block in `blocks` that is after the last
+    stored block. Returns the number of rows appended.
+    """
+    lastBlock = store.last_block(currencyId)
+    blocks = sorted(b for b in set(blocks) if b > lastBlock)
+
+    def fetch(blockNumber):
+        markets = notional.getActiveMarkets(currencyId, block_identifier=blockNumber)
+        return _market_rows(blockNumber, chain[blockNumber].timestamp, markets)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        rows = [r for block in pool.map(fetch, blocks) for r in block]
+
+    if rows:
+        store.append(currencyId, dict(zip(COLUMNS, zip(*rows))))
+    return len(rows)
+
+
+def market_event_blocks(notional, fromBlock, toBlock, decoder=None):
+    """Returns currencyId => sorted blocks with a trade, liquidity or initialization event"""
+    decoder = EventDecoder() if decoder is None else decoder
+    blocks = {}
+    for record in stream_events(decoder, fromBlock, toBlock, [notional.address], MARKET_EVENTS):
+        blocks.setdefault(record.args["currencyId"], set()).add(record.blockNumber)
+    return {currencyId: sorted(b) for (currencyId, b) in blocks.items()}
+
+
+def main(root="market_history", fromBlock=None, toBlock=None):
+    networkName = network.show_active()
+    if networkName in ("mainnet-fork", "hardhat-fork"):
+        networkName = "mainnet"
+    with open("v2.{}.json".format(networkName), "r") as f:
+        config = json.load(f)
+    env = EnvironmentV2(config)
+    store = MarketHistoryStore(root)
+
+    toBlock = int(web3.eth.block_number if toBlock is None else toBlock)
+    if fromBlock is None:
+        # Resume after the earliest last stored block
+        lastBlocks = [store.last_block(c) for c in store.currencies()]
+        fromBlock = min(lastBlocks) + 1 if lastBlocks else config["startBlock"]
+    fromBlock = int(fromBlock)
+
+    for (currencyId, blocks) in market_event_blocks(env.notional, fromBlock, toBlock).items():
+        count = capture(store, env.notional, currencyId, blocks)
+        print("Currency {}: appended {} rows from {} blocks".format(currencyId, count, len(blocks)))
@@ -0,0 +1,180 @@
+"""
+Port of the subset of contracts/math/ABDKMath64x64.sol used by the Notional liquidity curve. All
+results are bit for bit identical to the library, including the uint256 wrap around inside `ln`
+for inputs below one.
+"""
+from scripts.offchain.safe_math import div as _truncate, require
+
+MIN_64x64 = -0x80000000000000000000000000000000
+MAX_64x64 = 0x7FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF
+UINT256_MODULUS = 2 ** 256
+INT128_MODULUS = 2 ** 128
+
+# (bit mask, 128.128 multiplier) pairs used by exp_2
+EXP_2_FACTORS = (
+    (0x8000000000000000, 0x16A09E667F3BCC908B2FB1366EA957D3E),
+    (0x4000000000000000, 0x1306FE0A31B7152DE8D5A46305C85EDEC),
+    (0x2000000000000000, 0x1172B83C7D517ADCDF7C8C50EB14A791F),
+    (0x1000000000000000, 0x10B5586CF9890F6298B92B71842A98363),
+    (0x800000000000000, 0x1059B0D31585743AE7C548EB68CA417FD),
+    (0x400000000000000, 0x102C9A3E778060EE6F7CACA4F7A29BDE8),
+    (0x200000000000000, 0x10163DA9FB33356D84A66AE336DCDFA3F),
+    (0x100000000000000, 0x100B1AFA5ABCBED6129AB13EC11DC9543),
+    (0x80000000000000, 0x10058C86DA1C09EA1FF19D294CF2F679B),
+    (0x40000000000000, 0x1002C605E2E8CEC506D21BFC89A23A00F),
+    (0x20000000000000, 0x100162F3904051FA128BCA9C55C31E5DF),
+    (0x10000000000000, 0x1000B175EFFDC76BA38E31671CA939725),
+    (0x8000000000000, 0x100058BA01FB9F96D6CACD4B180917C3D),
+    (0x4000000000000, 0x10002C5CC37DA9491D0985C348C68E7B3),
+    (0x2000000000000, 0x1000162E525EE054754457D5995292026),
+    (0x1000000000000, 0x10000B17255775C040618BF4A4ADE83FC),
+    (0x800000000000, 0x1000058B91B5BC9AE2EED81E9B7D4CFAB),
+    (0x400000000000, 0x100002C5C89D5EC6CA4D7C8ACC017B7C9),
+    (0x200000000000, 0x10000162E43F4F831060E02D839A9D16D),
+    (0x100000000000, 0x100000B1721BCFC99D9F890EA06911763),
+    (0x80000000000, 0x10000058B90CF1E6D97F9CA14DBCC1628),
+    (0x40000000000, 0x1000002C5C863B73F016468F6BAC5CA2B),
+    (0x20000000000, 0x100000162E430E5A18F6119E3C02282A5),
+    (0x10000000000, 0x1000000B1721835514B86E6D96EFD1BFE),
+    (0x8000000000, 0x100000058B90C0B48C6BE5DF846C5B2EF),
+    (0x4000000000, 0x10000002C5C8601CC6B9E94213C72737A),
+    (0x2000000000, 0x1000000162E42FFF037DF38AA2B219F06),
+    (0x1000000000, 0x10000000B17217FBA9C739AA5819F44F9),
+    (0x800000000, 0x1000000058B90BFCDEE5ACD3C1CEDC823),
+    (0x400000000, 0x100000002C5C85FE31F35A6A30DA1BE50),
+    (0x200000000, 0x10000000162E42FF0999CE3541B9FFFCF),
+    (0x100000000, 0x100000000B17217F80F4EF5AADDA45554),
+    (0x80000000, 0x10000000058B90BFBF8479BD5A81B51AD),
+    (0x40000000, 0x1000000002C5C85FDF84BD62AE30A74CC),
+    (0x20000000, 0x100000000162E42FEFB2FED257559BDAA),
+    (0x10000000, 0x1000000000B17217F7D5A7716BBA4A9AE),
+    (0x8000000, 0x100000000058B90BFBE9DDBAC5E109CCE),
+    (0x4000000, 0x10000000002C5C85FDF4B15DE6F17EB0D),
+    (0x2000000, 0x1000000000162E42FEFA494F1478FDE05),
+    (0x1000000, 0x10000000000B17217F7D20CF927C8E94C),
+    (0x800000, 0x1000000000058B90BFBE8F71CB4E4B33D),
+    (0x400000, 0x100000000002C5C85FDF477B662B26945),
+    (0x200000, 0x10000000000162E42FEFA3AE53369388C),
+    (0x100000, 0x100000000000B17217F7D1D351A389D40),
+    (0x80000, 0x10000000000058B90BFBE8E8B2D3D4EDE),
+    (0x40000, 0x1000000000002C5C85FDF4741BEA6E77E),
+    (0x20000, 0x100000000000162E42FEFA39FE95583C2),
+    (0x10000, 0x1000000000000B17217F7D1CFB72B45E1),
+    (0x8000, 0x100000000000058B90BFBE8E7CC35C3F0),
+    (0x4000, 0x10000000000002C5C85FDF473E242EA38),
+    (0x2000, 0x1000000000000162E42FEFA39F02B772C),
+    (0x1000, 0x10000000000000B17217F7D1CF7D83C1A),
+    (0x800, 0x1000000000000058B90BFBE8E7BDCBE2E),
+    (0x400, 0x100000000000002C5C85FDF473DEA871F),
+    (0x200, 0x10000000000000162E42FEFA39EF44D91),
+    (0x100, 0x100000000000000B17217F7D1CF79E949),
+    (0x80, 0x10000000000000058B90BFBE8E7BCE544),
+    (0x40, 0x1000000000000002C5C85FDF473DE6ECA),
+    (0x20, 0x100000000000000162E42FEFA39EF366F),
+    (0x10, 0x1000000000000000B17217F7D1CF79AFA),
+    (0x8, 0x100000000000000058B90BFBE8E7BCD6D),
+    (0x4, 0x10000000000000002C5C85FDF473DE6B2),
+    (0x2, 0x1000000000000000162E42FEFA39EF358),
+    (0x1, 0x10000000000000000B17217F7D1CF79AB),
+)
+
+
+def _checked(result):
+    require(MIN_64x64 <= result <= MAX_64x64, "ABDK overflow")
+    return result
+
+
+def _toInt128(x):
+    # Mirrors an unchecked int128(...) cast
+    x %= INT128_MODULUS
+    return x - INT128_MODULUS if x > MAX_64x64 else x
+
+
+def fromInt(x):
+    require(-0x8000000000000000 <= x <= 0x7FFFFFFFFFFFFFFF, "ABDK fromInt overflow")
+    return x << 64
+
+
+def fromUInt(x):
+    require(x <= 0x7FFFFFFFFFFFFFFF, "ABDK fromUInt overflow")
+    return x << 64
+
+
+def toInt(x):
+    return x >> 64
+
+
+def toUInt(x):
+    require(x >= 0, "ABDK toUInt negative")
+    return x >> 64
+
+
+def add(x, y):
+    return _checked(x + y)
+
+
+def sub(x, y):
+    return _checked(x - y)
+
+
+def mul(x, y):
+    return _checked((x * y) >> 64)
+
+
+def div(x, y):
+    require(y != 0, "ABDK div by zero")
+    return _checked(_truncate(x << 64, y))
+
+
+def log_2(x):
+    require(x > 0, "ABDK log of non positive")
+
+    msb = 0
+    xc = x
+    for shift in (64, 32, 16, 8, 4, 2):
+        if xc >= 1 << shift:
+            xc >>= shift
+            msb += shift
+    if xc >= 0x2:
+        msb += 1
+
+    result = (msb - 64) << 64
+    ux = (x << (127 - msb)) % UINT256_MODULUS
+    bit = 0x8000000000000000
+    while bit > 0:
+        ux = (ux * ux) % UINT256_MODULUS
+        b = ux >> 255
+        ux >>= 127 + b
+        result += bit * b
+        bit >>= 1
+
+    return _toInt128(result)
+
+
+def ln(x):
+    require(x > 0, "ABDK log of non positive")
+    log2 = log_2(x) % UINT256_MODULUS
+    return _toInt128(((log2 * 0xB17217F7D1CF79ABC9E3B39803F2F6AF) % UINT256_MODULUS) >> 128)
+
+
+def exp_2(x):
+    require(x < 0x400000000000000000, "ABDK exp overflow")
+    if x < -0x400000000000000000:
+        return 0
+
+    result = 0x80000000000000000000000000000000
+    for (mask, factor) in EXP_2_FACTORS:
+        if x & mask > 0:
+            result = (result * factor) >> 128
+
+    result >>= 63 - (x >> 64)
+    require(result <= MAX_64x64, "ABDK exp overflow")
+    return result
+
+
+def exp(x):
+    require(x < 0x400000000000000000, "ABDK exp overflow")
+    if x < -0x400000000000000000:
+        return 0
+
+    return exp_2(_toInt128((x * 0x171547652B82FE1777D0FFDA0D23A7D12) >> 128))
@@ -0,0 +1,44 @@
+"""
+Port of the present value helpers in contracts/internal/valuation/AssetHandler.sol
+"""
+from scripts.offchain import abdk_math as ABDK
+from scripts.offchain.constants import IMPLIED_RATE_TIME, RATE_PRECISION, RATE_PRECISION_64x64
+from scripts.offchain.safe_math import mulInRatePrecision, require
+
+
+def getDiscountFactor(timeToMaturity, oracleRate):
+    expValue = ABDK.fromUInt(oracleRate * timeToMaturity // IMPLIED_RATE_TIME)
+    expValue = ABDK.div(expValue, RATE_PRECISION_64x64)
+    expValue = ABDK.exp(-expValue)
+    expValue = ABDK.mul(expValue, RATE_PRECISION_64x64)
+    return ABDK.toInt(expValue)
+
+
+def getPresentfCashValue(notional, maturity, blockTime, oracleRate):
+    """Present value of an fCash asset without any risk adjustments"""
+    if notional == 0:
+        return 0
+
+    require(maturity >= blockTime, "cannot discount matured assets")
+    discountFactor = getDiscountFactor(maturity - blockTime, oracleRate)
+    require(discountFactor <= RATE_PRECISION, "get present value invalid discount factor")
+    return mulInRatePrecision(notional, discountFactor)
+
+
+def getRiskAdjustedPresentfCashValue(cashGroup, notional, maturity, blockTime, oracleRate):
+    """Present value of an fCash asset with the fCash haircut or debt buffer applied"""
+    if notional == 0:
+        return 0
+
+    require(maturity >= blockTime, "cannot discount matured assets")
+    timeToMaturity = maturity - blockTime
+    if notional > 0:
+        discountFactor = getDiscountFactor(timeToMaturity, oracleRate + cashGroup.getfCashHaircut())
+    else:
+        debtBuffer = cashGroup.getDebtBuffer()
+        if debtBuffer >= oracleRate:
+            return notional
+        discountFactor = getDiscountFactor(timeToMaturity, oracleRate - debtBuffer)
+
+    require(discountFactor <= RATE_PRECISION, "get risk adjusted pv, invalid discount factor")
+    return mulInRatePrecision(notional, discountFactor)
@@ -0,0 +1,31 @@
+"""
+Port of contracts/internal/markets/AssetRate.sol
+"""
+from typing import NamedTuple
+
+from scripts.offchain.constants import ASSET_RATE_DECIMAL_DIFFERENCE
+from scripts.offchain.safe_math import div
+
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+
+
+class AssetRate(NamedTuple):
+    rateOracle: str
+    rate: int
+    underlyingDecimals: int
+
+    @classmethod
+    def fromParameters(cls, assetRate):
+        """Builds from the AssetRateParameters tuple returned by getCashGroupAndAssetRate"""
+        (rateOracle, rate, underlyingDecimals) = assetRate
+        return cls(str(rateOracle), int(rate), int(underlyingDecimals))
+
+    def convertToUnderlying(self, assetBalance):
+        return div(
+            div(self.rate * assetBalance, ASSET_RATE_DECIMAL_DIFFERENCE), self.underlyingDecimals
+        )
+
+    def convertFromUnderlying(self, underlyingBalance):
+        return div(
+            underlyingBalance * ASSET_RATE_DECIMAL_DIFFERENCE * self.underlyingDecimals, self.rate
+        )
@@ -0,0 +1,98 @@
+"""
+Port of the cash group getters in contracts/internal/markets/CashGroup.sol. The contract reads
+each parameter out of a packed bytes32, here they are read from the CashGroupSettings struct
+returned by getCashGroupAndAssetRate which holds the same unscaled values.
+"""
+from typing import NamedTuple, Tuple
+
+from scripts.offchain.asset_rate import AssetRate
+from scripts.offchain.constants import (
+    BASIS_POINT,
+    FIVE_BASIS_POINTS,
+    FIVE_MINUTES,
+    IMPLIED_RATE_TIME,
+    MAX_LIQUIDITY_TOKEN_INDEX,
+    MIN_LIQUIDITY_TOKEN_INDEX,
+    RATE_PRECISION,
+)
+from scripts.offchain.safe_math import div, require
+
+
+class CashGroup(NamedTuple):
+    currencyId: int
+    maxMarketIndex: int
+    rateOracleTimeWindow5Min: int
+    totalFeeBPS: int
+    reserveFeeShare: int
+    debtBuffer5BPS: int
+    fCashHaircut5BPS: int
+    settlementPenaltyRate5BPS: int
+    liquidationfCashHaircut5BPS: int
+    liquidationDebtBuffer5BPS: int
+    liquidityTokenHaircuts: Tuple[int, ...]
+    rateScalars: Tuple[int, ...]
+    assetRate: AssetRate
+
+    @classmethod
+    def fromParameters(cls, currencyId, cashGroupSettings, assetRate):
+        """Builds from the (CashGroupSettings, AssetRateParameters) returned by the views"""
+        settings = [int(v) for v in cashGroupSettings[0:9]]
+        return cls(
+            currencyId,
+            *settings,
+            tuple(int(h) for h in cashGroupSettings[9]),
+            tuple(int(s) for s in cashGroupSettings[10]),
+            assetRate if isinstance(assetRate, AssetRate) else AssetRate.fromParameters(assetRate),
+        )
+
+    def getRateScalar(self, marketIndex, timeToMaturity):
+        require(1 <= marketIndex <= self.maxMarketIndex, "invalid market index")
+        scalar = self.rateScalars[marketIndex - 1] * RATE_PRECISION
+        rateScalar = div(scalar * IMPLIED_RATE_TIME, timeToMaturity)
+        require(rateScalar > 0, "rate scalar underflow")
+        return rateScalar
+
+    def getLiquidityHaircut(self, assetType):
+        require(
+            MIN_LIQUIDITY_TOKEN_INDEX <= assetType <= MAX_LIQUIDITY_TOKEN_INDEX,
+            "liquidity haircut invalid asset type",
+        )
+        return self.liquidityTokenHaircuts[assetType - MIN_LIQUIDITY_TOKEN_INDEX]
+
+    def getTotalFee(self):
+        return self.totalFeeBPS * BASIS_POINT
+
+    def getReserveFeeShare(self):
+        return self.reserveFeeShare
+
+    def getfCashHaircut(self):
+        return self.fCashHaircut5BPS * FIVE_BASIS_POINTS
+
+    def getDebtBuffer(self):
+        return self.debtBuffer5BPS * FIVE_BASIS_POINTS
+
+    def getRateOracleTimeWindow(self):
+        return self.rateOracleTimeWindow5Min * FIVE_MINUTES
+
+    def getSettlementPenalty(self):
+        return self.settlementPenaltyRate5BPS * FIVE_BASIS_POINTS
+
+    def getLiquidationfCashHaircut(self):
+        return self.liquidationfCashHaircut5BPS * FIVE_BASIS_POINTS
+
+    def getLiquidationDebtBuffer(self):
+        return self.liquidationDebtBuffer5BPS * FIVE_BASIS_POINTS
+
+
+def interpolateOracleRate(shortMaturity, longMaturity, shortRate, longRate, assetMaturity):
+    require(shortMaturity < assetMaturity, "cash group interpolation error, short maturity")
+    require(assetMaturity < longMaturity, "cash group interpolation error, long maturity")
+
+    if longRate >= shortRate:
+        return (longRate - shortRate) * (assetMaturity - shortMaturity) // (
+            longMaturity - shortMaturity
+        ) + shortRate
+    else:
+        return shortRate - (shortRate - longRate) * (assetMaturity - shortMaturity) // (
+            longMaturity - shortMaturity
+        )
@@ -0,0 +1,133 @@
+"""
+Port of the compound-protocol@2.8.1 interest rate models deployed from scripts/artifacts and of
+the interest accrual in CToken.accrueInterest, which cTokenAggregator._viewExchangeRate mirrors.
+"""
+from typing import NamedTuple
+
+from scripts.offchain.safe_math import require
+
+BLOCKS_PER_YEAR = 2102400
+MANTISSA = 10 ** 18
+# borrowRateMaxMantissa in CTokenInterfaces.sol
+BORROW_RATE_MAX_MANTISSA = 5 * 10 ** 12
+
+
+def utilizationRate(cash, borrows, reserves):
+    if borrows == 0:
+        return 0
+    return borrows * MANTISSA // (cash + borrows - reserves)
+
+
+class InterestRateModel(NamedTuple):
+    baseRatePerBlock: int
+    multiplierPerBlock: int
+    # The whitepaper model has no kink, it is the jump model with a kink above full utilization
+    jumpMultiplierPerBlock: int = 0
+    kink: int = 2 ** 256 - 1
+
+    @classmethod
+    def whitePaper(cls, baseRatePerYear, multiplierPerYear):
+        return cls(baseRatePerYear // BLOCKS_PER_YEAR, multiplierPerYear // BLOCKS_PER_YEAR)
+
+    @classmethod
+    def jump(cls, baseRatePerYear, multiplierPerYear, jumpMultiplierPerYear, kink):
+        return cls(
+            baseRatePerYear // BLOCKS_PER_YEAR,
+            multiplierPerYear // BLOCKS_PER_YEAR,
+            jumpMultiplierPerYear // BLOCKS_PER_YEAR,
+            kink,
+        )
+
+    @classmethod
+    def fromConfig(cls, config):
+        """Builds from the interestRateModel entry in CompoundConfig"""
+        if config["name"] == "whitepaper":
+            return cls.whitePaper(config["baseRate"], config["multiplier"])
+        elif config["name"] == "jump":
+            return cls.jump(
+                config["baseRate"],
+                config["multiplier"],
+                config["jumpMultiplierPerYear"],
+                config["kink"],
+            )
+        raise Exception("Unknown interest rate model {}".format(config["name"]))
+
+    @classmethod
+    def fromContract(cls, model):
+        """Reads the per block parameters from a deployed whitepaper or jump rate model"""
+        if hasattr(model, "kink"):
+            return cls(
+                model.baseRatePerBlock(),
+                model.multiplierPerBlock(),
+                model.jumpMultiplierPerBlock(),
+                model.kink(),
+            )
+        return cls(model.baseRatePerBlock(), model.multiplierPerBlock())
+
+    def getBorrowRate(self, cash, borrows, reserves):
+        util = utilizationRate(cash, borrows, reserves)
+        if util <= self.kink:
+            return util * self.multiplierPerBlock // MANTISSA + self.baseRatePerBlock
+
+        normalRate = self.kink * self.multiplierPerBlock // MANTISSA + self.baseRatePerBlock
+        return (util - self.kink) * self.jumpMultiplierPerBlock // MANTISSA + normalRate
+
+    def getSupplyRate(self, cash, borrows, reserves, reserveFactorMantissa):
+        oneMinusReserveFactor = MANTISSA - reserveFactorMantissa
+        borrowRate = self.getBorrowRate(cash, borrows, reserves)
+        rateToPool = borrowRate * oneMinusReserveFactor // MANTISSA
+        return utilizationRate(cash, borrows, reserves) * rateToPool // MANTISSA
+
+
+class CTokenState(NamedTuple):
+    cash: int
+    totalBorrows: int
+    totalReserves: int
+    totalSupply: int
+    reserveFactorMantissa: int
+    initialExchangeRateMantissa: int
+    accrualBlockNumber: int
+
+    @classmethod
+    def fromContract(cls, cToken, blockNumber=None):
+        def call(method):
+            return getattr(cToken, method)(block_identifier=blockNumber)
+
+        return cls(
+            call("getCash"),
+            call("totalBorrows"),
+            call("totalReserves"),
+            call("totalSupply"),
+            call("reserveFactorMantissa"),
+            call("initialExchangeRateMantissa"),
+            call("accrualBlockNumber"),
+        )
+
+    def exchangeRate(self):
+        if self.totalSupply == 0:
+            return self.initialExchangeRateMantissa
+        return (self.cash + self.totalBorrows - self.totalReserves) * MANTISSA // self.totalSupply
+
+    def accrueInterest(self, model, blockNumber):
+        """Returns the state after interest is accrued up to blockNumber"""
+        blockDelta = blockNumber - self.accrualBlockNumber
+        require(blockDelta >= 0, "accrual block in the past")
+        if blockDelta == 0:
+            return self
+
+        borrowRate = model.getBorrowRate(self.cash, self.totalBorrows, self.totalReserves)
+        require(borrowRate <= BORROW_RATE_MAX_MANTISSA, "RATE_TOO_HIGH")
+
+        interestAccumulated = borrowRate * blockDelta * self.totalBorrows // MANTISSA
+        return self._replace(
+            totalBorrows=self.totalBorrows + interestAccumulated,
+            totalReserves=self.totalReserves
+            + self.reserveFactorMantissa * interestAccumulated // MANTISSA,
+            accrualBlockNumber=blockNumber,
+        )
+
+    def viewExchangeRate(self, model, blockNumber):
+        """Mirrors cTokenAggregator.getExchangeRateView at blockNumber"""
+        if blockNumber == self.accrualBlockNumber:
+            return self.exchangeRate()
+        return self.accrueInterest(model, blockNumber).exchangeRate()
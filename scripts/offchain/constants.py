@@ -0,0 +1,62 @@
+"""
+Integer versions of the constants in contracts/global/Constants.sol. Unlike tests/constants.py
+these are never floats so that off chain calculations round exactly like the contracts.
+"""
+
+INTERNAL_TOKEN_PRECISION = 10 ** 8
+ETH_CURRENCY_ID = 1
+ETH_DECIMALS = 10 ** 18
+PERCENTAGE_DECIMALS = 100
+MAX_TRADED_MARKET_INDEX = 7
+FIVE_MINUTES = 300
+
+DAY = 86400
+WEEK = DAY * 6
+MONTH = WEEK * 5
+QUARTER = MONTH * 3
+YEAR = QUARTER * 4
+
+DAYS_IN_WEEK = 6
+DAYS_IN_MONTH = 30
+DAYS_IN_QUARTER = 90
+
+MAX_DAY_OFFSET = 90
+MAX_WEEK_OFFSET = 360
+MAX_MONTH_OFFSET = 2160
+MAX_QUARTER_OFFSET = 7650
+
+WEEK_BIT_OFFSET = 90
+MONTH_BIT_OFFSET = 135
+QUARTER_BIT_OFFSET = 195
+
+IMPLIED_RATE_TIME = 360 * DAY
+RATE_PRECISION = 10 ** 9
+BASIS_POINT = RATE_PRECISION // 10000
+FIVE_BASIS_POINTS = 5 * BASIS_POINT
+TEN_BASIS_POINTS = 10 * BASIS_POINT
+
+RATE_PRECISION_64x64 = 0x3B9ACA000000000000000000
+LOG_RATE_PRECISION_64x64 = 382276781265598821176
+MAX_MARKET_PROPORTION = RATE_PRECISION * 99 // 100
+
+FCASH_ASSET_TYPE = 1
+MIN_LIQUIDITY_TOKEN_INDEX = 2
+MAX_LIQUIDITY_TOKEN_INDEX = 8
+
+HAS_ASSET_DEBT = 0x01
+HAS_CASH_DEBT = 0x02
+ACTIVE_IN_PORTFOLIO = 0x8000
+ACTIVE_IN_BALANCES = 0x4000
+UNMASK_FLAGS = 0x3FFF
+
+DEPOSIT_PERCENT_BASIS = 10 ** 8
+
+# Byte offsets into the nToken parameters
+LIQUIDATION_HAIRCUT_PERCENTAGE = 0
+CASH_WITHHOLDING_BUFFER = 1
+RESIDUAL_PURCHASE_TIME_BUFFER = 2
+PV_HAIRCUT_PERCENTAGE = 3
+RESIDUAL_PURCHASE_INCENTIVE = 4
+
+# Asset rates are in 1e18 decimals, internal balances are in 1e8 decimals
+ASSET_RATE_DECIMAL_DIFFERENCE = 10 ** 10
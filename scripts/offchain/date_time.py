@@ -0,0 +1,126 @@
+"""
+Port of contracts/internal/markets/DateTime.sol
+"""
+from scripts.offchain.constants import (
+    DAY,
+    DAYS_IN_MONTH,
+    DAYS_IN_QUARTER,
+    DAYS_IN_WEEK,
+    MAX_DAY_OFFSET,
+    MAX_MONTH_OFFSET,
+    MAX_QUARTER_OFFSET,
+    MAX_TRADED_MARKET_INDEX,
+    MAX_WEEK_OFFSET,
+    MONTH,
+    MONTH_BIT_OFFSET,
+    QUARTER,
+    QUARTER_BIT_OFFSET,
+    WEEK,
+    WEEK_BIT_OFFSET,
+    YEAR,
+)
+from scripts.offchain.safe_math import Revert, require
+
+TRADED_MARKETS = (QUARTER, 2 * QUARTER, YEAR, 2 * YEAR, 5 * YEAR, 10 * YEAR, 20 * YEAR)
+
+
+def getReferenceTime(blockTime):
+    require(blockTime >= QUARTER)
+    return blockTime - (blockTime % QUARTER)
+
+
+def getTimeUTC0(time):
+    require(time >= DAY)
+    return time - (time % DAY)
+
+
+def getTradedMarket(index):
+    if 1 <= index <= len(TRADED_MARKETS):
+        return TRADED_MARKETS[index - 1]
+
+    raise Revert("Invalid index")
+
+
+def getMarketMaturity(marketIndex, blockTime):
+    return getReferenceTime(blockTime) + getTradedMarket(marketIndex)
+
+
+def isValidMarketMaturity(maxMarketIndex, maturity, blockTime):
+    require(maxMarketIndex > 0, "CG: no markets listed")
+    require(maxMarketIndex <= MAX_TRADED_MARKET_INDEX, "CG: market index bound")
+
+    if maturity % QUARTER != 0:
+        return False
+    tRef = getReferenceTime(blockTime)
+    return any(maturity == tRef + getTradedMarket(i) for i in range(1, maxMarketIndex + 1))
+
+
+def getMarketIndex(maxMarketIndex, maturity, blockTime):
+    """
+    Returns (marketIndex, isIdiosyncratic), if the maturity is idiosyncratic then the market index
+    is the nearest market that is past the maturity
+    """
+    require(maxMarketIndex > 0, "CG: no markets listed")
+    require(maxMarketIndex <= MAX_TRADED_MARKET_INDEX, "CG: market index bound")
+    tRef = getReferenceTime(blockTime)
+
+    for i in range(1, maxMarketIndex + 1):
+        marketMaturity = tRef + getTradedMarket(i)
+        if marketMaturity == maturity:
+            return (i, False)
+        if marketMaturity > maturity:
+            return (i, True)
+
+    raise Revert("CG: no market found")
+
+
+def getBitNumFromMaturity(blockTime, maturity):
+    """Returns (bitNum, isExact), bit numbers are one indexed relative to the UTC0 block time"""
+    blockTimeUTC0 = getTimeUTC0(blockTime)
+
+    if maturity % DAY != 0:
+        return (0, False)
+    if blockTimeUTC0 >= maturity:
+        return (0, False)
+
+    daysOffset = (maturity - blockTimeUTC0) // DAY
+    if daysOffset <= MAX_DAY_OFFSET:
+        return (daysOffset, True)
+    elif daysOffset <= MAX_WEEK_OFFSET:
+        offsetInDays = daysOffset - MAX_DAY_OFFSET + (blockTimeUTC0 % WEEK) // DAY
+        return (
+            WEEK_BIT_OFFSET + offsetInDays // DAYS_IN_WEEK,
+            offsetInDays % DAYS_IN_WEEK == 0,
+        )
+    elif daysOffset <= MAX_MONTH_OFFSET:
+        offsetInDays = daysOffset - MAX_WEEK_OFFSET + (blockTimeUTC0 % MONTH) // DAY
+        return (
+            MONTH_BIT_OFFSET + offsetInDays // DAYS_IN_MONTH,
+            offsetInDays % DAYS_IN_MONTH == 0,
+        )
+    elif daysOffset <= MAX_QUARTER_OFFSET:
+        offsetInDays = daysOffset - MAX_MONTH_OFFSET + (blockTimeUTC0 % QUARTER) // DAY
+        return (
+            QUARTER_BIT_OFFSET + offsetInDays // DAYS_IN_QUARTER,
+            offsetInDays % DAYS_IN_QUARTER == 0,
+        )
+
+    return (256, False)
+
+
+def getMaturityFromBitNum(blockTime, bitNum):
+    require(bitNum != 0, "cash group get maturity from bit num is zero")
+    require(bitNum <= 256, "cash group get maturity from bit num overflow")
+    blockTimeUTC0 = getTimeUTC0(blockTime)
+
+    if bitNum <= WEEK_BIT_OFFSET:
+        return blockTimeUTC0 + bitNum * DAY
+    elif bitNum <= MONTH_BIT_OFFSET:
+        firstBit = blockTimeUTC0 + MAX_DAY_OFFSET * DAY - (blockTimeUTC0 % WEEK)
+        return firstBit + (bitNum - WEEK_BIT_OFFSET) * WEEK
+    elif bitNum <= QUARTER_BIT_OFFSET:
+        firstBit = blockTimeUTC0 + MAX_WEEK_OFFSET * DAY - (blockTimeUTC0 % MONTH)
+        return firstBit + (bitNum - MONTH_BIT_OFFSET) * MONTH
+    else:
+        firstBit = blockTimeUTC0 + MAX_MONTH_OFFSET * DAY - (blockTimeUTC0 % QUARTER)
+        return firstBit + (bitNum - QUARTER_BIT_OFFSET) * QUARTER
@@ -0,0 +1,49 @@
+"""
+Port of contracts/internal/valuation/ExchangeRate.sol
+"""
+from typing import NamedTuple
+
+from scripts.offchain.constants import ETH_CURRENCY_ID, ETH_DECIMALS, PERCENTAGE_DECIMALS
+from scripts.offchain.safe_math import div, require
+
+
+class ETHRate(NamedTuple):
+    rateDecimals: int
+    rate: int
+    buffer: int
+    haircut: int
+    liquidationDiscount: int
+
+    @classmethod
+    def fromParameters(cls, ethRate):
+        """Builds from the ETHRate tuple returned by getCurrencyAndRates"""
+        return cls(*[int(v) for v in ethRate])
+
+    @classmethod
+    def fromOracle(
+        cls, currencyId, answer, rateDecimalPlaces, mustInvert, buffer, haircut, discount
+    ):
+        """Mirrors buildExchangeRate given a raw oracle answer and the stored rate settings"""
+        if currencyId == ETH_CURRENCY_ID:
+            return cls(ETH_DECIMALS, ETH_DECIMALS, buffer, haircut, discount)
+
+        rate = int(answer)
+        require(rate > 0, "Invalid rate")
+        rateDecimals = 10 ** rateDecimalPlaces
+        if mustInvert:
+            rate = div(rateDecimals * rateDecimals, rate)
+        return cls(rateDecimals, rate, buffer, haircut, discount)
+
+    def convertToETH(self, balance):
+        """Buffers and haircuts are always applied"""
+        multiplier = self.haircut if balance > 0 else self.buffer
+        return div(div(balance * self.rate * multiplier, PERCENTAGE_DECIMALS), self.rateDecimals)
+
+    def convertETHTo(self, balance):
+        """Buffers and haircuts are not applied"""
+        return div(balance * self.rateDecimals, self.rate)
+
+
+def exchangeRate(baseER, quoteER):
+    """Exchange rate between two currencies via ETH in base rate decimals"""
+    return div(baseER.rate * quoteER.rateDecimals, quoteER.rate)
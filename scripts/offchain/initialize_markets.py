@@ -0,0 +1,357 @@
+"""
+Port of contracts/external/actions/InitializeMarketsAction.sol. The nToken portfolio is settled,
+cash is withheld against negative idiosyncratic fCash and new markets are set from the previous
+oracle rates and the governance parameters, reproducing the integer rounding of the contract.
+
+Storage is replaced by an NTokenState which holds the nToken cash balance, its liquidity tokens,
+its ifCash bitmap (as a dict of maturity to notional) and the markets that its liquidity tokens
+are held in. `initializeMarkets` returns the next NTokenState so successive quarters can be rolled
+forward without a chain.
+"""
+from typing import Dict, NamedTuple, Tuple
+
+from scripts.offchain import abdk_math as ABDK
+from scripts.offchain.asset_handler import getPresentfCashValue
+from scripts.offchain.cash_group import interpolateOracleRate
+from scripts.offchain.constants import (
+    DEPOSIT_PERCENT_BASIS,
+    MIN_LIQUIDITY_TOKEN_INDEX,
+    QUARTER,
+    RATE_PRECISION,
+    RATE_PRECISION_64x64,
+    TEN_BASIS_POINTS,
+)
+from scripts.offchain.date_time import (
+    getMarketIndex,
+    getReferenceTime,
+    getTimeUTC0,
+    getTradedMarket,
+    isValidMarketMaturity,
+)
+from scripts.offchain.market import (
+    Market,
+    getExchangeRateFromImpliedRate,
+    getImpliedRate,
+    updateRateOracle,
+)
+from scripts.offchain.safe_math import div, mulInRatePrecision, require, subNoNeg
+
+
+class GovernanceParameters(NamedTuple):
+    depositShares: Tuple[int, ...]
+    leverageThresholds: Tuple[int, ...]
+    annualizedAnchorRates: Tuple[int, ...]
+    proportions: Tuple[int, ...]
+
+    @classmethod
+    def fromParameters(cls, depositParameters, initializationParameters):
+        """Builds from the results of getDepositParameters and getInitializationParameters"""
+        (depositShares, leverageThresholds) = depositParameters
+        (annualizedAnchorRates, proportions) = initializationParameters
+        return cls(
+            tuple(int(v) for v in depositShares),
+            tuple(int(v) for v in leverageThresholds),
+            tuple(int(v) for v in annualizedAnchorRates),
+            tuple(int(v) for v in proportions),
+        )
+
+    @classmethod
+    def fromConfig(cls, nTokenConfig):
+        """Builds from an nToken config in scripts/config.py, i.e. nTokenDefaults"""
+        return cls.fromParameters(nTokenConfig["Deposit"], nTokenConfig["Initialization"])
+
+
+class NTokenState(NamedTuple):
+    cashBalance: int
+    lastInitializedTime: int
+    # nToken parameter byte CASH_WITHHOLDING_BUFFER, in 10 basis point increments
+    cashWithholdingBuffer10BPS: int
+    # Sorted tuple of (maturity, assetType, tokens)
+    liquidityTokens: Tuple[Tuple[int, int, int], ...] = ()
+    # Net fCash held in the nToken bitmap by maturity
+    ifCash: Dict[int, int] = {}
+    # Markets that the liquidity tokens are held in, by maturity
+    markets: Dict[int, Market] = {}
+
+    @classmethod
+    def initial(cls, cashBalance, cashWithholdingBuffer10BPS):
+        """nToken state before the first initialization, holding only deposited cash"""
+        return cls(cashBalance, 0, cashWithholdingBuffer10BPS)
+
+
+class InitializeMarketsResult(NamedTuple):
+    # State of the nToken after markets are initialized
+    nToken: NTokenState
+    # Asset cash deposited into the new markets
+    netAssetCashAvailable: int
+    # Asset cash withheld on the nToken against negative ifCash
+    assetCashWithholding: int
+
+
+def _settleNTokenPortfolio(nToken, blockTime, settlementRates, assetRate):
+    referenceTime = getReferenceTime(blockTime)
+    require(nToken.lastInitializedTime < referenceTime, "IM: invalid time")
+
+    cashBalance = nToken.cashBalance
+    ifCash = dict(nToken.ifCash)
+    for (maturity, _, tokens) in nToken.liquidityTokens:
+        # Liquidity is removed from a copy, the previous markets keep their oracle rates
+        (assetCash, fCash) = nToken.markets[maturity].copy().removeLiquidity(tokens)
+        if maturity > blockTime:
+            ifCash[maturity] = ifCash.get(maturity, 0) + fCash
+        else:
+            settlementRate = settlementRates.get(maturity, assetRate)
+            assetCash += settlementRate.convertFromUnderlying(fCash)
+        cashBalance += assetCash
+
+    # Settles the bitmap up to and including the new settlement time
+    lastInitializedTime = getTimeUTC0(blockTime)
+    for maturity in sorted(m for m in ifCash if m <= lastInitializedTime):
+        settlementRate = settlementRates.get(maturity, assetRate)
+        cashBalance += settlementRate.convertFromUnderlying(ifCash.pop(maturity))
+
+    return (cashBalance, lastInitializedTime, ifCash)
+
+
+def _getPreviousMarkets(nToken, cashGroup, blockTime):
+    rateOracleTimeWindow = cashGroup.getRateOracleTimeWindow()
+    previousMarkets = [Market(0, 0, 0, 0, 0, 0, 0) for _ in range(cashGroup.maxMarketIndex)]
+
+    # The three month market has settled and is not used
+    for (i, (maturity, _, _)) in enumerate(nToken.liquidityTokens):
+        if i == 0:
+            continue
+        market = nToken.markets[maturity].copy()
+        market.updateRateOracle(rateOracleTimeWindow, blockTime)
+        previousMarkets[i] = market
+
+    return previousMarkets
+
+
+def _getPreviousOracleRate(nToken, cashGroup, maturity, blockTime):
+    """Mirrors Market.getOracleRate against the markets of the previous quarter"""
+    market = nToken.markets.get(maturity)
+    require(market is not None and market.oracleRate > 0, "Market not initialized")
+    return updateRateOracle(
+        market.previousTradeTime,
+        market.lastImpliedRate,
+        market.oracleRate,
+        cashGroup.getRateOracleTimeWindow(),
+        blockTime,
+    )
+
+
+def _calculatePreviousOracleRate(nToken, cashGroup, maturity, blockTime):
+    """Mirrors CashGroup.calculateOracleRate where blockTime is in the previous quarter"""
+    (marketIndex, idiosyncratic) = getMarketIndex(cashGroup.maxMarketIndex, maturity, blockTime)
+    if not idiosyncratic:
+        return _getPreviousOracleRate(nToken, cashGroup, maturity, blockTime)
+
+    referenceTime = getReferenceTime(blockTime)
+    longMaturity = referenceTime + getTradedMarket(marketIndex)
+    longRate = _getPreviousOracleRate(nToken, cashGroup, longMaturity, blockTime)
+    # Idiosyncratic nToken fCash always lies past the previous three month market so the asset
+    # supply rate is never interpolated against here
+    require(marketIndex > 1, "IM: fCash before first market")
+    shortMaturity = referenceTime + getTradedMarket(marketIndex - 1)
+    shortRate = _getPreviousOracleRate(nToken, cashGroup, shortMaturity, blockTime)
+
+    return interpolateOracleRate(shortMaturity, longMaturity, shortRate, longRate, maturity)
+
+
+def getNTokenNegativefCashWithholding(nToken, cashGroup, ifCash, blockTime):
+    """
+    Asset cash withheld against negative idiosyncratic fCash during initialize markets. Oracle
+    rates are read from the previous quarter's markets in `nToken.markets`.
+    """
+    oracleRateBuffer = nToken.cashWithholdingBuffer10BPS * TEN_BASIS_POINTS
+    oracleRateBlockTime = blockTime - QUARTER
+
+    totalCashWithholding = 0
+    for maturity in sorted(ifCash):
+        notional = ifCash[maturity]
+        if notional >= 0 or isValidMarketMaturity(cashGroup.maxMarketIndex, maturity, blockTime):
+            continue
+
+        oracleRate = _calculatePreviousOracleRate(nToken, cashGroup, maturity, oracleRateBlockTime)
+        oracleRate = 0 if oracleRateBuffer > oracleRate else oracleRate - oracleRateBuffer
+        totalCashWithholding -= getPresentfCashValue(notional, maturity, blockTime, oracleRate)
+
+    return cashGroup.assetRate.convertFromUnderlying(totalCashWithholding)
+
+
+def getSixMonthImpliedRate(previousMarkets, referenceTime):
+    require(len(previousMarkets) >= 3, "IM: six month error")
+    return interpolateOracleRate(
+        previousMarkets[1].maturity,
+        previousMarkets[2].maturity,
+        previousMarkets[1].oracleRate,
+        previousMarkets[2].oracleRate,
+        referenceTime + 2 * QUARTER,
+    )
+
+
+def getProportionFromOracleRate(oracleRate, timeToMaturity, rateScalar, annualizedAnchorRate):
+    rateAnchor = getExchangeRateFromImpliedRate(annualizedAnchorRate, timeToMaturity)
+    exchangeRate = getExchangeRateFromImpliedRate(oracleRate, timeToMaturity)
+
+    expValue = ABDK.fromInt(mulInRatePrecision(exchangeRate - rateAnchor, rateScalar))
+    expValue = ABDK.div(expValue, RATE_PRECISION_64x64)
+    expValue = ABDK.exp(expValue)
+    proportion = ABDK.div(expValue, ABDK.add(expValue, 2 ** 64))
+    proportion = ABDK.mul(proportion, RATE_PRECISION_64x64)
+    return ABDK.toInt(proportion)
+
+
+def calculateOracleRate(
+    fCashAmount, underlyingCashToMarket, rateScalar, annualizedAnchorRate, timeToMaturity
+):
+    rateAnchor = getExchangeRateFromImpliedRate(annualizedAnchorRate, timeToMaturity)
+    return getImpliedRate(
+        fCashAmount, underlyingCashToMarket, rateScalar, rateAnchor, timeToMaturity
+    )
+
+
+def interpolateFutureRate(shortMaturity, shortRate, longMarket):
+    longMaturity = longMarket.maturity
+    longRate = longMarket.oracleRate
+    newMaturity = longMarket.maturity + QUARTER
+    require(shortMaturity < longMaturity, "IM: interpolation error")
+
+    if longRate >= shortRate:
+        return (longRate - shortRate) * (newMaturity - shortMaturity) // (
+            longMaturity - shortMaturity
+        ) + shortRate
+    else:
+        diff = (
+            (shortRate - longRate) * (newMaturity - shortMaturity) // (longMaturity - shortMaturity)
+        )
+        # Zero oracle rates mean uninitialized markets so interpolation is floored at one
+        return shortRate - diff if shortRate > diff else 1
+
+
+def calculatefCashAmountFromProportion(underlyingCashToMarket, proportion):
+    return div(underlyingCashToMarket * proportion, RATE_PRECISION - proportion)
+
+
+def initializeMarkets(
+    nToken, cashGroup, parameters, blockTime, isFirstInit=False, settlementRates=None
+):
+    """
+    Returns an InitializeMarketsResult. `settlementRates` is an optional dict of maturity to the
+    AssetRate that matured fCash settles at, by default fCash settles at the cash group asset
+    rate just like the first settlement of a maturity does on chain.
+    """
+    maxMarketIndex = cashGroup.maxMarketIndex
+    require(maxMarketIndex != 0, "IM: no markets to init")
+    for values in parameters:
+        require(len(values) >= maxMarketIndex, "IM: invalid parameters length")
+    if isFirstInit:
+        require(len(nToken.liquidityTokens) == 0, "IM: not first init")
+
+    assetRate = cashGroup.assetRate
+    previousMarkets = [Market(0, 0, 0, 0, 0, 0, 0) for _ in range(maxMarketIndex)]
+    assetCashWithholding = 0
+    if isFirstInit:
+        cashBalance = nToken.cashBalance
+        lastInitializedTime = getTimeUTC0(blockTime)
+        ifCash = dict(nToken.ifCash)
+    else:
+        (cashBalance, lastInitializedTime, ifCash) = _settleNTokenPortfolio(
+            nToken, blockTime, settlementRates or {}, assetRate
+        )
+        previousMarkets = _getPreviousMarkets(nToken, cashGroup, blockTime)
+        ifCash = {m: n for (m, n) in ifCash.items() if n != 0}
+        assetCashWithholding = getNTokenNegativefCashWithholding(
+            nToken, cashGroup, ifCash, blockTime
+        )
+
+    netAssetCashAvailable = subNoNeg(cashBalance, assetCashWithholding)
+    require(netAssetCashAvailable > DEPOSIT_PERCENT_BASIS, "IM: insufficient cash")
+
+    referenceTime = getReferenceTime(blockTime)
+    previousAssetCount = len(nToken.liquidityTokens)
+    liquidityTokens = []
+    markets = {}
+    # Like the contract, the new market struct and the oracle rate are carried between loops
+    previousTradeTime = 0
+    oracleRate = 0
+    for i in range(maxMarketIndex):
+        maturity = referenceTime + getTradedMarket(i + 1)
+        assetCashToMarket = div(
+            netAssetCashAvailable * parameters.depositShares[i], DEPOSIT_PERCENT_BASIS
+        )
+        liquidityTokens.append((maturity, MIN_LIQUIDITY_TOKEN_INDEX + i, assetCashToMarket))
+        underlyingCashToMarket = assetRate.convertToUnderlying(assetCashToMarket)
+
+        timeToMaturity = maturity - blockTime
+        rateScalar = cashGroup.getRateScalar(i + 1, timeToMaturity)
+        annualizedAnchorRate = parameters.annualizedAnchorRates[i]
+
+        if (
+            isFirstInit
+            or (i == 1 and len(previousMarkets) == 2)
+            or i >= previousAssetCount
+            or (i == 1 and previousMarkets[2].oracleRate == 0)
+        ):
+            totalfCash = calculatefCashAmountFromProportion(
+                underlyingCashToMarket, parameters.proportions[i]
+            )
+            newOracleRate = calculateOracleRate(
+                totalfCash, underlyingCashToMarket, rateScalar, annualizedAnchorRate, timeToMaturity
+            )
+            require(newOracleRate > 0, "IM: implied rate failed")
+        else:
+            if i == 0:
+                oracleRate = previousMarkets[1].oracleRate
+            elif i == 1:
+                oracleRate = getSixMonthImpliedRate(previousMarkets, referenceTime)
+            else:
+                shortMarketMaturity = referenceTime + getTradedMarket(i)
+                oracleRate = interpolateFutureRate(
+                    shortMarketMaturity, oracleRate, previousMarkets[i]
+                )
+
+            proportion = getProportionFromOracleRate(
+                oracleRate, timeToMaturity, rateScalar, annualizedAnchorRate
+            )
+            if proportion > parameters.leverageThresholds[i]:
+                proportion = parameters.leverageThresholds[i]
+                totalfCash = calculatefCashAmountFromProportion(underlyingCashToMarket, proportion)
+                oracleRate = calculateOracleRate(
+                    totalfCash,
+                    underlyingCashToMarket,
+                    rateScalar,
+                    annualizedAnchorRate,
+                    timeToMaturity,
+                )
+                require(oracleRate != 0, "Oracle rate overflow")
+            else:
+                totalfCash = calculatefCashAmountFromProportion(underlyingCashToMarket, proportion)
+
+            totalfCash = max(totalfCash, 1)
+            newOracleRate = oracleRate
+            previousTradeTime = blockTime
+
+        markets[maturity] = Market(
+            maturity,
+            totalfCash,
+            assetCashToMarket,
+            assetCashToMarket,
+            newOracleRate,
+            newOracleRate,
+            previousTradeTime,
+        )
+        ifCash[maturity] = ifCash.get(maturity, 0) - totalfCash
+
+    return InitializeMarketsResult(
+        nToken._replace(
+            cashBalance=assetCashWithholding,
+            lastInitializedTime=lastInitializedTime,
+            liquidityTokens=tuple(liquidityTokens),
+            ifCash={m: n for (m, n) in ifCash.items() if n != 0},
+            markets=markets,
+        ),
+        netAssetCashAvailable,
+        assetCashWithholding,
+    )
@@ -0,0 +1,328 @@
+"""
+Port of the liquidity curve in contracts/internal/markets/Market.sol. Every method reproduces the
+integer rounding of the contract so that results can be compared exactly with the on chain views.
+"""
+from scripts.offchain import abdk_math as ABDK
+from scripts.offchain.constants import (
+    IMPLIED_RATE_TIME,
+    INTERNAL_TOKEN_PRECISION,
+    LOG_RATE_PRECISION_64x64,
+    MAX_MARKET_PROPORTION,
+    PERCENTAGE_DECIMALS,
+    RATE_PRECISION,
+    RATE_PRECISION_64x64,
+)
+from scripts.offchain.safe_math import (
+    Revert,
+    div,
+    divInRatePrecision,
+    mulInRatePrecision,
+    require,
+    subNoNeg,
+)
+
+UINT32_MAX = 2 ** 32 - 1
+
+
+class Market:
+    def __init__(
+        self,
+        maturity,
+        totalfCash,
+        totalAssetCash,
+        totalLiquidity,
+        lastImpliedRate,
+        oracleRate,
+        previousTradeTime,
+    ):
+        self.maturity = maturity
+        self.totalfCash = totalfCash
+        self.totalAssetCash = totalAssetCash
+        self.totalLiquidity = totalLiquidity
+        self.lastImpliedRate = lastImpliedRate
+        self.oracleRate = oracleRate
+        self.previousTradeTime = previousTradeTime
+
+    @classmethod
+    def fromParameters(cls, market):
+        """Builds from a MarketParameters tuple as returned by getActiveMarkets"""
+        return cls(*(int(v) for v in market[1:8]))
+
+    def copy(self):
+        return Market(
+            self.maturity,
+            self.totalfCash,
+            self.totalAssetCash,
+            self.totalLiquidity,
+            self.lastImpliedRate,
+            self.oracleRate,
+            self.previousTradeTime,
+        )
+
+    def __repr__(self):
+        return "Market({})".format(", ".join("{}={}".format(k, v) for (k, v) in vars(self).items()))
+
+    def addLiquidity(self, assetCash):
+        require(self.totalLiquidity > 0, "M: zero liquidity")
+        if assetCash == 0:
+            return (0, 0)
+        require(assetCash > 0, "negative asset cash")
+
+        liquidityTokens = div(self.totalLiquidity * assetCash, self.totalAssetCash)
+        fCash = div(self.totalfCash * assetCash, self.totalAssetCash)
+
+        self.totalLiquidity += liquidityTokens
+        self.totalfCash += fCash
+        self.totalAssetCash += assetCash
+        return (liquidityTokens, -fCash)
+
+    def removeLiquidity(self, tokensToRemove):
+        if tokensToRemove == 0:
+            return (0, 0)
+        require(tokensToRemove > 0, "negative tokens to remove")
+
+        assetCash = div(self.totalAssetCash * tokensToRemove, self.totalLiquidity)
+        fCash = div(self.totalfCash * tokensToRemove, self.totalLiquidity)
+
+        self.totalLiquidity = subNoNeg(self.totalLiquidity, tokensToRemove)
+        self.totalfCash = subNoNeg(self.totalfCash, fCash)
+        self.totalAssetCash = subNoNeg(self.totalAssetCash, assetCash)
+        return (assetCash, fCash)
+
+    def calculateTrade(
+        self, cashGroup, fCashToAccount, timeToMaturity, marketIndex, blockTime=None
+    ):
+        """
+        Returns (netAssetCash, netAssetCashToReserve) and updates the market state in place. Like
+        the contract, a failed trade returns (0, 0) rather than raising.
+        """
+        if self.totalfCash <= fCashToAccount:
+            return (0, 0)
+
+        (rateScalar, totalCashUnderlying, rateAnchor) = self.getExchangeRateFactors(
+            cashGroup, timeToMaturity, marketIndex
+        )
+
+        (preFeeExchangeRate, success) = _getExchangeRate(
+            self.totalfCash, totalCashUnderlying, rateScalar, rateAnchor, fCashToAccount
+        )
+        if not success:
+            return (0, 0)
+
+        (netCashToAccount, netCashToMarket, netCashToReserve) = _getNetCashAmountsUnderlying(
+            cashGroup, preFeeExchangeRate, fCashToAccount, timeToMaturity
+        )
+        if netCashToAccount == 0:
+            return (0, 0)
+
+        self.totalfCash = subNoNeg(self.totalfCash, fCashToAccount)
+        self.lastImpliedRate = getImpliedRate(
+            self.totalfCash,
+            totalCashUnderlying + netCashToMarket,
+            rateScalar,
+            rateAnchor,
+            timeToMaturity,
+        )
+        if self.lastImpliedRate == 0:
+            return (0, 0)
+
+        assetRate = cashGroup.assetRate
+        self.totalAssetCash += assetRate.convertFromUnderlying(netCashToMarket)
+        if blockTime is not None:
+            self.previousTradeTime = blockTime
+
+        return (
+            assetRate.convertFromUnderlying(netCashToAccount),
+            assetRate.convertFromUnderlying(netCashToReserve),
+        )
+
+    def getExchangeRateFactors(self, cashGroup, timeToMaturity, marketIndex):
+        """Returns (rateScalar, totalCashUnderlying, rateAnchor), all zeros on failure"""
+        rateScalar = cashGroup.getRateScalar(marketIndex, timeToMaturity)
+        totalCashUnderlying = cashGroup.assetRate.convertToUnderlying(self.totalAssetCash)
+
+        if self.totalfCash == 0 or totalCashUnderlying == 0:
+            return (0, 0, 0)
+
+        (rateAnchor, success) = _getRateAnchor(
+            self.totalfCash, self.lastImpliedRate, totalCashUnderlying, rateScalar, timeToMaturity
+        )
+        if not success:
+            return (0, 0, 0)
+
+        return (rateScalar, totalCashUnderlying, rateAnchor)
+
+    def updateRateOracle(self, rateOracleTimeWindow, blockTime):
+        self.oracleRate = updateRateOracle(
+            self.previousTradeTime,
+            self.lastImpliedRate,
+            self.oracleRate,
+            rateOracleTimeWindow,
+            blockTime,
+        )
+        return self.oracleRate
+
+
+def _getNetCashAmountsUnderlying(cashGroup, preFeeExchangeRate, fCashToAccount, timeToMaturity):
+    preFeeCashToAccount = -divInRatePrecision(fCashToAccount, preFeeExchangeRate)
+    fee = getExchangeRateFromImpliedRate(cashGroup.getTotalFee(), timeToMaturity)
+
+    if fCashToAccount > 0:
+        # Lending
+        postFeeExchangeRate = divInRatePrecision(preFeeExchangeRate, fee)
+        if postFeeExchangeRate < RATE_PRECISION:
+            return (0, 0, 0)
+
+        fee = mulInRatePrecision(preFeeCashToAccount, RATE_PRECISION - fee)
+    else:
+        # Borrowing
+        fee = -div(preFeeCashToAccount * (RATE_PRECISION - fee), fee)
+
+    cashToReserve = div(fee * cashGroup.getReserveFeeShare(), PERCENTAGE_DECIMALS)
+
+    return (
+        preFeeCashToAccount - fee,
+        -(preFeeCashToAccount - fee + cashToReserve),
+        cashToReserve,
+    )
+
+
+def _getRateAnchor(totalfCash, lastImpliedRate, totalCashUnderlying, rateScalar, timeToMaturity):
+    newExchangeRate = getExchangeRateFromImpliedRate(lastImpliedRate, timeToMaturity)
+    if newExchangeRate < RATE_PRECISION:
+        return (0, False)
+
+    proportion = divInRatePrecision(totalfCash, totalfCash + totalCashUnderlying)
+    (lnProportion, success) = _logProportion(proportion)
+    if not success:
+        return (0, False)
+
+    return (newExchangeRate - divInRatePrecision(lnProportion, rateScalar), True)
+
+
+def getImpliedRate(totalfCash, totalCashUnderlying, rateScalar, rateAnchor, timeToMaturity):
+    (exchangeRate, success) = _getExchangeRate(
+        totalfCash, totalCashUnderlying, rateScalar, rateAnchor, 0
+    )
+    if not success:
+        return 0
+
+    rateScaled = ABDK.div(ABDK.fromInt(exchangeRate), RATE_PRECISION_64x64)
+    lnRateScaled = ABDK.ln(rateScaled)
+    lnRate = ABDK.toUInt(ABDK.mul(lnRateScaled, RATE_PRECISION_64x64))
+
+    impliedRate = lnRate * IMPLIED_RATE_TIME // timeToMaturity
+    if impliedRate > UINT32_MAX:
+        return 0
+
+    return impliedRate
+
+
+def getExchangeRateFromImpliedRate(impliedRate, timeToMaturity):
+    expValue = ABDK.fromUInt(impliedRate * timeToMaturity // IMPLIED_RATE_TIME)
+    expValueScaled = ABDK.div(expValue, RATE_PRECISION_64x64)
+    expResult = ABDK.exp(expValueScaled)
+    return ABDK.toInt(ABDK.mul(expResult, RATE_PRECISION_64x64))
+
+
+def _getExchangeRate(totalfCash, totalCashUnderlying, rateScalar, rateAnchor, fCashToAccount):
+    numerator = subNoNeg(totalfCash, fCashToAccount)
+    proportion = divInRatePrecision(numerator, totalfCash + totalCashUnderlying)
+
+    if proportion > MAX_MARKET_PROPORTION:
+        return (0, False)
+
+    (lnProportion, success) = _logProportion(proportion)
+    if not success:
+        return (0, False)
+
+    rate = divInRatePrecision(lnProportion, rateScalar) + rateAnchor
+    if rate < RATE_PRECISION:
+        return (0, False)
+
+    return (rate, True)
+
+
+def _logProportion(proportion):
+    if proportion == RATE_PRECISION:
+        return (0, False)
+
+    logitP = divInRatePrecision(proportion, RATE_PRECISION - proportion)
+    abdkProportion = ABDK.fromInt(logitP)
+    if abdkProportion <= 0:
+        return (0, False)
+
+    result = ABDK.toInt(
+        ABDK.mul(ABDK.sub(ABDK.ln(abdkProportion), LOG_RATE_PRECISION_64x64), RATE_PRECISION_64x64)
+    )
+    return (result, True)
+
+
+def updateRateOracle(
+    previousTradeTime, lastImpliedRate, oracleRate, rateOracleTimeWindow, blockTime
+):
+    require(rateOracleTimeWindow > 0, "update rate oracle, time window zero")
+
+    if previousTradeTime > blockTime:
+        return lastImpliedRate
+
+    timeDiff = blockTime - previousTradeTime
+    if timeDiff > rateOracleTimeWindow:
+        return lastImpliedRate
+
+    lastTradeWeight = timeDiff * RATE_PRECISION // rateOracleTimeWindow
+    oracleWeight = RATE_PRECISION - lastTradeWeight
+    return (lastImpliedRate * lastTradeWeight + oracleRate * oracleWeight) // RATE_PRECISION
+
+
+def getfCashGivenCashAmount(
+    totalfCash, netCashToAccount, totalCashUnderlying, rateScalar, rateAnchor, feeRate, maxDelta
+):
+    """Newton's method solver from Market.getfCashGivenCashAmount, limited to 250 iterations"""
+    require(maxDelta >= 0)
+    fCashChangeToAccountGuess = -mulInRatePrecision(netCashToAccount, rateAnchor)
+    for _ in range(250):
+        (exchangeRate, success) = _getExchangeRate(
+            totalfCash, totalCashUnderlying, rateScalar, rateAnchor, fCashChangeToAccountGuess
+        )
+        require(success, "invalid exchange rate")
+
+        delta = _calculateDelta(
+            netCashToAccount,
+            totalfCash,
+            totalCashUnderlying,
+            rateScalar,
+            fCashChangeToAccountGuess,
+            exchangeRate,
+            feeRate,
+        )
+
+        if abs(delta) <= maxDelta:
+            return fCashChangeToAccountGuess
+        fCashChangeToAccountGuess -= delta
+
+    raise Revert("No convergence")
+
+
+def _calculateDelta(
+    cashAmount, totalfCash, totalCashUnderlying, rateScalar, fCashGuess, exchangeRate, feeRate
+):
+    denominator = mulInRatePrecision(
+        rateScalar, (totalfCash - fCashGuess) * (totalCashUnderlying + fCashGuess)
+    )
+
+    if fCashGuess > 0:
+        # Lending
+        exchangeRate = divInRatePrecision(exchangeRate, feeRate)
+        require(exchangeRate >= RATE_PRECISION, "rate underflow")
+        derivative = divInRatePrecision(cashAmount * (totalfCash + totalCashUnderlying), feeRate)
+    else:
+        # Borrowing
+        exchangeRate = mulInRatePrecision(exchangeRate, feeRate)
+        require(exchangeRate >= RATE_PRECISION, "rate underflow")
+        derivative = mulInRatePrecision(cashAmount, feeRate * (totalfCash + totalCashUnderlying))
+
+    derivative = INTERNAL_TOKEN_PRECISION - div(derivative, denominator)
+
+    numerator = mulInRatePrecision(cashAmount, exchangeRate) + fCashGuess
+    return div(numerator * INTERNAL_TOKEN_PRECISION, derivative)
@@ -0,0 +1,35 @@
+"""
+Integer helpers that reproduce the rounding of contracts/math/SafeInt256.sol. Solidity division
+truncates towards zero whereas Python's floor division rounds towards negative infinity, so every
+port of contract math must divide using `div` below.
+"""
+from scripts.offchain.constants import RATE_PRECISION
+
+
+class Revert(Exception):
+    """Raised wherever the corresponding contract code would revert"""
+
+
+def require(condition, message="revert"):
+    if not condition:
+        raise Revert(message)
+
+
+def div(x, y):
+    require(y != 0, "division by zero")
+    q = abs(x) // abs(y)
+    return q if (x < 0) == (y < 0) else -q
+
+
+def subNoNeg(x, y):
+    z = x - y
+    require(z >= 0, "int256 sub to negative")
+    return z
+
+
+def mulInRatePrecision(x, y):
+    return div(x * y, RATE_PRECISION)
+
+
+def divInRatePrecision(x, y):
+    return div(x * RATE_PRECISION, y)
@@ -0,0 +1,53 @@
+"""
+Port of the pure precision conversions in contracts/internal/balances/TokenHandler.sol
+"""
+from typing import NamedTuple
+
+from scripts.offchain.constants import INTERNAL_TOKEN_PRECISION
+from scripts.offchain.safe_math import div
+
+# Mirrors the TokenType enum in Types.sol
+TOKEN_TYPE = {
+    "UnderlyingToken": 0,
+    "cToken": 1,
+    "cETH": 2,
+    "Ether": 3,
+    "NonMintable": 4,
+    "aToken": 5,
+}
+
+
+class Token(NamedTuple):
+    tokenAddress: str
+    hasTransferFee: bool
+    decimals: int
+    tokenType: int
+    maxCollateralBalance: int
+
+    @classmethod
+    def fromParameters(cls, token):
+        """Builds from a Token tuple returned by getCurrency"""
+        (tokenAddress, hasTransferFee, decimals, tokenType, maxCollateralBalance) = token
+        return cls(
+            str(tokenAddress),
+            bool(hasTransferFee),
+            int(decimals),
+            int(tokenType),
+            int(maxCollateralBalance),
+        )
+
+    def convertToInternal(self, amount):
+        if self.decimals == INTERNAL_TOKEN_PRECISION:
+            return amount
+        return div(amount * INTERNAL_TOKEN_PRECISION, self.decimals)
+
+    def convertToExternal(self, amount):
+        if self.decimals == INTERNAL_TOKEN_PRECISION:
+            return amount
+        return div(amount * self.decimals, INTERNAL_TOKEN_PRECISION)
+
+    def convertToUnderlyingExternalWithAdjustment(self, underlyingInternalAmount):
+        if self.decimals < INTERNAL_TOKEN_PRECISION:
+            return self.convertToExternal(underlyingInternalAmount) + 1
+        else:
+            return self.convertToExternal(underlyingInternalAmount + 1)
@@ -0,0 +1,330 @@
+"""
+Vectorized simulation of market oracle rates over many trade paths.
+
+Trades are replayed against a single market with a float64 version of the liquidity curve in
+Market.sol, every path is one row of the (paths, trades) input arrays and all paths advance one
+trade at a time. The resulting implied rates are rounded to RATE_PRECISION integers and the oracle
+rate recurrence in Market._updateRateOracle is then applied exactly, in integer arithmetic, for
+every rate oracle time window at once.
+
+As in the contract, the oracle rate is moved forward when a market is loaded for a trade, so a
+trade at time t stores updateRateOracle(previousTradeTime, lastImpliedRate, oracleRate, t) along
+with its own implied rate. Failed trades (i.e. past the max market proportion or lending at a
+negative rate) revert on chain, they leave the market untouched.
+"""
+import json
+from typing import NamedTuple
+
+import numpy as np
+from brownie import chain, network
+from scripts.config import CurrencyDefaults
+from scripts.environment_v2 import EnvironmentV2
+from scripts.offchain.cash_group import CashGroup
+from scripts.offchain.constants import (
+    FIVE_MINUTES,
+    IMPLIED_RATE_TIME,
+    MAX_MARKET_PROPORTION,
+    PERCENTAGE_DECIMALS,
+    RATE_PRECISION,
+)
+from scripts.offchain.market import Market
+
+UINT32_MAX = 2 ** 32 - 1
+
+
+class MarketState(NamedTuple):
+    """Market state with the cash balance in underlying, rates in RATE_PRECISION"""
+
+    maturity: int
+    totalfCash: float
+    totalCashUnderlying: float
+    lastImpliedRate: int
+    oracleRate: int
+    previousTradeTime: int
+
+    @classmethod
+    def fromMarket(cls, market, assetRate):
+        """Builds from an offchain Market and the AssetRate of its cash group"""
+        return cls(
+            market.maturity,
+            float(market.totalfCash),
+            float(assetRate.convertToUnderlying(market.totalAssetCash)),
+            market.lastImpliedRate,
+            market.oracleRate,
+            market.previousTradeTime,
+        )
+
+
+class CurveParameters(NamedTuple):
+    rateScalar: int
+    totalFee: int
+    reserveFeeShare: int
+
+    @classmethod
+    def fromCashGroup(cls, cashGroup, marketIndex):
+        return cls(
+            cashGroup.rateScalars[marketIndex - 1],
+            cashGroup.getTotalFee(),
+            cashGroup.getReserveFeeShare(),
+        )
+
+
+class TradePaths(NamedTuple):
+    # Trade times and fCash to account, shape (paths, trades)
+    times: np.ndarray
+    fCash: np.ndarray
+    # False where the trade would revert
+    success: np.ndarray
+    # Implied rate stored after each trade in RATE_PRECISION, the previous one if it failed
+    impliedRates: np.ndarray
+    # Underlying cash to the account, negative when lending
+    netCashToAccount: np.ndarray
+
+
+def _log_proportion(totalfCash, totalCash):
+    proportion = totalfCash / (totalfCash + totalCash)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (np.log(proportion / (1 - proportion)), proportion)
+
+
+def simulate_trades(state, curve, times, fCash):
+    """
+    Replays trades of `fCash` (positive to lend, negative to borrow) at `times` against the
+    market in every path. Both arrays have shape (paths, trades), trade times must be increasing
+    along each path and before maturity.
+    """
+    times = np.atleast_2d(np.asarray(times, dtype=np.int64))
+    fCash = np.atleast_2d(np.asarray(fCash, dtype=np.float64))
+    if times.shape != fCash.shape:
+        raise Exception("Trade times and amounts must have the same shape")
+    (paths, trades) = times.shape
+
+    totalfCash = np.full(paths, state.totalfCash)
+    totalCash = np.full(paths, state.totalCashUnderlying)
+    lastImpliedRate = np.full(paths, state.lastImpliedRate, dtype=np.int64)
+
+    success = np.zeros((paths, trades), dtype=bool)
+    impliedRates = np.zeros((paths, trades), dtype=np.int64)
+    netCashToAccount = np.zeros((paths, trades))
+    maxProportion = MAX_MARKET_PROPORTION / RATE_PRECISION
+    fee = curve.totalFee / RATE_PRECISION
+    reserveShare = curve.reserveFeeShare / PERCENTAGE_DECIMALS
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        for i in range(trades):
+            (t, f) = (times[:, i], fCash[:, i])
+            yearFraction = (state.maturity - t) / IMPLIED_RATE_TIME
+            rateScalar = curve.rateScalar / yearFraction
+
+            (lnProportion, _) = _log_proportion(totalfCash, totalCash)
+            rateAnchor = np.exp(lastImpliedRate / RATE_PRECISION * yearFraction) - (
+                lnProportion / rateScalar
+            )
+
+            # The proportion after the trade is taken over the pre trade market size
+            proportion = (totalfCash - f) / (totalfCash + totalCash)
+            lnTraded = np.log(proportion / (1 - proportion))
+            preFeeExchangeRate = lnTraded / rateScalar + rateAnchor
+
+            feeRate = np.exp(fee * yearFraction)
+            preFeeCashToAccount = -f / preFeeExchangeRate
+            lendFee = preFeeCashToAccount * (1 - feeRate)
+            borrowFee = -preFeeCashToAccount * (1 - feeRate) / feeRate
+            tradeFee = np.where(f > 0, lendFee, borrowFee)
+            cashToReserve = tradeFee * reserveShare
+            cashToAccount = preFeeCashToAccount - tradeFee
+            cashToMarket = -(cashToAccount + cashToReserve)
+
+            newfCash = totalfCash - f
+            newCash = totalCash + cashToMarket
+            (lnNew, _) = _log_proportion(newfCash, newCash)
+            newExchangeRate = lnNew / rateScalar + rateAnchor
+            newImpliedRate = np.floor(np.log(newExchangeRate) / yearFraction * RATE_PRECISION)
+
+            ok = (
+                (f != 0)
+                & (totalfCash > f)
+                & (proportion > 0)
+                & (proportion <= maxProportion)
+                & (preFeeExchangeRate >= 1)
+                & ((f < 0) | (preFeeExchangeRate / feeRate >= 1))
+                & (newExchangeRate >= 1)
+                & (newImpliedRate > 0)
+                & (newImpliedRate <= UINT32_MAX)
+            )
+
+            totalfCash = np.where(ok, newfCash, totalfCash)
+            totalCash = np.where(ok, newCash, totalCash)
+            lastImpliedRate = np.where(ok, newImpliedRate, lastImpliedRate).astype(np.int64)
+            success[:, i] = ok
+            impliedRates[:, i] = lastImpliedRate
+            netCashToAccount[:, i] = np.where(ok, cashToAccount, 0)
+
+    return TradePaths(times, fCash, success, impliedRates, netCashToAccount)
+
+
+def update_rate_oracle(previousTradeTime, lastImpliedRate, oracleRate, window, blockTime):
+    """Market._updateRateOracle over broadcast integer arrays"""
+    timeDiff = blockTime - previousTradeTime
+    lastTradeWeight = np.clip(timeDiff, 0, window) * RATE_PRECISION // window
+    updated = (
+        lastImpliedRate * lastTradeWeight + oracleRate * (RATE_PRECISION - lastTradeWeight)
+    ) // RATE_PRECISION
+    return np.where((timeDiff < 0) | (timeDiff > window), lastImpliedRate, updated)
+
+
+def stored_oracle_rates(state, trades, windows):
+    """
+    Returns (oracleRates, previousTradeTimes, lastImpliedRates) stored after each trade. The
+    oracle rates have shape (windows, paths, trades), the others (paths, trades).
+    """
+    windows = np.asarray(windows, dtype=np.int64).reshape(-1, 1)
+    if np.any(windows <= 0):
+        raise Exception("update rate oracle, time window zero")
+    (paths, count) = trades.times.shape
+
+    oracleRate = np.full((len(windows), paths), state.oracleRate, dtype=np.int64)
+    previousTradeTime = np.full(paths, state.previousTradeTime, dtype=np.int64)
+    lastImpliedRate = np.full(paths, state.lastImpliedRate, dtype=np.int64)
+
+    oracleRates = np.zeros((len(windows), paths, count), dtype=np.int64)
+    previousTradeTimes = np.zeros((paths, count), dtype=np.int64)
+    lastImpliedRates = np.zeros((paths, count), dtype=np.int64)
+    for i in range(count):
+        ok = trades.success[:, i]
+        t = trades.times[:, i]
+        updated = update_rate_oracle(previousTradeTime, lastImpliedRate, oracleRate, windows, t)
+        oracleRate = np.where(ok, updated, oracleRate)
+        previousTradeTime = np.where(ok, t, previousTradeTime)
+        lastImpliedRate = trades.impliedRates[:, i]
+
+        oracleRates[:, :, i] = oracleRate
+        previousTradeTimes[:, i] = previousTradeTime
+        lastImpliedRates[:, i] = lastImpliedRate
+
+    return (oracleRates, previousTradeTimes, lastImpliedRates)
+
+
+def oracle_rate_paths(state, trades, windows, observeTimes):
+    """
+    Oracle rate seen by valuation (Market.getOracleRate) at each of `observeTimes` on every path
+    and for every window, shape (windows, paths, observations).
+    """
+    windows = np.asarray(windows, dtype=np.int64).reshape(-1, 1, 1)
+    observeTimes = np.asarray(observeTimes, dtype=np.int64)
+    (oracleRates, previousTradeTimes, lastImpliedRates) = stored_oracle_rates(
+        state, trades, windows.ravel()
+    )
+
+    # Index of the last trade at or before each observation, -1 before the first trade
+    index = (trades.times[:, :, None] <= observeTimes[None, None, :]).sum(axis=1) - 1
+    before = index < 0
+    gather = np.maximum(index, 0)
+    previousTradeTime = np.where(
+        before, state.previousTradeTime, np.take_along_axis(previousTradeTimes, gather, axis=1)
+    )
+    lastImpliedRate = np.where(
+        before, state.lastImpliedRate, np.take_along_axis(lastImpliedRates, gather, axis=1)
+    )
+    gather = np.broadcast_to(gather[None], (len(windows),) + gather.shape)
+    oracleRate = np.where(
+        before[None], state.oracleRate, np.take_along_axis(oracleRates, gather, axis=2)
+    )
+    return update_rate_oracle(previousTradeTime, lastImpliedRate, oracleRate, windows, observeTimes)
+
+
+def manipulation_study(state, curve, notionals, windows, tradeTime, holdTime, observeTimes):
+    """
+    Trades each of `notionals` at tradeTime and the opposite fCash back at tradeTime + holdTime.
+    Returns (cost, maxDeviation): the underlying cash lost on the round trip per notional and the
+    largest oracle rate move from the undisturbed oracle rate, shape (windows, notionals).
+    """
+    notionals = np.asarray(notionals, dtype=np.float64)
+    times = np.tile(
+        np.array([tradeTime, tradeTime + holdTime], dtype=np.int64), (len(notionals), 1)
+    )
+    trades = simulate_trades(state, curve, times, np.stack([notionals, -notionals], axis=1))
+
+    roundTrip = trades.success.all(axis=1)
+    cost = np.where(roundTrip, -trades.netCashToAccount.sum(axis=1), np.nan)
+
+    undisturbed = update_rate_oracle(
+        state.previousTradeTime,
+        state.lastImpliedRate,
+        state.oracleRate,
+        np.asarray(windows, dtype=np.int64).reshape(-1, 1),
+        np.asarray(observeTimes, dtype=np.int64)[None, :],
+    )
+    rates = oracle_rate_paths(state, trades, windows, observeTimes)
+    deviation = np.abs(rates - undisturbed[:, None, :]).max(axis=2)
+    return (cost, np.where(roundTrip[None, :], deviation, np.nan))
+
+
+def random_trade_paths(state, paths, trades, meanInterval, maxNotional, startTime, seed=None):
+    """Trade times with exponential gaps and uniform fCash amounts, shape (paths, trades)"""
+    rng = np.random.default_rng(seed)
+    gaps = rng.exponential(meanInterval, size=(paths, trades)).astype(np.int64) + 1
+    times = startTime + np.cumsum(gaps, axis=1)
+    fCash = rng.uniform(-maxNotional, maxNotional, size=(paths, trades))
+    # Trades at or past maturity are not possible, they are dropped as failed trades
+    fCash = np.where(times < state.maturity, fCash, 0)
+    return (np.minimum(times, state.maturity - 1), fCash)
+
+
+def main(currencyId=2, marketIndex=1, paths=10_000, trades=20, seed=0):
+    """
+    Oracle lag and manipulation cost for rate oracle windows around the configured one, using the
+    current state of a market.
+    """
+    networkName = network.show_active()
+    if networkName in ("mainnet-fork", "hardhat-fork"):
+        networkName = "mainnet"
+    with open("v2.{}.json".format(networkName), "r") as f:
+        env = EnvironmentV2(json.load(f))
+
+    (settings, assetRate) = env.notional.getCashGroupAndAssetRate(currencyId)
+    cashGroup = CashGroup.fromParameters(currencyId, settings, assetRate)
+    market = Market.fromParameters(env.notional.getActiveMarkets(currencyId)[marketIndex - 1])
+    state = MarketState.fromMarket(market, cashGroup.assetRate)
+    curve = CurveParameters.fromCashGroup(cashGroup, marketIndex)
+
+    configured = cashGroup.getRateOracleTimeWindow()
+    windows = sorted(
+        {configured, CurrencyDefaults["rateOracleTimeWindow"] * FIVE_MINUTES}
+        | {configured * m // 4 for m in (1, 2, 8, 16)}
+    )
+    blockTime = chain.time()
+    observeTimes = blockTime + np.arange(0, 4 * max(windows), FIVE_MINUTES)
+
+    (times, fCash) = random_trade_paths(
+        state, paths, trades, configured / 2, state.totalfCash * 0.01, blockTime, seed
+    )
+    tradePaths = simulate_trades(state, curve, times, fCash)
+    rates = oracle_rate_paths(state, tradePaths, windows, observeTimes)
+    # Lag: mean absolute gap between the oracle rate and the last implied rate
+    index = (tradePaths.times[:, :, None] <= observeTimes[None, None, :]).sum(axis=1) - 1
+    implied = np.where(
+        index < 0,
+        state.lastImpliedRate,
+        np.take_along_axis(tradePaths.impliedRates, np.maximum(index, 0), axis=1),
+    )
+    lag = np.abs(rates - implied[None]).mean(axis=(1, 2)) / RATE_PRECISION
+
+    notionals = state.totalfCash * np.array([0.01, 0.05, 0.1, 0.2])
+    (cost, deviation) = manipulation_study(
+        state, curve, notionals, windows, blockTime, FIVE_MINUTES, observeTimes
+    )
+
+    print("Simulated {} paths of {} trades".format(paths, trades))
+    print("{:>10} {:>12} {}".format("window", "mean lag", "max oracle move per notional"))
+    for (w, window) in enumerate(windows):
+        print(
+            "{:>10} {:>12.4%} {}".format(
+                window,
+                lag[w],
+                " ".join("{:.4%}".format(d / RATE_PRECISION) for d in deviation[w]),
+            )
+        )
+    print(
+        "Round trip cost per notional: {}".format(" ".join("{:.2f}".format(c / 1e8) for c in cost))
+    )
@@ -0,0 +1,547 @@
+"""
+Local quote engine for the CalculationViews quote methods.
+
+Cash group, asset rate, token and market state is read from Notional once per block and every
+quote is then answered with the integer ports in scripts/offchain, which round identically to
+the contracts. Results are memoized per (block, method, currency, market, amount bucket) so that
+repeated quotes within a block never touch the node. Call `refresh()` whenever a new block arrives.
+"""
+import time
+from collections import OrderedDict
+
+from brownie import accounts, chain
+from scripts.batch_encoder import encode_trade_action
+from scripts.offchain.cash_group import CashGroup
+from scripts.offchain.constants import MAX_TRADED_MARKET_INDEX, QUARTER
+from scripts.offchain.date_time import getMarketIndex, getReferenceTime
+from scripts.offchain.market import (
+    Market,
+    getExchangeRateFromImpliedRate,
+    getfCashGivenCashAmount,
+)
+from scripts.offchain.safe_math import Revert, div, require
+from scripts.offchain.token_handler import TOKEN_TYPE
+from scripts.rate_provider import RateProvider
+from tests.helpers import initialize_environment
+
+INT88_MIN = -(2 ** 87)
+INT88_MAX = 2 ** 87 - 1
+UINT88_MAX = 2 ** 88 - 1
+
+
+def _safeInt88(x):
+    require(INT88_MIN <= x <= INT88_MAX, "int88 overflow")
+    return x
+
+
+def _encodeLendBorrowTrade(tradeActionType, marketIndex, fCash, slippage):
+    absfCash = abs(fCash)
+    require(absfCash <= UINT88_MAX, "uint88 overflow")
+    slippageKey = "minSlippage" if tradeActionType == "Lend" else "maxSlippage"
+    encodedTrade = encode_trade_action(
+        tradeActionType, marketIndex=marketIndex, notional=absfCash, **{slippageKey: slippage}
+    )
+
+    return (encodedTrade, absfCash)
+
+
+class CurrencySnapshot:
+    """Per block state for a single currency, markets are loaded per reference time"""
+
+    def __init__(self, currencyId, cashGroup, assetToken, underlyingToken):
+        self.currencyId = currencyId
+        self.cashGroup = cashGroup
+        self.assetToken = assetToken
+        self.underlyingToken = underlyingToken
+        self.markets = {}
+        self.nToken = None
+
+
+class QuoteEngine:
+    def __init__(self, notional, bucketSize=1, maxCacheSize=100_000, rates=None):
+        """
+        `bucketSize` rounds quoted amounts down to a multiple of itself before quoting, the
+        default of one quotes every amount exactly. `maxCacheSize` bounds the number of memoized
+        quotes held for the current block. Asset rates and tokens come from `rates`, pass a shared
+        RateProvider to avoid loading them more than once per block.
+        """
+        self.notional = notional
+        self.rates = RateProvider(notional) if rates is None else rates
+        self.bucketSize = int(bucketSize)
+        self.maxCacheSize = maxCacheSize
+        self.blockNumber = None
+        self.blockTime = None
+        self.maxCurrencyId = 0
+        self.currencies = {}
+        self.cache = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "rpcCalls": 0, "refreshes": 0}
+
+    def refresh(self, blockNumber=None):
+        """
+        Drops all state if the chain has moved past the loaded block. Returns True if the
+        snapshot changed.
+        """
+        blockNumber = chain.height if blockNumber is None else blockNumber
+        if blockNumber == self.blockNumber:
+            return False
+
+        self.blockNumber = blockNumber
+        self.blockTime = chain[blockNumber].timestamp
+        self.maxCurrencyId = self._call("getMaxCurrencyId")
+        self.rates.refresh(blockNumber)
+        self.currencies = {}
+        self.cache.clear()
+        self.stats["refreshes"] += 1
+        return True
+
+    def _call(self, method, *args):
+        self.stats["rpcCalls"] += 1
+        return getattr(self.notional, method)(*args, block_identifier=self.blockNumber)
+
+    def _checkValidCurrency(self, currencyId):
+        require(0 < currencyId <= self.maxCurrencyId, "Invalid currency id")
+
+    def _currency(self, currencyId):
+        if self.blockNumber is None:
+            self.refresh()
+
+        if currencyId not in self.currencies:
+            self._checkValidCurrency(currencyId)
+            cashGroupSettings = self._call("getCashGroup", currencyId)
+            (assetToken, underlyingToken) = self.rates.getTokens(currencyId)
+            self.currencies[currencyId] = CurrencySnapshot(
+                currencyId,
+                CashGroup.fromParameters(
+                    currencyId, cashGroupSettings, self.rates.getAssetRate(currencyId)
+                ),
+                assetToken,
+                underlyingToken,
+            )
+
+        return self.currencies[currencyId]
+
+    def _loadMarket(self, currency, marketIndex, blockTime):
+        require(1 <= marketIndex <= currency.cashGroup.maxMarketIndex, "Invalid market")
+        referenceTime = getReferenceTime(blockTime)
+        if referenceTime not in currency.markets:
+            # Market storage is keyed by settlement date so any block time inside the same
+            # quarter loads the same markets
+            currency.markets[referenceTime] = [
+                Market.fromParameters(m)
+                for m in self._call("getActiveMarketsAtBlockTime", currency.currencyId, blockTime)
+            ]
+
+        # Trades mutate the market so always hand out a copy
+        return currency.markets[referenceTime][marketIndex - 1].copy()
+
+    def _nToken(self, currency):
+        if currency.nToken is None:
+            nTokenAddress = self._call("nTokenAddress", currency.currencyId)
+            (_, totalSupply, _, lastInitializedTime, _, _, _, _) = self._call(
+                "getNTokenAccount", nTokenAddress
+            )
+            assetCashPV = self._call("nTokenPresentValueAssetDenominated", currency.currencyId)
+            currency.nToken = (int(totalSupply), int(lastInitializedTime), int(assetCashPV))
+
+        return currency.nToken
+
+    def _bucket(self, amount):
+        amount = int(amount)
+        if self.bucketSize == 1:
+            return amount
+        return amount - (amount % self.bucketSize)
+
+    def _memoize(self, key, calculate):
+        if key in self.cache:
+            self.stats["hits"] += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        self.stats["misses"] += 1
+        result = calculate()
+        self.cache[key] = result
+        if len(self.cache) > self.maxCacheSize:
+            self.cache.popitem(last=False)
+
+        return result
+
+    def _blockTime(self, blockTime):
+        if self.blockNumber is None:
+            self.refresh()
+        return self.blockTime if blockTime is None else int(blockTime)
+
+    def _getMarketIndex(self, maturity, blockTime):
+        (marketIndex, isIdiosyncratic) = getMarketIndex(
+            MAX_TRADED_MARKET_INDEX, maturity, blockTime
+        )
+        marketIndex = 0 if isIdiosyncratic else marketIndex
+        require(marketIndex > 0, "Idiosyncratic maturity")
+        return marketIndex
+
+    def _getfCashAmountGivenCashAmount(self, currency, netCashToAccount, marketIndex, blockTime):
+        cashGroup = currency.cashGroup
+        market = self._loadMarket(currency, marketIndex, blockTime)
+
+        require(market.maturity > blockTime, "Invalid block time")
+        timeToMaturity = market.maturity - blockTime
+        (rateScalar, totalCashUnderlying, rateAnchor) = market.getExchangeRateFactors(
+            cashGroup, timeToMaturity, marketIndex
+        )
+        fee = getExchangeRateFromImpliedRate(cashGroup.getTotalFee(), timeToMaturity)
+
+        return getfCashGivenCashAmount(
+            market.totalfCash,
+            netCashToAccount,
+            totalCashUnderlying,
+            rateScalar,
+            rateAnchor,
+            fee,
+            0,
+        )
+
+    def _getCashAmountGivenfCashAmount(
+        self, currency, fCashAmount, marketIndex, blockTime, rateLimit
+    ):
+        cashGroup = currency.cashGroup
+        market = self._loadMarket(currency, marketIndex, blockTime)
+
+        require(market.maturity > blockTime, "Invalid block time")
+        timeToMaturity = market.maturity - blockTime
+        (assetCash, _) = market.calculateTrade(cashGroup, fCashAmount, timeToMaturity, marketIndex)
+
+        if rateLimit != 0:
+            if fCashAmount < 0:
+                require(market.lastImpliedRate <= rateLimit, "Trade failed, slippage")
+            else:
+                require(market.lastImpliedRate >= rateLimit, "Trade failed, slippage")
+
+        return (assetCash, cashGroup.assetRate.convertToUnderlying(assetCash))
+
+    def _convertToAmountExternal(self, currency, amountInternal, useUnderlying):
+        token = currency.underlyingToken if useUnderlying else currency.assetToken
+        require(token.tokenType != TOKEN_TYPE["aToken"], "aToken quotes are not supported")
+
+        if useUnderlying and amountInternal < 0:
+            amountExternal = token.convertToUnderlyingExternalWithAdjustment(-amountInternal)
+        else:
+            amountExternal = abs(token.convertToExternal(amountInternal))
+
+        require(amountExternal >= 0)
+        return amountExternal
+
+    def _convertDepositAmountToUnderlyingInternal(
+        self, currency, depositAmountExternal, useUnderlying
+    ):
+        token = currency.underlyingToken if useUnderlying else currency.assetToken
+        require(token.tokenType != TOKEN_TYPE["aToken"], "aToken quotes are not supported")
+
+        underlyingInternal = token.convertToInternal(int(depositAmountExternal))
+        if not useUnderlying:
+            underlyingInternal = currency.cashGroup.assetRate.convertToUnderlying(
+                underlyingInternal
+            )
+
+        return underlyingInternal
+
+    def getfCashAmountGivenCashAmount(
+        self, currencyId, netCashToAccount, marketIndex, blockTime=None
+    ):
+        blockTime = self._blockTime(blockTime)
+        netCashToAccount = _safeInt88(self._bucket(netCashToAccount))
+        key = (
+            self.blockNumber,
+            "getfCashAmountGivenCashAmount",
+            currencyId,
+            marketIndex,
+            netCashToAccount,
+            blockTime,
+        )
+
+        return self._memoize(
+            key,
+            lambda: self._getfCashAmountGivenCashAmount(
+                self._currency(currencyId), netCashToAccount, marketIndex, blockTime
+            ),
+        )
+
+    def getCashAmountGivenfCashAmount(self, currencyId, fCashAmount, marketIndex, blockTime=None):
+        blockTime = self._blockTime(blockTime)
+        fCashAmount = _safeInt88(self._bucket(fCashAmount))
+        key = (
+            self.blockNumber,
+            "getCashAmountGivenfCashAmount",
+            currencyId,
+            marketIndex,
+            fCashAmount,
+            blockTime,
+        )
+
+        return self._memoize(
+            key,
+            lambda: self._getCashAmountGivenfCashAmount(
+                self._currency(currencyId), fCashAmount, marketIndex, blockTime, 0
+            ),
+        )
+
+    def getfCashLendFromDeposit(
+        self,
+        currencyId,
+        depositAmountExternal,
+        maturity,
+        minLendRate,
+        blockTime=None,
+        useUnderlying=True,
+    ):
+        """Returns (fCashAmount, marketIndex, encodedTrade)"""
+        blockTime = self._blockTime(blockTime)
+        marketIndex = self._getMarketIndex(maturity, blockTime)
+        depositAmountExternal = self._bucket(depositAmountExternal)
+        key = (
+            self.blockNumber,
+            "getfCashLendFromDeposit",
+            currencyId,
+            marketIndex,
+            depositAmountExternal,
+            blockTime,
+            minLendRate,
+            useUnderlying,
+        )
+
+        def calculate():
+            currency = self._currency(currencyId)
+            underlyingInternal = self._convertDepositAmountToUnderlyingInternal(
+                currency, depositAmountExternal, useUnderlying
+            )
+            fCash = self._getfCashAmountGivenCashAmount(
+                currency, _safeInt88(-underlyingInternal), marketIndex, blockTime
+            )
+            require(0 < fCash)
+            (encodedTrade, fCashAmount) = _encodeLendBorrowTrade(
+                "Lend", marketIndex, fCash, minLendRate
+            )
+            return (fCashAmount, marketIndex, encodedTrade)
+
+        return self._memoize(key, calculate)
+
+    def getfCashBorrowFromPrincipal(
+        self,
+        currencyId,
+        borrowedAmountExternal,
+        maturity,
+        maxBorrowRate,
+        blockTime=None,
+        useUnderlying=True,
+    ):
+        """Returns (fCashDebt, marketIndex, encodedTrade)"""
+        blockTime = self._blockTime(blockTime)
+        marketIndex = self._getMarketIndex(maturity, blockTime)
+        borrowedAmountExternal = self._bucket(borrowedAmountExternal)
+        key = (
+            self.blockNumber,
+            "getfCashBorrowFromPrincipal",
+            currencyId,
+            marketIndex,
+            borrowedAmountExternal,
+            blockTime,
+            maxBorrowRate,
+            useUnderlying,
+        )
+
+        def calculate():
+            currency = self._currency(currencyId)
+            underlyingInternal = self._convertDepositAmountToUnderlyingInternal(
+                currency, borrowedAmountExternal, useUnderlying
+            )
+            fCash = self._getfCashAmountGivenCashAmount(
+                currency, _safeInt88(underlyingInternal), marketIndex, blockTime
+            )
+            require(fCash < 0)
+            (encodedTrade, fCashDebt) = _encodeLendBorrowTrade(
+                "Borrow", marketIndex, fCash, maxBorrowRate
+            )
+            return (fCashDebt, marketIndex, encodedTrade)
+
+        return self._memoize(key, calculate)
+
+    def getDepositFromfCashLend(
+        self, currencyId, fCashAmount, maturity, minLendRate, blockTime=None
+    ):
+        """Returns (depositAmountUnderlying, depositAmountAsset, marketIndex, encodedTrade)"""
+        blockTime = self._blockTime(blockTime)
+        marketIndex = self._getMarketIndex(maturity, blockTime)
+        fCashAmount = self._bucket(fCashAmount)
+        require(fCashAmount < INT88_MAX)
+        key = (
+            self.blockNumber,
+            "getDepositFromfCashLend",
+            currencyId,
+            marketIndex,
+            fCashAmount,
+            blockTime,
+            minLendRate,
+        )
+
+        def calculate():
+            currency = self._currency(currencyId)
+            (assetCashInternal, underlyingCashInternal) = self._getCashAmountGivenfCashAmount(
+                currency, fCashAmount, marketIndex, blockTime, minLendRate
+            )
+            (encodedTrade, _) = _encodeLendBorrowTrade(
+                "Lend", marketIndex, fCashAmount, minLendRate
+            )
+            return (
+                self._convertToAmountExternal(currency, underlyingCashInternal, True),
+                self._convertToAmountExternal(currency, assetCashInternal, False),
+                marketIndex,
+                encodedTrade,
+            )
+
+        return self._memoize(key, calculate)
+
+    def getPrincipalFromfCashBorrow(
+        self, currencyId, fCashBorrow, maturity, maxBorrowRate, blockTime=None
+    ):
+        """Returns (borrowAmountUnderlying, borrowAmountAsset, marketIndex, encodedTrade)"""
+        blockTime = self._blockTime(blockTime)
+        marketIndex = self._getMarketIndex(maturity, blockTime)
+        fCashBorrow = self._bucket(fCashBorrow)
+        require(fCashBorrow < INT88_MAX)
+        key = (
+            self.blockNumber,
+            "getPrincipalFromfCashBorrow",
+            currencyId,
+            marketIndex,
+            fCashBorrow,
+            blockTime,
+            maxBorrowRate,
+        )
+
+        def calculate():
+            currency = self._currency(currencyId)
+            fCash = -fCashBorrow
+            (assetCashInternal, underlyingCashInternal) = self._getCashAmountGivenfCashAmount(
+                currency, fCash, marketIndex, blockTime, maxBorrowRate
+            )
+            (encodedTrade, _) = _encodeLendBorrowTrade("Borrow", marketIndex, fCash, maxBorrowRate)
+            return (
+                self._convertToAmountExternal(currency, underlyingCashInternal, True),
+                self._convertToAmountExternal(currency, assetCashInternal, False),
+                marketIndex,
+                encodedTrade,
+            )
+
+        return self._memoize(key, calculate)
+
+    def calculateNTokensToMint(self, currencyId, amountToDepositExternalPrecision):
+        """Quoted at the snapshot block time, the same as the view which uses block.timestamp"""
+        blockTime = self._blockTime(None)
+        amount = self._bucket(amountToDepositExternalPrecision)
+        key = (self.blockNumber, "calculateNTokensToMint", currencyId, 0, amount)
+
+        def calculate():
+            currency = self._currency(currencyId)
+            amountToDepositInternal = currency.assetToken.convertToInternal(amount)
+            require(amountToDepositInternal >= 0, "deposit amount negative")
+            if amountToDepositInternal == 0:
+                return 0
+
+            (totalSupply, lastInitializedTime, assetCashPV) = self._nToken(currency)
+            if lastInitializedTime != 0:
+                nextSettleTime = getReferenceTime(lastInitializedTime) + QUARTER
+                require(nextSettleTime > blockTime, "Requires settlement")
+
+            require(assetCashPV >= 0)
+            if totalSupply == 0:
+                return amountToDepositInternal
+
+            return div(amountToDepositInternal * totalSupply, assetCashPV)
+
+        return self._memoize(key, calculate)
+
+
+def _normalize(value):
+    values = value if isinstance(value, tuple) else (value,)
+    normalized = tuple(bytes(v) if isinstance(v, bytes) else int(v) for v in values)
+    return normalized if isinstance(value, tuple) else normalized[0]
+
+
+def main():
+    """
+    Checks local quotes against CalculationViews on a local test environment and reports the
+    latency of each
+    """
+    env = initialize_environment(accounts)
+    engine = QuoteEngine(env.notional)
+    engine.refresh()
+    blockTime = engine.blockTime
+
+    checks = []
+    for (currencyId, decimals) in [(2, 18), (3, 6)]:
+        for market in env.notional.getActiveMarkets(currencyId):
+            maturity = market[1]
+            for amount in [1, 100, 10_000, 1_000_000]:
+                external = amount * 10 ** decimals
+                internal = amount * 10 ** 8
+                checks.extend(
+                    [
+                        (
+                            "getfCashLendFromDeposit",
+                            currencyId,
+                            external,
+                            maturity,
+                            0,
+                            blockTime,
+                            True,
+                        ),
+                        (
+                            "getfCashBorrowFromPrincipal",
+                            currencyId,
+                            external,
+                            maturity,
+                            0,
+                            blockTime,
+                            True,
+                        ),
+                        ("getDepositFromfCashLend", currencyId, internal, maturity, 0, blockTime),
+                        (
+                            "getPrincipalFromfCashBorrow",
+                            currencyId,
+                            internal,
+                            maturity,
+                            0,
+                            blockTime,
+                        ),
+                    ]
+                )
+        checks.append(("calculateNTokensToMint", currencyId, 1000 * 10 ** 8))
+
+    (mismatches, localTime, rpcTime) = (0, 0, 0)
+    for (method, *args) in checks:
+        start = time.perf_counter()
+        try:
+            local = getattr(engine, method)(*args)
+        except Revert as e:
+            local = "revert: {}".format(e)
+        localTime += time.perf_counter() - start
+
+        start = time.perf_counter()
+        try:
+            onchain = getattr(env.notional, method)(*args)
+        except Exception as e:
+            onchain = "revert: {}".format(e)
+        rpcTime += time.perf_counter() - start
+
+        if isinstance(onchain, str) and isinstance(local, str):
+            continue
+        expected = onchain if isinstance(onchain, str) else _normalize(onchain)
+        if local != expected:
+            mismatches += 1
+            print("Mismatch {}{}: local {} on chain {}".format(method, tuple(args), local, onchain))
+
+    print("Checked {} quotes, {} mismatches".format(len(checks), mismatches))
+    print(
+        "Average latency: local {:.1f}us, rpc {:.1f}us".format(
+            localTime / len(checks) * 1e6, rpcTime / len(checks) * 1e6
+        )
+    )
+    print("Engine stats: {}".format(engine.stats))
@@ -0,0 +1,127 @@
+"""
+Shared asset rate and ETH exchange rate provider for off chain valuation.
+
+Every listed currency's asset rate, ETH rate and tokens are read with getCurrencyAndRates once
+per block, all calls pinned to the same block and issued concurrently. Conversions are then served
+from memory with the AssetRate and ExchangeRate ports in scripts/offchain so they round exactly
+like the contracts, including the buffer and haircut applied by convertToETH.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from brownie import chain
+from scripts.offchain.asset_rate import AssetRate
+from scripts.offchain.exchange_rate import ETHRate, exchangeRate
+from scripts.offchain.safe_math import require
+from scripts.offchain.token_handler import Token
+
+READ_WORKERS = 8
+
+
+class CurrencyRates:
+    def __init__(self, assetToken, underlyingToken, ethRate, assetRate):
+        self.assetToken = assetToken
+        self.underlyingToken = underlyingToken
+        self.ethRate = ethRate
+        self.assetRate = assetRate
+
+    @classmethod
+    def fromParameters(cls, currencyAndRates):
+        """Builds from the tuple returned by getCurrencyAndRates"""
+        (assetToken, underlyingToken, ethRate, assetRate) = currencyAndRates
+        return cls(
+            Token.fromParameters(assetToken),
+            Token.fromParameters(underlyingToken),
+            ETHRate.fromParameters(ethRate),
+            AssetRate.fromParameters(assetRate),
+        )
+
+
+class RateProvider:
+    def __init__(self, notional, currencyIds=None):
+        """
+        `currencyIds` restricts the currencies loaded on refresh, by default every listed
+        currency is loaded.
+        """
+        self.notional = notional
+        self.currencyIds = currencyIds
+        self.blockNumber = None
+        self.currencies = {}
+        self.stats = {"rpcCalls": 0, "refreshes": 0}
+
+    @classmethod
+    def fromRates(cls, ethRates, assetRates):
+        """
+        Builds a provider that never reads from chain, i.e. for simulations. Takes dicts of
+        currency id to ETHRate and AssetRate.
+        """
+        provider = cls(None, sorted(ethRates))
+        provider.currencies = {
+            currencyId: CurrencyRates(None, None, ethRates[currencyId], assetRates[currencyId])
+            for currencyId in ethRates
+        }
+        return provider
+
+    def _call(self, method, *args):
+        self.stats["rpcCalls"] += 1
+        return getattr(self.notional, method)(*args, block_identifier=self.blockNumber)
+
+    def refresh(self, blockNumber=None):
+        """Reloads all rates if the chain has moved past the loaded block"""
+        if self.notional is None:
+            return False
+
+        blockNumber = chain.height if blockNumber is None else blockNumber
+        if blockNumber == self.blockNumber:
+            return False
+
+        self.blockNumber = blockNumber
+        currencyIds = self.currencyIds
+        if currencyIds is None:
+            currencyIds = range(1, self._call("getMaxCurrencyId") + 1)
+
+        with ThreadPoolExecutor(max_workers=READ_WORKERS) as pool:
+            results = {
+                currencyId: pool.submit(self._call, "getCurrencyAndRates", currencyId)
+                for currencyId in currencyIds
+            }
+        self.currencies = {
+            currencyId: CurrencyRates.fromParameters(r.result())
+            for (currencyId, r) in results.items()
+        }
+        self.stats["refreshes"] += 1
+        return True
+
+    def _currency(self, currencyId):
+        if self.blockNumber is None:
+            self.refresh()
+        require(currencyId in self.currencies, "Invalid currency id")
+        return self.currencies[currencyId]
+
+    def getTokens(self, currencyId):
+        currency = self._currency(currencyId)
+        return (currency.assetToken, currency.underlyingToken)
+
+    def getAssetRate(self, currencyId):
+        return self._currency(currencyId).assetRate
+
+    def getETHRate(self, currencyId):
+        return self._currency(currencyId).ethRate
+
+    def convertToUnderlying(self, currencyId, assetBalance):
+        return self.getAssetRate(currencyId).convertToUnderlying(assetBalance)
+
+    def convertFromUnderlying(self, currencyId, underlyingBalance):
+        return self.getAssetRate(currencyId).convertFromUnderlying(underlyingBalance)
+
+    def convertToETH(self, currencyId, underlyingBalance):
+        """Applies the haircut to positive balances and the buffer to negative balances"""
+        return self.getETHRate(currencyId).convertToETH(underlyingBalance)
+
+    def convertETHTo(self, currencyId, ethBalance):
+        return self.getETHRate(currencyId).convertETHTo(ethBalance)
+
+    def convertAssetToETH(self, currencyId, assetBalance):
+        return self.convertToETH(currencyId, self.convertToUnderlying(currencyId, assetBalance))
+
+    def exchangeRate(self, baseCurrencyId, quoteCurrencyId):
+        return exchangeRate(self.getETHRate(baseCurrencyId), self.getETHRate(quoteCurrencyId))
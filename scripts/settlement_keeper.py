@@ -0,0 +1,312 @@
+"""
+Settlement keeper that submits settleAccount for many accounts with pipelined nonces.
+
+Accounts are spread round robin over one or more keeper accounts. Every keeper hands out its
+own nonces locally so transactions are sent without waiting for earlier ones to be mined, up to
+`maxPending` in flight per keeper. Sends are issued concurrently and receipts are polled in
+batches. Transactions that revert are retried with a new nonce up to `maxRetries` times.
+Transactions that are not mined within `timeout` seconds are replaced at the same nonce with a
+higher gas price, the original and every replacement are tracked until one of them is mined.
+Nonces of rejected sends are reused by the next transaction, or by a zero value transfer to the
+keeper itself if nothing else is queued, so that later nonces never stall behind a gap.
+
+Usage:
+    brownie run scripts/settlement_keeper.py main <keeper> [<keeper> ...] --network mainnet
+"""
+import heapq
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+from brownie import accounts, chain, network
+from brownie.network import web3
+from eth_account import Account
+from scripts.account_scanner import AccountContextIndex
+from scripts.environment_v2 import EnvironmentV2
+
+SEND_WORKERS = 16
+SETTLE_GAS_LIMIT = 1_500_000
+GAP_FILL_GAS_LIMIT = 21_000
+# Replacement transactions must raise the gas price by at least 10%
+GAS_PRICE_BUMP = 1.125
+
+
+class PendingSettlement(NamedTuple):
+    account: str
+    nonce: int
+    gasPrice: int
+    # Every transaction sent at the nonce, the original and its replacements. Any of them may
+    # be the one that is mined.
+    txHashes: tuple
+    sentAt: float
+    attempts: int
+
+
+class SettlementResult(NamedTuple):
+    settled: list
+    # Account to the reason its last attempt failed
+    failed: dict
+    transactions: int
+    replacements: int
+    startBlock: int
+    endBlock: int
+
+
+class Keeper:
+    def __init__(self, account, nonce):
+        self.account = account
+        self.nextNonce = nonce
+        self.freeNonces = []
+        # Nonce to PendingSettlement
+        self.pending = {}
+
+    def allocate_nonce(self):
+        if self.freeNonces:
+            return heapq.heappop(self.freeNonces)
+        self.nextNonce += 1
+        return self.nextNonce - 1
+
+    def release_nonce(self, nonce):
+        heapq.heappush(self.freeNonces, nonce)
+
+
+class SettlementKeeper:
+    def __init__(
+        self,
+        notional,
+        keepers,
+        gasPrice=None,
+        gasLimit=SETTLE_GAS_LIMIT,
+        maxPending=64,
+        maxRetries=3,
+        timeout=120,
+        pollInterval=1,
+    ):
+        self.notional = notional
+        self.keepers = [
+            Keeper(k, web3.eth.get_transaction_count(k.address, "pending")) for k in keepers
+        ]
+        self.gasPrice = web3.eth.gas_price if gasPrice is None else int(gasPrice)
+        self.gasLimit = gasLimit
+        self.maxPending = maxPending
+        self.maxRetries = maxRetries
+        self.timeout = timeout
+        self.pollInterval = pollInterval
+        self.chainId = web3.eth.chain_id
+        self.stats = {"sent": 0, "replaced": 0, "reverted": 0, "rejected": 0, "gapFills": 0}
+
+    def _send(self, keeper, to, data, nonce, gasPrice, gasLimit):
+        """Returns the transaction hash, or raises if the node rejects the transaction"""
+        tx = {
+            "from": keeper.account.address,
+            "to": to,
+            "value": 0,
+            "data": data,
+            "nonce": nonce,
+            "gas": gasLimit,
+            "gasPrice": gasPrice,
+            "chainId": self.chainId,
+        }
+        if hasattr(keeper.account, "private_key"):
+            signed = Account.sign_transaction(tx, keeper.account.private_key)
+            response = web3.provider.make_request(
+                "eth_sendRawTransaction", [signed.rawTransaction.hex()]
+            )
+        else:
+            tx = {k: hex(v) if isinstance(v, int) else v for (k, v) in tx.items()}
+            response = web3.provider.make_request("eth_sendTransaction", [tx])
+
+        if "error" in response:
+            raise Exception(response["error"])
+        return response["result"]
+
+    def _nonce_consumed(self, keeper, nonce):
+        return web3.eth.get_transaction_count(keeper.account.address, "latest") > nonce
+
+    def _submit(self, keeper, account, attempts, nonce, gasPrice):
+        """
+        Sends one settlement, returns (PendingSettlement, None) or (None, error). Runs on the send
+        pool so it never touches keeper state.
+        """
+        data = self.notional.settleAccount.encode_input(account)
+        try:
+            txHash = self._send(keeper, self.notional.address, data, nonce, gasPrice, self.gasLimit)
+        except Exception as e:
+            return (None, str(e))
+
+        return (
+            PendingSettlement(account, nonce, gasPrice, (txHash,), time.time(), attempts + 1),
+            None,
+        )
+
+    def _rejected(self, keeper, nonce):
+        # Some nodes mine a reverting transaction and then return an error, in that case the
+        # nonce has been used
+        self.stats["rejected"] += 1
+        if not self._nonce_consumed(keeper, nonce):
+            keeper.release_nonce(nonce)
+
+    def _fill_gaps(self, keeper):
+        """Sends zero value transfers at released nonces that later transactions wait behind"""
+        while keeper.freeNonces and keeper.freeNonces[0] < max(
+            [p.nonce for p in keeper.pending.values()], default=-1
+        ):
+            nonce = heapq.heappop(keeper.freeNonces)
+            if self._nonce_consumed(keeper, nonce):
+                continue
+            try:
+                self._send(
+                    keeper, keeper.account.address, "0x", nonce, self.gasPrice, GAP_FILL_GAS_LIMIT
+                )
+            except Exception:
+                # Retried on the next polling round
+                keeper.release_nonce(nonce)
+                break
+            self.stats["gapFills"] += 1
+
+    @staticmethod
+    def _receipt(txHashes):
+        """Returns the receipt of whichever transaction at the nonce was mined, if any"""
+        for txHash in txHashes:
+            receipt = web3.provider.make_request("eth_getTransactionReceipt", [txHash]).get(
+                "result"
+            )
+            if receipt is not None:
+                return receipt
+        return None
+
+    def settle(self, settleAccounts):
+        """Settles every account, returns once all transactions are mined or have failed"""
+        startBlock = chain.height
+        queue = deque((str(a), 0) for a in dict.fromkeys(settleAccounts))
+        (settled, failed) = ([], {})
+
+        with ThreadPoolExecutor(max_workers=SEND_WORKERS) as pool:
+            while queue or any(k.pending for k in self.keepers):
+                # Hand out queued accounts round robin to keepers with free pending slots
+                slots = {k: self.maxPending - len(k.pending) for k in self.keepers}
+                submissions = []
+                while queue and any(n > 0 for n in slots.values()):
+                    for keeper in self.keepers:
+                        if queue and slots[keeper] > 0:
+                            (account, attempts) = queue.popleft()
+                            submissions.append(
+                                (keeper, account, attempts, keeper.allocate_nonce(), self.gasPrice)
+                            )
+                            slots[keeper] -= 1
+
+                results = pool.map(lambda s: self._submit(*s), submissions)
+                for ((keeper, account, attempts, nonce, _), (pending, error)) in zip(
+                    submissions, results
+                ):
+                    if pending is not None:
+                        keeper.pending[pending.nonce] = pending
+                        self.stats["sent"] += 1
+                        continue
+
+                    self._rejected(keeper, nonce)
+                    if attempts + 1 < self.maxRetries:
+                        queue.append((account, attempts + 1))
+                    else:
+                        failed[account] = error
+
+                for keeper in self.keepers:
+                    if not queue:
+                        self._fill_gaps(keeper)
+
+                progressed = self._track(pool, queue, settled, failed)
+                if not progressed and not submissions:
+                    time.sleep(self.pollInterval)
+
+        return SettlementResult(
+            settled,
+            failed,
+            self.stats["sent"],
+            self.stats["replaced"],
+            startBlock,
+            chain.height,
+        )
+
+    def _track(self, pool, queue, settled, failed):
+        pending = [(k, p) for k in self.keepers for p in list(k.pending.values())]
+        receipts = list(pool.map(lambda kp: self._receipt(kp[1].txHashes), pending))
+        progressed = False
+        now = time.time()
+
+        for ((keeper, p), receipt) in zip(pending, receipts):
+            if receipt is None and now - p.sentAt > self.timeout:
+                if not self._nonce_consumed(keeper, p.nonce):
+                    self._replace(keeper, p, now)
+                    continue
+
+                # One of the transactions may have been mined since the receipts were polled
+                receipt = self._receipt(p.txHashes)
+                if receipt is None:
+                    # A transaction that is not tracked here took the nonce, none of the
+                    # settlements at it were mined
+                    del keeper.pending[p.nonce]
+                    progressed = True
+                    queue.append((p.account, p.attempts - 1))
+                    continue
+
+            if receipt is None:
+                continue
+
+            del keeper.pending[p.nonce]
+            progressed = True
+            if int(receipt["status"], 16) == 1:
+                settled.append(p.account)
+            elif p.attempts < self.maxRetries:
+                self.stats["reverted"] += 1
+                queue.append((p.account, p.attempts))
+            else:
+                self.stats["reverted"] += 1
+                failed[p.account] = "reverted"
+
+        return progressed
+
+    def _replace(self, keeper, p, now):
+        """Resends a stuck settlement at the same nonce with a higher gas price"""
+        gasPrice = int(p.gasPrice * GAS_PRICE_BUMP) + 1
+        (replacement, _) = self._submit(keeper, p.account, p.attempts - 1, p.nonce, gasPrice)
+        if replacement is None:
+            # Earlier transactions are still pending at this nonce, keep waiting on them
+            keeper.pending[p.nonce] = p._replace(sentAt=now)
+        else:
+            keeper.pending[p.nonce] = p._replace(
+                gasPrice=gasPrice, txHashes=p.txHashes + replacement.txHashes, sentAt=now
+            )
+            self.stats["replaced"] += 1
+
+
+def main(*keeperIds):
+    """Settles every indexed account that must settle at the current block time"""
+    networkName = network.show_active()
+    if networkName in ("mainnet-fork", "hardhat-fork"):
+        networkName = "mainnet"
+    with open("v2.{}.json".format(networkName), "r") as f:
+        config = json.load(f)
+    env = EnvironmentV2(config)
+
+    index = AccountContextIndex(env.notional)
+    index.blockNumber = config["startBlock"] - 1
+    index.sync()
+    due = index.must_settle(chain.time())
+
+    keepers = [accounts.load(k) for k in keeperIds]
+    print("Settling {} accounts with {} keepers".format(len(due), len(keepers)))
+    result = SettlementKeeper(env.notional, keepers).settle(due)
+    print(
+        "Settled {} accounts in blocks {} to {}".format(
+            len(result.settled), result.startBlock, result.endBlock
+        )
+    )
+    print(
+        "{} failed, {} transactions, {} replacements".format(
+            len(result.failed), result.transactions, result.replacements
+        )
+    )
+    for (account, reason) in result.failed.items():
+        print("  {}: {}".format(account, reason))
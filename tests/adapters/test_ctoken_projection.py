@@ -0,0 +1,77 @@
+import pytest
+from brownie.network.state import Chain
+from scripts.common import loadContractFromArtifact
+from scripts.config import CompoundConfig
+from scripts.ctoken_projection import (
+    INTEREST_RATE_MODEL_ARTIFACTS,
+    load_ctoken,
+    project,
+    project_exact,
+)
+from scripts.offchain.compound import InterestRateModel
+from tests.helpers import initialize_environment
+
+chain = Chain()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def environment(accounts):
+    env = initialize_environment(accounts)
+    # Borrow against cDAI so that the cUSDC interest rate is non zero
+    env.comptroller.enterMarkets([env.cToken["DAI"].address], {"from": accounts[0]})
+    env.cToken["USDC"].borrow(50_000_000e6, {"from": accounts[0]})
+    return env
+
+
+@pytest.fixture(autouse=True)
+def isolation(fn_isolation):
+    pass
+
+
+@pytest.mark.parametrize("symbol", ["ETH", "DAI", "USDC", "WBTC"])
+def test_interest_rate_model_matches_contract(environment, symbol):
+    config = CompoundConfig[symbol]["interestRateModel"]
+    contract = loadContractFromArtifact(
+        "InterestRateModel",
+        environment.cToken[symbol].interestRateModel(),
+        INTEREST_RATE_MODEL_ARTIFACTS[config["name"]],
+    )
+    (_, model) = load_ctoken(environment.cToken[symbol], symbol)
+    assert model == InterestRateModel.fromConfig(config)
+
+    for (cash, borrows, reserves) in [(100e18, 0, 0), (100e18, 50e18, 1e18), (1e18, 99e18, 0)]:
+        assert model.getBorrowRate(int(cash), int(borrows), int(reserves)) == (
+            contract.getBorrowRate(cash, borrows, reserves)
+        )
+        assert model.getSupplyRate(int(cash), int(borrows), int(reserves), int(0.1e18)) == (
+            contract.getSupplyRate(cash, borrows, reserves, 0.1e18)
+        )
+
+
+@pytest.mark.parametrize("blocks", [1, 100, 10_000])
+def test_view_exchange_rate_matches_aggregator(environment, blocks):
+    cToken = environment.cToken["USDC"]
+    (state, model) = load_ctoken(cToken, "USDC")
+    assert state.totalBorrows > 0
+
+    chain.mine(blocks)
+    # Depending on the node, calls execute in the context of the latest or the pending block
+    assert environment.cTokenAggregator["USDC"].getExchangeRateView() in (
+        state.viewExchangeRate(model, chain.height),
+        state.viewExchangeRate(model, chain.height + 1),
+    )
+
+    txn = cToken.accrueInterest({"from": environment.deployer})
+    assert state.accrueInterest(model, txn.block_number).exchangeRate() == (
+        cToken.exchangeRateStored()
+    )
+
+
+def test_projection_matches_exact_accrual(environment):
+    (state, model) = load_ctoken(environment.cToken["USDC"], "USDC")
+    exact = project_exact(state, model, 6570, 100)
+    projected = project(state, model, 6570, 100)[0]
+
+    assert exact[-1] > exact[0]
+    for (e, p) in zip(exact, projected):
+        assert pytest.approx(e, rel=1e-9) == p
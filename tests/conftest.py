@@ -1,4 +1,17 @@
 import pytest
+from tests import fork_cache, impact, rpc_profiler
+
+
+def pytest_addoption(parser):
+    fork_cache.add_options(parser)
+    rpc_profiler.add_options(parser)
+    impact.add_options(parser)
+
+
+def pytest_configure(config):
+    fork_cache.register(config)
+    rpc_profiler.register(config)
+    impact.register(config)
 
 
 @pytest.fixture(scope="module", autouse=True)
@@ -0,0 +1,232 @@
+"""
+Record / replay cache for the upstream node behind a forked test network.
+
+A forked development node (hardhat or ganache) lazily pulls every account, code and storage slot
+it touches from an archive node. With `--fork-cache=record` a local JSON-RPC proxy is started
+in front of the archive node and the fork is pointed at it, every response is stored on disk
+keyed by method and params. With `--fork-cache=replay` the same proxy answers purely from the
+store and never touches the network, a request that was not recorded fails with an error so
+that a stale store is noticed instead of silently going online.
+
+Because the fork is pinned with `fork_block` every read it makes is deterministic, so the store
+is keyed by the chain id and fork block. Usage:
+
+    brownie test tests/mainnet-fork --network mainnet-fork --fork-cache=record
+    brownie test tests/mainnet-fork --network mainnet-fork --fork-cache=replay
+"""
+import gzip
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from brownie._config import CONFIG
+
+MODES = ("record", "replay")
+DEFAULT_STORE_DIR = "tests/mainnet-fork/fork_cache"
+# Forks never need to forward transactions upstream
+UNCACHEABLE_METHODS = ("eth_sendRawTransaction", "eth_sendTransaction")
+
+
+def _request_key(method, params):
+    # Clients are not consistent about the case of hex values
+    return "{}:{}".format(method, json.dumps(params, sort_keys=True, separators=(",", ":")).lower())
+
+
+class ForkStore:
+    def __init__(self, path):
+        self.path = path
+        self.responses = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with gzip.open(path, "rt") as f:
+                self.responses = json.load(f)
+
+    def get(self, key):
+        return self.responses.get(key)
+
+    def put(self, key, result):
+        with self.lock:
+            self.responses[key] = result
+            self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self.lock:
+            with gzip.open(self.path, "wt") as f:
+                json.dump(self.responses, f, sort_keys=True)
+            self.dirty = False
+
+
+class ForkCacheProxy:
+    def __init__(self, store, mode, upstream=None):
+        if mode == "record" and upstream is None:
+            raise Exception("An upstream node is required to record a fork cache")
+
+        self.store = store
+        self.mode = mode
+        self.upstream = upstream
+        self.session = requests.Session()
+        self.stats = {"hits": 0, "fetched": 0, "misses": 0}
+        self.missed = set()
+        self.server = None
+
+    def _fetch(self, request):
+        response = self.session.post(self.upstream, json=request, timeout=120)
+        response.raise_for_status()
+        return response.json()
+
+    def handle(self, request):
+        method = request.get("method")
+        params = request.get("params", [])
+        rpcId = request.get("id")
+
+        if method in UNCACHEABLE_METHODS:
+            return {
+                "jsonrpc": "2.0",
+                "id": rpcId,
+                "error": {"code": -32601, "message": "{} is not forwarded".format(method)},
+            }
+
+        key = _request_key(method, params)
+        cached = self.store.get(key)
+        if cached is not None:
+            self.stats["hits"] += 1
+            return {"jsonrpc": "2.0", "id": rpcId, "result": cached["result"]}
+
+        if self.mode == "replay":
+            self.stats["misses"] += 1
+            self.missed.add(key)
+            return {
+                "jsonrpc": "2.0",
+                "id": rpcId,
+                "error": {
+                    "code": -32000,
+                    "message": "fork cache miss for {}, re-record with --fork-cache=record".format(
+                        key
+                    ),
+                },
+            }
+
+        response = self._fetch(request)
+        self.stats["fetched"] += 1
+        # Errors are not cached, they are usually rate limits or timeouts
+        if "error" not in response:
+            self.store.put(key, {"result": response.get("result")})
+        return response
+
+    def start(self, port=0):
+        proxy = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if isinstance(body, list):
+                    result = [proxy.handle(r) for r in body]
+                else:
+                    result = proxy.handle(body)
+
+                data = json.dumps(result).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return "http://127.0.0.1:{}".format(self.server.server_address[1])
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.mode == "record":
+            self.store.save()
+
+
+class ForkCachePlugin:
+    def __init__(self, proxy):
+        self.proxy = proxy
+
+    def pytest_terminal_summary(self, terminalreporter):
+        terminalreporter.section("fork cache ({})".format(self.proxy.mode))
+        terminalreporter.write_line(
+            "hits: {hits}, fetched upstream: {fetched}, misses: {misses}".format(**self.proxy.stats)
+        )
+        for key in sorted(self.proxy.missed)[:20]:
+            terminalreporter.write_line("  missed {}".format(key))
+
+    def pytest_unconfigure(self, config):
+        self.proxy.stop()
+
+
+def _fork_settings(networkId):
+    """Returns the upstream url, chain id and fork block of a forked development network"""
+    network = CONFIG.networks[networkId]
+    cmdSettings = network.get("cmd_settings", {})
+    if "fork" not in cmdSettings:
+        raise Exception("Network {} is not a forked network".format(networkId))
+
+    fork = cmdSettings["fork"]
+    if fork in CONFIG.networks:
+        upstream = CONFIG.networks[fork]["host"]
+        chainId = int(CONFIG.networks[fork]["chainid"])
+    else:
+        upstream = fork
+        chainId = int(cmdSettings.get("chain_id", network.get("chainid", 1)))
+
+    return (os.path.expandvars(upstream), chainId, cmdSettings.get("fork_block"))
+
+
+def add_options(parser):
+    group = parser.getgroup("fork cache")
+    group.addoption(
+        "--fork-cache",
+        action="store",
+        default=None,
+        choices=MODES,
+        help="Record upstream state of a forked network to disk, or replay it without network",
+    )
+    group.addoption(
+        "--fork-cache-dir",
+        action="store",
+        default=DEFAULT_STORE_DIR,
+        metavar="DIR",
+        help="Directory holding the recorded fork state",
+    )
+
+
+def register(config):
+    mode = config.getoption("--fork-cache")
+    if mode is None:
+        return
+
+    networkId = config.getoption("network")
+    networkId = networkId[0] if networkId else CONFIG.settings["networks"]["default"]
+    (upstream, chainId, forkBlock) = _fork_settings(networkId)
+    if forkBlock is None:
+        raise Exception("fork_block must be set on {} to use the fork cache".format(networkId))
+
+    store = ForkStore(
+        os.path.join(
+            config.getoption("--fork-cache-dir"), "{}-{}.json.gz".format(chainId, forkBlock)
+        )
+    )
+    proxy = ForkCacheProxy(store, mode, upstream if mode == "record" else None)
+
+    # Point the fork at the proxy, brownie would otherwise derive the chain id from the network
+    # named in the fork setting
+    network = CONFIG.networks[networkId]
+    network["chainid"] = str(chainId)
+    network["cmd_settings"].setdefault("chain_id", chainId)
+    network["cmd_settings"]["fork"] = proxy.start()
+    config.pluginmanager.register(ForkCachePlugin(proxy), "fork_cache")
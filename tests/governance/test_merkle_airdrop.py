@@ -0,0 +1,63 @@
+import json
+import os
+
+import pytest
+from scripts.mainnet.merkle_airdrop import (
+    ProofStore,
+    build_tree,
+    read_claims_csv,
+    read_claims_json_tree,
+    read_merkle_root,
+    verify_proof,
+    write_proof_store,
+)
+
+TREES = ["scripts/mainnet/AirdropMerkleTree.json", "scripts/mainnet/IncentiveAirdropTree.json"]
+
+
+@pytest.mark.parametrize("treePath", TREES)
+def test_matches_existing_trees(tmp_path, treePath):
+    with open(treePath, "r") as f:
+        tree = json.load(f)
+
+    storePath = str(tmp_path / "tree.bin")
+    root = write_proof_store(storePath, *build_tree(read_claims_json_tree(treePath), workers=1))
+    assert root == tree["merkleRoot"]
+    assert read_merkle_root(storePath) == tree["merkleRoot"]
+
+    store = ProofStore(storePath)
+    assert store.tokenTotal == int(tree["tokenTotal"], 16)
+    for (address, claim) in tree["claims"].items():
+        assert store.getClaim(address) == claim
+        assert store.getClaim(address.lower()) == claim
+    store.close()
+
+
+def test_build_from_csv(tmp_path):
+    csvPath = str(tmp_path / "claims.csv")
+    claims = [("0x{:040x}".format(i * 7919 + 1), i + 1) for i in range(101)]
+    with open(csvPath, "w") as f:
+        f.write("address,amount\n")
+        for (address, amount) in claims:
+            f.write("{},{}\n".format(address, amount))
+
+    storePath = str(tmp_path / "claims.bin")
+    root = write_proof_store(storePath, *build_tree(read_claims_csv(csvPath), workers=1))
+    store = ProofStore(storePath)
+    assert store.merkleRoot == root
+    assert store.numClaims == len(claims)
+
+    for (address, amount) in claims:
+        claim = store.getClaim(address)
+        assert int(claim["amount"], 16) == amount
+        assert verify_proof(root, claim["index"], address, amount, claim["proof"])
+        assert not verify_proof(root, claim["index"], address, amount + 1, claim["proof"])
+
+    assert store.getClaim("0x" + "ff" * 20) is None
+    store.close()
+
+
+def test_rejects_duplicate_addresses():
+    address = "0x" + os.urandom(20).hex()
+    with pytest.raises(Exception, match="Duplicate"):
+        build_tree([(address, 1), (address.upper().replace("0X", "0x"), 2)])
@@ -4,14 +4,18 @@ from brownie.convert import to_bytes, to_uint
 from brownie.convert.datatypes import Wei
 from brownie.network.state import Chain
 from brownie.test import strategy
-from eth_abi.packed import encode_abi_packed
+from scripts.batch_encoder import (
+    balance_action,
+    balance_action_with_trades,
+    batch_lend,
+    encode_trade_action,
+)
 from scripts.config import CurrencyDefaults, nTokenDefaults
 from scripts.deployment import TestEnvironment
 from tests.constants import (
     BALANCE_FLAG_INT,
     CASH_GROUP_PARAMETERS,
     CURVE_SHAPES,
-    DEPOSIT_ACTION_TYPE,
     MARKET_LENGTH,
     MARKETS,
     PORTFOLIO_FLAG_INT,
@@ -19,7 +23,6 @@ from tests.constants import (
     SECONDS_IN_DAY,
     SECONDS_IN_QUARTER,
     START_TIME,
-    TRADE_ACTION_TYPE,
 )
 
 chain = Chain()
@@ -274,112 +277,19 @@ def active_currencies_to_list(activeCurrencies):
 
 
 def get_balance_action(currencyId, depositActionType, **kwargs):
-    depositActionAmount = (
-        0 if "depositActionAmount" not in kwargs else kwargs["depositActionAmount"]
-    )
-    withdrawAmountInternalPrecision = (
-        0
-        if "withdrawAmountInternalPrecision" not in kwargs
-        else kwargs["withdrawAmountInternalPrecision"]
-    )
-    withdrawEntireCashBalance = (
-        False if "withdrawEntireCashBalance" not in kwargs else kwargs["withdrawEntireCashBalance"]
-    )
-    redeemToUnderlying = (
-        False if "redeemToUnderlying" not in kwargs else kwargs["redeemToUnderlying"]
-    )
-
-    return (
-        DEPOSIT_ACTION_TYPE[depositActionType],
-        currencyId,
-        int(depositActionAmount),
-        int(withdrawAmountInternalPrecision),
-        withdrawEntireCashBalance,
-        redeemToUnderlying,
-    )
+    return balance_action(currencyId, depositActionType, **kwargs)
 
 
 def get_balance_trade_action(currencyId, depositActionType, tradeActionData, **kwargs):
-    tradeActions = [get_trade_action(**t) for t in tradeActionData]
-    balanceAction = list(get_balance_action(currencyId, depositActionType, **kwargs))
-    balanceAction.append(tradeActions)
-
-    return tuple(balanceAction)
+    return balance_action_with_trades(currencyId, depositActionType, tradeActionData, **kwargs)
 
 
 def get_lend_action(currencyId, tradeActionData, depositUnderlying):
-    tradeActions = [get_trade_action(**t) for t in tradeActionData]
-    return (currencyId, depositUnderlying, tradeActions)
+    return batch_lend(currencyId, tradeActionData, depositUnderlying)
 
 
 def get_trade_action(**kwargs):
-    tradeActionType = kwargs["tradeActionType"]
-
-    if tradeActionType == "Lend":
-        return encode_abi_packed(
-            ["uint8", "uint8", "uint88", "uint32", "uint120"],
-            [
-                TRADE_ACTION_TYPE[tradeActionType],
-                kwargs["marketIndex"],
-                int(kwargs["notional"]),
-                int(kwargs["minSlippage"]),
-                0,
-            ],
-        )
-    elif tradeActionType == "Borrow":
-        return encode_abi_packed(
-            ["uint8", "uint8", "uint88", "uint32", "uint120"],
-            [
-                TRADE_ACTION_TYPE[tradeActionType],
-                kwargs["marketIndex"],
-                int(kwargs["notional"]),
-                int(kwargs["maxSlippage"]),
-                0,
-            ],
-        )
-    elif tradeActionType == "AddLiquidity":
-        return encode_abi_packed(
-            ["uint8", "uint8", "uint88", "uint32", "uint32", "uint88"],
-            [
-                TRADE_ACTION_TYPE[tradeActionType],
-                kwargs["marketIndex"],
-                int(kwargs["notional"]),
-                int(kwargs["minSlippage"]),
-                int(kwargs["maxSlippage"]),
-                0,
-            ],
-        )
-    elif tradeActionType == "RemoveLiquidity":
-        return encode_abi_packed(
-            ["uint8", "uint8", "uint88", "uint32", "uint32", "uint88"],
-            [
-                TRADE_ACTION_TYPE[tradeActionType],
-                kwargs["marketIndex"],
-                int(kwargs["notional"]),
-                int(kwargs["minSlippage"]),
-                int(kwargs["maxSlippage"]),
-                0,
-            ],
-        )
-    elif tradeActionType == "PurchaseNTokenResidual":
-        return encode_abi_packed(
-            ["uint8", "uint32", "int88", "uint128"],
-            [
-                TRADE_ACTION_TYPE[tradeActionType],
-                kwargs["maturity"],
-                int(kwargs["fCashAmountToPurchase"]),
-                0,
-            ],
-        )
-    elif tradeActionType == "SettleCashDebt":
-        return encode_abi_packed(
-            ["uint8", "address", "uint88"],
-            [
-                TRADE_ACTION_TYPE[tradeActionType],
-                kwargs["counterparty"],
-                int(kwargs["amountToSettle"]),
-            ],
-        )
+    return encode_trade_action(**kwargs)
 
 
 def _enable_cash_group(currencyId, env, accounts, initialCash=50000000e8):
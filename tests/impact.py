@@ -0,0 +1,296 @@
+"""
+Test impact analysis, selects the test modules affected by a set of changed files.
+
+Solidity sources in contracts/ and interfaces/ are parsed for their imports and the contracts,
+libraries and interfaces they define. Libraries that brownie links at deploy time are always
+imported by the contracts that call them, so the import graph also covers library links. A change
+to a Solidity file affects every contract defined in that file or in any file importing it,
+directly or transitively.
+
+Each test module is mapped to the contract names it references: names in its own source, in the
+conftest.py files above it and in every tests / scripts module it imports (i.e. tests.helpers or
+scripts.deployment), which covers the mocks and actions deployed by fixtures and by the
+TestEnvironment. A test module is affected if it references one of the affected contracts or if
+it, a conftest above it or any module it imports has changed.
+
+Anything the analysis cannot attribute (brownie-config.yaml, requirements, abi files, deleted
+Solidity sources, unknown paths) falls back to running the full suite.
+
+Usage:
+    brownie test --impacted-by <git ref>
+    python -m tests.impact <git ref>
+"""
+import ast
+import fnmatch
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+
+SOLIDITY_DIRS = ("contracts", "interfaces")
+PYTHON_DIRS = ("tests", "scripts")
+# Changes to these files never affect test results
+NO_IMPACT_PATTERNS = ("*.md", "docs/*", "audits/*", "reports/*", ".vscode/*", "requests.jsonl")
+
+IMPORT_PATTERN = re.compile(r"^\s*import\s+(?:[^;]*?\bfrom\s+)?[\"']([^\"']+)[\"']", re.M)
+DEFINITION_PATTERN = re.compile(r"^\s*(?:abstract\s+)?(?:contract|library|interface)\s+(\w+)", re.M)
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_]\w*")
+COMMENT_PATTERN = re.compile(r"//[^\n]*|/\*.*?\*/", re.S)
+
+
+def _read(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def _walk(root, directory, extension):
+    for (dirpath, _, filenames) in os.walk(os.path.join(root, directory)):
+        for name in sorted(filenames):
+            if name.endswith(extension):
+                yield os.path.relpath(os.path.join(dirpath, name), root).replace(os.sep, "/")
+
+
+def _closure(start, edges):
+    """All nodes reachable from `start` through `edges`, including the start nodes"""
+    seen = set(start)
+    stack = list(start)
+    while stack:
+        for node in edges.get(stack.pop(), ()):
+            if node not in seen:
+                seen.add(node)
+                stack.append(node)
+    return seen
+
+
+class SolidityGraph:
+    def __init__(self, root):
+        self.root = root
+        # Source path => set of imported source paths inside the repo
+        self.imports = {}
+        # Source path => names of the contracts, libraries and interfaces it defines
+        self.definitions = {}
+        self.importedBy = defaultdict(set)
+
+        for directory in SOLIDITY_DIRS:
+            for path in _walk(root, directory, ".sol"):
+                source = COMMENT_PATTERN.sub("", _read(os.path.join(root, path)))
+                self.definitions[path] = set(DEFINITION_PATTERN.findall(source))
+                self.imports[path] = {
+                    resolved
+                    for resolved in (self._resolve(path, i) for i in IMPORT_PATTERN.findall(source))
+                    if resolved is not None
+                }
+
+        for (path, imports) in self.imports.items():
+            for imported in imports:
+                self.importedBy[imported].add(path)
+
+    def _resolve(self, path, imported):
+        if imported.startswith("."):
+            resolved = os.path.normpath(os.path.join(os.path.dirname(path), imported))
+        else:
+            # Remapped dependencies (i.e. @openzeppelin) are not part of the repo
+            resolved = os.path.normpath(imported)
+        resolved = resolved.replace(os.sep, "/")
+        return resolved if os.path.isfile(os.path.join(self.root, resolved)) else None
+
+    def dependents(self, paths):
+        """Sources that import any of `paths` directly or transitively, including `paths`"""
+        return _closure(paths, self.importedBy)
+
+    def affected_names(self, paths):
+        return {name for p in self.dependents(paths) for name in self.definitions.get(p, ())}
+
+
+class PythonGraph:
+    def __init__(self, root):
+        self.root = root
+        # Module path => set of imported module paths inside the repo
+        self.imports = {}
+        # Module path => identifiers referenced anywhere in the source, including strings
+        self.identifiers = {}
+
+        for directory in PYTHON_DIRS:
+            for path in _walk(root, directory, ".py"):
+                source = _read(os.path.join(root, path))
+                self.identifiers[path] = set(IDENTIFIER_PATTERN.findall(source))
+                self.imports[path] = self._parse_imports(path, source)
+
+    def _module_path(self, module):
+        base = module.replace(".", "/")
+        for candidate in (base + ".py", base + "/__init__.py"):
+            if os.path.isfile(os.path.join(self.root, candidate)):
+                return candidate
+        return None
+
+    def _parse_imports(self, path, source):
+        try:
+            tree = ast.parse(source, path)
+        except SyntaxError:
+            return set()
+
+        modules = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                modules.update(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module is not None and node.level == 0:
+                modules.add(node.module)
+                # from scripts.offchain import market
+                modules.update("{}.{}".format(node.module, alias.name) for alias in node.names)
+
+        resolved = set()
+        for module in modules:
+            if module.split(".")[0] not in PYTHON_DIRS:
+                continue
+            modulePath = self._module_path(module)
+            if modulePath is not None:
+                resolved.add(modulePath)
+        return resolved
+
+    def conftests(self, path):
+        """conftest.py files that apply to a test module"""
+        found = []
+        directory = os.path.dirname(path)
+        while directory:
+            conftest = directory + "/conftest.py"
+            if conftest in self.imports:
+                found.append(conftest)
+            directory = os.path.dirname(directory)
+        return found
+
+    def dependencies(self, path):
+        """The test module, its conftests and every repo module they import, transitively"""
+        return _closure([path] + self.conftests(path), self.imports)
+
+    def test_modules(self):
+        return sorted(
+            p
+            for p in self.imports
+            if p.startswith("tests/") and fnmatch.fnmatch(os.path.basename(p), "test_*.py")
+        )
+
+
+class ImpactAnalysis:
+    def __init__(self, root="."):
+        self.root = os.path.abspath(root)
+        self.solidity = SolidityGraph(self.root)
+        self.python = PythonGraph(self.root)
+
+    def select(self, changedFiles):
+        """
+        Returns (modules, reason). `modules` is the sorted list of affected test modules, or None
+        when the full suite has to run, in which case `reason` names the file responsible.
+        """
+        changedSolidity = set()
+        changedPython = set()
+        for path in changedFiles:
+            path = path.replace(os.sep, "/")
+            if any(fnmatch.fnmatch(path, p) for p in NO_IMPACT_PATTERNS):
+                continue
+            elif path.endswith(".sol") and path in self.solidity.definitions:
+                changedSolidity.add(path)
+            elif path.endswith(".py") and path in self.python.imports:
+                changedPython.add(path)
+            elif path.endswith(".py") and path.split("/")[0] not in PYTHON_DIRS:
+                # Python files outside of tests and scripts are never imported by the suite
+                continue
+            else:
+                return (None, path)
+
+        affectedNames = self.solidity.affected_names(changedSolidity)
+        selected = []
+        for module in self.python.test_modules():
+            dependencies = self.python.dependencies(module)
+            if not changedPython.isdisjoint(dependencies):
+                selected.append(module)
+                continue
+
+            referenced = set().union(*(self.python.identifiers[d] for d in dependencies))
+            if not affectedNames.isdisjoint(referenced):
+                selected.append(module)
+
+        return (selected, None)
+
+
+def changed_files(base, root="."):
+    """Files changed between `base` and the working tree, including untracked files"""
+
+    def git(*args):
+        return subprocess.run(
+            ("git",) + args, cwd=root, check=True, capture_output=True, text=True
+        ).stdout.splitlines()
+
+    # Renames are listed as a deletion and an addition so both paths are considered
+    changed = git("diff", "--name-only", "--no-renames", base)
+    changed += git("ls-files", "--others", "--exclude-standard")
+    return sorted(set(f for f in changed if f))
+
+
+class ImpactSelector:
+    def __init__(self, base):
+        self.base = base
+        self.modules = None
+        self.reason = None
+
+    def pytest_collection_modifyitems(self, session, config, items):
+        root = str(config.rootdir)
+        try:
+            changed = changed_files(self.base, root)
+        except subprocess.CalledProcessError as e:
+            self.reason = "git diff against {} failed: {}".format(self.base, e.stderr.strip())
+            return
+
+        (modules, fullRunPath) = ImpactAnalysis(root).select(changed)
+        if modules is None:
+            self.reason = "{} changed".format(fullRunPath)
+            return
+
+        self.modules = set(modules)
+        (selected, deselected) = ([], [])
+        for item in items:
+            path = os.path.relpath(str(item.fspath), root).replace(os.sep, "/")
+            (selected if path in self.modules else deselected).append(item)
+
+        if deselected:
+            config.hook.pytest_deselected(items=deselected)
+            items[:] = selected
+
+    def pytest_report_collectionfinish(self):
+        if self.modules is None:
+            return "impact analysis: running the full suite, {}".format(self.reason)
+        return "impact analysis: {} test modules affected by changes since {}".format(
+            len(self.modules), self.base
+        )
+
+
+def add_options(parser):
+    group = parser.getgroup("impact analysis")
+    group.addoption(
+        "--impacted-by",
+        action="store",
+        default=None,
+        metavar="REF",
+        help="Only run test modules affected by the changes since the git ref REF",
+    )
+
+
+def register(config):
+    base = config.getoption("--impacted-by")
+    if base is not None:
+        config.pluginmanager.register(ImpactSelector(base), "impact_selector")
+
+
+def main(argv):
+    """Prints the affected test modules, or `ALL` when the full suite has to run"""
+    base = argv[0] if argv else "HEAD"
+    (modules, fullRunPath) = ImpactAnalysis().select(changed_files(base))
+    if modules is None:
+        print("ALL  # {} changed".format(fullRunPath))
+    else:
+        print("\n".join(modules))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -4,6 +4,9 @@ import random
 from brownie import MockAggregator, MockCToken, MockValuationLib, cTokenV2Aggregator
 from brownie.convert.datatypes import HexString, Wei
 from brownie.network.state import Chain
+from scripts.offchain.asset_rate import AssetRate
+from scripts.offchain.exchange_rate import ETHRate
+from scripts.rate_provider import RateProvider
 from tests.constants import (
     BASIS_POINT,
     RATE_PRECISION,
@@ -71,44 +74,67 @@ class ValuationMock:
             self.cTokens[i] = account.deploy(MockCToken, 8)
             self.cTokens[i].setAnswer(self.cTokenRates[i])
             self.ethAggregators[i] = MockAggregator.deploy(18, {"from": account})
+            self.ethAggregators[i].setAnswer(self.ethRates[i])
             self.cTokenAdapters[i] = cTokenV2Aggregator.deploy(
                 self.cTokens[i].address, {"from": account}
             )
-
-            c.setAssetRateMapping(i, (self.cTokenAdapters[i].address, self.underlyingDecimals[i]))
             self.cashGroups[i] = get_cash_group_with_max_markets(3)
-            c.setCashGroup(i, self.cashGroups[i])
-
-            self.ethAggregators[i].setAnswer(self.ethRates[i])
-            c.setETHRateMapping(
-                i,
-                get_eth_rate_mapping(
-                    self.ethAggregators[i],
-                    buffer=self.bufferHaircutDiscount[i][0],
-                    haircut=self.bufferHaircutDiscount[i][1],
-                    discount=self.bufferHaircutDiscount[i][2],
-                ),
-            )
-
-            c.setNTokenValue(
-                i,
-                self.nTokenAddress[i],
-                self.nTokenTotalSupply[i],
-                self.nTokenCashBalance[i],
-                self.nTokenParameters[i][0],
-                self.nTokenParameters[i][1],
-                START_TIME,
-            )
-
             # TODO: change the market curve...
             self.markets[i] = get_market_curve(3, "flat")
-            for m in self.markets[i]:
-                c.setMarketStorage(i, SETTLEMENT_DATE, m)
 
+        # Writes every currency's settings to the mock in one transaction
+        c.setCurrencies([self.get_currency_settings(i) for i in range(1, 5)])
         chain.mine(1, timestamp=START_TIME)
 
         self.mock = c
 
+    def get_currency_settings(self, i):
+        """Returns a MockCurrencySettings tuple for setCurrencies"""
+        return (
+            i,
+            (self.cTokenAdapters[i].address, self.underlyingDecimals[i]),
+            get_eth_rate_mapping(
+                self.ethAggregators[i],
+                buffer=self.bufferHaircutDiscount[i][0],
+                haircut=self.bufferHaircutDiscount[i][1],
+                discount=self.bufferHaircutDiscount[i][2],
+            ),
+            self.cashGroups[i],
+            self.nTokenAddress[i],
+            self.nTokenTotalSupply[i],
+            self.nTokenCashBalance[i],
+            self.nTokenParameters[i][0],
+            self.nTokenParameters[i][1],
+            START_TIME,
+            SETTLEMENT_DATE,
+            self.markets[i],
+        )
+
+    def set_account(self, account, balances, assets=()):
+        """
+        Sets an account's balances and assets in one transaction. `balances` maps currency id to
+        (cashBalance, nTokenBalance), assets go to the bitmap if the account has one enabled.
+        """
+        return self.mock.setAccount(
+            account, [(c, b[0], b[1]) for (c, b) in balances.items()], list(assets)
+        )
+
+    def get_rate_provider(self):
+        """Off chain rates matching the mocked oracles, rounds exactly like the contracts"""
+        ethRates = {}
+        assetRates = {}
+        for i in range(1, 5):
+            (buffer, haircut, discount) = self.bufferHaircutDiscount[i]
+            ethRates[i] = ETHRate.fromOracle(
+                i, int(self.ethRates[i]), 18, False, buffer, haircut, discount
+            )
+            assetRates[i] = AssetRate(
+                self.cTokenAdapters[i].address,
+                int(self.cTokenRates[i]),
+                10 ** self.underlyingDecimals[i],
+            )
+        return RateProvider.fromRates(ethRates, assetRates)
+
     def calculate_to_underlying(self, currency, balance):
         return math.trunc(
             (balance * self.cTokenRates[currency] * Wei(1e8))
@@ -0,0 +1,124 @@
+import random
+
+import pytest
+from brownie.test import given, strategy
+from scripts.bitmap_valuation import BitmapPortfolios, DiscountFactorTable, present_values
+from scripts.offchain.cash_group import CashGroup
+from scripts.offchain.date_time import getBitNumFromMaturity, getMaturityFromBitNum
+from scripts.offchain.market import Market
+from tests.constants import (
+    MARKETS,
+    RATE_PRECISION,
+    SECONDS_IN_DAY,
+    SETTLEMENT_DATE,
+    START_TIME,
+    START_TIME_TREF,
+)
+from tests.helpers import get_cash_group_with_max_markets, get_market_state, random_asset_bitmap
+
+ORACLE_RATES = [0.01, 0.02, 0.03, 0.04, 0.05, 0.06, 0.07]
+
+
+@pytest.mark.portfolio
+class TestBitmapValuation:
+    @pytest.fixture(scope="module", autouse=True)
+    def mockAssetRate(self, MockCToken, cTokenV2Aggregator, accounts):
+        mockToken = MockCToken.deploy(8, {"from": accounts[0]})
+        mockToken.setSupplyRate(0.01e18)
+        mockToken.setAnswer(0.01e18)
+        return cTokenV2Aggregator.deploy(mockToken.address, {"from": accounts[0]})
+
+    @pytest.fixture(scope="module", autouse=True)
+    def bitmapAssets(self, MockBitmapAssetsHandler, mockAssetRate, accounts):
+        handler = MockBitmapAssetsHandler.deploy({"from": accounts[0]})
+        handler.setAssetRateMapping(1, (mockAssetRate.address, 18))
+        handler.setCashGroup(1, get_cash_group_with_max_markets(7))
+        for (maturity, rate) in zip(MARKETS, ORACLE_RATES):
+            handler.setMarketStorage(
+                1,
+                SETTLEMENT_DATE,
+                get_market_state(
+                    maturity,
+                    lastImpliedRate=rate * RATE_PRECISION,
+                    oracleRate=rate * RATE_PRECISION,
+                ),
+            )
+
+        return handler
+
+    @pytest.fixture(autouse=True)
+    def isolation(self, fn_isolation):
+        pass
+
+    def get_table(self, mockAssetRate):
+        cashGroup = CashGroup.fromParameters(
+            1, get_cash_group_with_max_markets(7), (mockAssetRate.address, 0, 10 ** 18)
+        )
+        markets = [
+            Market.fromParameters(
+                get_market_state(
+                    m, lastImpliedRate=r * RATE_PRECISION, oracleRate=r * RATE_PRECISION
+                )
+            )
+            for (m, r) in zip(MARKETS, ORACLE_RATES)
+        ]
+        supplyRate = mockAssetRate.getAnnualizedSupplyRate()
+        return DiscountFactorTable.fromMarkets(cashGroup, markets, supplyRate, START_TIME)
+
+    def set_random_assets(self, bitmapAssets, account, nextSettleTime):
+        (maxBit, _) = bitmapAssets.getBitNumFromMaturity(nextSettleTime, MARKETS[6])
+        (_, bitmapList) = random_asset_bitmap(10, maxBit)
+        assets = {}
+        for (i, b) in enumerate(bitmapList):
+            if b == "1":
+                notional = random.randint(-1e12, 1e12)
+                maturity = bitmapAssets.getMaturityFromBitNum(nextSettleTime, i + 1)
+                bitmapAssets.addifCashAsset(account, 1, maturity, nextSettleTime, notional)
+                assets[i + 1] = notional
+
+        return assets
+
+    @given(
+        days=strategy("uint", min_value=0, max_value=89),
+        bitNum=strategy("uint", min_value=1, max_value=256),
+    )
+    def test_bit_num_matches_contract(self, bitmapAssets, days, bitNum):
+        blockTime = START_TIME_TREF + days * SECONDS_IN_DAY
+        maturity = getMaturityFromBitNum(blockTime, bitNum)
+        assert maturity == bitmapAssets.getMaturityFromBitNum(blockTime, bitNum)
+        for offset in [0, SECONDS_IN_DAY, SECONDS_IN_DAY // 2]:
+            assert getBitNumFromMaturity(
+                blockTime, maturity + offset
+            ) == bitmapAssets.getBitNumFromMaturity(blockTime, maturity + offset)
+
+    def test_npv_matches_contract(self, bitmapAssets, mockAssetRate, accounts):
+        cashGroup = bitmapAssets.buildCashGroupView(1)
+        table = self.get_table(mockAssetRate)
+        nextSettleTimes = [START_TIME_TREF, START_TIME - START_TIME % SECONDS_IN_DAY]
+        portfolios = []
+
+        for (account, nextSettleTime) in zip(accounts[0:2], nextSettleTimes):
+            assets = self.set_random_assets(bitmapAssets, account, nextSettleTime)
+            portfolios.append(assets)
+
+            for riskAdjusted in [True, False]:
+                assert table.getNetPresentValueFromBitmap(
+                    nextSettleTime, assets, riskAdjusted
+                ) == bitmapAssets.getifCashNetPresentValue(
+                    account, 1, nextSettleTime, START_TIME, cashGroup, riskAdjusted
+                )
+
+        maturities = [
+            [(getMaturityFromBitNum(t, b), n) for (b, n) in assets.items()]
+            for (t, assets) in zip(nextSettleTimes, portfolios)
+        ]
+        bitmapPortfolios = BitmapPortfolios.build(
+            accounts[0:2], [1, 1], nextSettleTimes, maturities
+        )
+        for riskAdjusted in [True, False]:
+            values = present_values(bitmapPortfolios, {1: table}, riskAdjusted)
+            for (i, account) in enumerate(accounts[0:2]):
+                (pv, _) = bitmapAssets.getifCashNetPresentValue(
+                    account, 1, nextSettleTimes[i], START_TIME, cashGroup, riskAdjusted
+                )
+                assert pytest.approx(values[i], abs=len(portfolios[i])) == pv
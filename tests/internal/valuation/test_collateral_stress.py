@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+from brownie.network.state import Chain
+from scripts.collateral_stress import (
+    Scenarios,
+    StressParameters,
+    StressPortfolio,
+    base_scenario,
+    correlated_scenarios,
+    free_collateral,
+    stress,
+)
+from tests.constants import BASIS_POINT, MARKETS, SETTLEMENT_DATE, START_TIME
+from tests.helpers import get_fcash_token
+from tests.internal.liquidation.liquidation_helpers import ValuationMock
+
+chain = Chain()
+RATE_SHIFT = 100 * BASIS_POINT
+
+
+@pytest.mark.valuation
+class TestCollateralStress:
+    @pytest.fixture(scope="module", autouse=True)
+    def freeCollateral(self, MockFreeCollateral, accounts):
+        return ValuationMock(accounts[0], MockFreeCollateral)
+
+    @pytest.fixture(autouse=True)
+    def isolation(self, fn_isolation):
+        pass
+
+    def set_account(self, freeCollateral, account):
+        balances = {1: (100e8, 0), 2: (-50_000e8, 20_000e8), 3: (0, 15_000e8)}
+        for (currency, (cash, nTokens)) in balances.items():
+            freeCollateral.mock.setBalance(account, currency, cash, nTokens)
+        assets = [
+            get_fcash_token(1, currencyId=2, maturity=MARKETS[0], notional=-400e8),
+            get_fcash_token(1, currencyId=2, maturity=MARKETS[2], notional=-600e8),
+            get_fcash_token(1, currencyId=3, maturity=MARKETS[1], notional=800e8),
+        ]
+        freeCollateral.mock.setPortfolio(account, assets)
+        return balances
+
+    def fetch_portfolio(self, freeCollateral, accounts, params):
+        balances = [self.set_account(freeCollateral, accounts[0])]
+        (_, _, portfolio) = freeCollateral.mock.getAccount(accounts[0])
+        fCash = [
+            [
+                (a[0], a[1], freeCollateral.mock.getRiskAdjustedPresentfCashValue(a, START_TIME))
+                for a in portfolio
+            ]
+        ]
+        return StressPortfolio.build(params.currencyIds, balances, fCash, START_TIME)
+
+    def get_fc(self, freeCollateral, accounts):
+        txn = freeCollateral.mock.testFreeCollateral(accounts[0], START_TIME)
+        return txn.events["FreeCollateralResult"][0]["fc"]
+
+    def test_base_scenario_matches_free_collateral(self, freeCollateral, accounts):
+        params = StressParameters.fromValuationMock(freeCollateral)
+        portfolio = self.fetch_portfolio(freeCollateral, accounts, params)
+        fc = free_collateral(portfolio, params, base_scenario(params))
+
+        assert fc.shape == (1, 1)
+        assert pytest.approx(fc[0, 0], rel=1e-6) == self.get_fc(freeCollateral, accounts)
+
+    def test_shocked_scenario_matches_free_collateral(self, freeCollateral, accounts):
+        params = StressParameters.fromValuationMock(freeCollateral)
+        portfolio = self.fetch_portfolio(freeCollateral, accounts, params)
+        ethRates = params.ethRates * [1, 1.2, 0.9, 1]
+        assetRates = params.assetRates * [1, 1.01, 1.02, 1]
+        shifts = np.array([0, RATE_SHIFT, -RATE_SHIFT, 0])
+        fc = free_collateral(
+            portfolio, params, Scenarios(ethRates[None, :], assetRates[None, :], shifts[None, :])
+        )
+
+        for (i, currency) in enumerate(params.currencyIds):
+            freeCollateral.ethAggregators[currency].setAnswer(int(ethRates[i] * 1e18))
+            freeCollateral.cTokens[currency].setAnswer(
+                int(freeCollateral.cTokenRates[currency] * assetRates[i] / params.assetRates[i])
+            )
+            for m in freeCollateral.markets[currency]:
+                rate = m[5] + shifts[i]
+                freeCollateral.mock.setMarketStorage(
+                    currency, SETTLEMENT_DATE, m[:5] + (rate, rate) + m[7:]
+                )
+
+        assert pytest.approx(fc[0, 0], rel=1e-5) == self.get_fc(freeCollateral, accounts)
+
+    def test_stress_distribution(self, freeCollateral, accounts):
+        params = StressParameters.fromValuationMock(freeCollateral)
+        portfolio = self.fetch_portfolio(freeCollateral, accounts, params)
+        currencies = len(params.currencyIds)
+        volatility = [0] + [0.2] * (currencies - 1) + [0] * currencies + [RATE_SHIFT] * currencies
+        scenarios = correlated_scenarios(params, 5000, volatility, np.identity(3 * currencies))
+        result = stress(portfolio, params, scenarios, reserves=[0, 1_000e8, 0, 0])
+
+        fc = free_collateral(portfolio, params, scenarios)[:, 0]
+        assert list(result.liquidatable) == list((fc < 0).astype(int))
+        assert np.allclose(result.shortfall, np.maximum(-fc, 0))
+        assert result.accountLiquidations[0] == (fc < 0).sum()
+        # Bad debt is never more than the shortfall since haircuts and buffers are removed
+        assert (result.badDebt <= result.shortfall).all()
+        assert 0 < result.liquidatable.sum() < len(fc)
+        assert result.summary()["badDebtExceedsReserves"] <= result.liquidatable.mean()
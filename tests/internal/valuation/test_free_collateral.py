@@ -45,8 +45,9 @@ class TestFreeCollateral:
 
         return (fc, netLocal, txn)
 
-    def set_random_balances(self, freeCollateral, accounts, bitmapCurrency=0):
+    def set_random_balances(self, freeCollateral, accounts, bitmapCurrency=0, assets=()):
         balanceAssetPV = OrderedDict({})
+        balances = {}
 
         for currency in range(1, 5):
             if bitmapCurrency == currency:
@@ -55,11 +56,12 @@ class TestFreeCollateral:
                 cashBalance = random.randint(-100_000e8, 100_000e8)
 
             nTokens = random.randint(0, 100_000e8)
-            freeCollateral.mock.setBalance(accounts[0], currency, cashBalance, nTokens)
+            balances[currency] = (cashBalance, nTokens)
             nTokenAsset = freeCollateral.calculate_ntoken_to_asset(currency, nTokens)
 
             balanceAssetPV[currency] = nTokenAsset + cashBalance
 
+        freeCollateral.set_account(accounts[0], balances, assets)
         return balanceAssetPV
 
     # Test Single Free Collateral Components
@@ -89,6 +91,20 @@ class TestFreeCollateral:
         ethFC = freeCollateral.calculate_to_eth(currency, underlying)
         assert pytest.approx(fc, abs=1) == ethFC
 
+    @given(
+        currency=strategy("uint", min_value=1, max_value=4),
+        balance=strategy("int", min_value=-100_000_000e8, max_value=100_000_000e8),
+    )
+    def test_rate_provider_matches_free_collateral(
+        self, freeCollateral, accounts, currency, balance
+    ):
+        freeCollateral.mock.setBalance(accounts[0], currency, balance, 0)
+        (fc, _, _) = self.get_fc_and_net_local(freeCollateral, accounts)
+
+        # Off chain rates built from the mocked oracles round exactly like the contracts
+        rates = freeCollateral.get_rate_provider()
+        assert fc == rates.convertAssetToETH(currency, balance)
+
     # nToken Balance
     @given(
         currency=strategy("uint", min_value=1, max_value=4),
@@ -111,13 +127,11 @@ class TestFreeCollateral:
         numCurrencies=strategy("uint", min_value=1, max_value=4),
     )
     def test_portfolio_valuation(self, freeCollateral, accounts, numAssets, numCurrencies):
-        balanceAssetPV = self.set_random_balances(freeCollateral, accounts)
-
         cashGroups = []
         for i in range(1, numCurrencies + 1):
             cashGroups.append(freeCollateral.cashGroups[i])
         assets = get_portfolio_array(numAssets, cashGroups, sorted=True)
-        freeCollateral.mock.setPortfolio(accounts[0], assets)
+        balanceAssetPV = self.set_random_balances(freeCollateral, accounts, assets=assets)
 
         i = 0
         (fc, netLocal, _) = self.get_fc_and_net_local(freeCollateral, accounts)
@@ -156,13 +170,18 @@ class TestFreeCollateral:
     )
     def test_bitmap_valuation(self, freeCollateral, accounts, numAssets, currency):
         freeCollateral.mock.enableBitmapForAccount(accounts[0], currency, START_TIME_TREF)
-        balanceAssetPV = self.set_random_balances(freeCollateral, accounts, bitmapCurrency=currency)
-
+        assets = []
         for i in range(0, numAssets):
             bitNum = random.randint(1, 130)
             maturity = freeCollateral.mock.getMaturityFromBitNum(START_TIME_TREF, bitNum)
             notional = random.randint(-500_000e8, 500_000e8)
-            freeCollateral.mock.setifCashAsset(accounts[0], currency, maturity, notional)
+            assets.append(
+                get_fcash_token(1, currencyId=currency, maturity=maturity, notional=notional)
+            )
+
+        balanceAssetPV = self.set_random_balances(
+            freeCollateral, accounts, bitmapCurrency=currency, assets=assets
+        )
 
         (_, _, portfolio) = freeCollateral.mock.getAccount(accounts[0])
 
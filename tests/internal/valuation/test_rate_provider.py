@@ -0,0 +1,83 @@
+from itertools import product
+
+import pytest
+from brownie.test import given, strategy
+from scripts.offchain.asset_rate import AssetRate
+from scripts.offchain.exchange_rate import ETHRate
+from scripts.rate_provider import RateProvider
+
+parameterNames = "rateDecimals,mustInvert"
+parameterValues = list(product([6, 8, 18], [True, False]))
+
+
+@pytest.mark.valuation
+class TestRateProvider:
+    @pytest.fixture(scope="module", autouse=True)
+    def exchangeRate(self, MockExchangeRate, accounts):
+        return accounts[0].deploy(MockExchangeRate)
+
+    @pytest.fixture(scope="module", autouse=True)
+    def assetRate(self, MockAssetRate, accounts):
+        return accounts[0].deploy(MockAssetRate)
+
+    @pytest.fixture(autouse=True)
+    def isolation(self, fn_isolation):
+        pass
+
+    def get_provider(self, accounts):
+        ethRates = {
+            1: ETHRate.fromOracle(1, 0, 18, False, 130, 70, 105),
+            2: ETHRate.fromOracle(2, 0.01e18, 18, False, 105, 95, 106),
+            3: ETHRate.fromOracle(3, 91e6, 8, True, 110, 90, 107),
+        }
+        assetRates = {
+            1: AssetRate(accounts[9].address, 200000000000000000000000000, 10 ** 18),
+            2: AssetRate(accounts[9].address, 210000000000000000000000000, 10 ** 18),
+            3: AssetRate(accounts[9].address, 220000000000000, 10 ** 6),
+        }
+        return RateProvider.fromRates(ethRates, assetRates)
+
+    @pytest.mark.parametrize(parameterNames, parameterValues)
+    def test_build_exchange_rate(
+        self, accounts, MockAggregator, exchangeRate, rateDecimals, mustInvert
+    ):
+        aggregator = accounts[0].deploy(MockAggregator, rateDecimals)
+        aggregator.setAnswer(10 ** rateDecimals / 100)
+        exchangeRate.setETHRateMapping(
+            2, (aggregator.address, rateDecimals, mustInvert, 120, 80, 105)
+        )
+
+        ethRate = ETHRate.fromOracle(
+            2, aggregator.latestAnswer(), rateDecimals, mustInvert, 120, 80, 105
+        )
+        assert ethRate == ETHRate.fromParameters(exchangeRate.buildExchangeRate(2))
+
+    @given(
+        currencyId=strategy("uint", min_value=1, max_value=3),
+        amount=strategy("uint88", min_value=1e8),
+        isNegative=strategy("bool"),
+    )
+    def test_conversions_match_contracts(
+        self, accounts, exchangeRate, assetRate, currencyId, amount, isNegative
+    ):
+        # Mocks assert that the sign is preserved so dust amounts are excluded
+        balance = -amount if isNegative else amount
+        rates = self.get_provider(accounts)
+        er = rates.getETHRate(currencyId)
+        ar = rates.getAssetRate(currencyId)
+
+        assert rates.convertToUnderlying(currencyId, balance) == assetRate.convertToUnderlying(
+            ar, balance
+        )
+        assert rates.convertFromUnderlying(currencyId, balance) == assetRate.convertFromUnderlying(
+            ar, balance
+        )
+        assert rates.convertToETH(currencyId, balance) == exchangeRate.convertToETH(er, balance)
+        assert rates.convertETHTo(currencyId, balance) == exchangeRate.convertETHTo(er, balance)
+
+    def test_exchange_rate(self, accounts, exchangeRate):
+        rates = self.get_provider(accounts)
+        for (base, quote) in product(range(1, 4), range(1, 4)):
+            assert rates.exchangeRate(base, quote) == exchangeRate.exchangeRate(
+                rates.getETHRate(base), rates.getETHRate(quote)
+            )
@@ -0,0 +1,233 @@
+"""
+pytest plugin that records JSON-RPC traffic per test and per fixture.
+
+Every request sent through the active web3 provider is counted and timed and attributed to the
+fixture being set up or to the setup / call / teardown phase of the running test. Transaction
+receipts are used to count deployments and gas used. Enable with `--rpc-profile=<path>`, the
+report is written as JSON (or CSV if the path ends with .csv) and a summary of the most
+expensive scopes is printed at the end of the session.
+"""
+import csv
+import json
+import time
+from collections import defaultdict
+
+import pytest
+from brownie.network import web3
+
+SORT_KEYS = ("time", "calls", "gas", "deployments")
+
+
+def _new_scope():
+    return {
+        "methods": defaultdict(lambda: {"calls": 0, "time": 0.0}),
+        "calls": 0,
+        "time": 0.0,
+        "deployments": 0,
+        "gas": 0,
+    }
+
+
+class RpcProfiler:
+    def __init__(self, path, sortKey="time", top=20):
+        self.path = path
+        self.sortKey = sortKey
+        self.top = top
+        self.scopes = defaultdict(_new_scope)
+        self.scopeStack = ["session"]
+        self.seenReceipts = set()
+        self.provider = None
+
+    def _install(self):
+        # Brownie replaces the provider when it connects to a network, wrap whichever provider
+        # is currently active
+        provider = web3.provider
+        if provider is None or provider is self.provider:
+            return
+
+        self.uninstall()
+        makeRequest = provider.make_request
+
+        def profiled_make_request(method, params):
+            start = time.perf_counter()
+            try:
+                response = makeRequest(method, params)
+            finally:
+                self._record(method, time.perf_counter() - start)
+
+            if method == "eth_getTransactionReceipt":
+                self._record_receipt(response)
+            return response
+
+        provider.make_request = profiled_make_request
+        # web3 caches the middleware chain it builds around make_request on the first request,
+        # drop it so that requests sent through web3.eth also go through the wrapper
+        provider._request_func_cache = (None, None)
+        self.provider = provider
+
+    def uninstall(self):
+        if self.provider is not None:
+            # Removes the instance attribute, restoring the provider's own make_request
+            del self.provider.make_request
+            self.provider._request_func_cache = (None, None)
+            self.provider = None
+
+    def _record(self, method, elapsed):
+        scope = self.scopes[self.scopeStack[-1]]
+        scope["methods"][method]["calls"] += 1
+        scope["methods"][method]["time"] += elapsed
+        scope["calls"] += 1
+        scope["time"] += elapsed
+
+    def _record_receipt(self, response):
+        receipt = response.get("result") if isinstance(response, dict) else None
+        if not receipt or receipt["transactionHash"] in self.seenReceipts:
+            return
+
+        # Brownie may poll the same receipt several times, only count it once
+        self.seenReceipts.add(receipt["transactionHash"])
+        scope = self.scopes[self.scopeStack[-1]]
+        scope["gas"] += int(receipt["gasUsed"], 16)
+        if receipt.get("contractAddress"):
+            scope["deployments"] += 1
+
+    def _enter(self, scope):
+        self._install()
+        self.scopeStack.append(scope)
+
+    def _exit(self):
+        self.scopeStack.pop()
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_fixture_setup(self, fixturedef, request):
+        self._enter("fixture:{}".format(fixturedef.argname))
+        try:
+            yield
+        finally:
+            self._exit()
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_setup(self, item):
+        self._enter("setup:{}".format(item.nodeid))
+        try:
+            yield
+        finally:
+            self._exit()
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_call(self, item):
+        self._enter("test:{}".format(item.nodeid))
+        try:
+            yield
+        finally:
+            self._exit()
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_teardown(self, item):
+        self._enter("teardown:{}".format(item.nodeid))
+        try:
+            yield
+        finally:
+            self._exit()
+
+    def pytest_sessionfinish(self):
+        self.uninstall()
+
+    def report(self):
+        rows = []
+        for (name, scope) in self.scopes.items():
+            if scope["calls"] == 0:
+                continue
+            rows.append(
+                {
+                    "scope": name,
+                    "calls": scope["calls"],
+                    "time": round(scope["time"], 6),
+                    "deployments": scope["deployments"],
+                    "gas": scope["gas"],
+                    "methods": {
+                        m: {"calls": v["calls"], "time": round(v["time"], 6)}
+                        for (m, v) in sorted(scope["methods"].items())
+                    },
+                }
+            )
+
+        return sorted(rows, key=lambda r: r[self.sortKey], reverse=True)
+
+    def write_report(self, rows):
+        if self.path.endswith(".csv"):
+            methods = sorted({m for r in rows for m in r["methods"]})
+            with open(self.path, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["scope", "calls", "time", "deployments", "gas"] + methods)
+                for r in rows:
+                    writer.writerow(
+                        [r["scope"], r["calls"], r["time"], r["deployments"], r["gas"]]
+                        + [r["methods"].get(m, {}).get("calls", 0) for m in methods]
+                    )
+        else:
+            with open(self.path, "w") as f:
+                json.dump(rows, f, indent=4)
+
+    def pytest_terminal_summary(self, terminalreporter):
+        rows = self.report()
+        self.write_report(rows)
+
+        terminalreporter.section("rpc profile (sorted by {})".format(self.sortKey))
+        terminalreporter.write_line(
+            "{:<70} {:>8} {:>10} {:>8} {:>14}".format(
+                "Scope", "Calls", "Time (s)", "Deploys", "Gas"
+            )
+        )
+        for r in rows[: self.top]:
+            terminalreporter.write_line(
+                "{:<70} {:>8} {:>10.3f} {:>8} {:>14}".format(
+                    r["scope"][-70:], r["calls"], r["time"], r["deployments"], r["gas"]
+                )
+            )
+
+        totals = defaultdict(lambda: [0, 0.0])
+        for r in rows:
+            for (m, v) in r["methods"].items():
+                totals[m][0] += v["calls"]
+                totals[m][1] += v["time"]
+        terminalreporter.write_line("")
+        for (m, (calls, elapsed)) in sorted(totals.items(), key=lambda x: x[1][1], reverse=True):
+            terminalreporter.write_line("{:<40} {:>8} {:>10.3f}".format(m, calls, elapsed))
+        terminalreporter.write_line("Report written to {}".format(self.path))
+
+
+def add_options(parser):
+    group = parser.getgroup("rpc profile")
+    group.addoption(
+        "--rpc-profile",
+        action="store",
+        default=None,
+        metavar="PATH",
+        help="Record JSON-RPC calls per test and fixture and write a report to PATH",
+    )
+    group.addoption(
+        "--rpc-profile-sort",
+        action="store",
+        default="time",
+        choices=SORT_KEYS,
+        help="Column used to sort the rpc profile report",
+    )
+    group.addoption(
+        "--rpc-profile-top",
+        action="store",
+        default=20,
+        type=int,
+        help="Number of scopes shown in the rpc profile summary",
+    )
+
+
+def register(config):
+    path = config.getoption("--rpc-profile")
+    if path is not None:
+        config.pluginmanager.register(
+            RpcProfiler(
+                path, config.getoption("--rpc-profile-sort"), config.getoption("--rpc-profile-top")
+            ),
+            "rpc_profiler",
+        )
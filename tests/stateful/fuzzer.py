@@ -0,0 +1,376 @@
+"""
+Snapshot tree fuzzer for the full protocol.
+
+Random action sequences are explored as a tree: every node is an EVM snapshot and each of its
+children applies one more random action on top of it. Siblings branch from their parent with
+evm_revert instead of replaying their shared prefix from the module setup, so a tree with depth d
+and branching b executes b + b^2 + ... + b^d actions rather than d * b^d.
+
+Every action first draws its arguments from the current state (raising Infeasible if there is
+nothing to act on, i.e. no liquidity tokens to remove) and then sends its transactions. Actions
+that revert leave the state unchanged and are retried with another draw, so every edge of the
+tree changes state. The invariant suite runs after every successful action, a violation raises
+InvariantViolation with the full action sequence, which can be reproduced with `replay`.
+"""
+import random
+from typing import NamedTuple
+
+from brownie.exceptions import VirtualMachineError
+from brownie.network import rpc
+from brownie.network.state import Chain
+from tests.constants import RATE_PRECISION, SECONDS_IN_DAY, SECONDS_IN_QUARTER
+from tests.helpers import get_balance_action, get_balance_trade_action
+from tests.stateful.invariants import check_system_invariants
+
+chain = Chain()
+
+# Currencies traded by the fuzzer, as set up by initialize_environment
+CURRENCY_IDS = (2, 3)
+COLLATERAL_CURRENCY_ID = 1
+SYMBOLS = {2: "DAI", 3: "USDC"}
+UNDERLYING_DECIMALS = {2: 18, 3: 6}
+FCASH_ASSET_TYPE = 1
+# Attempts at drawing an action that succeeds before a branch is abandoned
+MAX_ATTEMPTS = 10
+
+
+class Infeasible(Exception):
+    """Raised while drawing arguments when an action has nothing to act on"""
+
+
+class Step(NamedTuple):
+    action: str
+    args: dict
+
+    def __str__(self):
+        return "{}({})".format(
+            self.action, ", ".join("{}={}".format(k, v) for (k, v) in self.args.items())
+        )
+
+
+class InvariantViolation(Exception):
+    def __init__(self, steps, error):
+        self.steps = steps
+        super().__init__(
+            "Invariant failed after {} steps: {!r}\n{}".format(
+                len(steps), error, "\n".join("  {}".format(s) for s in steps)
+            )
+        )
+
+
+def _underlying(currencyId, notional):
+    """Underlying token amount worth `notional` in internal precision"""
+    return int(notional) * 10 ** UNDERLYING_DECIMALS[currencyId] // 10 ** 8
+
+
+def _trade(currencyId, trade, depositActionType="None", **kwargs):
+    return get_balance_trade_action(
+        currencyId,
+        depositActionType,
+        [trade],
+        withdrawEntireCashBalance=True,
+        redeemToUnderlying=True,
+        **kwargs,
+    )
+
+
+def lend(env, account, currencyId, marketIndex, notional):
+    action = _trade(
+        currencyId,
+        {
+            "tradeActionType": "Lend",
+            "marketIndex": marketIndex,
+            "notional": notional,
+            "minSlippage": 0,
+        },
+        "DepositUnderlying",
+        depositActionAmount=_underlying(currencyId, notional),
+    )
+    env.notional.batchBalanceAndTradeAction(account, [action], {"from": account})
+
+
+def borrow(env, account, currencyId, marketIndex, notional, collateral):
+    deposit = get_balance_action(
+        COLLATERAL_CURRENCY_ID, "DepositUnderlying", depositActionAmount=collateral
+    )
+    action = _trade(
+        currencyId,
+        {
+            "tradeActionType": "Borrow",
+            "marketIndex": marketIndex,
+            "notional": notional,
+            "maxSlippage": 0,
+        },
+    )
+    env.notional.batchBalanceAndTradeAction(
+        account, [deposit, action], {"from": account, "value": collateral}
+    )
+
+
+def add_liquidity(env, account, currencyId, marketIndex, assetCash):
+    action = _trade(
+        currencyId,
+        {
+            "tradeActionType": "AddLiquidity",
+            "marketIndex": marketIndex,
+            "notional": assetCash,
+            "minSlippage": 0,
+            "maxSlippage": 0.4 * RATE_PRECISION,
+        },
+        "DepositAsset",
+        depositActionAmount=assetCash,
+    )
+    env.notional.batchBalanceAndTradeAction(account, [action], {"from": account})
+
+
+def remove_liquidity(env, account, currencyId, marketIndex, tokens):
+    action = _trade(
+        currencyId,
+        {
+            "tradeActionType": "RemoveLiquidity",
+            "marketIndex": marketIndex,
+            "notional": tokens,
+            "minSlippage": 0,
+            "maxSlippage": 0.4 * RATE_PRECISION,
+        },
+    )
+    env.notional.batchBalanceAndTradeAction(account, [action], {"from": account})
+
+
+def mint_ntoken(env, account, currencyId, assetCash):
+    action = get_balance_action(
+        currencyId, "DepositAssetAndMintNToken", depositActionAmount=assetCash
+    )
+    env.notional.batchBalanceAction(account, [action], {"from": account})
+
+
+def redeem_ntoken(env, account, currencyId, tokens):
+    env.notional.nTokenRedeem(account, currencyId, tokens, True, True, {"from": account})
+
+
+def transfer_fcash(env, account, to, currencyId, maturity, amount):
+    erc1155Id = env.notional.encodeToId(currencyId, maturity, FCASH_ASSET_TYPE)
+    env.notional.safeTransferFrom(account, to, erc1155Id, amount, "", {"from": account})
+
+
+def transfer_ntoken(env, account, to, currencyId, amount):
+    env.nToken[currencyId].transfer(to, amount, {"from": account})
+
+
+def settle(env, account):
+    env.notional.settleAccount(account, {"from": account})
+
+
+def time_travel(env, seconds):
+    chain.mine(1, timestamp=chain.time() + seconds)
+    for currencyId in env.nToken:
+        try:
+            env.notional.initializeMarkets(currencyId, False)
+        except VirtualMachineError:
+            # Markets are already initialized for the current quarter
+            pass
+
+
+def oracle_move(env, symbol, factor):
+    oracle = env.ethOracle[symbol]
+    oracle.setAnswer(int(oracle.latestAnswer() * factor))
+
+
+def _assets(env, account, predicate):
+    assets = [a for a in env.notional.getAccountPortfolio(account) if predicate(a)]
+    if len(assets) == 0:
+        raise Infeasible()
+    return assets
+
+
+def _draw_lend(env, rng, account, other):
+    return {
+        "account": account,
+        "currencyId": rng.choice(CURRENCY_IDS),
+        "marketIndex": rng.randint(1, 2),
+        "notional": rng.choice([10, 1_000, 100_000]) * 10 ** 8,
+    }
+
+
+def _draw_borrow(env, rng, account, other):
+    return {
+        "account": account,
+        "currencyId": rng.choice(CURRENCY_IDS),
+        "marketIndex": rng.randint(1, 2),
+        "notional": rng.choice([10, 1_000, 10_000]) * 10 ** 8,
+        "collateral": rng.choice([1, 10, 100]) * 10 ** 18,
+    }
+
+
+def _draw_add_liquidity(env, rng, account, other):
+    return {
+        "account": account,
+        "currencyId": rng.choice(CURRENCY_IDS),
+        "marketIndex": rng.randint(1, 2),
+        "assetCash": rng.choice([100, 10_000, 1_000_000]) * 10 ** 8,
+    }
+
+
+def _draw_remove_liquidity(env, rng, account, other):
+    token = rng.choice(_assets(env, account, lambda a: a[2] > FCASH_ASSET_TYPE))
+    return {
+        "account": account,
+        "currencyId": token[0],
+        "marketIndex": token[2] - FCASH_ASSET_TYPE,
+        "tokens": int(token[3] * rng.choice([0.1, 0.5, 1])),
+    }
+
+
+def _draw_mint_ntoken(env, rng, account, other):
+    return {
+        "account": account,
+        "currencyId": rng.choice(CURRENCY_IDS),
+        "assetCash": rng.choice([100, 10_000, 1_000_000]) * 10 ** 8,
+    }
+
+
+def _draw_redeem_ntoken(env, rng, account, other):
+    currencyId = rng.choice(CURRENCY_IDS)
+    balance = env.nToken[currencyId].balanceOf(account)
+    if balance == 0:
+        raise Infeasible()
+    return {
+        "account": account,
+        "currencyId": currencyId,
+        "tokens": int(balance * rng.choice([0.1, 0.5, 1])),
+    }
+
+
+def _draw_transfer_fcash(env, rng, account, other):
+    asset = rng.choice(_assets(env, account, lambda a: a[2] == FCASH_ASSET_TYPE and a[3] > 0))
+    return {
+        "account": account,
+        "to": other,
+        "currencyId": asset[0],
+        "maturity": asset[1],
+        "amount": int(asset[3] * rng.choice([0.1, 0.5, 1])),
+    }
+
+
+def _draw_transfer_ntoken(env, rng, account, other):
+    args = _draw_redeem_ntoken(env, rng, account, other)
+    return {
+        "account": account,
+        "to": other,
+        "currencyId": args["currencyId"],
+        "amount": args["tokens"],
+    }
+
+
+def _draw_settle(env, rng, account, other):
+    return {"account": account}
+
+
+def _draw_time_travel(env, rng, account, other):
+    return {"seconds": rng.choice([3600, SECONDS_IN_DAY, 30 * SECONDS_IN_DAY, SECONDS_IN_QUARTER])}
+
+
+def _draw_oracle_move(env, rng, account, other):
+    return {"symbol": SYMBOLS[rng.choice(CURRENCY_IDS)], "factor": rng.uniform(0.8, 1.25)}
+
+
+# Action name => (weight, draw, apply)
+ACTIONS = {
+    "lend": (4, _draw_lend, lend),
+    "borrow": (4, _draw_borrow, borrow),
+    "add_liquidity": (2, _draw_add_liquidity, add_liquidity),
+    "remove_liquidity": (2, _draw_remove_liquidity, remove_liquidity),
+    "mint_ntoken": (2, _draw_mint_ntoken, mint_ntoken),
+    "redeem_ntoken": (2, _draw_redeem_ntoken, redeem_ntoken),
+    "transfer_fcash": (1, _draw_transfer_fcash, transfer_fcash),
+    "transfer_ntoken": (1, _draw_transfer_ntoken, transfer_ntoken),
+    "settle": (1, _draw_settle, settle),
+    "time_travel": (1, _draw_time_travel, time_travel),
+    "oracle_move": (1, _draw_oracle_move, oracle_move),
+}
+
+
+def apply_step(env, step, actions=ACTIONS):
+    actions[step.action][2](env, **step.args)
+
+
+def replay(env, accounts, steps, actions=ACTIONS, invariants=check_system_invariants):
+    """
+    Applies a sequence of steps, i.e. the steps of an InvariantViolation. The invariants run
+    after every step as they do while fuzzing, since they settle accounts and initialize markets.
+    """
+    for step in steps:
+        apply_step(env, step, actions)
+        invariants(env, accounts)
+
+
+class SnapshotTreeFuzzer:
+    def __init__(
+        self, env, accounts, actors=2, seed=0, actions=ACTIONS, invariants=check_system_invariants
+    ):
+        self.env = env
+        self.accounts = accounts
+        self.actors = list(accounts[0:actors])
+        self.rng = random.Random(seed)
+        self.actions = actions
+        self.invariants = invariants
+        self.stats = {"steps": 0, "reverts": 0, "infeasible": 0, "abandoned": 0}
+
+    def _draw(self):
+        names = list(self.actions)
+        (name,) = self.rng.choices(names, weights=[self.actions[n][0] for n in names])
+        (account, other) = self.rng.sample(self.actors, 2)
+        return Step(name, self.actions[name][1](self.env, self.rng, account, other))
+
+    def step(self):
+        """Applies one random action that succeeds, returns None if none was found"""
+        for _ in range(MAX_ATTEMPTS):
+            try:
+                step = self._draw()
+            except Infeasible:
+                self.stats["infeasible"] += 1
+                continue
+
+            try:
+                apply_step(self.env, step, self.actions)
+            except VirtualMachineError:
+                self.stats["reverts"] += 1
+                continue
+
+            self.stats["steps"] += 1
+            return step
+        return None
+
+    def _check(self, steps):
+        try:
+            self.invariants(self.env, self.accounts)
+        except (AssertionError, VirtualMachineError) as e:
+            raise InvariantViolation(steps, e)
+
+    def _explore(self, snapshotId, prefix, depth, branching):
+        for branch in range(branching):
+            if branch > 0:
+                # Reverting consumes the snapshot, a new one is taken of the same state
+                snapshotId = chain._revert(snapshotId)
+
+            step = self.step()
+            if step is None:
+                self.stats["abandoned"] += 1
+                continue
+
+            steps = prefix + [step]
+            self._check(steps)
+            if len(steps) < depth:
+                self._explore(rpc.snapshot(), steps, depth, branching)
+
+    def run(self, depth, branching):
+        """
+        Explores a tree of `branching` random actions per node down to `depth` actions, then
+        restores the state the run started from. Returns the run statistics.
+        """
+        root = rpc.snapshot()
+        try:
+            self._explore(root, [], depth, branching)
+        finally:
+            chain._revert(root)
+        return self.stats
@@ -0,0 +1,119 @@
+import pytest
+from brownie import MockAaveFlashLender, MockExchange, NotionalV2FlashLiquidator
+from brownie.network.state import Chain
+from scripts.flash_liquidation_planner import (
+    ConstantProductModel,
+    LiquidationView,
+    MockExchangeModel,
+    encode_params,
+    flash_loan_calldata,
+    plan_collateral_liquidation,
+)
+from tests.helpers import get_balance_trade_action, initialize_environment
+
+chain = Chain()
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+GAS_PRICE = 10 ** 9
+
+
+@pytest.fixture(scope="module", autouse=True)
+def env(accounts):
+    environment = initialize_environment(accounts)
+    borrowAction = get_balance_trade_action(
+        2,
+        "None",
+        [{"tradeActionType": "Borrow", "marketIndex": 1, "notional": 100e8, "maxSlippage": 0}],
+        withdrawEntireCashBalance=True,
+        redeemToUnderlying=True,
+    )
+    collateral = get_balance_trade_action(1, "DepositUnderlying", [], depositActionAmount=2.33e18)
+    environment.notional.batchBalanceAndTradeAction(
+        accounts[1], [collateral, borrowAction], {"from": accounts[1], "value": 2.33e18}
+    )
+    environment.ethOracle["DAI"].setAnswer(0.0135e18)
+
+    return environment
+
+
+@pytest.fixture(scope="module", autouse=True)
+def exchange(env, accounts):
+    exchange = MockExchange.deploy({"from": accounts[0]})
+    env.token["DAI"].transfer(exchange.address, 10000e18, {"from": accounts[0]})
+    return exchange
+
+
+@pytest.fixture(scope="module", autouse=True)
+def lender(env, accounts):
+    lender = MockAaveFlashLender.deploy(env.WETH.address, accounts[0], {"from": accounts[0]})
+    env.token["DAI"].transfer(lender.address, 10000e18, {"from": accounts[0]})
+    return lender
+
+
+@pytest.fixture(scope="module", autouse=True)
+def liquidator(env, lender, exchange, accounts):
+    liquidator = NotionalV2FlashLiquidator.deploy(
+        env.notional.address,
+        lender.address,
+        env.WETH.address,
+        env.WETH.address,
+        accounts[9],
+        exchange.address,
+        ZERO_ADDRESS,
+        {"from": accounts[0]},
+    )
+    liquidator.enableCurrencies([1, 2], {"from": accounts[9]})
+    return liquidator
+
+
+@pytest.fixture(autouse=True)
+def isolation(fn_isolation):
+    pass
+
+
+def test_flash_liquidation_realizes_planned_profit(env, exchange, lender, liquidator, accounts):
+    exchange.setExchangeRate(76e18)
+    view = LiquidationView.fetch(env.notional, accounts[1], 2, 1, env.WETH.address)
+    model = MockExchangeModel.fromContract(exchange, [env.token["DAI"]])
+    plan = plan_collateral_liquidation(view, [model], GAS_PRICE)
+    assert plan is not None
+    assert plan.maxCollateralLiquidation == view.collateralRaised
+
+    params = encode_params(view, plan, liquidator.address, chain.time() + 3600)
+    daiBefore = env.token["DAI"].balanceOf(accounts[9])
+    accounts[0].transfer(
+        lender.address, 0, data=flash_loan_calldata(view, plan, liquidator.address, params)
+    )
+
+    # Profit is paid to the owner, the collateral buffer is withdrawn as WETH
+    profit = env.token["DAI"].balanceOf(accounts[9]) - daiBefore
+    assert pytest.approx(profit, rel=1e-4) == plan.profit + plan.gasCost
+    assert env.WETH.balanceOf(accounts[9]) > 0
+    assert env.notional.getFreeCollateral(accounts[1])[0] > 0
+
+
+def test_no_plan_below_break_even(env, exchange, accounts):
+    exchange.setExchangeRate(70e18)
+    view = LiquidationView.fetch(env.notional, accounts[1], 2, 1, env.WETH.address)
+    model = MockExchangeModel.fromContract(exchange, [env.token["DAI"]])
+    assert plan_collateral_liquidation(view, [model], GAS_PRICE) is None
+
+
+def test_routes_through_deepest_pools(env, accounts):
+    (weth, dai, usdc) = (env.WETH.address, env.token["DAI"].address, env.token["USDC"].address)
+    view = LiquidationView.fetch(env.notional, accounts[1], 2, 1, weth)
+    pools = ConstantProductModel(
+        ZERO_ADDRESS,
+        [
+            (weth, dai, 1e18, 80e18, 3000),
+            (weth, usdc, 1000e18, 80000e6, 500),
+            (usdc, dai, 1e12, 1e24, 100),
+        ],
+    )
+
+    plan = plan_collateral_liquidation(view, [pools], GAS_PRICE)
+    assert plan.route.tokens == (weth, usdc, dai)
+    # Thin pools limit the liquidation size
+    thin = ConstantProductModel(ZERO_ADDRESS, [(weth, dai, 2e18, 160e18, 3000)])
+    assert plan_collateral_liquidation(view, [thin], GAS_PRICE).maxCollateralLiquidation < (
+        view.collateralRaised
+    )
@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+from brownie.network.state import Chain
+from scripts.liquidation_backtester import (
+    PortfolioSnapshot,
+    RiskParameters,
+    asset_rates_from_ctoken,
+    backtest,
+    current_rates,
+    eth_rates_from_answers,
+    free_collateral,
+)
+from tests.helpers import get_balance_trade_action, initialize_environment
+
+chain = Chain()
+
+STEPS = 10
+DAI = 1
+
+
+@pytest.fixture(scope="module", autouse=True)
+def environment(accounts):
+    env = initialize_environment(accounts)
+    for (account, collateral) in [(accounts[1], 2.33e18), (accounts[2], 5e18)]:
+        borrowAction = get_balance_trade_action(
+            2,
+            "None",
+            [{"tradeActionType": "Borrow", "marketIndex": 1, "notional": 100e8, "maxSlippage": 0}],
+            withdrawEntireCashBalance=True,
+            redeemToUnderlying=True,
+        )
+        deposit = get_balance_trade_action(
+            1, "DepositUnderlying", [], depositActionAmount=collateral
+        )
+        env.notional.batchBalanceAndTradeAction(
+            account, [deposit, borrowAction], {"from": account, "value": collateral}
+        )
+    return env
+
+
+@pytest.fixture(autouse=True)
+def isolation(fn_isolation):
+    pass
+
+
+def setup_backtest(environment, accounts):
+    currencyIds = list(range(1, environment.notional.getMaxCurrencyId() + 1))
+    snapshot = PortfolioSnapshot.fetch(
+        environment.notional, accounts[1:3], currencyIds, chain[-1].timestamp
+    )
+    params = RiskParameters.fetch(environment.notional, currencyIds)
+    (ethRates, assetRates) = current_rates(environment.notional, currencyIds)
+    return (snapshot, params, ethRates, assetRates)
+
+
+def test_free_collateral_matches_chain(environment, accounts):
+    (snapshot, params, ethRates, assetRates) = setup_backtest(environment, accounts)
+    fc = free_collateral(snapshot, params, ethRates[None, None, :], assetRates[None, None, :])
+
+    for (i, account) in enumerate(accounts[1:3]):
+        assert (
+            pytest.approx(fc[0, 0, i], rel=1e-6)
+            == environment.notional.getFreeCollateral(account)[0]
+        )
+
+
+def test_first_liquidation_matches_chain(environment, accounts):
+    (snapshot, params, ethRates, assetRates) = setup_backtest(environment, accounts)
+    # DAI appreciates against ETH by 35% over the path
+    ethPaths = np.tile(ethRates, (1, STEPS + 1, 1))
+    ethPaths[0, :, DAI] = np.linspace(0.01, 0.0135, STEPS + 1)
+    result = backtest(snapshot, params, ethPaths, np.tile(assetRates, (1, STEPS + 1, 1)))
+
+    # The larger collateral is never liquidated
+    assert result.firstLiquidation[0, 1] == -1
+    step = result.firstLiquidation[0, 0]
+    assert 0 < step <= STEPS
+    assert list(result.liquidatable[0]) == [0] * step + [1] * (STEPS + 1 - step)
+
+    environment.ethOracle["DAI"].setAnswer(int(ethPaths[0, step - 1, DAI] * 1e18))
+    assert environment.notional.getFreeCollateral(accounts[1])[0] >= 0
+    environment.ethOracle["DAI"].setAnswer(int(ethPaths[0, step, DAI] * 1e18))
+    (netETHValue, _) = environment.notional.getFreeCollateral(accounts[1])
+    assert pytest.approx(-netETHValue, rel=1e-5) == result.shortfall[0, 0]
+
+    (_, collateralAssetCash, _) = environment.notional.calculateCollateralCurrencyLiquidation.call(
+        accounts[1], 2, 1, 0, 0
+    )
+    assert pytest.approx(collateralAssetCash * assetRates[0], rel=1e-4) == (
+        result.currencyCleared[0, 0]
+    )
+    assert result.fCashCleared[0, 0] == 0
+    assert result.badDebt[0, 0] == 0
+
+
+def test_risk_parameters_change_liquidations(environment, accounts):
+    (snapshot, params, ethRates, assetRates) = setup_backtest(environment, accounts)
+    ethPaths = np.tile(ethRates, (1, STEPS + 1, 1))
+    ethPaths[0, :, DAI] = np.linspace(0.01, 0.0135, STEPS + 1)
+    assetPaths = np.tile(assetRates, (1, STEPS + 1, 1))
+
+    base = backtest(snapshot, params, ethPaths, assetPaths)
+    stricter = backtest(snapshot, params.update(0, haircut=50), ethPaths, assetPaths)
+    assert stricter.firstLiquidation[0, 0] < base.firstLiquidation[0, 0]
+    assert stricter.liquidatable.sum() > base.liquidatable.sum()
+
+
+def test_replayed_rates_match_chain(environment):
+    currencyIds = [1, 2, 3]
+    # Aggregator answers for DAI as they would be replayed from oracle history
+    answers = [0.01e18, 0.0115e18, 0.0135e18]
+    ethPath = eth_rates_from_answers(answers, 18, False)
+    for (answer, ethRate) in zip(answers, ethPath):
+        environment.ethOracle["DAI"].setAnswer(answer)
+        (ethRates, _) = current_rates(environment.notional, currencyIds)
+        assert pytest.approx(ethRates[1], rel=1e-12) == ethRate
+
+    (_, assetRates) = current_rates(environment.notional, currencyIds)
+    for (i, (symbol, decimals)) in enumerate([("ETH", 18), ("DAI", 18), ("USDC", 6)]):
+        exchangeRate = environment.cToken[symbol].exchangeRateStored()
+        assert (
+            pytest.approx(assetRates[i], rel=1e-6)
+            == asset_rates_from_ctoken([exchangeRate], decimals)[0]
+        )
@@ -0,0 +1,74 @@
+import pytest
+from brownie.network.state import Chain
+from scripts.account_scanner import AccountContextIndex, encode_account_context
+from tests.constants import SECONDS_IN_QUARTER
+from tests.helpers import get_balance_trade_action, get_tref, initialize_environment
+
+chain = Chain()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def environment(accounts):
+    env = initialize_environment(accounts)
+    daiAction = get_balance_trade_action(
+        2,
+        "None",
+        [{"tradeActionType": "Borrow", "marketIndex": 1, "notional": 150e8, "maxSlippage": 0}],
+        withdrawEntireCashBalance=True,
+        redeemToUnderlying=True,
+    )
+    usdcAction = get_balance_trade_action(
+        3,
+        "DepositUnderlying",
+        [{"tradeActionType": "Lend", "marketIndex": 1, "notional": 100e8, "minSlippage": 0}],
+        depositActionAmount=10000e6,
+    )
+    env.notional.batchBalanceAndTradeAction(
+        accounts[1], [daiAction, usdcAction], {"from": accounts[1]}
+    )
+    env.notional.enableBitmapCurrency(2, {"from": accounts[2]})
+    return env
+
+
+@pytest.fixture(autouse=True)
+def isolation(fn_isolation):
+    pass
+
+
+@pytest.mark.parametrize("source", ["storage", "view"])
+def test_index_matches_account_context(environment, accounts, source):
+    index = AccountContextIndex(environment.notional, source)
+    index.update(accounts[0:4])
+
+    for account in accounts[0:4]:
+        context = environment.notional.getAccountContext(account)
+        assert index.words[index.rows[account.address]].tobytes() == encode_account_context(context)
+        assert index.context(account)[0:4] == (context[0], int(context[1].hex(), 16), *context[2:4])
+
+    assert index.with_asset_debt(2) == [accounts[1].address]
+    assert index.with_asset_debt(1) == []
+    assert index.active_in(3, balances=False) == [accounts[1].address]
+    assert index.bitmap_accounts(2) == [accounts[2].address]
+    assert index.with_cash_debt(2) == []
+    assert index.must_settle(chain.time()) == []
+
+
+def test_settlement_triage(environment, accounts):
+    index = AccountContextIndex(environment.notional)
+    index.update(accounts[0:4])
+
+    newTime = get_tref(chain.time()) + SECONDS_IN_QUARTER + 1
+    chain.mine(1, timestamp=newTime)
+    for currencyId in range(1, 4):
+        environment.notional.initializeMarkets(currencyId, False)
+    # Bitmap accounts settle whenever their next settle time is before the current day
+    assert index.must_settle(newTime) == [accounts[1].address, accounts[2].address]
+
+    environment.notional.settleAccount(accounts[1], {"from": accounts[0]})
+    assert index.sync() > 0
+    assert accounts[1].address not in index.must_settle(chain.time())
+    assert index.words[index.rows[accounts[1].address]].tobytes() == encode_account_context(
+        environment.notional.getAccountContext(accounts[1])
+    )
+    # Settled negative fCash becomes a negative cash balance
+    assert index.with_cash_debt(2) == [accounts[1].address]
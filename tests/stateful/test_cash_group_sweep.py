@@ -0,0 +1,28 @@
+import pytest
+from scripts.cash_group_sweep import config_grid, sweep
+
+
+@pytest.fixture(scope="module")
+def results(accounts):
+    # A debt buffer below the liquidation debt buffer is rejected by governance
+    return sweep(config_grid(debtBuffer=[150, 40]), workers=1)
+
+
+def test_sweep_runs_scenario(results):
+    (config, metrics) = results[0]
+    assert config["debtBuffer"] == 150
+    assert metrics["error"] is None
+    assert metrics["lendAssetCash"] < 0
+    assert metrics["borrowAssetCash"] > 0
+    assert metrics["freeCollateralAfterBorrow"] > 0
+    assert metrics["freeCollateralAfterShock"] < 0
+    assert metrics["netLocalFromLiquidator"] > 0
+    assert metrics["netCollateralTransfer"] > 0
+    assert metrics["freeCollateralAfterLiquidation"] > metrics["freeCollateralAfterShock"]
+
+
+def test_sweep_reports_rejected_config(results):
+    (config, metrics) = results[1]
+    assert config["debtBuffer"] == 40
+    assert metrics["error"] is not None
+    assert metrics["lendAssetCash"] is None
@@ -0,0 +1,54 @@
+import pytest
+from brownie.network.state import Chain
+from tests.helpers import initialize_environment
+from tests.stateful.fuzzer import (
+    ACTIONS,
+    InvariantViolation,
+    SnapshotTreeFuzzer,
+    Step,
+    replay,
+)
+from tests.stateful.invariants import check_system_invariants
+
+chain = Chain()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def environment(accounts):
+    return initialize_environment(accounts)
+
+
+@pytest.fixture(autouse=True)
+def isolation(fn_isolation):
+    pass
+
+
+@pytest.mark.parametrize("seed", [1, 2])
+def test_snapshot_tree_fuzzer(environment, accounts, seed):
+    height = chain.height
+    stats = SnapshotTreeFuzzer(environment, accounts, seed=seed).run(depth=3, branching=2)
+
+    assert stats["steps"] > 0
+    # The run restores the state it started from
+    assert chain.height == height
+
+
+def test_violation_reports_replayable_sequence(environment, accounts):
+    def no_portfolios(env, accounts):
+        check_system_invariants(env, accounts)
+        for account in accounts[0:2]:
+            assert len(env.notional.getAccountPortfolio(account)) == 0
+
+    fuzzer = SnapshotTreeFuzzer(
+        environment, accounts, actions={"lend": ACTIONS["lend"]}, invariants=no_portfolios
+    )
+    with pytest.raises(InvariantViolation) as e:
+        fuzzer.run(depth=2, branching=2)
+
+    steps = e.value.steps
+    assert [s.action for s in steps] == ["lend"]
+    assert isinstance(steps[0], Step)
+
+    # The run was interrupted by the violation, the state is restored before replaying
+    with pytest.raises(AssertionError):
+        replay(environment, accounts, steps, invariants=no_portfolios)
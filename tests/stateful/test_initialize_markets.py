@@ -6,6 +6,9 @@ from brownie.convert.datatypes import Wei
 from brownie.network.state import Chain
 from scripts.config import CurrencyDefaults
 from scripts.deployment import TestEnvironment
+from scripts.initialize_markets_sweep import load_ntoken_state
+from scripts.offchain.initialize_markets import initializeMarkets
+from scripts.offchain.market import Market
 from tests.constants import RATE_PRECISION, SECONDS_IN_DAY, SECONDS_IN_QUARTER, SECONDS_IN_YEAR
 from tests.helpers import (
     get_balance_action,
@@ -561,3 +564,70 @@ def test_delayed_second_initialize_markets_positive_residual(accounts):
     environment.notional.initializeMarkets(currencyId, False)
 
     ntoken_asserts(environment, currencyId, False, accounts)
+
+
+def simulated_initialize_markets(environment, currencyId, isFirstInit):
+    (nToken, cashGroup, parameters) = load_ntoken_state(environment.notional, currencyId)
+    txn = environment.notional.initializeMarkets(currencyId, isFirstInit)
+    result = initializeMarkets(nToken, cashGroup, parameters, txn.timestamp, isFirstInit)
+
+    nTokenAddress = environment.notional.nTokenAddress(currencyId)
+    (liquidityTokens, ifCashAssets) = environment.notional.getNTokenPortfolio(nTokenAddress)
+    assert result.nToken.cashBalance == environment.notional.getNTokenAccount(nTokenAddress)[5]
+    assert result.nToken.liquidityTokens == tuple((lt[1], lt[2], lt[3]) for lt in liquidityTokens)
+    assert result.nToken.ifCash == {a[1]: a[3] for a in ifCashAssets}
+
+    markets = [Market.fromParameters(m) for m in environment.notional.getActiveMarkets(currencyId)]
+    assert [vars(m) for m in markets] == [
+        vars(m) for (_, m) in sorted(result.nToken.markets.items())
+    ]
+    return result
+
+
+def test_simulated_initialize_markets(environment, accounts):
+    currencyId = 2
+    environment.notional.updateDepositParameters(currencyId, [0.4e8, 0.6e8], [0.8e9, 0.8e9])
+    environment.notional.updateInitializationParameters(
+        currencyId, [0.01e9, 0.021e9], [0.5e9, 0.5e9]
+    )
+    environment.notional.batchBalanceAction(
+        accounts[0],
+        [
+            get_balance_action(
+                currencyId, "DepositAssetAndMintNToken", depositActionAmount=INITIAL_CASH_AMOUNT
+            )
+        ],
+        {"from": accounts[0]},
+    )
+    simulated_initialize_markets(environment, currencyId, True)
+
+    # Extend to the one year market
+    cashGroup = list(environment.notional.getCashGroup(currencyId))
+    cashGroup[0] = 3
+    cashGroup[9] = CurrencyDefaults["tokenHaircut"][0:3]
+    cashGroup[10] = CurrencyDefaults["rateScalar"][0:3]
+    environment.notional.updateCashGroup(currencyId, cashGroup)
+    environment.notional.updateDepositParameters(
+        currencyId, [0.4e8, 0.4e8, 0.2e8], [0.8e9, 0.8e9, 0.8e9]
+    )
+    environment.notional.updateInitializationParameters(
+        currencyId, [0.01e9, 0.021e9, 0.07e9], [0.5e9, 0.5e9, 0.5e9]
+    )
+    chain.mine(1, timestamp=chain.time() + SECONDS_IN_QUARTER)
+    simulated_initialize_markets(environment, currencyId, False)
+
+    # Lending in the one year market leaves a negative idiosyncratic residual after the roll
+    action = get_balance_trade_action(
+        currencyId,
+        "DepositAsset",
+        [{"tradeActionType": "Lend", "marketIndex": 3, "notional": 1000e8, "minSlippage": 0}],
+        depositActionAmount=100_000e8,
+        withdrawEntireCashBalance=True,
+    )
+    environment.notional.batchBalanceAndTradeAction(accounts[0], [action], {"from": accounts[0]})
+    chain.mine(1, timestamp=chain.time() + SECONDS_IN_QUARTER)
+    result = simulated_initialize_markets(environment, currencyId, False)
+    assert result.assetCashWithholding > 0
+
+    chain.mine(1, timestamp=chain.time() + SECONDS_IN_QUARTER)
+    simulated_initialize_markets(environment, currencyId, False)
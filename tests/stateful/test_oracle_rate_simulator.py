@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+from brownie.network.state import Chain
+from scripts.initialize_markets_sweep import read_market_storage
+from scripts.offchain.cash_group import CashGroup
+from scripts.offchain.constants import QUARTER
+from scripts.offchain.date_time import getReferenceTime
+from scripts.oracle_rate_simulator import (
+    CurveParameters,
+    MarketState,
+    TradePaths,
+    oracle_rate_paths,
+    simulate_trades,
+    stored_oracle_rates,
+)
+from tests.helpers import get_balance_trade_action, initialize_environment
+
+chain = Chain()
+
+CURRENCY_ID = 2
+NOTIONALS = [1_000e8, 50_000e8, 5_000e8, 20_000e8]
+
+
+@pytest.fixture(scope="module", autouse=True)
+def environment(accounts):
+    return initialize_environment(accounts)
+
+
+@pytest.fixture(autouse=True)
+def isolation(fn_isolation):
+    pass
+
+
+def read_market(environment):
+    maturity = environment.notional.getActiveMarkets(CURRENCY_ID)[0][1]
+    settlementDate = getReferenceTime(chain.time()) + QUARTER
+    return read_market_storage(environment.notional, CURRENCY_ID, maturity, settlementDate)
+
+
+def lend(environment, account, notional):
+    action = get_balance_trade_action(
+        CURRENCY_ID,
+        "DepositUnderlying",
+        [{"tradeActionType": "Lend", "marketIndex": 1, "notional": notional, "minSlippage": 0}],
+        depositActionAmount=notional * 10 ** 10 * 2,
+        withdrawEntireCashBalance=True,
+    )
+    return environment.notional.batchBalanceAndTradeAction(account, [action], {"from": account})
+
+
+def test_simulated_oracle_rates_match_chain(environment, accounts):
+    (settings, assetRate) = environment.notional.getCashGroupAndAssetRate(CURRENCY_ID)
+    cashGroup = CashGroup.fromParameters(CURRENCY_ID, settings, assetRate)
+    window = cashGroup.getRateOracleTimeWindow()
+    state = MarketState.fromMarket(read_market(environment), cashGroup.assetRate)
+
+    (times, markets) = ([], [])
+    for (i, notional) in enumerate(NOTIONALS):
+        # Trades both inside and past the rate oracle time window
+        chain.sleep(window // 3 if i % 2 == 0 else window * 2)
+        times.append(lend(environment, accounts[1], notional).timestamp)
+        markets.append(read_market(environment))
+
+    trades = simulate_trades(
+        state, CurveParameters.fromCashGroup(cashGroup, 1), [times], [NOTIONALS]
+    )
+    assert trades.success.all()
+    for (i, market) in enumerate(markets):
+        assert pytest.approx(market.lastImpliedRate, rel=1e-6) == trades.impliedRates[0, i]
+
+    # Given the on chain implied rates the oracle rates are exact
+    chainTrades = TradePaths(
+        trades.times,
+        trades.fCash,
+        trades.success,
+        np.array([[m.lastImpliedRate for m in markets]], dtype=np.int64),
+        trades.netCashToAccount,
+    )
+    (stored, _, _) = stored_oracle_rates(state, chainTrades, [window])
+    assert list(stored[0, 0]) == [m.oracleRate for m in markets]
+
+    chain.sleep(window // 2)
+    chain.mine()
+    observed = oracle_rate_paths(state, chainTrades, [window], [chain[-1].timestamp])
+    view = environment.notional.getActiveMarkets(CURRENCY_ID, block_identifier=chain.height)
+    assert observed[0, 0, 0] == view[0][6]
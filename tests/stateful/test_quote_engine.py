@@ -0,0 +1,137 @@
+import pytest
+from brownie.network.state import Chain
+from brownie.test import given, strategy
+from scripts.offchain.safe_math import Revert
+from scripts.quote_engine import QuoteEngine
+from tests.helpers import get_balance_action, get_balance_trade_action, initialize_environment
+
+chain = Chain()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def environment(accounts):
+    env = initialize_environment(accounts)
+    env.notional.batchBalanceAction(
+        accounts[0],
+        [
+            get_balance_action(
+                2, "DepositUnderlyingAndMintNToken", depositActionAmount=100_000_000e18
+            ),
+            get_balance_action(
+                3, "DepositUnderlyingAndMintNToken", depositActionAmount=100_000_000e6
+            ),
+        ],
+        {"from": accounts[0]},
+    )
+
+    return env
+
+
+@pytest.fixture(autouse=True)
+def isolation(fn_isolation):
+    pass
+
+
+def upscale_precision(amount, currencyId, useUnderlying):
+    if not useUnderlying:
+        return int(amount * 1e8)
+    elif currencyId == 2:
+        return int(amount * 1e18)
+    elif currencyId == 3:
+        return int(amount * 1e6)
+
+
+@given(
+    currencyId=strategy("uint", min_value=2, max_value=3),
+    marketIndex=strategy("uint", min_value=1, max_value=2),
+    useUnderlying=strategy("bool"),
+    amount=strategy("uint", min_value=1, max_value=1_000_000),
+)
+def test_fcash_quotes_match_calculation_views(
+    environment, currencyId, marketIndex, useUnderlying, amount
+):
+    engine = QuoteEngine(environment.notional)
+    engine.refresh()
+    blockTime = engine.blockTime
+    maturity = environment.notional.getActiveMarkets(currencyId)[marketIndex - 1][1]
+    externalAmount = upscale_precision(amount, currencyId, useUnderlying)
+
+    assert engine.getfCashLendFromDeposit(
+        currencyId, externalAmount, maturity, 0, blockTime, useUnderlying
+    ) == environment.notional.getfCashLendFromDeposit(
+        currencyId, externalAmount, maturity, 0, blockTime, useUnderlying
+    )
+    assert engine.getfCashBorrowFromPrincipal(
+        currencyId, externalAmount, maturity, 0, blockTime, useUnderlying
+    ) == environment.notional.getfCashBorrowFromPrincipal(
+        currencyId, externalAmount, maturity, 0, blockTime, useUnderlying
+    )
+    assert engine.getDepositFromfCashLend(
+        currencyId, amount * 1e8, maturity, 0, blockTime
+    ) == environment.notional.getDepositFromfCashLend(
+        currencyId, amount * 1e8, maturity, 0, blockTime
+    )
+    assert engine.getPrincipalFromfCashBorrow(
+        currencyId, amount * 1e8, maturity, 0, blockTime
+    ) == environment.notional.getPrincipalFromfCashBorrow(
+        currencyId, amount * 1e8, maturity, 0, blockTime
+    )
+    assert engine.calculateNTokensToMint(
+        currencyId, amount * 1e8
+    ) == environment.notional.calculateNTokensToMint(currencyId, amount * 1e8)
+
+
+def test_quotes_are_memoized_per_block(environment, accounts):
+    engine = QuoteEngine(environment.notional)
+    maturity = environment.notional.getActiveMarkets(2)[0][1]
+
+    quote = engine.getfCashLendFromDeposit(2, 100e18, maturity, 0)
+    rpcCalls = engine.stats["rpcCalls"]
+    assert engine.getfCashLendFromDeposit(2, 100e18, maturity, 0) == quote
+    assert engine.stats["hits"] == 1
+    assert engine.stats["rpcCalls"] == rpcCalls
+
+    # Trading moves the market so a new block must produce a new quote
+    environment.notional.batchBalanceAndTradeAction(
+        accounts[1],
+        [
+            get_balance_trade_action(
+                2,
+                "DepositUnderlying",
+                [
+                    {
+                        "tradeActionType": "Lend",
+                        "marketIndex": 1,
+                        "notional": 10_000e8,
+                        "minSlippage": 0,
+                    }
+                ],
+                depositActionAmount=10_100e18,
+                withdrawEntireCashBalance=True,
+            )
+        ],
+        {"from": accounts[1]},
+    )
+    assert engine.refresh()
+    newQuote = engine.getfCashLendFromDeposit(2, 100e18, maturity, 0)
+    assert newQuote != quote
+    assert newQuote == environment.notional.getfCashLendFromDeposit(
+        2, 100e18, maturity, 0, engine.blockTime, True
+    )
+
+
+def test_quote_reverts_on_rate_limit(environment):
+    engine = QuoteEngine(environment.notional)
+    maturity = environment.notional.getActiveMarkets(2)[0][1]
+
+    with pytest.raises(Revert, match="Trade failed, slippage"):
+        engine.getDepositFromfCashLend(2, 50000e8, maturity, 1e9)
+
+
+def test_mint_quote_reverts_on_zero_ntoken_pv(environment):
+    engine = QuoteEngine(environment.notional)
+    # Supply outstanding with no present value, the contract reverts on the division
+    engine._currency(2).nToken = (int(100e8), 0, 0)
+
+    with pytest.raises(Revert, match="division by zero"):
+        engine.calculateNTokensToMint(2, 100e18)
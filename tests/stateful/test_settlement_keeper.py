@@ -0,0 +1,74 @@
+import pytest
+from brownie.network.state import Chain
+from scripts.account_scanner import AccountContextIndex
+from scripts.settlement_keeper import SettlementKeeper
+from tests.constants import SECONDS_IN_QUARTER
+from tests.helpers import get_balance_trade_action, get_tref, initialize_environment
+from tests.stateful.invariants import check_system_invariants
+
+chain = Chain()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def environment(accounts):
+    env = initialize_environment(accounts)
+    daiAction = get_balance_trade_action(
+        2,
+        "None",
+        [{"tradeActionType": "Borrow", "marketIndex": 1, "notional": 150e8, "maxSlippage": 0}],
+        withdrawEntireCashBalance=True,
+        redeemToUnderlying=True,
+    )
+    usdcAction = get_balance_trade_action(
+        3,
+        "DepositUnderlying",
+        [{"tradeActionType": "Lend", "marketIndex": 1, "notional": 100e8, "minSlippage": 0}],
+        depositActionAmount=10000e6,
+    )
+    # initialize_environment only funds accounts[1] with USDC
+    for account in accounts[2:4]:
+        env.token["USDC"].transfer(account, 100000e6, {"from": accounts[0]})
+        env.token["USDC"].approve(env.notional.address, 2 ** 255, {"from": account})
+
+    for account in accounts[1:4]:
+        env.notional.batchBalanceAndTradeAction(account, [daiAction, usdcAction], {"from": account})
+    return env
+
+
+@pytest.fixture(autouse=True)
+def isolation(fn_isolation):
+    pass
+
+
+def test_keeper_settles_due_accounts(environment, accounts):
+    index = AccountContextIndex(environment.notional)
+    index.update(accounts[0:4])
+
+    newTime = get_tref(chain.time()) + SECONDS_IN_QUARTER + 1
+    chain.mine(1, timestamp=newTime)
+    for currencyId in range(1, 4):
+        environment.notional.initializeMarkets(currencyId, False)
+
+    due = index.must_settle(chain.time())
+    assert due == [a.address for a in accounts[1:4]]
+
+    keeper = SettlementKeeper(environment.notional, accounts[8:10], maxPending=2)
+    result = keeper.settle(due)
+    assert sorted(result.settled) == sorted(due)
+    assert result.failed == {}
+    assert result.transactions == 3
+
+    index.sync()
+    assert index.must_settle(chain.time()) == []
+    check_system_invariants(environment, accounts)
+
+
+def test_keeper_reports_failed_settlements(environment, accounts):
+    keeper = SettlementKeeper(environment.notional, accounts[8:10], maxRetries=2)
+    # Settling the proxy itself fails requireValidAccount on every attempt
+    result = keeper.settle([environment.notional.address])
+
+    assert result.settled == []
+    assert list(result.failed) == [environment.notional.address]
+    for k in keeper.keepers:
+        assert k.pending == {}
@@ -0,0 +1,113 @@
+import pytest
+from eth_abi import encode_abi
+from eth_abi.packed import encode_abi_packed
+from scripts.batch_encoder import (
+    BALANCE_ACTION_TYPES,
+    BALANCE_ACTION_WITH_TRADES_TYPES,
+    BATCH_LEND_TYPES,
+    SELECTORS,
+    encode_batch_balance_action,
+    encode_batch_balance_and_trade_action,
+    encode_batch_lend,
+    encode_bulk,
+)
+from tests.constants import TRADE_ACTION_TYPE
+from tests.helpers import (
+    get_balance_action,
+    get_balance_trade_action,
+    get_lend_action,
+    get_trade_action,
+)
+
+ACCOUNT = "0x8B64fA5Fd129df9c755eB82dB1e16D6D0Bdf5Bc3"
+TRADES = [
+    {"tradeActionType": "Lend", "marketIndex": 1, "notional": 100e8, "minSlippage": 0.01e9},
+    {"tradeActionType": "Borrow", "marketIndex": 2, "notional": 5e8, "maxSlippage": 0.2e9},
+    {
+        "tradeActionType": "AddLiquidity",
+        "marketIndex": 3,
+        "notional": 1000e8,
+        "minSlippage": 0.01e9,
+        "maxSlippage": 0.3e9,
+    },
+    {
+        "tradeActionType": "RemoveLiquidity",
+        "marketIndex": 1,
+        "notional": 1e8,
+        "minSlippage": 0,
+        "maxSlippage": 0,
+    },
+]
+
+
+def test_packed_trade_actions():
+    assert get_trade_action(**TRADES[0]) == encode_abi_packed(
+        ["uint8", "uint8", "uint88", "uint32", "uint120"],
+        [TRADE_ACTION_TYPE["Lend"], 1, int(100e8), int(0.01e9), 0],
+    )
+    assert get_trade_action(**TRADES[1]) == encode_abi_packed(
+        ["uint8", "uint8", "uint88", "uint32", "uint120"],
+        [TRADE_ACTION_TYPE["Borrow"], 2, int(5e8), int(0.2e9), 0],
+    )
+    assert get_trade_action(**TRADES[2]) == encode_abi_packed(
+        ["uint8", "uint8", "uint88", "uint32", "uint32", "uint88"],
+        [TRADE_ACTION_TYPE["AddLiquidity"], 3, int(1000e8), int(0.01e9), int(0.3e9), 0],
+    )
+    assert get_trade_action(
+        tradeActionType="PurchaseNTokenResidual", maturity=1234, fCashAmountToPurchase=-100e8
+    ) == encode_abi_packed(
+        ["uint8", "uint32", "int88", "uint128"],
+        [TRADE_ACTION_TYPE["PurchaseNTokenResidual"], 1234, int(-100e8), 0],
+    )
+    assert get_trade_action(
+        tradeActionType="SettleCashDebt", counterparty=ACCOUNT, amountToSettle=100e8
+    ) == encode_abi_packed(
+        ["uint8", "address", "uint88"],
+        [TRADE_ACTION_TYPE["SettleCashDebt"], ACCOUNT, int(100e8)],
+    )
+
+
+def test_trade_action_overflow():
+    with pytest.raises(ValueError):
+        get_trade_action(tradeActionType="Lend", marketIndex=1, notional=2 ** 88, minSlippage=0)
+
+
+def test_batch_balance_action_calldata():
+    actions = [
+        get_balance_action(2, "DepositUnderlying", depositActionAmount=100e18),
+        get_balance_action(3, "None", withdrawAmountInternalPrecision=5e8, redeemToUnderlying=True),
+    ]
+
+    assert encode_batch_balance_action(ACCOUNT, actions) == SELECTORS[
+        "batchBalanceAction"
+    ] + encode_abi(["address", "{}[]".format(BALANCE_ACTION_TYPES)], [ACCOUNT, actions])
+
+
+def test_batch_balance_and_trade_action_calldata():
+    actions = [
+        get_balance_trade_action(1, "DepositUnderlying", [], depositActionAmount=10e18),
+        get_balance_trade_action(
+            2, "DepositAsset", TRADES, depositActionAmount=5000e8, withdrawEntireCashBalance=True
+        ),
+        get_balance_trade_action(3, "None", TRADES[1:2], redeemToUnderlying=True),
+    ]
+
+    assert encode_batch_balance_and_trade_action(ACCOUNT, actions) == SELECTORS[
+        "batchBalanceAndTradeAction"
+    ] + encode_abi(["address", "{}[]".format(BALANCE_ACTION_WITH_TRADES_TYPES)], [ACCOUNT, actions])
+
+
+def test_batch_lend_calldata():
+    actions = [get_lend_action(2, TRADES[0:1], True), get_lend_action(3, [], False)]
+
+    assert encode_batch_lend(ACCOUNT, actions) == SELECTORS["batchLend"] + encode_abi(
+        ["address", "{}[]".format(BATCH_LEND_TYPES)], [ACCOUNT, actions]
+    )
+
+
+def test_bulk_encoding_matches_single():
+    action = get_balance_trade_action(2, "DepositUnderlying", TRADES[0:1], depositActionAmount=1e18)
+    batches = [(ACCOUNT, [action] * i) for i in range(0, 10)]
+
+    calldata = encode_bulk("batchBalanceAndTradeAction", batches)
+    assert calldata == [encode_batch_balance_and_trade_action(a, b) for (a, b) in batches]
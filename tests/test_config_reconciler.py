@@ -0,0 +1,179 @@
+from types import SimpleNamespace
+
+import pytest
+from scripts.common import encodeNTokenParams
+from scripts.config import CurrencyConfig, nTokenConfig
+from scripts.initializers.config_reconciler import ConfigReconciler
+from scripts.initializers.notional_initializer import NotionalInitializer
+from web3.exceptions import ContractLogicError
+
+ORACLE = "0x" + "11" * 20
+NTOKEN = "0x" + "22" * 20
+ZERO_ADDRESS = "0x" + "00" * 20
+
+
+class View:
+    def __init__(self, fn):
+        self.fn = fn
+
+    def call(self, *args, block_identifier=None):
+        return self.fn(*args)
+
+
+class Initializer:
+    """Builds call arguments like NotionalInitializer without reading token contracts"""
+
+    _cashGroupSettings = NotionalInitializer._cashGroupSettings
+    dryRun = True
+
+    def __init__(self, notional=None):
+        self.env = SimpleNamespace(notional=notional, ethOracles={"ETH": ORACLE, "DAI": ORACLE})
+
+    def _listCurrencyArgs(self, symbol, config):
+        return (symbol,)
+
+    def _enableCashGroupArgs(self, currencyId, symbol, config):
+        return (currencyId, symbol)
+
+
+def live_state(symbol):
+    """On chain state that matches the config exactly"""
+    (config, nToken) = (CurrencyConfig[symbol], nTokenConfig[symbol])
+    ethRate = (
+        ORACLE,
+        18,
+        False,
+        config["buffer"],
+        config["haircut"],
+        config["liquidationDiscount"],
+    )
+    return {
+        "listed": True,
+        "cashGroupEnabled": True,
+        "rateStorage": (ethRate, (ZERO_ADDRESS, 0)),
+        "cashGroup": Initializer()._cashGroupSettings(config),
+        "depositParameters": nToken["Deposit"],
+        "initializationParameters": nToken["Initialization"],
+        "nTokenAccount": (
+            NTOKEN,
+            0,
+            config["incentiveEmissionRate"],
+            0,
+            encodeNTokenParams(nToken["Collateral"]),
+            0,
+            0,
+            0,
+        ),
+    }
+
+
+def unlisted_state():
+    return {
+        "listed": False,
+        "cashGroupEnabled": False,
+        "rateStorage": None,
+        "cashGroup": None,
+        "depositParameters": None,
+        "initializationParameters": None,
+        "nTokenAccount": None,
+    }
+
+
+def diff(state):
+    changes = ConfigReconciler(Initializer()).diffState(state, CurrencyConfig, nTokenConfig)
+    return [(c.currencyId, c.method) for c in changes]
+
+
+def test_matching_state_has_no_changes():
+    assert diff({1: live_state("ETH"), 2: live_state("DAI")}) == []
+
+
+def test_unlisted_currency_is_listed_and_configured():
+    assert diff({1: unlisted_state()}) == [
+        (1, "listCurrency"),
+        (1, "enableCashGroup"),
+        (1, "updateDepositParameters"),
+        (1, "updateInitializationParameters"),
+        (1, "updateTokenCollateralParameters"),
+        (1, "updateIncentiveEmissionRate"),
+    ]
+
+
+def test_listed_currency_without_cash_group():
+    state = live_state("ETH")
+    state.update(cashGroupEnabled=False, nTokenAccount=None)
+    assert diff({1: state})[0] == (1, "enableCashGroup")
+    assert (1, "listCurrency") not in diff({1: state})
+
+
+def test_only_changed_parameters_are_updated():
+    state = live_state("ETH")
+    ethRate = list(state["rateStorage"][0])
+    ethRate[4] = 50
+    state["rateStorage"] = (tuple(ethRate), state["rateStorage"][1])
+    state["nTokenAccount"] = state["nTokenAccount"][0:2] + (0,) + state["nTokenAccount"][3:]
+
+    changes = ConfigReconciler(Initializer()).diffState({1: state}, CurrencyConfig, nTokenConfig)
+    assert [(c.method, c.args) for c in changes] == [
+        (
+            "updateETHRate",
+            (
+                1,
+                ORACLE,
+                False,
+                CurrencyConfig["ETH"]["buffer"],
+                CurrencyConfig["ETH"]["haircut"],
+                CurrencyConfig["ETH"]["liquidationDiscount"],
+            ),
+        ),
+        ("updateIncentiveEmissionRate", (1, CurrencyConfig["ETH"]["incentiveEmissionRate"])),
+    ]
+
+
+def test_changes_are_ordered_by_currency():
+    state = {2: unlisted_state(), 1: live_state("ETH")}
+    state[1]["cashGroup"] = None
+    assert diff(state)[0:2] == [(1, "updateCashGroup"), (2, "listCurrency")]
+
+
+def notional_views(maxCurrencyId, **overrides):
+    state = live_state("ETH")
+    views = {
+        "getMaxCurrencyId": lambda: maxCurrencyId,
+        "getRateStorage": lambda c: state["rateStorage"],
+        "getCashGroup": lambda c: state["cashGroup"],
+        "getDepositParameters": lambda c: state["depositParameters"],
+        "getInitializationParameters": lambda c: state["initializationParameters"],
+        "nTokenAddress": lambda c: NTOKEN,
+        "getNTokenAccount": lambda a: state["nTokenAccount"],
+    }
+    views.update(overrides)
+    return SimpleNamespace(**{k: View(v) for (k, v) in views.items()})
+
+
+def test_listed_is_read_from_max_currency_id():
+    notional = notional_views(1)
+    reconciler = ConfigReconciler(Initializer(notional))
+    state = reconciler.readState([1, 2], block=1)
+
+    assert state[1] == live_state("ETH")
+    assert state[2] == unlisted_state()
+
+
+def test_reverting_ntoken_view_disables_cash_group():
+    def revert(currencyId):
+        raise ContractLogicError("No nToken for currency")
+
+    notional = notional_views(1, nTokenAddress=revert)
+    state = ConfigReconciler(Initializer(notional)).readState([1], block=1)
+    assert state[1]["listed"]
+    assert not state[1]["cashGroupEnabled"]
+
+
+def test_transport_errors_are_raised():
+    def timeout(currencyId):
+        raise ConnectionError("timed out")
+
+    notional = notional_views(2, getRateStorage=timeout)
+    with pytest.raises(ConnectionError):
+        ConfigReconciler(Initializer(notional)).readState([1, 2], block=1)
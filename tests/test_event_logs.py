@@ -0,0 +1,66 @@
+import pytest
+from brownie.network.state import Chain
+from scripts.event_logs import EventDecoder, notional_addresses, stream_events
+from tests.helpers import get_balance_trade_action, initialize_environment
+
+chain = Chain()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def environment(accounts):
+    return initialize_environment(accounts)
+
+
+@pytest.fixture(autouse=True)
+def isolation(fn_isolation):
+    pass
+
+
+@pytest.fixture(scope="module")
+def decoder():
+    return EventDecoder()
+
+
+def brownie_events(txn, addresses):
+    return [(e.name, e.address, dict(e)) for e in txn.events if e.address in addresses]
+
+
+def test_decoded_events_match_brownie(environment, accounts, decoder):
+    addresses = notional_addresses(environment.notional)
+    action = get_balance_trade_action(
+        2,
+        "DepositUnderlying",
+        [{"tradeActionType": "Lend", "marketIndex": 1, "notional": 100e8, "minSlippage": 0}],
+        depositActionAmount=100e18,
+        withdrawEntireCashBalance=True,
+    )
+    txn = environment.notional.batchBalanceAndTradeAction(
+        accounts[1], [action], {"from": accounts[1]}
+    )
+
+    records = [
+        r
+        for r in stream_events(decoder, txn.block_number, txn.block_number, addresses)
+        if r.transactionHash == txn.txid
+    ]
+    assert len(records) > 0
+    assert [(r.event, r.address, r.args) for r in records] == brownie_events(txn, addresses)
+    assert [r.logIndex for r in records] == sorted(r.logIndex for r in records)
+
+
+def test_event_name_filter(environment, decoder):
+    records = list(
+        stream_events(decoder, 0, chain.height, [environment.notional.address], ["ListCurrency"])
+    )
+    assert {r.event for r in records} == {"ListCurrency"}
+    assert [r.args["newCurrencyId"] for r in records] == list(
+        range(1, environment.notional.getMaxCurrencyId() + 1)
+    )
+
+
+def test_chunk_size_does_not_change_results(environment, decoder):
+    addresses = notional_addresses(environment.notional)
+    expected = list(stream_events(decoder, 0, chain.height, addresses))
+    assert len(expected) > 0
+    assert list(stream_events(decoder, 0, chain.height, addresses, chunkSize=1)) == expected
+    assert decoder.unknown == 0
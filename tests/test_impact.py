@@ -0,0 +1,85 @@
+import os
+
+import pytest
+from tests.impact import ImpactAnalysis
+
+# A small repository with the same layout as this one
+SOURCES = {
+    "contracts/math/DateTime.sol": "library DateTime {}\n",
+    "contracts/markets/Market.sol": 'import "../math/DateTime.sol";\nlibrary Market {}\n',
+    "contracts/mocks/MockMarket.sol": 'import "../markets/Market.sol";\ncontract MockMarket {}\n',
+    "contracts/mocks/MockBitmap.sol": (
+        '// import "../math/DateTime.sol";\ncontract MockBitmap {}\n'
+    ),
+    "contracts/mocks/MockDateTime.sol": (
+        'import "../math/DateTime.sol";\ncontract MockDateTime {}\n'
+    ),
+    "tests/__init__.py": "",
+    "tests/conftest.py": "",
+    "tests/helpers.py": "def get_market():\n    pass\n",
+    "tests/test_market.py": "def test_market(MockMarket):\n    pass\n",
+    "tests/test_bitmap.py": "def test_bitmap(MockBitmap):\n    pass\n",
+    "tests/internal/__init__.py": "",
+    "tests/internal/conftest.py": "import pytest\n",
+    "tests/internal/test_date_time.py": "def test_date_time(MockDateTime):\n    pass\n",
+    "tests/stateful/__init__.py": "",
+    "tests/stateful/test_helpers.py": (
+        "from tests.helpers import get_market\n\ndef test_helpers():\n    get_market()\n"
+    ),
+    "brownie-config.yaml": "",
+    "README.md": "",
+}
+
+
+@pytest.fixture(scope="module")
+def analysis(tmp_path_factory):
+    root = tmp_path_factory.mktemp("repo")
+    for (path, source) in SOURCES.items():
+        os.makedirs(os.path.dirname(root / path), exist_ok=True)
+        (root / path).write_text(source)
+    return ImpactAnalysis(str(root))
+
+
+def test_library_change_selects_importers(analysis):
+    (modules, reason) = analysis.select(["contracts/math/DateTime.sol"])
+    assert reason is None
+    # MockBitmap only imports DateTime in a comment
+    assert modules == ["tests/internal/test_date_time.py", "tests/test_market.py"]
+
+
+def test_mock_change_selects_its_module(analysis):
+    assert analysis.select(["contracts/mocks/MockMarket.sol"]) == (["tests/test_market.py"], None)
+    assert analysis.select(["contracts/mocks/MockBitmap.sol"]) == (["tests/test_bitmap.py"], None)
+
+
+def test_helpers_change_selects_importers(analysis):
+    assert analysis.select(["tests/helpers.py"]) == (["tests/stateful/test_helpers.py"], None)
+
+
+def test_conftest_change_selects_modules_below_it(analysis):
+    assert analysis.select(["tests/internal/conftest.py"]) == (
+        ["tests/internal/test_date_time.py"],
+        None,
+    )
+    (modules, _) = analysis.select(["tests/conftest.py"])
+    assert len(modules) == 4
+
+
+def test_unattributed_changes_run_full_suite(analysis):
+    assert analysis.select(["brownie-config.yaml"]) == (None, "brownie-config.yaml")
+    assert analysis.select(["unknown/file.txt"]) == (None, "unknown/file.txt")
+    # Deleted Solidity sources are no longer in the graph
+    assert analysis.select(["contracts/mocks/Deleted.sol"]) == (
+        None,
+        "contracts/mocks/Deleted.sol",
+    )
+    assert analysis.select(["README.md"]) == ([], None)
+
+
+def test_repository_date_time_selects_importers():
+    analysis = ImpactAnalysis(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    (modules, reason) = analysis.select(["contracts/internal/markets/DateTime.sol"])
+    assert reason is None
+    assert "tests/internal/math/test_date_time.py" in modules
+    assert "tests/stateful/test_settlement.py" in modules
+    assert "tests/internal/math/test_floating_point.py" not in modules
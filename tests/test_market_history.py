@@ -0,0 +1,77 @@
+import pytest
+from brownie.network.state import Chain
+from scripts.market_history import MarketHistoryStore, capture, market_event_blocks
+from tests.helpers import get_balance_trade_action, initialize_environment
+
+chain = Chain()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def environment(accounts):
+    return initialize_environment(accounts)
+
+
+@pytest.fixture(autouse=True)
+def isolation(fn_isolation):
+    pass
+
+
+def lend(environment, account, marketIndex):
+    action = get_balance_trade_action(
+        2,
+        "DepositUnderlying",
+        [
+            {
+                "tradeActionType": "Lend",
+                "marketIndex": marketIndex,
+                "notional": 100e8,
+                "minSlippage": 0,
+            }
+        ],
+        depositActionAmount=100e18,
+        withdrawEntireCashBalance=True,
+    )
+    return environment.notional.batchBalanceAndTradeAction(account, [action], {"from": account})
+
+
+def test_capture_matches_active_markets(environment, accounts, tmp_path):
+    startBlock = chain.height
+    blocks = [lend(environment, accounts[1], i).block_number for i in (1, 2, 1)]
+    eventBlocks = market_event_blocks(environment.notional, startBlock + 1, chain.height)
+    assert eventBlocks == {2: blocks}
+
+    store = MarketHistoryStore(str(tmp_path))
+    assert capture(store, environment.notional, 2, blocks) == 6
+    # Blocks already stored are skipped
+    assert capture(store, environment.notional, 2, blocks) == 0
+
+    history = store.read(2)
+    assert len(history) == 6
+    for block in blocks:
+        curve = history.curve(block)
+        markets = environment.notional.getActiveMarkets(2, block_identifier=block)
+        assert list(curve["blockNumber"]) == [block, block]
+        assert list(curve["timestamp"]) == [chain[block].timestamp] * 2
+        assert list(curve["marketIndex"]) == [1, 2]
+        for (i, m) in enumerate(markets):
+            assert curve["maturity"][i] == m[1]
+            assert curve["totalfCash"][i] == m[2]
+            assert curve["totalAssetCash"][i] == m[3]
+            assert curve["totalLiquidity"][i] == m[4]
+            assert curve["lastImpliedRate"][i] == m[5]
+            assert curve["oracleRate"][i] == m[6]
+            assert curve["previousTradeTime"][i] == m[7]
+
+    assert len(history.blocks(blocks[1], blocks[2])) == 4
+    assert len(history.curve(blocks[0] - 1)) == 0
+    assert list(history.market(2)["blockNumber"]) == blocks
+
+
+def test_append_rejects_out_of_order_blocks(environment, accounts, tmp_path):
+    blocks = [lend(environment, accounts[1], 1).block_number for _ in range(2)]
+    store = MarketHistoryStore(str(tmp_path))
+    capture(store, environment.notional, 2, blocks[1:])
+
+    with pytest.raises(Exception, match="in order"):
+        store.append(2, {c: list(v) for (c, v) in store.read(2).curve(blocks[1]).columns.items()})
+    assert len(store.read(2)) == 2
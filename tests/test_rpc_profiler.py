@@ -0,0 +1,31 @@
+import pytest
+from tests.rpc_profiler import RpcProfiler
+
+
+@pytest.fixture
+def profiler(tmp_path):
+    profiler = RpcProfiler(str(tmp_path / "profile.json"))
+    yield profiler
+    profiler.uninstall()
+
+
+def test_records_requests_sent_through_web3(profiler, accounts, MockAggregator):
+    # Brownie has already sent requests through web3 before the profiler is installed
+    assert accounts[0].balance() > 0
+
+    profiler._enter("test:transaction")
+    aggregator = MockAggregator.deploy(18, {"from": accounts[0]})
+    aggregator.setAnswer(100, {"from": accounts[0]})
+    assert aggregator.latestAnswer() == 100
+    profiler._exit()
+
+    scope = profiler.scopes["test:transaction"]
+    assert scope["methods"]["eth_call"]["calls"] > 0
+    assert scope["methods"]["eth_getTransactionReceipt"]["calls"] > 0
+    assert scope["deployments"] == 1
+    assert scope["gas"] > 0
+
+    profiler.uninstall()
+    calls = scope["calls"]
+    aggregator.latestAnswer()
+    assert scope["calls"] == calls